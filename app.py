@@ -3,20 +3,23 @@ VHM24R - Основное Flask приложение
 Интеллектуальная система сверки заказов, платежей и фискализации
 """
 
+import hmac
 import os
 import uuid
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, Response
 from werkzeug.utils import secure_filename
 import pandas as pd
 
 # Импорт модулей проекта
 from models import get_database
+from pipeline_metrics import pipeline_metrics
 from processors_updated import OrderProcessor, RecipeProcessor, FinanceProcessor
 from file_detector_updated import AdvancedFileTypeDetector
 from storage import init_storage
 from telegram_bot import init_telegram
 from scheduler import init_scheduler
+from unmatched_retry import UnmatchedRecordRetrier
 from reports_api import reports_bp
 
 # Инициализация Flask приложения
@@ -32,6 +35,7 @@ db = None
 order_processor = None
 recipe_processor = None
 finance_processor = None
+unmatched_retrier = None
 file_detector = None
 file_manager = None
 telegram_notifier = None
@@ -39,7 +43,7 @@ scheduler = None
 
 def init_app():
     """Инициализация всех компонентов приложения"""
-    global db, order_processor, recipe_processor, finance_processor
+    global db, order_processor, recipe_processor, finance_processor, unmatched_retrier
     global file_detector, file_manager, telegram_notifier, scheduler
     
     try:
@@ -51,6 +55,7 @@ def init_app():
         order_processor = OrderProcessor(db)
         recipe_processor = RecipeProcessor(db)
         finance_processor = FinanceProcessor(db)
+        unmatched_retrier = UnmatchedRecordRetrier(db, order_processor)
         print("Processors initialized")
         
         # Инициализация детектора файлов
@@ -66,8 +71,11 @@ def init_app():
         print("Telegram initialized")
         
         # Инициализация планировщика (только в production)
+        # Под gunicorn задачи запускает один воркер-лидер (post_worker_init в gunicorn.conf.py)
         if not app.debug:
-            scheduler = init_scheduler(db, order_processor, telegram_notifier, file_manager)
+            under_gunicorn = 'gunicorn' in os.environ.get('SERVER_SOFTWARE', '')
+            scheduler = init_scheduler(db, order_processor, telegram_notifier, file_manager,
+                                       autostart=not under_gunicorn)
             print("Scheduler initialized")
         
         print("VHM24R application initialized successfully")
@@ -119,6 +127,20 @@ def index():
                              recent_orders=[],
                              success_rate=0)
 
+def _report_memory_profile(session_id: str, summary: dict):
+    """Профиль памяти сессии (PIPELINE_MEMORY=1) - в хранилище рядом с результатами, превышение бюджета - в Telegram"""
+    memory = summary.get('memory')
+    if not memory:
+        return
+    
+    try:
+        if file_manager:
+            file_manager.backup_memory_profile(session_id, memory)
+        if memory['exceeded'] and telegram_notifier:
+            telegram_notifier.send_memory_budget_alert(session_id, memory['exceeded'])
+    except Exception as e:
+        print(f"Error reporting memory profile: {e}")
+
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_files():
     """Загрузка и обработка файлов"""
@@ -128,6 +150,10 @@ def upload_files():
     try:
         # Генерируем ID сессии
         session_id = str(uuid.uuid4())
+        session_started = unmatched_retrier.current_timestamp()
+        metrics_session = pipeline_metrics.start_session(
+            session_id, memory_budget_mb=order_processor.config.get('memory_stage_budget_mb')
+        )
         
         processing_results = []
         
@@ -146,7 +172,8 @@ def upload_files():
                     file.save(temp_path)
                     
                     # Определяем тип файла
-                    file_type = file_detector.detect_type(temp_path)
+                    with pipeline_metrics.stage('detect'):
+                        file_type = file_detector.detect_type(temp_path)
                     
                     # Обрабатываем файл если тип определен
                     if file_type != 'unknown':
@@ -195,16 +222,18 @@ def upload_files():
         
         # Запускаем сверку если есть обработанные файлы
         if any(r['status'] == 'success' for r in processing_results):
+            # Чеки из прошлых загрузок могли найти свои заказы в новых файлах
+            unmatched_retrier.run(since=session_started)
             matching_stats = order_processor.run_matching()
+            order_processor.conflict_detector.run(since=session_started)
             
             # Отправляем уведомление о завершении
             if telegram_notifier:
-                import asyncio
-                asyncio.run(telegram_notifier.send_processing_complete(
+                telegram_notifier.send_processing_complete(
                     session_id=session_id,
                     stats=matching_stats,
                     files_count=len([r for r in processing_results if r['status'] == 'success'])
-                ))
+                )
             
             # Сохраняем результаты в DigitalOcean
             if file_manager:
@@ -216,6 +245,8 @@ def upload_files():
         else:
             matching_stats = {'total': 0}
         
+        _report_memory_profile(session_id, pipeline_metrics.finish_session(metrics_session, db))
+        
         return render_template('upload_results.html',
                              session_id=session_id,
                              processing_results=processing_results,
@@ -223,6 +254,8 @@ def upload_files():
     
     except Exception as e:
         print(f"Error in upload route: {e}")
+        if 'metrics_session' in locals():
+            _report_memory_profile(session_id, pipeline_metrics.finish_session(metrics_session, db))
         flash(f'Ошибка при обработке файлов: {str(e)}', 'error')
         return redirect(url_for('upload_files'))
 
@@ -362,6 +395,50 @@ def finance_cash_collection():
         return render_template('finance/cash_collection.html', 
                              machines_status=[], recent_collections=[])
 
+@app.route('/finance/cash-collection', methods=['POST'])
+def api_register_cash_collection():
+    """Регистрация инкассации (форма страницы инкассации); остаток автомата обновляется в журнале"""
+    data = request.get_json(silent=True) or request.form.to_dict()
+    
+    missing = [field for field in ('machine_code', 'collection_date', 'amount_collected') if not data.get(field)]
+    if missing:
+        return jsonify({'success': False, 'error': f"Не заполнены поля: {', '.join(missing)}"}), 400
+    
+    collection_id = finance_processor.register_cash_collection({
+        'machine_code': data['machine_code'],
+        'collection_date': data['collection_date'],
+        'collection_time': data.get('collection_time') or None,
+        'collector_name': data.get('collector_name', ''),
+        'amount_collected': data['amount_collected'],
+        'notes': data.get('notes', '')
+    })
+    if collection_id is None:
+        return jsonify({'success': False, 'error': 'Не удалось сохранить инкассацию'}), 500
+    
+    return jsonify({
+        'success': True,
+        'collection_id': collection_id,
+        'balance': finance_processor.cash_balances.get_balance(data['machine_code'])
+    })
+
+@app.route('/api/finance/cash-balance/<machine_code>')
+def api_cash_balance(machine_code):
+    """Кассовый остаток автомата: текущий или на момент ?at=YYYY-MM-DD[ HH:MM:SS] и последние события журнала"""
+    moment = request.args.get('at')
+    limit = request.args.get('limit', 20, type=int)
+    ledger = finance_processor.cash_balances
+    
+    current = ledger.get_balance(machine_code)
+    return jsonify({
+        'success': True,
+        'machine_code': machine_code,
+        'at': moment,
+        'balance': finance_processor.get_cash_balance_at(machine_code, moment) if moment
+                   else float(current['balance']) if current else 0.0,
+        'current': current,
+        'ledger': ledger.get_ledger(machine_code, limit=limit)
+    })
+
 @app.route('/api/orders/details')
 def api_orders_details():
     """API для получения деталей заказов"""
@@ -410,6 +487,41 @@ def health_check():
             'error': str(e)
         }), 500
 
+@app.route('/api/metrics')
+def api_metrics():
+    """Метрики конвейера загрузки в формате Prometheus"""
+    return Response(pipeline_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def _admin_allowed() -> bool:
+    """
+    Служебные API требуют заголовок X-Admin-Token, совпадающий с ADMIN_TOKEN
+    Без ADMIN_TOKEN доступ закрыт
+    """
+    token = os.environ.get('ADMIN_TOKEN')
+    if not token:
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode())
+
+@app.route('/api/admin/query-stats', methods=['GET', 'DELETE'])
+def api_admin_query_stats():
+    """Статистика SQL запросов по отпечаткам и журнал медленных запросов (DELETE - сброс)"""
+    if not _admin_allowed():
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
+    
+    observer = db.query_observer
+    if request.method == 'DELETE':
+        observer.reset()
+        return jsonify({'success': True})
+    
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        'success': True,
+        'summary': observer.summary(),
+        'queries': observer.top(sort=request.args.get('sort', 'total_seconds'), limit=limit),
+        'slow_queries': observer.slow_queries(limit=limit),
+        'statement_cache': db.query_builder.stats()
+    })
+
 @app.errorhandler(404)
 def not_found_error(error):
     """Обработка ошибки 404"""
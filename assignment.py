@@ -0,0 +1,172 @@
+"""
+VHM24R - Оптимальное сопоставление записей с заказами
+Чеки/транзакции и заказы разбиваются на кластеры (одна сумма, время без разрывов больше допуска),
+внутри кластера решается задача о назначениях с ценой |Δt| (венгерский алгоритм).
+Кластеры маленькие, поэтому общее время почти линейно от числа записей
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Кластеры больше этого размера (по любой стороне) сопоставляются жадно по ближайшему времени
+MAX_CLUSTER_SIZE = 80
+
+# Сколько кандидатов сохранять в match_candidates для аудита
+MAX_CANDIDATES = 5
+
+
+def hungarian(cost: Sequence[Sequence[float]]) -> List[Tuple[int, int]]:
+    """
+    Назначение минимальной стоимости для прямоугольной матрицы cost[строка][столбец]
+
+    Returns:
+        List: Пары (строка, столбец); назначается min(строк, столбцов) пар
+    """
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if n == 0 or m == 0:
+        return []
+
+    transposed = n > m
+    if transposed:
+        cost = [list(column) for column in zip(*cost)]
+        n, m = m, n
+
+    inf = float('inf')
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    p = [0] * (m + 1)
+    way = [0] * (m + 1)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = inf
+            j1 = 0
+            row = cost[i0 - 1]
+            for j in range(1, m + 1):
+                if not used[j]:
+                    current = row[j - 1] - u[i0] - v[j]
+                    if current < minv[j]:
+                        minv[j] = current
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    pairs = [(p[j] - 1, j - 1) for j in range(1, m + 1) if p[j]]
+    if transposed:
+        pairs = [(column, row) for row, column in pairs]
+    return sorted(pairs)
+
+
+def assign_by_time(records: List[Tuple[datetime, float]], orders: List[Tuple[datetime, float]],
+                   time_tolerance: float, amount_tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Оптимальное сопоставление записей (время, сумма) с заказами (время, сумма)
+
+    Пара допустима, если |Δt| <= time_tolerance секунд и |Δсуммы| <= amount_tolerance.
+    В каждом кластере сначала максимизируется число пар, затем минимизируется сумма |Δt|
+
+    Returns:
+        List: Для каждой записи {'order': индекс заказа или None, 'candidates': индексы допустимых
+              заказов по возрастанию |Δt| (не более MAX_CANDIDATES)}
+    """
+    result = [{'order': None, 'candidates': []} for _ in records]
+
+    for cluster_records, cluster_orders in _clusters(records, orders, time_tolerance, amount_tolerance):
+        feasible = {}
+        for r in cluster_records:
+            record_time, record_amount = records[r]
+            edges = []
+            for o in cluster_orders:
+                order_time, order_amount = orders[o]
+                delta = abs((order_time - record_time).total_seconds())
+                if delta <= time_tolerance and abs(order_amount - record_amount) <= amount_tolerance:
+                    edges.append((delta, o))
+            edges.sort()
+            feasible[r] = dict((o, delta) for delta, o in edges)
+            result[r]['candidates'] = [o for _, o in edges[:MAX_CANDIDATES]]
+
+        if len(cluster_records) > MAX_CLUSTER_SIZE or len(cluster_orders) > MAX_CLUSTER_SIZE:
+            pairs = _greedy(cluster_records, feasible)
+        else:
+            pairs = _optimal(cluster_records, cluster_orders, feasible, time_tolerance)
+
+        for r, o in pairs:
+            result[r]['order'] = o
+
+    return result
+
+
+def _clusters(records, orders, time_tolerance: float, amount_tolerance: float):
+    """
+    Компоненты связности: группы по сумме (цепочки в пределах допуска),
+    внутри группы - разрыв по времени больше допуска начинает новый кластер
+    """
+    items = [(amount, time, 0, i) for i, (time, amount) in enumerate(records)]
+    items += [(amount, time, 1, i) for i, (time, amount) in enumerate(orders)]
+    items.sort(key=lambda item: item[0])
+
+    amount_groups = []
+    for item in items:
+        if amount_groups and item[0] - amount_groups[-1][-1][0] <= amount_tolerance:
+            amount_groups[-1].append(item)
+        else:
+            amount_groups.append([item])
+
+    for group in amount_groups:
+        group.sort(key=lambda item: item[1])
+        cluster_records, cluster_orders = [], []
+        previous_time = None
+        for amount, time, side, index in group:
+            if previous_time is not None and (time - previous_time).total_seconds() > time_tolerance:
+                if cluster_records and cluster_orders:
+                    yield cluster_records, cluster_orders
+                cluster_records, cluster_orders = [], []
+            (cluster_records if side == 0 else cluster_orders).append(index)
+            previous_time = time
+        if cluster_records and cluster_orders:
+            yield cluster_records, cluster_orders
+
+
+def _optimal(cluster_records: List[int], cluster_orders: List[int], feasible: Dict[int, Dict[int, float]],
+             time_tolerance: float) -> List[Tuple[int, int]]:
+    # Недопустимая пара дороже любой суммы допустимых: сначала максимум пар, потом минимум |Δt|
+    penalty = (time_tolerance + 1) * (len(cluster_records) + len(cluster_orders) + 1)
+    cost = [[feasible[r].get(o, penalty) for o in cluster_orders] for r in cluster_records]
+
+    return [(cluster_records[i], cluster_orders[j]) for i, j in hungarian(cost)
+            if cluster_orders[j] in feasible[cluster_records[i]]]
+
+
+def _greedy(cluster_records: List[int], feasible: Dict[int, Dict[int, float]]) -> List[Tuple[int, int]]:
+    """Запасной вариант для очень больших кластеров: пары по возрастанию |Δt|"""
+    edges = sorted((delta, r, o) for r in cluster_records for o, delta in feasible[r].items())
+    taken_records, taken_orders, pairs = set(), set(), []
+    for _, r, o in edges:
+        if r not in taken_records and o not in taken_orders:
+            taken_records.add(r)
+            taken_orders.add(o)
+            pairs.append((r, o))
+    return pairs
@@ -0,0 +1,311 @@
+"""
+VHM24R - Потоковое резервное копирование
+Строки читаются из БД курсором пачками и сразу пишутся в сжатый поток, который
+уходит в S3-совместимое хранилище частями (multipart upload). Память не зависит
+от объема данных за день; manifest.json фиксирует количество строк и контрольные суммы
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+
+# Опциональный импорт для Parquet
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+    pa = None
+    pq = None
+
+
+def iter_rows(db, query: str, params: Optional[tuple] = None, batch_size: int = 5000) -> Iterator[Dict[str, Any]]:
+    """
+    Построчное чтение результата запроса без загрузки всей выборки в память
+    В PostgreSQL используется именованный (серверный) курсор
+    """
+    if db.is_postgres:
+        cursor = db.connection.cursor(name=f"backup_{uuid.uuid4().hex[:12]}")
+        cursor.itersize = batch_size
+        query = query.replace('?', '%s')
+    else:
+        cursor = db.connection.cursor()
+
+    try:
+        cursor.execute(query, params or ())
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+    finally:
+        cursor.close()
+
+
+class MultipartUploadStream:
+    """
+    Файлоподобный поток, который загружает данные в хранилище частями по part_size байт
+    Попутно считает SHA-256 и размер загруженного объекта
+    """
+
+    def __init__(self, client, bucket: str, key: str, part_size: int = 8 * 1024 * 1024,
+                 content_type: str = 'application/octet-stream'):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+
+        self._buffer = bytearray()
+        self._parts = []
+        self._sha256 = hashlib.sha256()
+        self.bytes_written = 0
+        self.closed = False
+
+        upload = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)
+        self.upload_id = upload['UploadId']
+
+    @property
+    def sha256(self) -> str:
+        return self._sha256.hexdigest()
+
+    @property
+    def parts_count(self) -> int:
+        return len(self._parts)
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._buffer.extend(data)
+        self._sha256.update(data)
+        self.bytes_written += len(data)
+
+        while len(self._buffer) >= self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def close(self):
+        """Загрузка последней части и завершение multipart upload"""
+        if self.closed:
+            return
+        if self._buffer or not self._parts:
+            self._upload_part(bytes(self._buffer))
+            self._buffer.clear()
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self._parts}
+        )
+        self.closed = True
+
+    def abort(self):
+        """Отмена загрузки: уже загруженные части удаляются хранилищем"""
+        if self.closed:
+            return
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        finally:
+            self.closed = True
+
+    def _upload_part(self, data: bytes):
+        part_number = len(self._parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=data
+        )
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+
+class StreamingBackupWriter:
+    """
+    Резервная копия набора таблиц в каталоге prefix
+
+    - ndjson: одна JSON-строка на запись, gzip
+    - parquet: группы строк по batch_size (нужен pyarrow)
+    """
+
+    FORMATS = ('ndjson', 'parquet')
+
+    def __init__(self, client, bucket: str, prefix: str, fmt: str = 'ndjson',
+                 part_size: int = 8 * 1024 * 1024, batch_size: int = 5000):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unsupported backup format: {fmt}")
+        if fmt == 'parquet' and not PARQUET_AVAILABLE:
+            raise ValueError("Parquet backup requires pyarrow")
+
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.fmt = fmt
+        self.part_size = part_size
+        self.batch_size = batch_size
+        self.files: List[Dict[str, Any]] = []
+
+    def write_rows(self, name: str, rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Потоковая запись строк в объект prefix/name.<ext>
+
+        Returns:
+            Dict: Запись манифеста (ключ, строки, байты, sha256, части)
+        """
+        extension = 'ndjson.gz' if self.fmt == 'ndjson' else 'parquet'
+        key = f"{self.prefix}/{name}.{extension}"
+        content_type = 'application/gzip' if self.fmt == 'ndjson' else 'application/vnd.apache.parquet'
+        stream = MultipartUploadStream(self.client, self.bucket, key, self.part_size, content_type)
+
+        try:
+            if self.fmt == 'ndjson':
+                row_count, content_sha256 = self._write_ndjson(stream, rows)
+            else:
+                row_count, content_sha256 = self._write_parquet(stream, rows)
+            stream.close()
+        except Exception:
+            stream.abort()
+            raise
+
+        entry = {
+            'name': name,
+            'key': key,
+            'format': self.fmt,
+            'rows': row_count,
+            'bytes': stream.bytes_written,
+            'sha256': stream.sha256,
+            'parts': stream.parts_count
+        }
+        if content_sha256:
+            entry['content_sha256'] = content_sha256
+        self.files.append(entry)
+        return entry
+
+    def write_manifest(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Запись manifest.json после всех таблиц: по нему проверяется полнота копии"""
+        manifest = {
+            'created_at': datetime.now().isoformat(),
+            'prefix': self.prefix,
+            'format': self.fmt,
+            'files': self.files,
+            'total_rows': sum(entry['rows'] for entry in self.files),
+            **(extra or {})
+        }
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/manifest.json",
+            Body=json.dumps(manifest, ensure_ascii=False, indent=2, default=str).encode('utf-8'),
+            ContentType='application/json'
+        )
+        return manifest
+
+    def _write_ndjson(self, stream: MultipartUploadStream, rows: Iterable[Dict[str, Any]]):
+        """Возвращает число строк и SHA-256 несжатого NDJSON"""
+        content_sha256 = hashlib.sha256()
+        row_count = 0
+
+        with gzip.GzipFile(fileobj=stream, mode='wb', mtime=0) as gz:
+            for row in rows:
+                line = (json.dumps(row, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+                gz.write(line)
+                content_sha256.update(line)
+                row_count += 1
+
+        return row_count, content_sha256.hexdigest()
+
+    def _write_parquet(self, stream: MultipartUploadStream, rows: Iterable[Dict[str, Any]]):
+        writer = None
+        row_count = 0
+        batch = []
+
+        def flush_batch():
+            nonlocal writer
+            table = pa.Table.from_pylist(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(pa.PythonFile(stream, mode='w'), table.schema, compression='snappy')
+            writer.write_table(table.cast(writer.schema))
+            batch.clear()
+
+        for row in rows:
+            batch.append({k: (str(v) if v is not None and not isinstance(v, (int, float, str, bool)) else v)
+                          for k, v in row.items()})
+            row_count += 1
+            if len(batch) >= self.batch_size:
+                flush_batch()
+
+        if batch:
+            flush_batch()
+        if writer is not None:
+            writer.close()
+
+        return row_count, None
+
+
+class LocalS3Client:
+    """
+    Локальная замена S3-клиента (тот же набор методов multipart upload)
+    Используется, когда хранилище не настроено, и в тестах: объекты - файлы в root_dir/bucket/key
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self._uploads: Dict[str, Dict[str, Any]] = {}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> Dict[str, str]:
+        upload_id = uuid.uuid4().hex
+        parts_dir = os.path.join(self.root_dir, '.multipart', upload_id)
+        os.makedirs(parts_dir, exist_ok=True)
+        self._uploads[upload_id] = {'bucket': Bucket, 'key': Key, 'dir': parts_dir}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body: bytes) -> Dict[str, str]:
+        upload = self._uploads[UploadId]
+        with open(os.path.join(upload['dir'], f"{PartNumber:05d}"), 'wb') as f:
+            f.write(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict) -> Dict:
+        upload = self._uploads.pop(UploadId)
+        target = self._object_path(Bucket, Key)
+
+        with open(target, 'wb') as out:
+            for part in sorted(MultipartUpload['Parts'], key=lambda p: p['PartNumber']):
+                part_path = os.path.join(upload['dir'], f"{part['PartNumber']:05d}")
+                with open(part_path, 'rb') as f:
+                    while True:
+                        chunk = f.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                os.remove(part_path)
+
+        os.rmdir(upload['dir'])
+        return {'Key': Key}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> Dict:
+        upload = self._uploads.pop(UploadId, None)
+        if upload:
+            for name in os.listdir(upload['dir']):
+                os.remove(os.path.join(upload['dir'], name))
+            os.rmdir(upload['dir'])
+        return {}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> Dict:
+        with open(self._object_path(Bucket, Key), 'wb') as f:
+            f.write(Body)
+        return {}
+
+    def _object_path(self, bucket: str, key: str) -> str:
+        path = os.path.join(self.root_dir, bucket, *key.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
@@ -3,18 +3,50 @@ VHM24R - Модуль парсинга банковских выписок
 Обработка банковских выписок различных форматов для финансовой сверки
 """
 
+import bisect
+import codecs
+import csv
+from itertools import combinations
 import pandas as pd
 import re
-from datetime import datetime, date
+from collections import Counter
+from datetime import datetime, date, timedelta
 from typing import Dict, List, Optional, Any, Tuple
 import json
 
+# Опциональный импорт для определения кодировки
+try:
+    import chardet
+    CHARDET_AVAILABLE = True
+except ImportError:
+    CHARDET_AVAILABLE = False
+    chardet = None
+
+# Размер фрагмента файла для определения диалекта CSV
+SNIFF_SAMPLE_BYTES = 64 * 1024
+
+# Диалекты CSV, определенные для банковских счетов (кодировка, разделитель, строка заголовка)
+_statement_dialects: Dict[str, Dict[str, Any]] = {}
+
 class BankStatementParser:
     """
     Парсер банковских выписок различных форматов
     Автоматическое определение платежных систем и извлечение данных
     """
     
+    # Поддерживаемые форматы дат (порядок = приоритет)
+    DATE_FORMATS = [
+        '%Y-%m-%d %H:%M:%S',
+        '%d.%m.%Y %H:%M:%S',
+        '%d/%m/%Y %H:%M:%S',
+        '%Y-%m-%d',
+        '%d.%m.%Y',
+        '%d/%m/%Y',
+        '%d-%m-%Y',
+        '%m/%d/%Y',
+        '%Y.%m.%d'
+    ]
+    
     def __init__(self):
         # Паттерны для определения платежных систем
         self.payment_patterns = {
@@ -54,6 +86,14 @@ class BankStatementParser:
             'click': 0.02,  # 2%
             'uzum': 0.02    # 2%
         }
+        
+        # Один regex на все платежные системы для Series.str.extract: по необязательной
+        # опережающей проверке на систему, чтобы сохранить приоритет систем из payment_patterns
+        # (простая альтернация вернула бы систему, упомянутую в тексте раньше)
+        self._payment_system_regex = re.compile('^' + ''.join(
+            f"(?=[\\s\\S]*?(?P<{system}>{'|'.join(f'(?:{p})' for p in patterns)}))?"
+            for system, patterns in self.payment_patterns.items()
+        ), re.IGNORECASE)
     
     def parse_statement(self, file_path: str, bank_account: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -61,7 +101,7 @@ class BankStatementParser:
         """
         try:
             # Определяем формат файла и читаем данные
-            df = self._read_statement_file(file_path)
+            df = self._read_statement_file(file_path, bank_account)
             
             if df is None or df.empty:
                 return {
@@ -73,12 +113,8 @@ class BankStatementParser:
             # Нормализуем названия колонок
             df = self._normalize_columns(df)
             
-            # Парсим транзакции
-            transactions = []
-            for _, row in df.iterrows():
-                transaction = self._parse_transaction(row, bank_account)
-                if transaction:
-                    transactions.append(transaction)
+            # Парсим транзакции по колонкам
+            transactions = self._parse_transactions_frame(df, bank_account)
             
             # Группируем по платежным системам
             grouped_stats = self._group_by_payment_system(transactions)
@@ -98,7 +134,7 @@ class BankStatementParser:
                 'transactions': []
             }
     
-    def _read_statement_file(self, file_path: str) -> Optional[pd.DataFrame]:
+    def _read_statement_file(self, file_path: str, bank_account: Optional[str] = None) -> Optional[pd.DataFrame]:
         """
         Чтение файла выписки в зависимости от формата
         """
@@ -106,15 +142,7 @@ class BankStatementParser:
             if file_path.endswith('.xlsx') or file_path.endswith('.xls'):
                 return pd.read_excel(file_path)
             elif file_path.endswith('.csv'):
-                # Пробуем разные кодировки и разделители
-                for encoding in ['utf-8', 'cp1251', 'windows-1251', 'iso-8859-1']:
-                    for sep in [',', ';', '\t']:
-                        try:
-                            df = pd.read_csv(file_path, encoding=encoding, sep=sep)
-                            if len(df.columns) > 3:  # Минимум 3 колонки для банковской выписки
-                                return df
-                        except:
-                            continue
+                return self._read_statement_csv(file_path, bank_account)
             elif file_path.endswith('.txt'):
                 # Для текстовых файлов пробуем табуляцию
                 return pd.read_csv(file_path, sep='\t', encoding='utf-8')
@@ -125,6 +153,144 @@ class BankStatementParser:
             print(f"Error reading statement file: {e}")
             return None
     
+    def _read_statement_csv(self, file_path: str, bank_account: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """
+        Чтение CSV выписки за один полный разбор
+        Диалект определяется по первым 64КБ и запоминается для банковского счета
+        """
+        dialect = _statement_dialects.get(bank_account) if bank_account else None
+        if dialect:
+            df = self._parse_csv_with_dialect(file_path, dialect)
+            if df is not None:
+                return df
+            # Формат выписок счета изменился - определяем заново
+            _statement_dialects.pop(bank_account, None)
+        
+        dialect = self._sniff_csv_dialect(file_path)
+        if dialect:
+            df = self._parse_csv_with_dialect(file_path, dialect)
+            if df is not None:
+                if bank_account:
+                    _statement_dialects[bank_account] = dialect
+                return df
+        
+        return self._read_csv_by_trial(file_path)
+    
+    def _sniff_csv_dialect(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """Определение кодировки, разделителя и строки заголовка по началу файла"""
+        with open(file_path, 'rb') as f:
+            sample_bytes = f.read(SNIFF_SAMPLE_BYTES)
+        if not sample_bytes.strip():
+            return None
+        
+        truncated = len(sample_bytes) == SNIFF_SAMPLE_BYTES
+        encoding = self._detect_encoding(sample_bytes, truncated)
+        sample = sample_bytes.decode(encoding, errors='ignore')
+        
+        lines = sample.splitlines()
+        if truncated and len(lines) > 1:
+            # Последняя строка фрагмента может быть обрезана
+            lines = lines[:-1]
+        lines = [line for line in lines if line.strip()]
+        if not lines:
+            return None
+        
+        sep = self._detect_delimiter(lines)
+        header_row = self._detect_header_row(lines, sep)
+        if header_row is None:
+            return None
+        
+        # Номер строки заголовка считается по непустым строкам - переводим в номер строки файла
+        skiprows = 0
+        non_empty = -1
+        for skiprows, line in enumerate(sample.splitlines()):
+            if line.strip():
+                non_empty += 1
+                if non_empty == header_row:
+                    break
+        
+        return {'encoding': encoding, 'sep': sep, 'skiprows': skiprows}
+    
+    @staticmethod
+    def _detect_encoding(sample_bytes: bytes, truncated: bool = False) -> str:
+        """UTF-8 проверяется строгим декодированием, остальные кодировки - через chardet"""
+        if sample_bytes.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        
+        # Фрагмент мог обрезать многобайтный символ в конце
+        for cut in range(4 if truncated else 1):
+            try:
+                sample_bytes[:len(sample_bytes) - cut].decode('utf-8')
+                return 'utf-8'
+            except UnicodeDecodeError:
+                continue
+        
+        if CHARDET_AVAILABLE:
+            detected = chardet.detect(sample_bytes)
+            if detected.get('encoding') and (detected.get('confidence') or 0) >= 0.5:
+                try:
+                    encoding = codecs.lookup(detected['encoding']).name
+                except LookupError:
+                    return 'cp1251'
+                # chardet часто принимает короткие фрагменты cp1251 за MacCyrillic
+                return 'cp1251' if encoding == 'mac-cyrillic' else encoding
+        
+        return 'cp1251'
+    
+    @staticmethod
+    def _detect_delimiter(lines: List[str]) -> str:
+        """Разделитель: csv.Sniffer, при неудаче - самый частый из ; , TAB"""
+        try:
+            return csv.Sniffer().sniff('\n'.join(lines[:50]), delimiters=';,\t').delimiter
+        except csv.Error:
+            counts = {sep: sum(line.count(sep) for line in lines[:50]) for sep in (';', ',', '\t')}
+            return max(counts, key=counts.get)
+    
+    @staticmethod
+    def _detect_header_row(lines: List[str], sep: str) -> Optional[int]:
+        """
+        Строка заголовка - первая строка с типичным для таблицы числом полей (больше 3);
+        строки над ней (название банка, счет, период) пропускаются
+        """
+        field_counts = [len(next(csv.reader([line], delimiter=sep))) for line in lines]
+        table_counts = [count for count in field_counts if count > 3]
+        if not table_counts:
+            return None
+        
+        table_width = Counter(table_counts).most_common(1)[0][0]
+        for row, count in enumerate(field_counts):
+            if count == table_width:
+                return row
+        return None
+    
+    @staticmethod
+    def _parse_csv_with_dialect(file_path: str, dialect: Dict[str, Any]) -> Optional[pd.DataFrame]:
+        """Один полный разбор CSV; None если диалект не подходит к файлу"""
+        try:
+            df = pd.read_csv(file_path, encoding=dialect['encoding'], sep=dialect['sep'],
+                             skiprows=dialect['skiprows'])
+        except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError) as e:
+            print(f"Statement dialect {dialect} does not fit {file_path}: {e}")
+            return None
+        
+        named = [col for col in df.columns if not str(col).startswith('Unnamed:')]
+        if len(df.columns) <= 3 or len(named) <= 3:  # Минимум 3 колонки для банковской выписки
+            return None
+        return df
+    
+    @staticmethod
+    def _read_csv_by_trial(file_path: str) -> Optional[pd.DataFrame]:
+        """Прежний перебор кодировок и разделителей - если определить диалект не удалось"""
+        for encoding in ['utf-8', 'cp1251', 'windows-1251', 'iso-8859-1']:
+            for sep in [',', ';', '\t']:
+                try:
+                    df = pd.read_csv(file_path, encoding=encoding, sep=sep)
+                    if len(df.columns) > 3:  # Минимум 3 колонки для банковской выписки
+                        return df
+                except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError):
+                    continue
+        return None
+    
     def _normalize_columns(self, df: pd.DataFrame) -> pd.DataFrame:
         """
         Нормализация названий колонок
@@ -169,9 +335,231 @@ class BankStatementParser:
         
         return df_renamed
     
+    def _parse_transactions_frame(self, df: pd.DataFrame, bank_account: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Парсинг всех транзакций выписки по колонкам
+        Результат совпадает с построчным _parse_transaction, но без обхода строк в Python
+        """
+        if df.empty:
+            return []
+        
+        # При дублировании колонок после нормализации берется первая
+        columns: Dict[str, pd.Series] = {}
+        for position, name in enumerate(df.columns):
+            if name not in columns:
+                columns[name] = df.iloc[:, position]
+        
+        dates = self._extract_dates(columns, df.index)
+        amounts = self._extract_amounts(columns, df.index)
+        
+        valid = dates.notna() & (amounts != 0)
+        if not valid.any():
+            return []
+        
+        frame = df.loc[valid]
+        columns = {name: column[valid] for name, column in columns.items()}
+        amounts = amounts[valid]
+        
+        description = self._first_text(columns, ['description', 'описание', 'назначение', 'purpose', 'детали'], frame.index)
+        counterparty = self._first_text(columns, ['counterparty', 'контрагент', 'получатель', 'отправитель'], frame.index)
+        reference = self._first_text(columns, ['reference_number', 'референс', 'номер документа', 'doc_number'], frame.index)
+        
+        payment_system = self._identify_payment_systems(description, counterparty)
+        
+        # Комиссия от суммы со знаком, как в _calculate_commission
+        rates = payment_system.map(self.commission_rates).fillna(0.0).astype(float)
+        commission = amounts * rates
+        
+        # Дубли колонок в raw_data схлопываются как в Series.to_dict (последнее значение)
+        raw_frame = frame.loc[:, ~frame.columns.duplicated(keep='last')]
+        
+        result = pd.DataFrame({
+            'transaction_date': dates[valid],
+            'transaction_time': self._extract_times(columns, frame.index),
+            'amount': amounts.abs(),
+            'transaction_type': self._determine_transaction_types(columns, amounts),
+            'description': description,
+            'counterparty': counterparty,
+            'reference_number': reference,
+            'payment_system': payment_system,
+            'bank_account': pd.Series(bank_account, index=frame.index, dtype=object),
+            'commission_rate': rates,
+            'commission_amount': commission,
+            'net_amount': amounts - commission,
+        }, index=frame.index)
+        for field in ('transaction_time', 'bank_account'):
+            result[field] = result[field].astype(object).where(result[field].notna(), None)
+        
+        transactions = result.to_dict('records')
+        for transaction, raw_data in zip(transactions, raw_frame.to_dict('records')):
+            transaction['raw_data'] = raw_data
+        
+        return transactions
+    
+    @staticmethod
+    def _value_kinds(values: pd.Series) -> pd.Series:
+        """Тип значений колонки: datetime / date / number / str / other"""
+        def kind(value):
+            if isinstance(value, datetime):
+                return 'datetime'
+            if isinstance(value, date):
+                return 'date'
+            if isinstance(value, str):
+                return 'str'
+            if isinstance(value, (int, float)):
+                return 'number'
+            return 'other'
+        
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return pd.Series('datetime', index=values.index)
+        if pd.api.types.is_numeric_dtype(values):
+            return pd.Series('number', index=values.index)
+        return values.map(kind)
+    
+    def _extract_dates(self, columns: Dict[str, pd.Series], index: pd.Index) -> pd.Series:
+        """
+        Векторное извлечение даты (семантика _extract_date): первая непустая колонка
+        с датой или строкой определяет результат, строки разбираются по форматам
+        """
+        result = pd.Series(None, index=index, dtype=object)
+        resolved = pd.Series(False, index=index)
+        
+        for field in ['transaction_date', 'дата', 'date']:
+            if field not in columns:
+                continue
+            
+            values = columns[field][~resolved & columns[field].notna()]
+            if values.empty:
+                continue
+            kinds = self._value_kinds(values)
+            
+            is_datelike = kinds.isin(['datetime', 'date'])
+            if is_datelike.any():
+                result[values.index[is_datelike]] = values[is_datelike].map(lambda v: v.strftime('%Y-%m-%d'))
+            
+            is_str = kinds == 'str'
+            if is_str.any():
+                result[values.index[is_str]] = self._parse_date_strings(values[is_str])
+            
+            resolved[values.index[is_datelike | is_str]] = True
+        
+        return result
+    
+    def _parse_date_strings(self, values: pd.Series) -> pd.Series:
+        """Разбор строк дат по форматам _parse_date_string; каждая уникальная строка - один раз"""
+        stripped = values.str.strip()
+        uniques = pd.Series(stripped.unique())
+        parsed = pd.Series(None, index=uniques.index, dtype=object)
+        remaining = pd.Series(True, index=uniques.index)
+        
+        for fmt in self.DATE_FORMATS:
+            if not remaining.any():
+                break
+            converted = pd.to_datetime(uniques[remaining], format=fmt, errors='coerce')
+            ok = converted.notna()
+            parsed[ok[ok].index] = converted[ok].dt.strftime('%Y-%m-%d')
+            remaining[ok[ok].index] = False
+        
+        return stripped.map(dict(zip(uniques, parsed)))
+    
+    def _extract_times(self, columns: Dict[str, pd.Series], index: pd.Index) -> pd.Series:
+        """Векторное извлечение времени (семантика _extract_time)"""
+        result = pd.Series(None, index=index, dtype=object)
+        resolved = pd.Series(False, index=index)
+        
+        for field in ['transaction_date', 'дата', 'date', 'время', 'time']:
+            if field not in columns:
+                continue
+            
+            values = columns[field][~resolved & columns[field].notna()]
+            if values.empty:
+                continue
+            kinds = self._value_kinds(values)
+            
+            is_datetime = kinds == 'datetime'
+            if is_datetime.any():
+                result[values.index[is_datetime]] = values[is_datetime].map(lambda v: v.strftime('%H:%M:%S'))
+                resolved[values.index[is_datetime]] = True
+            
+            strings = values[kinds == 'str']
+            if not strings.empty:
+                times = strings.str.extract(r'(\d{2}:\d{2}:\d{2})', expand=False)
+                short = strings.str.extract(r'(\d{2}:\d{2})', expand=False) + ':00'
+                times = times.fillna(short).dropna()
+                result[times.index] = times
+                resolved[times.index] = True
+        
+        return result
+    
+    def _extract_amounts(self, columns: Dict[str, pd.Series], index: pd.Index) -> pd.Series:
+        """Векторное извлечение суммы (семантика _extract_amount)"""
+        result = pd.Series(0.0, index=index)
+        resolved = pd.Series(False, index=index)
+        
+        for field in ['amount', 'сумма', 'credit_amount', 'debit_amount', 'кредит', 'дебет']:
+            if field not in columns:
+                continue
+            
+            values = columns[field][~resolved & columns[field].notna()]
+            if values.empty:
+                continue
+            kinds = self._value_kinds(values)
+            
+            numbers = values[kinds == 'number']
+            if not numbers.empty:
+                result[numbers.index] = numbers.astype(float)
+                resolved[numbers.index] = True
+            
+            strings = values[kinds == 'str']
+            if not strings.empty:
+                cleaned = strings.str.replace(r'[^\d\.,\-]', '', regex=True).str.replace(',', '.', regex=False)
+                parsed = pd.to_numeric(cleaned, errors='coerce').dropna()
+                result[parsed.index] = parsed.astype(float)
+                resolved[parsed.index] = True
+        
+        return result
+    
+    @staticmethod
+    def _first_text(columns: Dict[str, pd.Series], fields: List[str], index: pd.Index) -> pd.Series:
+        """Первое непустое значение из списка колонок как строка без пробелов по краям"""
+        result = pd.Series('', index=index, dtype=object)
+        resolved = pd.Series(False, index=index)
+        
+        for field in fields:
+            if field not in columns:
+                continue
+            mask = ~resolved & columns[field].notna()
+            if mask.any():
+                result[mask] = columns[field][mask].astype(str).str.strip()
+                resolved |= mask
+        
+        return result
+    
+    def _identify_payment_systems(self, description: pd.Series, counterparty: pd.Series) -> pd.Series:
+        """Векторное определение платежной системы (семантика _identify_payment_system)"""
+        text = (description + ' ' + counterparty).str.upper()
+        matched = text.str.extract(self._payment_system_regex).notna()
+        
+        systems = matched.idxmax(axis=1)
+        return systems.where(matched.any(axis=1), 'other').astype(object)
+    
+    def _determine_transaction_types(self, columns: Dict[str, pd.Series], amounts: pd.Series) -> pd.Series:
+        """Векторное определение типа транзакции (семантика _determine_transaction_type)"""
+        result = pd.Series('debit', index=amounts.index, dtype=object)
+        result[amounts > 0] = 'credit'
+        
+        if 'credit_amount' in columns:
+            credit = columns['credit_amount']
+            result[(credit.notna() & (credit != 0)).to_numpy()] = 'credit'
+        if 'debit_amount' in columns:
+            debit = columns['debit_amount']
+            result[(debit.notna() & (debit != 0)).to_numpy()] = 'debit'
+        
+        return result
+    
     def _parse_transaction(self, row: pd.Series, bank_account: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
-        Парсинг одной транзакции
+        Парсинг одной транзакции (построчный вариант _parse_transactions_frame)
         """
         try:
             # Извлекаем основные поля
@@ -369,19 +757,7 @@ class BankStatementParser:
         """
         Парсинг строки даты в различных форматах
         """
-        date_formats = [
-            '%Y-%m-%d %H:%M:%S',
-            '%d.%m.%Y %H:%M:%S',
-            '%d/%m/%Y %H:%M:%S',
-            '%Y-%m-%d',
-            '%d.%m.%Y',
-            '%d/%m/%Y',
-            '%d-%m-%Y',
-            '%m/%d/%Y',
-            '%Y.%m.%d'
-        ]
-        
-        for fmt in date_formats:
+        for fmt in self.DATE_FORMATS:
             try:
                 parsed_date = datetime.strptime(date_str.strip(), fmt)
                 return parsed_date.strftime('%Y-%m-%d')
@@ -394,33 +770,40 @@ class BankStatementParser:
         """
         Группировка транзакций по платежным системам
         """
-        grouped = {}
+        if not transactions:
+            return {}
         
-        for transaction in transactions:
-            system = transaction['payment_system']
-            
-            if system not in grouped:
-                grouped[system] = {
-                    'count': 0,
-                    'total_amount': 0.0,
-                    'total_commission': 0.0,
-                    'net_amount': 0.0,
-                    'transactions': []
-                }
-            
-            grouped[system]['count'] += 1
-            grouped[system]['total_amount'] += transaction['amount']
-            grouped[system]['total_commission'] += transaction['commission_amount']
-            grouped[system]['net_amount'] += transaction['net_amount']
-            grouped[system]['transactions'].append(transaction)
+        frame = pd.DataFrame({
+            'payment_system': [t['payment_system'] for t in transactions],
+            'amount': [t['amount'] for t in transactions],
+            'commission_amount': [t['commission_amount'] for t in transactions],
+            'net_amount': [t['net_amount'] for t in transactions]
+        })
+        groups = frame.groupby('payment_system', sort=False)
+        totals = groups[['amount', 'commission_amount', 'net_amount']].sum()
         
-        return grouped
+        grouped = {}
+        for system, positions in groups.indices.items():
+            grouped[system] = {
+                'count': len(positions),
+                'total_amount': float(totals.at[system, 'amount']),
+                'total_commission': float(totals.at[system, 'commission_amount']),
+                'net_amount': float(totals.at[system, 'net_amount']),
+                'transactions': [transactions[i] for i in positions]
+            }
+        
+        # Порядок систем - по первому появлению, как при построчной группировке
+        return {system: grouped[system] for system in totals.index}
     
     def reconcile_with_orders(self, transactions: List[Dict[str, Any]], 
                             orders_data: List[Dict[str, Any]], 
                             time_tolerance_minutes: int = 10) -> Dict[str, Any]:
         """
         Сверка банковских транзакций с данными заказов
+        
+        Жадное сопоставление в порядке транзакций с оценкой _calculate_match_score
+        (порог 0.7, при равной оценке - более ранний заказ), но без перебора всех пар:
+        заказы индексируются по шлюзу, цене и времени оплаты (см. _OrderMatchIndex)
         """
         reconciliation_results = {
             'matched': [],
@@ -434,35 +817,32 @@ class BankStatementParser:
             }
         }
         
-        # Создаем копии для работы
-        remaining_transactions = transactions.copy()
-        remaining_orders = orders_data.copy()
+        order_index = _OrderMatchIndex(orders_data, time_tolerance_minutes)
+        matched_transactions = set()
         
         # Сопоставляем транзакции с заказами
-        for transaction in transactions:
-            best_match = None
-            best_score = 0
-            
-            for order in remaining_orders:
-                score = self._calculate_match_score(transaction, order, time_tolerance_minutes)
-                if score > best_score and score >= 0.7:  # Минимальный порог совпадения
-                    best_match = order
-                    best_score = score
-            
-            if best_match:
-                reconciliation_results['matched'].append({
-                    'transaction': transaction,
-                    'order': best_match,
-                    'match_score': best_score,
-                    'amount_difference': abs(transaction['net_amount'] - best_match.get('order_price', 0))
-                })
-                
-                remaining_transactions.remove(transaction)
-                remaining_orders.remove(best_match)
-                reconciliation_results['summary']['matched_count'] += 1
+        for position, transaction in enumerate(transactions):
+            best = order_index.find_best_match(transaction)
+            if best is None:
+                continue
+            
+            order_position, best_score = best
+            best_match = orders_data[order_position]
+            order_index.remove(order_position)
+            matched_transactions.add(position)
+            
+            reconciliation_results['matched'].append({
+                'transaction': transaction,
+                'order': best_match,
+                'match_score': best_score,
+                'amount_difference': abs(transaction['net_amount'] - best_match.get('order_price', 0))
+            })
+            reconciliation_results['summary']['matched_count'] += 1
         
-        reconciliation_results['unmatched_transactions'] = remaining_transactions
-        reconciliation_results['unmatched_orders'] = remaining_orders
+        reconciliation_results['unmatched_transactions'] = [
+            t for position, t in enumerate(transactions) if position not in matched_transactions
+        ]
+        reconciliation_results['unmatched_orders'] = order_index.remaining_orders()
         
         # Расчет общей разности
         total_transactions_amount = sum(t['net_amount'] for t in transactions)
@@ -514,6 +894,190 @@ class BankStatementParser:
         
         return score
     
+    def compute_daily_settlement_totals(self, orders_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Свертка заказов в дневные итоги по платежным шлюзам (брутто и нетто за вычетом комиссии)
+        Для данных из БД используйте FinanceProcessor.get_daily_settlement_totals
+        """
+        totals: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        
+        for order in orders_data:
+            gateway = order.get('payment_gateway')
+            if gateway not in self.commission_rates:
+                continue
+            
+            try:
+                price = float(order.get('order_price') or 0)
+            except (TypeError, ValueError):
+                continue
+            if price <= 0:
+                continue
+            
+            order_date = order.get('paying_time') or order.get('creation_time')
+            if not order_date:
+                continue
+            settlement_date = str(order_date)[:10]
+            
+            day = totals.setdefault((gateway, settlement_date), {
+                'payment_system': gateway,
+                'settlement_date': settlement_date,
+                'orders_count': 0,
+                'gross_amount': 0.0
+            })
+            day['orders_count'] += 1
+            day['gross_amount'] += price
+        
+        return self.with_net_amounts(totals.values())
+    
+    def with_net_amounts(self, daily_totals) -> List[Dict[str, Any]]:
+        """Добавление ожидаемой суммы зачисления (брутто минус комиссия шлюза)"""
+        result = []
+        for day in daily_totals:
+            day = dict(day)
+            day['gross_amount'] = float(day['gross_amount'] or 0)
+            day['net_amount'] = self._calculate_commission(day['gross_amount'], day['payment_system'])['net_amount']
+            result.append(day)
+        
+        result.sort(key=lambda d: (d['payment_system'], d['settlement_date']))
+        return result
+    
+    def reconcile_settlements(self, transactions: List[Dict[str, Any]],
+                              daily_totals: List[Dict[str, Any]],
+                              max_lag_days: int = 3,
+                              max_window_days: int = 3,
+                              amount_tolerance: float = 1.0,
+                              relative_tolerance: float = 0.001,
+                              max_subsets: int = 500) -> Dict[str, Any]:
+        """
+        Сверка зачислений от платежных систем с дневными итогами заказов
+        
+        Шлюзы перечисляют выручку одной суммой за день (или за несколько дней) за вычетом
+        комиссии, поэтому строка выписки сравнивается с нетто-итогами дней из окна
+        [дата зачисления - max_lag_days, дата зачисления]:
+        1. Сначала для всех строк ищется один день с совпадающей суммой
+        2. Затем для оставшихся - набор из 2..max_window_days дней (сумма подмножества),
+           перебор ограничен max_subsets сочетаниями на строку
+        
+        Args:
+            transactions: Транзакции из parse_statement
+            daily_totals: Итоги из compute_daily_settlement_totals / get_daily_settlement_totals
+        """
+        results = {
+            'matched': [],
+            'unmatched_transactions': [],
+            'unsettled_days': [],
+            'other_transactions': [],
+            'summary': {
+                'total_transactions': len(transactions),
+                'total_days': len(daily_totals),
+                'matched_count': 0,
+                'multi_day_count': 0,
+                'amount_difference': 0.0
+            }
+        }
+        
+        days_by_gateway: Dict[str, Dict[date, Dict[str, Any]]] = {}
+        for day in daily_totals:
+            try:
+                settlement_date = datetime.strptime(str(day['settlement_date'])[:10], '%Y-%m-%d').date()
+            except ValueError:
+                continue
+            days_by_gateway.setdefault(day['payment_system'], {})[settlement_date] = day
+        
+        settled = set()
+        pending = []
+        
+        for transaction in transactions:
+            gateway = transaction.get('payment_system')
+            if gateway not in self.commission_rates or transaction.get('transaction_type') == 'debit':
+                results['other_transactions'].append(transaction)
+                continue
+            try:
+                credit_date = datetime.strptime(str(transaction['transaction_date'])[:10], '%Y-%m-%d').date()
+            except (KeyError, ValueError):
+                results['unmatched_transactions'].append(transaction)
+                continue
+            pending.append((credit_date, transaction))
+        
+        pending.sort(key=lambda item: item[0])
+        
+        def candidate_days(gateway: str, credit_date: date) -> List[Tuple[date, Dict[str, Any]]]:
+            gateway_days = days_by_gateway.get(gateway, {})
+            candidates = []
+            for lag in range(max_lag_days + 1):
+                settlement_date = credit_date - timedelta(days=lag)
+                if (gateway, settlement_date) not in settled and settlement_date in gateway_days:
+                    candidates.append((settlement_date, gateway_days[settlement_date]))
+            return candidates
+        
+        def record_match(transaction: Dict[str, Any], days: List[Tuple[date, Dict[str, Any]]]):
+            gateway = transaction['payment_system']
+            expected_net = sum(day['net_amount'] for _, day in days)
+            for settlement_date, _ in days:
+                settled.add((gateway, settlement_date))
+            results['matched'].append({
+                'transaction': transaction,
+                'payment_system': gateway,
+                'settlement_dates': sorted(d.strftime('%Y-%m-%d') for d, _ in days),
+                'orders_count': sum(day['orders_count'] for _, day in days),
+                'gross_amount': sum(day['gross_amount'] for _, day in days),
+                'expected_net': expected_net,
+                'difference': transaction['amount'] - expected_net
+            })
+        
+        # Этап 1: зачисление за один день (ближайший по сумме, затем по дате)
+        multi_day_pending = []
+        for credit_date, transaction in pending:
+            amount = transaction['amount']
+            tolerance = max(amount_tolerance, amount * relative_tolerance)
+            
+            best = None
+            for settlement_date, day in candidate_days(transaction['payment_system'], credit_date):
+                difference = abs(amount - day['net_amount'])
+                if difference <= tolerance and (best is None or difference < best[0]):
+                    best = (difference, settlement_date, day)
+            
+            if best:
+                record_match(transaction, [(best[1], best[2])])
+            else:
+                multi_day_pending.append((credit_date, transaction))
+        
+        # Этап 2: зачисление за несколько дней - ограниченный перебор подмножеств
+        for credit_date, transaction in multi_day_pending:
+            amount = transaction['amount']
+            tolerance = max(amount_tolerance, amount * relative_tolerance)
+            candidates = candidate_days(transaction['payment_system'], credit_date)
+            
+            best = None
+            checked = 0
+            for size in range(2, min(max_window_days, len(candidates)) + 1):
+                for subset in combinations(candidates, size):
+                    checked += 1
+                    if checked > max_subsets:
+                        break
+                    difference = abs(amount - sum(day['net_amount'] for _, day in subset))
+                    if difference <= tolerance and (best is None or difference < best[0]):
+                        best = (difference, list(subset))
+                if best is not None or checked > max_subsets:
+                    # Меньшее число дней предпочтительнее
+                    break
+            
+            if best:
+                record_match(transaction, best[1])
+                results['summary']['multi_day_count'] += 1
+            else:
+                results['unmatched_transactions'].append(transaction)
+        
+        results['unsettled_days'] = [
+            day for gateway, gateway_days in days_by_gateway.items()
+            for settlement_date, day in sorted(gateway_days.items())
+            if (gateway, settlement_date) not in settled
+        ]
+        results['summary']['matched_count'] = len(results['matched'])
+        results['summary']['amount_difference'] = sum(m['difference'] for m in results['matched'])
+        
+        return results
+    
     def generate_reconciliation_report(self, reconciliation_results: Dict[str, Any]) -> str:
         """
         Генерация отчета по сверке
@@ -546,3 +1110,320 @@ class BankStatementParser:
                 report_lines.append(f"- {order.get('order_number', 'N/A')} | {order.get('order_price', 0):.2f} | {order.get('payment_gateway', 'N/A')}")
         
         return "\n".join(report_lines)
+
+
+# ============================================================================
+# ИНДЕКС ЗАКАЗОВ ДЛЯ СВЕРКИ
+# ============================================================================
+
+def _match_score(gateway_matched: bool, amount_tier: int, time_tier: int) -> float:
+    """
+    Оценка совпадения из компонентов - те же слагаемые в том же порядке,
+    что и в BankStatementParser._calculate_match_score (результат совпадает до бита)
+    """
+    score = 0.0
+    if gateway_matched:
+        score += 0.4
+    if amount_tier == 2:
+        score += 0.4
+    elif amount_tier == 1:
+        score += 0.2
+    if time_tier == 2:
+        score += 0.2
+    elif time_tier == 1:
+        score += 0.1
+    return score
+
+
+def _amount_tier(transaction_amount: float, order_amount: float) -> int:
+    """2 - расхождение суммы до 1%, 1 - до 5%, 0 - больше"""
+    diff_percent = abs(transaction_amount - order_amount) / order_amount
+    if diff_percent <= 0.01:
+        return 2
+    if diff_percent <= 0.05:
+        return 1
+    return 0
+
+
+class _MinSegmentTree:
+    """Дерево отрезков для минимума на диапазоне с точечным обновлением"""
+    
+    INF = float('inf')
+    
+    def __init__(self, values: List[float]):
+        self.size = 1
+        while self.size < max(1, len(values)):
+            self.size *= 2
+        self.tree = [self.INF] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = values
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+    
+    def update(self, position: int, value: float):
+        i = position + self.size
+        self.tree[i] = value
+        i //= 2
+        while i:
+            self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+    
+    def query(self, lo: int, hi: int) -> float:
+        """Минимум на полуинтервале [lo, hi)"""
+        result = self.INF
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                result = min(result, self.tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                result = min(result, self.tree[hi])
+            lo //= 2
+            hi //= 2
+        return result
+
+
+class _PriceIndex:
+    """
+    Набор заказов, сгруппированных по уникальной цене (по возрастанию)
+    Для каждой цены хранится указатель на самый ранний несопоставленный заказ,
+    дерево отрезков дает самый ранний заказ в диапазоне цен за O(log n)
+    """
+    
+    def __init__(self, positions: List[int], prices: List[Optional[float]], used: bytearray):
+        by_price: Dict[float, List[int]] = {}
+        for position in positions:
+            by_price.setdefault(prices[position], []).append(position)
+        
+        self.prices = sorted(by_price)
+        # Позиции заказов по возрастанию для каждой цены
+        self.price_orders = [sorted(by_price[price]) for price in self.prices]
+        self.heads = [0] * len(self.prices)
+        self.slots = {}
+        
+        for slot, slot_positions in enumerate(self.price_orders):
+            head = 0
+            while head < len(slot_positions) and used[slot_positions[head]]:
+                head += 1
+            self.heads[slot] = head
+            for position in slot_positions:
+                self.slots[position] = slot
+        
+        self.earliest = _MinSegmentTree([
+            slot_positions[head] if head < len(slot_positions) else _MinSegmentTree.INF
+            for slot_positions, head in zip(self.price_orders, self.heads)
+        ])
+    
+    def price_range(self, amount: float, tolerance: float) -> Tuple[int, int]:
+        """Полуинтервал индексов цен, для которых abs(amount - price) / price <= tolerance"""
+        if amount <= 0 or not self.prices:
+            return 0, 0
+        
+        # Границы с запасом на округление, затем точная проверка той же формулой
+        lo = bisect.bisect_left(self.prices, amount / (1 + tolerance) * (1 - 1e-9))
+        hi = bisect.bisect_right(self.prices, amount / (1 - tolerance) * (1 + 1e-9))
+        while lo < hi and abs(amount - self.prices[lo]) / self.prices[lo] > tolerance:
+            lo += 1
+        while hi > lo and abs(amount - self.prices[hi - 1]) / self.prices[hi - 1] > tolerance:
+            hi -= 1
+        return lo, hi
+    
+    def earliest_in(self, lo: int, hi: int) -> Optional[int]:
+        """Самый ранний несопоставленный заказ в диапазоне цен [lo, hi)"""
+        if lo >= hi:
+            return None
+        earliest = self.earliest.query(lo, hi)
+        return None if earliest == _MinSegmentTree.INF else int(earliest)
+    
+    def remove(self, position: int, used: bytearray):
+        slot = self.slots.get(position)
+        if slot is None:
+            return
+        
+        slot_positions = self.price_orders[slot]
+        head = self.heads[slot]
+        while head < len(slot_positions) and used[slot_positions[head]]:
+            head += 1
+        self.heads[slot] = head
+        self.earliest.update(slot, slot_positions[head] if head < len(slot_positions) else _MinSegmentTree.INF)
+
+
+class _OrderMatchIndex:
+    """
+    Индекс заказов для сверки с банковскими транзакциями
+    
+    Оценка >= 0.7 возможна только при совпадении шлюза и расхождении суммы до 5%,
+    а без бонуса за время - только при расхождении до 1%. Все сочетания
+    (сумма до 1%/до 5%) x (время до допуска/до двух допусков/вне) дают разные оценки,
+    поэтому лучший кандидат - самый ранний заказ в лучшем непустом сочетании:
+    - ценовой индекс всех заказов шлюза (сумма до 1%, время любое)
+    - ценовые индексы заказов из окна времени вокруг даты транзакции, по одному
+      на уровень бонуса за время; строятся лениво один раз на (шлюз, дата)
+    """
+    
+    def __init__(self, orders: List[Dict[str, Any]], time_tolerance_minutes: int):
+        self.orders = orders
+        self.time_tolerance_minutes = time_tolerance_minutes
+        self.used = bytearray(len(orders))
+        
+        self.prices: List[Optional[float]] = [None] * len(orders)
+        self.times: List[Optional[datetime]] = [None] * len(orders)
+        # Индексы, в которые входит заказ (для обновления при сопоставлении)
+        self.memberships: Dict[int, List[_PriceIndex]] = {}
+        
+        positions_by_gateway: Dict[Any, List[int]] = {}
+        self.times_by_gateway: Dict[Any, Tuple[List[datetime], List[int]]] = {}
+        timed_by_gateway: Dict[Any, List[Tuple[datetime, int]]] = {}
+        
+        for position, order in enumerate(orders):
+            price = order.get('order_price', 0)
+            try:
+                price = float(price)
+            except (TypeError, ValueError):
+                continue
+            if price <= 0:
+                # Без суммы заказ не может набрать порог 0.7
+                continue
+            
+            gateway = order.get('payment_gateway', '')
+            self.prices[position] = price
+            positions_by_gateway.setdefault(gateway, []).append(position)
+            
+            order_time = self._parse_order_time(order)
+            self.times[position] = order_time
+            if order_time is not None:
+                timed_by_gateway.setdefault(gateway, []).append((order_time, position))
+        
+        self.gateways: Dict[Any, _PriceIndex] = {}
+        for gateway, positions in positions_by_gateway.items():
+            self.gateways[gateway] = self._register(_PriceIndex(positions, self.prices, self.used))
+        
+        for gateway, timed in timed_by_gateway.items():
+            timed.sort()
+            self.times_by_gateway[gateway] = ([t for t, _ in timed], [p for _, p in timed])
+        
+        self.windows: Dict[Tuple[Any, datetime], Dict[int, _PriceIndex]] = {}
+        # Даты выписки повторяются (десятки уникальных на месяц) - разбираются один раз
+        self.transaction_dates: Dict[Any, Optional[datetime]] = {}
+    
+    def _register(self, index: _PriceIndex) -> _PriceIndex:
+        for position in index.slots:
+            self.memberships.setdefault(position, []).append(index)
+        return index
+    
+    @staticmethod
+    def _parse_order_time(order: Dict[str, Any]) -> Optional[datetime]:
+        """Время заказа разбирается один раз; время с часовым поясом не сравнимо с датой выписки"""
+        order_date = order.get('paying_time') or order.get('creation_time')
+        if not order_date:
+            return None
+        try:
+            order_time = datetime.fromisoformat(str(order_date).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+        return order_time if order_time.tzinfo is None else None
+    
+    def _parse_transaction_date(self, transaction_date: Any) -> Optional[datetime]:
+        if not transaction_date:
+            return None
+        try:
+            return self.transaction_dates[transaction_date]
+        except KeyError:
+            pass
+        except TypeError:
+            # Нехешируемое значение - как и при ошибке разбора, без бонуса за время
+            return None
+        
+        try:
+            parsed = datetime.strptime(transaction_date, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            parsed = None
+        self.transaction_dates[transaction_date] = parsed
+        return parsed
+    
+    def _time_tier(self, transaction_time: datetime, order_time: datetime) -> int:
+        """2 - разница до допуска, 1 - до двух допусков, 0 - больше"""
+        time_diff_minutes = abs((transaction_time - order_time).total_seconds()) / 60
+        if time_diff_minutes <= self.time_tolerance_minutes:
+            return 2
+        if time_diff_minutes <= self.time_tolerance_minutes * 2:
+            return 1
+        return 0
+    
+    def _window(self, gateway: Any, transaction_time: datetime) -> Dict[int, _PriceIndex]:
+        """Ценовые индексы заказов шлюза около времени транзакции по уровню бонуса за время"""
+        key = (gateway, transaction_time)
+        if key in self.windows:
+            return self.windows[key]
+        
+        tiers: Dict[int, List[int]] = {1: [], 2: []}
+        if gateway in self.times_by_gateway:
+            times, positions = self.times_by_gateway[gateway]
+            window = timedelta(minutes=self.time_tolerance_minutes * 2)
+            start = bisect.bisect_left(times, transaction_time - window)
+            stop = bisect.bisect_right(times, transaction_time + window)
+            for i in range(start, stop):
+                tier = self._time_tier(transaction_time, times[i])
+                if tier:
+                    tiers[tier].append(positions[i])
+        
+        self.windows[key] = {
+            tier: self._register(_PriceIndex(positions, self.prices, self.used))
+            for tier, positions in tiers.items() if positions
+        }
+        return self.windows[key]
+    
+    def find_best_match(self, transaction: Dict[str, Any]) -> Optional[Tuple[int, float]]:
+        """Лучший несопоставленный заказ для транзакции: (позиция заказа, оценка) или None"""
+        gateway = transaction['payment_system']
+        index = self.gateways.get(gateway)
+        if index is None:
+            return None
+        
+        amount = transaction['net_amount']
+        transaction_time = self._parse_transaction_date(transaction.get('transaction_date'))
+        
+        best_position = None
+        best_score = 0.0
+        
+        def consider(position: Optional[int]):
+            nonlocal best_position, best_score
+            if position is None:
+                return
+            time_tier = 0
+            if transaction_time is not None and self.times[position] is not None:
+                time_tier = self._time_tier(transaction_time, self.times[position])
+            score = _match_score(True, _amount_tier(amount, self.prices[position]), time_tier)
+            if score >= 0.7 and (score > best_score or (score == best_score and position < best_position)):
+                best_position = position
+                best_score = score
+        
+        # Самый ранний заказ с расхождением суммы до 1%
+        consider(index.earliest_in(*index.price_range(amount, 0.01)))
+        
+        # Самые ранние заказы с бонусом за время: сумма до 1% и от 1% до 5%
+        if transaction_time is not None:
+            for window_index in self._window(gateway, transaction_time).values():
+                lo1, hi1 = window_index.price_range(amount, 0.01)
+                lo5, hi5 = window_index.price_range(amount, 0.05)
+                if lo1 < hi1:
+                    consider(window_index.earliest_in(lo1, hi1))
+                    consider(window_index.earliest_in(lo5, lo1))
+                    consider(window_index.earliest_in(hi1, hi5))
+                else:
+                    consider(window_index.earliest_in(lo5, hi5))
+        
+        if best_position is None:
+            return None
+        return best_position, best_score
+    
+    def remove(self, position: int):
+        """Исключение сопоставленного заказа из всех индексов"""
+        self.used[position] = 1
+        for index in self.memberships.get(position, []):
+            index.remove(position, self.used)
+    
+    def remaining_orders(self) -> List[Dict[str, Any]]:
+        """Несопоставленные заказы в исходном порядке"""
+        return [order for position, order in enumerate(self.orders) if not self.used[position]]
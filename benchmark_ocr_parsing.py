@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Микро-бенчмарк разбора текста чеков OCR
+Сравнение прежнего построчного разбора с однопроходным (OCRProcessor._parse_receipt_data)
+
+Запуск: python benchmark_ocr_parsing.py [--receipts 2000] [--repeat 5]
+"""
+
+import argparse
+import random
+import re
+import sys
+import time
+from typing import Any, Dict, List
+
+from ocr_processor import OCRProcessor
+
+# Построчные паттерны товарных позиций до перехода на однопроходный разбор
+LEGACY_ITEM_PATTERNS = [
+    r'(.+?)\s+(\d+[\.,]\d+)\s*[xх]\s*(\d+[\.,]\d+)',
+    r'(.+?)\s+(\d+[\.,]\d+)\s*шт\s*(\d+[\.,]\d+)',
+    r'(.+?)\s+(\d+[\.,]\d+)$'
+]
+
+GOODS = ['Капучино', 'Латте', 'Americano', 'Эспрессо', 'Чай черный', 'Горячий шоколад', 'Вода 0.5']
+VENDORS = ['ООО VENDING HUB', 'OOO COFFEE POINT', 'ТОРГОВАЯ ТОЧКА №3']
+PAYMENTS = ['Наличные', 'Payme', 'CLICK', 'Оплата картой', 'Uzum Pay']
+
+
+def generate_receipt_text(seed: int) -> str:
+    """Детерминированная генерация текста чека, похожего на вывод Tesseract"""
+    rnd = random.Random(seed)
+    lines = [
+        rnd.choice(VENDORS),
+        f"ЧЕК № {rnd.randint(1, 99999)}",
+        f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.2024 "
+        f"{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:{rnd.randint(0, 59):02d}",
+    ]
+
+    for _ in range(rnd.randint(1, 15)):
+        name = rnd.choice(GOODS)
+        style = rnd.random()
+        if style < 0.5:
+            lines.append(f"{name} {rnd.randint(1, 3)}.00 x {rnd.randint(5, 30)}000.00")
+        elif style < 0.7:
+            lines.append(f"{name} {rnd.randint(1, 3)},00 шт {rnd.randint(5, 30)}000,00")
+        else:
+            lines.append(f"  {name}   {rnd.randint(5, 30)}000.00 ")
+
+    lines.append(f"ИТОГО: {rnd.randint(5, 90)}000.00")
+    if rnd.random() < 0.5:
+        lines.append(f"ФП: {rnd.randint(10 ** 9, 10 ** 10)}")
+    if rnd.random() < 0.3:
+        lines.append(f"TRANSACTION ID: {rnd.randint(1, 10 ** 6)}")
+    lines.append(rnd.choice(PAYMENTS))
+    lines.extend(['Спасибо за покупку!'] * rnd.randint(0, 20))
+
+    return '\n'.join(lines)
+
+
+def legacy_parse_receipt_data(processor: OCRProcessor, text: str) -> Dict[str, Any]:
+    """Прежний алгоритм: re.search по каждому паттерну и построчный поиск позиций"""
+    data = {
+        'items': [], 'total_amount': None, 'date': None, 'time': None,
+        'receipt_number': None, 'fiscal_number': None, 'transaction_id': None,
+        'payment_method': None
+    }
+    field_targets = {'amount': 'total_amount'}
+
+    for field, patterns in processor.patterns.items():
+        for pattern in patterns:
+            match = re.search(pattern, text, re.IGNORECASE)
+            if match:
+                value = match.group(1)
+                if field == 'amount':
+                    value = processor._parse_amount(value)
+                elif field == 'date':
+                    value = processor._parse_date(value)
+                data[field_targets.get(field, field)] = value
+                break
+
+    items: List[Dict[str, Any]] = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or len(line) < 5:
+            continue
+        for pattern in LEGACY_ITEM_PATTERNS:
+            match = re.search(pattern, line)
+            if match:
+                groups = match.groups()
+                if len(groups) == 3:
+                    name, quantity, price = groups
+                    items.append({
+                        'name': name.strip(),
+                        'quantity': processor._parse_float(quantity),
+                        'price': processor._parse_float(price),
+                        'total': processor._parse_float(quantity) * processor._parse_float(price)
+                    })
+                else:
+                    name, price = groups
+                    items.append({
+                        'name': name.strip(),
+                        'quantity': 1.0,
+                        'price': processor._parse_float(price),
+                        'total': processor._parse_float(price)
+                    })
+                break
+
+    data['items'] = items
+    data['payment_method'] = processor._detect_payment_method(text)
+    return data
+
+
+def _best_time(func, corpus: List[str], repeat: int) -> float:
+    """Лучшее время прохода по корпусу из нескольких повторов"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in corpus:
+            func(text)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run_benchmark(receipts: int = 2000, repeat: int = 5) -> Dict[str, float]:
+    """Запуск бенчмарка с проверкой эквивалентности результатов"""
+    processor = OCRProcessor()
+    corpus = [generate_receipt_text(seed) for seed in range(receipts)]
+
+    mismatches = sum(
+        1 for text in corpus
+        if legacy_parse_receipt_data(processor, text) != processor._parse_receipt_data(text)
+    )
+
+    legacy_time = _best_time(lambda text: legacy_parse_receipt_data(processor, text), corpus, repeat)
+    current_time = _best_time(processor._parse_receipt_data, corpus, repeat)
+
+    return {
+        'receipts': receipts,
+        'mismatches': mismatches,
+        'legacy_us_per_receipt': legacy_time / receipts * 1e6,
+        'current_us_per_receipt': current_time / receipts * 1e6,
+        'speedup': legacy_time / current_time if current_time else 0.0
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--receipts', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    result = run_benchmark(args.receipts, args.repeat)
+
+    print(f"📄 Чеков в корпусе:        {result['receipts']}")
+    print(f"🐢 Построчный разбор:      {result['legacy_us_per_receipt']:.1f} мкс/чек")
+    print(f"🚀 Однопроходный разбор:   {result['current_us_per_receipt']:.1f} мкс/чек")
+    print(f"📈 Ускорение:              x{result['speedup']:.2f}")
+
+    if result['mismatches']:
+        print(f"❌ Результаты расходятся на {result['mismatches']} чеках")
+        sys.exit(1)
+    print("✅ Результаты разбора идентичны")
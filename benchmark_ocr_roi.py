@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Сравнение задержки OCR: вся страница против ROI режима
+Для каждого изображения выводится время обоих режимов и совпадение ключевых полей
+
+Запуск: python benchmark_ocr_roi.py <изображения или папки> [--min-confidence 0.6]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from typing import Any, Dict, List
+
+from ocr_processor import OCRProcessor, OCR_AVAILABLE
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+KEY_FIELDS = ('total_amount', 'date', 'fiscal_number', 'receipt_number')
+
+
+def collect_images(paths: List[str]) -> List[str]:
+    """Список изображений из переданных файлов и папок"""
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.join(path, name))
+        elif os.path.isfile(path):
+            images.append(path)
+    return images
+
+
+def _timed(processor: OCRProcessor, image_path: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    result = processor.process_image(image_path)
+    result['latency'] = time.perf_counter() - started
+    return result
+
+
+def run_benchmark(image_paths: List[str], min_confidence: float = 0.6) -> List[Dict[str, Any]]:
+    """Обработка каждого изображения в обоих режимах"""
+    full_processor = OCRProcessor(ocr_mode='full')
+    roi_processor = OCRProcessor(ocr_mode='roi', roi_min_confidence=min_confidence)
+    full_processor.warm_up()
+
+    rows = []
+    for image_path in image_paths:
+        full = _timed(full_processor, image_path)
+        roi = _timed(roi_processor, image_path)
+
+        full_fields = {f: (full.get('parsed_data') or {}).get(f) for f in KEY_FIELDS}
+        roi_fields = {f: (roi.get('parsed_data') or {}).get(f) for f in KEY_FIELDS}
+
+        rows.append({
+            'image': os.path.basename(image_path),
+            'full_latency': full['latency'],
+            'roi_latency': roi['latency'],
+            'roi_mode': roi.get('ocr_mode', roi.get('status')),
+            'fields_match': full_fields == roi_fields
+        })
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--min-confidence', type=float, default=0.6)
+    args = parser.parse_args()
+
+    if not OCR_AVAILABLE:
+        print("❌ OCR libraries not available")
+        sys.exit(1)
+
+    images = collect_images(args.paths)
+    if not images:
+        print("❌ Изображения не найдены")
+        sys.exit(1)
+
+    rows = run_benchmark(images, args.min_confidence)
+
+    print(f"{'Изображение':<32} {'Full, мс':>10} {'ROI, мс':>10} {'Режим':>14} {'Поля':>6}")
+    for row in rows:
+        print(f"{row['image'][:32]:<32} {row['full_latency'] * 1000:>10.1f} {row['roi_latency'] * 1000:>10.1f} "
+              f"{row['roi_mode']:>14} {'✅' if row['fields_match'] else '❌':>5}")
+
+    full_median = statistics.median(r['full_latency'] for r in rows)
+    roi_median = statistics.median(r['roi_latency'] for r in rows)
+    fallbacks = sum(1 for r in rows if r['roi_mode'] == 'roi_fallback')
+
+    print(f"\n📊 Медиана: full {full_median * 1000:.1f} мс, roi {roi_median * 1000:.1f} мс "
+          f"(x{full_median / roi_median if roi_median else 0:.2f})")
+    print(f"↩️  Откатов на всю страницу: {fallbacks}/{len(rows)}")
+    print(f"🎯 Совпадение ключевых полей: {sum(r['fields_match'] for r in rows)}/{len(rows)}")
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Бенчмарк конвейера загрузки на синтетических данных (SQLite)
+Сценарии: определение типа, загрузка HW/VendHub, сопоставление фискальных чеков и
+шлюзов, run_matching, экспорт заказов и слияние отчетных таблиц (ReportsProcessor).
+Результат - JSON с временем, строками/с и пиковым RSS по сценариям; два JSON разных
+коммитов сравниваются через --compare
+
+Запуск: python benchmark_pipeline.py [--sizes 10k,100k,1m] [--scenarios ingest,matching]
+        [--output bench.json] [--compare bench_old.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+from memory_tracing import PeakRssSampler
+from synthetic_data import SyntheticDataGenerator
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATH = os.path.join(BASE_DIR, 'schema_final.sql')
+
+SCENARIOS = ('detect', 'ingest', 'matching', 'run_matching', 'export', 'report_merge')
+# Сценарии, которым нужны заказы в основной базе
+REQUIRES_INGEST = ('matching', 'run_matching', 'export')
+GATEWAY_TYPES = ('payme', 'click', 'uzum')
+REPORT_TYPES = ('happy_workers', 'vendhub', 'fiscal_bills') + GATEWAY_TYPES
+# Слияние ReportsProcessor сопоставляет чеки и транзакции полным просмотром orders
+# (julianday по каждой строке) - O(n*m), на больших объемах выполняется часами
+REPORT_MERGE_MAX_ORDERS = 20000
+
+
+def parse_size(value: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000"""
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith('k'):
+        multiplier, value = 1000, value[:-1]
+    elif value.endswith('m'):
+        multiplier, value = 1000000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def measure(name: str, func: Callable[[], int]) -> Dict[str, Any]:
+    """Запуск сценария: стеночное и процессорное время, строки/с, пиковый RSS, этапы конвейера"""
+    from pipeline_metrics import pipeline_metrics
+
+    print(f"  ▶ {name}...", flush=True)
+    with PeakRssSampler() as sampler:
+        with pipeline_metrics.session(f"benchmark-{name}") as session:
+            cpu_started = time.process_time()
+            started = time.perf_counter()
+            rows = func() or 0
+            seconds = time.perf_counter() - started
+            cpu_seconds = time.process_time() - cpu_started
+
+    summary = session.summary()
+    result = {
+        'seconds': round(seconds, 3),
+        'cpu_seconds': round(cpu_seconds, 3),
+        'rows': rows,
+        'rows_per_second': round(rows / seconds, 1) if seconds > 0 else 0,
+        'peak_rss_mb': sampler.peak_mb,
+        'db_queries': summary['db']['queries'],
+        'stages': {stage: values['seconds'] for stage, values in summary['stages'].items()}
+    }
+    if 'memory' in summary:
+        result['memory'] = summary['memory']
+    print(f"    {result['seconds']:.2f} с, {result['rows_per_second']:.0f} строк/с, "
+          f"пик RSS {result['peak_rss_mb']} МБ, запросов {result['db_queries']}")
+    return result
+
+
+def _create_schema(connection):
+    with open(SCHEMA_PATH, encoding='utf-8') as f:
+        connection.executescript(f.read())
+
+
+def run_main_pipeline(files: Dict[str, str], work_dir: str, scenarios: List[str]) -> Dict[str, Any]:
+    """Сценарии основного конвейера (processors_updated.OrderProcessor) на отдельной базе"""
+    from file_detector_updated import AdvancedFileTypeDetector
+    from models import Database
+    from processors_updated import OrderProcessor
+
+    os.environ['SQLITE_DB_PATH'] = os.path.join(work_dir, 'orders.db')
+    db = Database()
+    _create_schema(db.connection)
+    processor = OrderProcessor(db)
+    results = {}
+
+    try:
+        if 'detect' in scenarios:
+            detector = AdvancedFileTypeDetector()
+
+            def detect():
+                for path in files.values():
+                    detector.detect_type(path)
+                return len(files)
+            results['detect'] = measure('detect', detect)
+
+        if 'ingest' in scenarios:
+            results['ingest'] = measure('ingest', lambda: (
+                processor.process_file(files['happy_workers'], 'happy_workers')
+                + processor.process_file(files['vendhub'], 'vendhub')
+            ))
+
+        if 'matching' in scenarios:
+            def matching():
+                processed = processor.process_file(files['fiscal_bills'], 'fiscal_bills')
+                for gateway in GATEWAY_TYPES:
+                    processed += processor.process_file(files[gateway], gateway)
+                return processed
+            results['matching'] = measure('matching', matching)
+
+        if 'run_matching' in scenarios:
+            results['run_matching'] = measure('run_matching', lambda: sum(processor.run_matching().values()))
+
+        if 'export' in scenarios:
+            def export():
+                # Как /api/orders/export: до 10000 заказов в Excel
+                orders = db.get_orders_with_filters({}, limit=10000)
+                df = pd.DataFrame(orders)
+                if not df.empty:
+                    df['creation_time'] = pd.to_datetime(df['creation_time']).dt.strftime('%Y-%m-%d %H:%M:%S')
+                df.to_excel(os.path.join(work_dir, 'orders_export.xlsx'), index=False, engine='openpyxl')
+                return len(df)
+            results['export'] = measure('export', export)
+    finally:
+        db.close()
+
+    return results
+
+
+def run_report_merge(files: Dict[str, str], work_dir: str) -> Dict[str, Any]:
+    """Загрузка в отчетные таблицы и слияние в orders через ReportsProcessor"""
+    from create_reports_system import create_reports_tables
+    from reports_processor import ReportsProcessor
+
+    reports_dir = os.path.join(work_dir, 'reports')
+    os.makedirs(reports_dir, exist_ok=True)
+    previous_dir = os.getcwd()
+    os.chdir(reports_dir)  # create_reports_tables() пишет в ./orders.db
+    try:
+        connection = sqlite3.connect('orders.db')
+        connection.row_factory = sqlite3.Row
+        # Сначала основная схема: create_reports_tables() создает индексы с IF NOT EXISTS
+        # и совпадающими с schema_final.sql именами, а не наоборот
+        _create_schema(connection)
+        create_reports_tables()
+        # Слияние отмечает источник флагами, которых нет в schema_final.sql
+        connection.execute("ALTER TABLE orders ADD COLUMN hw_source BOOLEAN DEFAULT FALSE")
+        connection.execute("ALTER TABLE orders ADD COLUMN vh_source BOOLEAN DEFAULT FALSE")
+        connection.commit()
+
+        processor = ReportsProcessor(connection)
+
+        def merge():
+            return sum(processor.process_file(files[file_type], file_type, os.path.basename(files[file_type]))
+                       for file_type in REPORT_TYPES)
+        try:
+            return measure('report_merge', merge)
+        finally:
+            connection.close()
+    finally:
+        os.chdir(previous_dir)
+
+
+def run_size(orders: int, args, scenarios: List[str]) -> Dict[str, Any]:
+    """Все выбранные сценарии для одного объема заказов"""
+    days = max(1, args.days)
+    generator = SyntheticDataGenerator(
+        machines=args.machines, days=days, orders_per_day=max(1, orders // days), seed=args.seed,
+        missing_rate=args.missing_rate, late_rate=args.late_rate, duplicate_rate=args.duplicate_rate
+    )
+    work_dir = tempfile.mkdtemp(prefix=f"vhm24r_bench_{orders}_", dir=args.workdir)
+    print(f"\n📦 {orders} заказов ({work_dir})")
+
+    try:
+        generated = {}
+
+        def generate():
+            generated.update(generator.generate(os.path.join(work_dir, 'data')))
+            return generated['orders']
+
+        results = {'generate': measure('generate', generate)}
+        results.update(run_main_pipeline(generated['files'], work_dir, scenarios))
+
+        if 'report_merge' in scenarios:
+            if orders <= args.report_merge_max:
+                results['report_merge'] = run_report_merge(generated['files'], work_dir)
+            else:
+                print(f"  ⏭ report_merge пропущен: больше {args.report_merge_max} заказов (--report-merge-max)")
+                results['report_merge'] = {'skipped': f"orders > {args.report_merge_max}"}
+
+        return {'orders': generated['orders'], 'params': generator.params,
+                'file_rows': generated['rows'], 'scenarios': results}
+    finally:
+        if args.keep:
+            print(f"  📁 Данные сохранены: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def environment_info() -> Dict[str, Any]:
+    """Коммит и версии - чтобы результаты разных прогонов были сопоставимы"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                                capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any]):
+    """Изменение времени и пикового RSS относительно прошлого прогона"""
+    print(f"\n📈 Сравнение с {previous.get('environment', {}).get('commit') or 'предыдущим прогоном'}")
+    for size, data in current['results'].items():
+        old_size = previous.get('results', {}).get(size)
+        if not old_size:
+            continue
+        for name, result in data['scenarios'].items():
+            old = old_size['scenarios'].get(name)
+            if not old or 'seconds' not in old or 'seconds' not in result:
+                continue
+            delta = (result['seconds'] - old['seconds']) / old['seconds'] * 100 if old['seconds'] else 0
+            marker = '🔴' if delta > 10 else ('🟢' if delta < -10 else '⚪')
+            print(f"  {marker} {size:>8} {name:<13} {old['seconds']:>9.2f} → {result['seconds']:>9.2f} с "
+                  f"({delta:+.1f}%), RSS {old['peak_rss_mb']} → {result['peak_rss_mb']} МБ")
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='10k', help='Объемы заказов через запятую: 10k,100k,1m')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Из: {', '.join(SCENARIOS)}")
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--machines', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--missing-rate', type=float, default=0.02)
+    parser.add_argument('--late-rate', type=float, default=0.01)
+    parser.add_argument('--duplicate-rate', type=float, default=0.005)
+    parser.add_argument('--report-merge-max', type=int, default=REPORT_MERGE_MAX_ORDERS)
+    parser.add_argument('--workdir', default=None, help='Каталог для временных баз и файлов')
+    parser.add_argument('--keep', action='store_true', help='Не удалять сгенерированные файлы и базы')
+    parser.add_argument('--memory', action='store_true', help='Профиль памяти по этапам (memory_tracing)')
+    parser.add_argument('--output', default=None, help='Путь для JSON с результатами')
+    parser.add_argument('--compare', default=None, help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Неизвестные сценарии: {', '.join(unknown)}")
+    if any(name in scenarios for name in REQUIRES_INGEST) and 'ingest' not in scenarios:
+        scenarios.append('ingest')
+
+    if args.memory:
+        # tracemalloc замедляет сценарии: время с --memory несопоставимо с обычными прогонами
+        os.environ['PIPELINE_MEMORY'] = '1'
+        os.environ.setdefault('PIPELINE_PROFILE_DIR', os.path.join(args.workdir or tempfile.gettempdir(),
+                                                                   'vhm24r_bench_profiles'))
+
+    # Бенчмарк всегда на SQLite, независимо от окружения
+    os.environ.pop('DATABASE_URL', None)
+    previous_db_path = os.environ.get('SQLITE_DB_PATH')
+
+    report = {'environment': environment_info(), 'scenarios': scenarios, 'memory_tracing': args.memory,
+              'results': {}}
+    try:
+        for size in args.sizes.split(','):
+            orders = parse_size(size)
+            report['results'][size.strip()] = run_size(orders, args, scenarios)
+    finally:
+        if previous_db_path is None:
+            os.environ.pop('SQLITE_DB_PATH', None)
+        else:
+            os.environ['SQLITE_DB_PATH'] = previous_db_path
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Результаты: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+    return report
+
+
+if __name__ == "__main__":
+    main()
+    sys.exit(0)
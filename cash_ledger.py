@@ -0,0 +1,423 @@
+"""
+VHM24R - Кассовые остатки автоматов
+Остаток наличных по каждому автомату хранится в отдельной таблице и обновляется
+при каждом наличном заказе и каждой инкассации, без пересчета по всей истории.
+Журнал machine_cash_ledger хранит остаток после каждого события, поэтому остаток
+на любой момент времени читается одной строкой по индексу
+"""
+
+from datetime import datetime
+from typing import Dict, List, Any, Optional
+
+
+class CashBalanceTracker:
+    """
+    Текущие кассовые остатки автоматов (machine_cash_balances) и журнал событий (machine_cash_ledger)
+
+    - apply_cash_order / apply_collection: событие записывается в журнал и обновляет остаток
+      (повторная запись того же события игнорируется)
+    - revert_cash_order: событие убирается из журнала, остатки пересчитываются
+    - balance_at: остаток автомата на момент времени
+    - rebuild: полный пересчет журнала и остатков из заказов и инкассаций
+    История заполняется один раз при первом создании трекера (маркер в machine_cash_ledger_state),
+    независимо от того, успели ли до этого прийти новые события
+    """
+
+    CASH_ORDER_CONDITION = "payment_type = 'Cash' AND error_type = 'OK'"
+
+    SOURCE_ORDER = 'order'
+    SOURCE_COLLECTION = 'collection'
+    BACKFILL_MARKER = 'backfill'
+
+    def __init__(self, db):
+        self.db = db
+        self.placeholder = '%s' if db.is_postgres else '?'
+        self._init_tables()
+        self._backfill_once()
+
+    def _init_tables(self):
+        """Создание таблиц инкассаций, остатков и журнала"""
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        statements = [
+            f"""CREATE TABLE IF NOT EXISTS cash_collections (
+                id {id_column},
+                machine_code TEXT,
+                collection_date DATE,
+                collection_time TIME,
+                collector_name TEXT,
+                amount_collected DECIMAL(10,2),
+                notes TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""",
+            """CREATE TABLE IF NOT EXISTS machine_cash_balances (
+                machine_code TEXT PRIMARY KEY,
+                total_cash DECIMAL(14,2) DEFAULT 0,
+                collected_cash DECIMAL(14,2) DEFAULT 0,
+                balance DECIMAL(14,2) DEFAULT 0,
+                last_order_time TIMESTAMP,
+                last_collection_date DATE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""",
+            "CREATE INDEX IF NOT EXISTS idx_machine_cash_balances_balance ON machine_cash_balances(balance)",
+            f"""CREATE TABLE IF NOT EXISTS machine_cash_ledger (
+                id {id_column},
+                machine_code TEXT NOT NULL,
+                event_time TIMESTAMP NOT NULL,
+                source_type TEXT NOT NULL,
+                source_id INTEGER NOT NULL,
+                amount DECIMAL(14,2) NOT NULL,
+                balance_after DECIMAL(14,2) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )""",
+            """CREATE UNIQUE INDEX IF NOT EXISTS idx_machine_cash_ledger_source
+                ON machine_cash_ledger(source_type, source_id)""",
+            """CREATE INDEX IF NOT EXISTS idx_machine_cash_ledger_machine_time
+                ON machine_cash_ledger(machine_code, event_time, id)""",
+            """CREATE TABLE IF NOT EXISTS machine_cash_ledger_state (
+                name TEXT PRIMARY KEY,
+                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )"""
+        ]
+        for statement in statements:
+            self.db.execute_query(statement)
+
+    def _backfill_once(self):
+        """
+        Заполнение журнала из истории заказов и инкассаций, если оно еще не выполнялось
+        Пока таблицы orders нет, бэкфилл откладывается до следующего создания трекера
+        """
+        p = self.placeholder
+        if self.db.execute_query(
+            f"SELECT 1 AS found FROM machine_cash_ledger_state WHERE name = {p}", (self.BACKFILL_MARKER,)
+        ):
+            return
+        if not self._table_exists('orders'):
+            return
+        self.rebuild()
+
+    @classmethod
+    def is_cash_order(cls, order: Dict[str, Any]) -> bool:
+        """Заказ учитывается в кассе: оплата наличными и подтвержден фискальным чеком"""
+        return order.get('payment_type') == 'Cash' and order.get('error_type') == 'OK'
+
+    def apply_cash_order(self, order_id: int, machine_code: str, amount: float, order_time) -> bool:
+        """Наличный заказ увеличивает остаток автомата"""
+        return self._record_event(self.SOURCE_ORDER, order_id, machine_code,
+                                  float(amount or 0), self._event_time(order_time))
+
+    def apply_collection(self, collection_id: int, machine_code: str, amount: float,
+                         collection_date, collection_time=None) -> bool:
+        """Инкассация уменьшает остаток автомата"""
+        return self._record_event(self.SOURCE_COLLECTION, collection_id, machine_code,
+                                  -float(amount or 0), self._event_time(collection_date, collection_time))
+
+    def revert_cash_order(self, order_id: int) -> bool:
+        """Отмена учета заказа (например, перед повторной классификацией)"""
+        return self._remove_event(self.SOURCE_ORDER, order_id)
+
+    def get_balances(self) -> List[Dict[str, Any]]:
+        """Остатки по всем автоматам, по убыванию"""
+        return self.db.execute_query("""
+            SELECT machine_code, total_cash, collected_cash, balance,
+                   last_order_time, last_collection_date
+            FROM machine_cash_balances
+            ORDER BY balance DESC
+        """)
+
+    def get_balance(self, machine_code: str) -> Optional[Dict[str, Any]]:
+        """Остаток одного автомата"""
+        rows = self.db.execute_query(f"""
+            SELECT machine_code, total_cash, collected_cash, balance,
+                   last_order_time, last_collection_date
+            FROM machine_cash_balances
+            WHERE machine_code = {self.placeholder}
+        """, (machine_code,))
+        return rows[0] if rows else None
+
+    def balance_at(self, machine_code: str, moment) -> float:
+        """Остаток автомата на момент времени: последний снимок журнала не позже moment"""
+        rows = self.db.execute_query(f"""
+            SELECT balance_after FROM machine_cash_ledger
+            WHERE machine_code = {self.placeholder} AND event_time <= {self.placeholder}
+            ORDER BY event_time DESC, id DESC
+            LIMIT 1
+        """, (machine_code, self._event_time(moment)))
+        return float(rows[0]['balance_after']) if rows else 0.0
+
+    def get_ledger(self, machine_code: str, limit: int = 100) -> List[Dict[str, Any]]:
+        """Последние события журнала автомата"""
+        return self.db.execute_query(f"""
+            SELECT event_time, source_type, source_id, amount, balance_after
+            FROM machine_cash_ledger
+            WHERE machine_code = {self.placeholder}
+            ORDER BY event_time DESC, id DESC
+            LIMIT {int(limit)}
+        """, (machine_code,))
+
+    def rebuild(self) -> int:
+        """
+        Полный пересчет журнала и остатков (для бэкфилла и после ручных правок)
+
+        Журнал заполняется одним INSERT ... SELECT с накопительной суммой по автомату.
+        Остатки строятся из предагрегированных подзапросов: заказы и инкассации
+        агрегируются по автомату по отдельности, затем агрегаты соединяются.
+        В той же транзакции ставится маркер выполненного бэкфилла
+
+        Returns:
+            int: Количество автоматов в таблице после пересчета
+        """
+        events = f"""
+            SELECT machine_code, {self._order_time_sql()} AS event_time,
+                   '{self.SOURCE_ORDER}' AS source_type, id AS source_id, order_price AS amount
+            FROM orders
+            WHERE {self.CASH_ORDER_CONDITION} AND machine_code IS NOT NULL AND creation_time IS NOT NULL
+            UNION ALL
+            SELECT machine_code, {self._collection_time_sql()} AS event_time,
+                   '{self.SOURCE_COLLECTION}' AS source_type, id AS source_id, -amount_collected AS amount
+            FROM cash_collections
+            WHERE machine_code IS NOT NULL AND collection_date IS NOT NULL
+        """
+
+        cursor = self.db.connection.cursor()
+        try:
+            cursor.execute("DELETE FROM machine_cash_ledger")
+            cursor.execute(f"""
+                INSERT INTO machine_cash_ledger (machine_code, event_time, source_type, source_id, amount, balance_after)
+                SELECT machine_code, event_time, source_type, source_id, amount,
+                       SUM(amount) OVER (
+                           PARTITION BY machine_code
+                           ORDER BY event_time, source_type, source_id
+                           ROWS UNBOUNDED PRECEDING
+                       )
+                FROM ({events}) e
+                ORDER BY event_time, source_type, source_id
+            """)
+
+            cursor.execute("DELETE FROM machine_cash_balances")
+            cursor.execute(f"""
+                INSERT INTO machine_cash_balances (
+                    machine_code, total_cash, collected_cash, balance,
+                    last_order_time, last_collection_date, updated_at
+                )
+                SELECT m.machine_code,
+                       COALESCE(o.total_cash, 0),
+                       COALESCE(c.collected_cash, 0),
+                       COALESCE(o.total_cash, 0) - COALESCE(c.collected_cash, 0),
+                       o.last_order_time,
+                       c.last_collection_date,
+                       CURRENT_TIMESTAMP
+                FROM (
+                    SELECT machine_code FROM orders WHERE {self.CASH_ORDER_CONDITION}
+                    UNION
+                    SELECT machine_code FROM cash_collections
+                ) m
+                LEFT JOIN (
+                    SELECT machine_code, SUM(order_price) AS total_cash, MAX(creation_time) AS last_order_time
+                    FROM orders
+                    WHERE {self.CASH_ORDER_CONDITION}
+                    GROUP BY machine_code
+                ) o ON o.machine_code = m.machine_code
+                LEFT JOIN (
+                    SELECT machine_code, SUM(amount_collected) AS collected_cash,
+                           MAX(collection_date) AS last_collection_date
+                    FROM cash_collections
+                    GROUP BY machine_code
+                ) c ON c.machine_code = m.machine_code
+                WHERE m.machine_code IS NOT NULL
+            """)
+
+            cursor.execute(f"DELETE FROM machine_cash_ledger_state WHERE name = {self.placeholder}",
+                           (self.BACKFILL_MARKER,))
+            cursor.execute(f"INSERT INTO machine_cash_ledger_state (name) VALUES ({self.placeholder})",
+                           (self.BACKFILL_MARKER,))
+            self.db.connection.commit()
+        except Exception as e:
+            self.db.connection.rollback()
+            print(f"Error rebuilding cash balances: {e}")
+            return 0
+        finally:
+            cursor.close()
+
+        return self.db.execute_query("SELECT COUNT(*) AS count FROM machine_cash_balances")[0]['count']
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _record_event(self, source_type: str, source_id: int, machine_code: str,
+                      amount: float, event_time: Optional[str]) -> bool:
+        """
+        Запись события в журнал и обновление остатка в одной транзакции
+
+        Снимок события = снимок предыдущего события автомата + сумма; если событие
+        пришло задним числом, снимки более поздних событий сдвигаются на ту же сумму
+        """
+        if not machine_code or source_id is None or event_time is None:
+            return False
+
+        p = self.placeholder
+        cursor = self.db.connection.cursor()
+        try:
+            cursor.execute(
+                f"SELECT 1 FROM machine_cash_ledger WHERE source_type = {p} AND source_id = {p}",
+                (source_type, source_id)
+            )
+            if cursor.fetchone():
+                return False
+
+            cursor.execute(f"""
+                SELECT balance_after FROM machine_cash_ledger
+                WHERE machine_code = {p} AND event_time <= {p}
+                ORDER BY event_time DESC, id DESC
+                LIMIT 1
+            """, (machine_code, event_time))
+            previous = cursor.fetchone()
+            previous_balance = float(self._first_value(previous)) if previous else 0.0
+
+            cursor.execute(f"""
+                INSERT INTO machine_cash_ledger (machine_code, event_time, source_type, source_id, amount, balance_after)
+                VALUES ({p}, {p}, {p}, {p}, {p}, {p})
+            """, (machine_code, event_time, source_type, source_id, amount, previous_balance + amount))
+            cursor.execute(f"""
+                UPDATE machine_cash_ledger SET balance_after = balance_after + {p}
+                WHERE machine_code = {p} AND event_time > {p}
+            """, (amount, machine_code, event_time))
+
+            self._upsert_balance(cursor, source_type, machine_code, amount, event_time)
+            self.db.connection.commit()
+            return True
+
+        except Exception as e:
+            self.db.connection.rollback()
+            print(f"Error recording cash event: {e}")
+            return False
+        finally:
+            cursor.close()
+
+    def _remove_event(self, source_type: str, source_id: int) -> bool:
+        """Удаление события из журнала со сдвигом последующих снимков"""
+        p = self.placeholder
+        cursor = self.db.connection.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT id, machine_code, event_time, amount FROM machine_cash_ledger
+                WHERE source_type = {p} AND source_id = {p}
+            """, (source_type, source_id))
+            row = cursor.fetchone()
+            if not row:
+                return False
+
+            event_id, machine_code, event_time, amount = self._row_values(row, ('id', 'machine_code', 'event_time', 'amount'))
+            amount = float(amount)
+
+            cursor.execute(f"DELETE FROM machine_cash_ledger WHERE id = {p}", (event_id,))
+            cursor.execute(f"""
+                UPDATE machine_cash_ledger SET balance_after = balance_after - {p}
+                WHERE machine_code = {p}
+                  AND (event_time > {p} OR (event_time = {p} AND id > {p}))
+            """, (amount, machine_code, event_time, event_time, event_id))
+
+            self._upsert_balance(cursor, source_type, machine_code, -amount, None)
+            self.db.connection.commit()
+            return True
+
+        except Exception as e:
+            self.db.connection.rollback()
+            print(f"Error removing cash event: {e}")
+            return False
+        finally:
+            cursor.close()
+
+    def _upsert_balance(self, cursor, source_type: str, machine_code: str, amount: float,
+                        event_time: Optional[str]):
+        """Атомарное изменение строки остатка автомата (INSERT ... ON CONFLICT DO UPDATE)"""
+        if source_type == self.SOURCE_ORDER:
+            cash_delta, collected_delta = amount, 0.0
+            order_time, collection_date = event_time, None
+        else:
+            cash_delta, collected_delta = 0.0, -amount
+            order_time, collection_date = None, event_time[:10] if event_time else None
+
+        values = ', '.join([self.placeholder] * 6)
+        cursor.execute(f"""
+            INSERT INTO machine_cash_balances (
+                machine_code, total_cash, collected_cash, balance,
+                last_order_time, last_collection_date, updated_at
+            ) VALUES ({values}, CURRENT_TIMESTAMP)
+            ON CONFLICT (machine_code) DO UPDATE SET
+                total_cash = machine_cash_balances.total_cash + excluded.total_cash,
+                collected_cash = machine_cash_balances.collected_cash + excluded.collected_cash,
+                balance = machine_cash_balances.balance + excluded.balance,
+                last_order_time = CASE
+                    WHEN excluded.last_order_time IS NULL THEN machine_cash_balances.last_order_time
+                    WHEN machine_cash_balances.last_order_time IS NULL
+                         OR excluded.last_order_time > machine_cash_balances.last_order_time
+                    THEN excluded.last_order_time
+                    ELSE machine_cash_balances.last_order_time END,
+                last_collection_date = CASE
+                    WHEN excluded.last_collection_date IS NULL THEN machine_cash_balances.last_collection_date
+                    WHEN machine_cash_balances.last_collection_date IS NULL
+                         OR excluded.last_collection_date > machine_cash_balances.last_collection_date
+                    THEN excluded.last_collection_date
+                    ELSE machine_cash_balances.last_collection_date END,
+                updated_at = CURRENT_TIMESTAMP
+        """, (machine_code, cash_delta, collected_delta, cash_delta - collected_delta,
+              order_time, collection_date))
+
+    def _table_exists(self, table: str) -> bool:
+        if self.db.is_postgres:
+            query = f"SELECT 1 AS found FROM information_schema.tables WHERE table_name = {self.placeholder}"
+        else:
+            query = f"SELECT 1 AS found FROM sqlite_master WHERE type = 'table' AND name = {self.placeholder}"
+        return bool(self.db.execute_query(query, (table,)))
+
+    def _order_time_sql(self) -> str:
+        """Время заказа в формате журнала"""
+        return "creation_time" if self.db.is_postgres else "datetime(creation_time)"
+
+    def _collection_time_sql(self) -> str:
+        """Дата и время инкассации в формате журнала"""
+        if self.db.is_postgres:
+            return "(collection_date + COALESCE(collection_time, TIME '00:00'))"
+        return "datetime(collection_date || ' ' || COALESCE(collection_time, '00:00'))"
+
+    @staticmethod
+    def _event_time(value, time_value=None) -> Optional[str]:
+        """Приведение даты/времени события к 'YYYY-MM-DD HH:MM:SS'"""
+        if value is None or value == '':
+            return None
+
+        text = value.isoformat(sep=' ') if isinstance(value, datetime) else str(value).strip()
+        if time_value:
+            text = f"{text[:10]} {str(time_value).strip()}"
+
+        try:
+            return datetime.fromisoformat(text.replace('T', ' ')).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return text
+
+    @staticmethod
+    def _first_value(row):
+        """Первое значение строки курсора (кортеж SQLite или словарь RealDictCursor)"""
+        return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+    @staticmethod
+    def _row_values(row, columns) -> tuple:
+        if isinstance(row, dict):
+            return tuple(row[column] for column in columns)
+        return tuple(row[i] for i in range(len(columns)))
+
+
+class MatchedCashBalanceTracker(CashBalanceTracker):
+    """
+    Кассовые остатки для схемы schema_final (processors_updated): заказ учитывается в кассе,
+    когда он оплачен наличными и полностью сопоставлен (включая фискальный чек)
+    """
+
+    CASH_ORDER_CONDITION = ("(order_resource = 'Cash payment' OR payment_type = 'Cash') "
+                            "AND match_status = 'fully_matched'")
+
+    @classmethod
+    def is_cash_order(cls, order: Dict[str, Any]) -> bool:
+        return ((order.get('order_resource') == 'Cash payment' or order.get('payment_type') == 'Cash')
+                and order.get('match_status') == 'fully_matched')
@@ -0,0 +1,229 @@
+"""
+VHM24R - Настройки из system_config
+Таблица читается один раз и держится в памяти с приведением типов. Любое изменение
+строк system_config увеличивает счетчик версии (триггер), поэтому для проверки
+актуальности кэша достаточно одного дешевого запроса не чаще CHECK_INTERVAL секунд
+"""
+
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+class ConfigService:
+    """
+    Типизированный кэш system_config
+
+    - get() отдает значение из памяти, приведенное к типу из SETTINGS
+      (значение из БД, которое не приводится к типу, заменяется значением по умолчанию)
+    - Версия из system_config_version проверяется не чаще CHECK_INTERVAL секунд
+      или явно через refresh() на границах пакетов (файл, задача планировщика)
+    - set() записывает значение; триггер увеличивает версию, остальные процессы
+      подхватят изменение при следующей проверке
+    """
+
+    CHECK_INTERVAL = 30
+
+    # Ключ: (тип, значение по умолчанию)
+    SETTINGS = {
+        'time_tolerance_seconds': (int, 60),
+        'amount_tolerance': (float, 0.01),
+        'hw_vendhub_time_window': (int, 60),
+        'fiscal_time_window': (int, 60),
+        'gateway_time_window': (int, 60),
+        'critical_error_threshold': (int, 5),
+        'max_file_size_mb': (int, 100),
+        'memory_stage_budget_mb': (int, 512),
+        'auto_matching_enabled': (bool, True),
+        'telegram_notifications': (bool, True),
+        'backup_to_cloud': (bool, True),
+        'debug_mode': (bool, False),
+        'commission_calculation': (str, 'direct_comparison'),
+    }
+
+    def __init__(self, db, check_interval: Optional[float] = None):
+        self.db = db
+        self.check_interval = self.CHECK_INTERVAL if check_interval is None else check_interval
+        self.placeholder = '%s' if db.is_postgres else '?'
+        self.stats = {'loads': 0, 'version_checks': 0}
+
+        self._values: Dict[str, Any] = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+        self._init_tables()
+        self.refresh(force=True)
+
+    def _init_tables(self):
+        """Таблица версии и триггеры, увеличивающие ее при любом изменении system_config"""
+        if self.db.is_postgres:
+            statements = [
+                """CREATE TABLE IF NOT EXISTS system_config (
+                    id SERIAL PRIMARY KEY,
+                    config_key VARCHAR(100) UNIQUE NOT NULL,
+                    config_value TEXT,
+                    description TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )""",
+                """CREATE TABLE IF NOT EXISTS system_config_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version BIGINT NOT NULL DEFAULT 0
+                )""",
+                "INSERT INTO system_config_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING",
+                """CREATE OR REPLACE FUNCTION bump_system_config_version() RETURNS TRIGGER AS $$
+                BEGIN
+                    UPDATE system_config_version SET version = version + 1 WHERE id = 1;
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql""",
+                "DROP TRIGGER IF EXISTS trg_system_config_version ON system_config",
+                """CREATE TRIGGER trg_system_config_version
+                AFTER INSERT OR UPDATE OR DELETE ON system_config
+                FOR EACH STATEMENT EXECUTE PROCEDURE bump_system_config_version()""",
+            ]
+        else:
+            statements = [
+                """CREATE TABLE IF NOT EXISTS system_config (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    config_key TEXT UNIQUE NOT NULL,
+                    config_value TEXT,
+                    description TEXT,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )""",
+                """CREATE TABLE IF NOT EXISTS system_config_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL DEFAULT 0
+                )""",
+                "INSERT OR IGNORE INTO system_config_version (id, version) VALUES (1, 0)",
+            ]
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                statements.append(f"""CREATE TRIGGER IF NOT EXISTS trg_system_config_version_{event.lower()}
+                AFTER {event} ON system_config
+                BEGIN
+                    UPDATE system_config_version SET version = version + 1 WHERE id = 1;
+                END""")
+
+        for statement in statements:
+            self.db.execute_query(statement)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Значение настройки из кэша
+
+        Args:
+            key: config_key
+            default: Значение, если настройки нет в БД (без него - значение из SETTINGS)
+        """
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh()
+        value = self._values.get(key)
+        if value is not None:
+            return value
+        if default is None and key in self.SETTINGS:
+            return self.SETTINGS[key][1]
+        return default
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Все настройки (значения по умолчанию + system_config)"""
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self.refresh()
+        values = {key: default for key, (_, default) in self.SETTINGS.items()}
+        values.update({key: value for key, value in self._values.items() if value is not None})
+        return values
+
+    @property
+    def version(self) -> Optional[int]:
+        return self._version
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Перечитать system_config, если изменилась версия
+
+        Returns:
+            bool: Кэш перезагружен
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            version = self._read_version()
+            self.stats['version_checks'] += 1
+            if not force and version is not None and version == self._version:
+                return False
+
+            try:
+                rows = self.db.execute_query("SELECT config_key, config_value FROM system_config")
+            except Exception as e:
+                print(f"Error loading system config: {e}")
+                return False
+
+            self._values = {row['config_key']: self._parse(row['config_key'], row['config_value'])
+                            for row in rows}
+            self._version = version
+            self.stats['loads'] += 1
+            return True
+
+    def set(self, key: str, value: Any, description: Optional[str] = None) -> bool:
+        """Запись настройки; кэш этого процесса обновляется сразу"""
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        p = self.placeholder
+        try:
+            self.db.execute_query(f"""
+                INSERT INTO system_config (config_key, config_value, description, updated_at)
+                VALUES ({p}, {p}, {p}, CURRENT_TIMESTAMP)
+                ON CONFLICT (config_key) DO UPDATE SET
+                    config_value = excluded.config_value,
+                    description = COALESCE(excluded.description, system_config.description),
+                    updated_at = CURRENT_TIMESTAMP
+            """, (key, str(value), description))
+        except Exception as e:
+            print(f"Error saving system config {key}: {e}")
+            return False
+        return self.refresh(force=True)
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _read_version(self) -> Optional[int]:
+        try:
+            rows = self.db.execute_query("SELECT version FROM system_config_version WHERE id = 1")
+            return int(rows[0]['version']) if rows else None
+        except Exception as e:
+            print(f"Error reading system config version: {e}")
+            return None
+
+    def _parse(self, key: str, raw: Optional[str]) -> Any:
+        """Приведение к типу из SETTINGS; неизвестные ключи остаются строками"""
+        if key not in self.SETTINGS:
+            return raw
+        value_type, default = self.SETTINGS[key]
+        if raw is None:
+            return None
+
+        try:
+            if value_type is bool:
+                text = str(raw).strip().lower()
+                if text in ('true', '1', 'yes', 'on'):
+                    return True
+                if text in ('false', '0', 'no', 'off'):
+                    return False
+                raise ValueError(raw)
+            if value_type is int:
+                return int(float(raw))
+            return value_type(raw)
+        except (TypeError, ValueError):
+            print(f"Invalid system config value {key}={raw!r}, using default {default!r}")
+            return None
+
+
+# Общий экземпляр для процессоров и задач планировщика
+config_service = None
+
+
+def get_config_service(db) -> ConfigService:
+    """Общий ConfigService для данного подключения"""
+    global config_service
+    if config_service is None or config_service.db is not db:
+        config_service = ConfigService(db)
+    return config_service
@@ -0,0 +1,221 @@
+"""
+VHM24R - Поиск конфликтов между источниками
+Один проход SQL после каждой загрузки: заказы одного автомата сравниваются только
+внутри соседних временных корзин, найденные конфликты пишутся в conflicts пачкой
+без дублей
+"""
+
+from typing import Any, Dict, List, Optional
+
+from config_service import get_config_service
+
+
+class ConflictDetector:
+    """
+    Заполнение таблицы conflicts
+
+    Сравниваются заказы, которые остались только в одном источнике (hw_only / vendhub_only),
+    из разных источников, на одном автомате, не дальше окна hw_vendhub_time_window друг от друга:
+    - number_mismatch: суммы совпадают, номера заказов разные (одна продажа под двумя номерами)
+    - amount_mismatch: суммы расходятся
+
+    Заказы раскладываются по корзинам времени шириной в это окно, и пара ищется только
+    в своей и следующей корзине по индексу (machine_code, bucket), поэтому проход линейный,
+    а не попарный по всей таблице. Расхождения, найденные при загрузке VendHub
+    (_log_mismatch), записываются через record() как amount_mismatch/time_mismatch
+
+    Окно и допуск по сумме берутся из system_config (hw_vendhub_time_window, amount_tolerance),
+    как и в OrderProcessor
+    """
+
+    SINGLE_SOURCE_STATUSES = ('hw_only', 'vendhub_only')
+
+    def __init__(self, db):
+        self.db = db
+        self.config = get_config_service(db)
+        self.placeholder = '%s' if db.is_postgres else '?'
+        self._init_tables()
+
+    @property
+    def window_seconds(self) -> int:
+        return int(self.config.get('hw_vendhub_time_window'))
+
+    @property
+    def amount_tolerance(self) -> float:
+        return float(self.config.get('amount_tolerance'))
+
+    def _init_tables(self):
+        """Таблица конфликтов и уникальный ключ для отсечения дублей"""
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        self.db.execute_query(f"""
+            CREATE TABLE IF NOT EXISTS conflicts (
+                id {id_column},
+                conflict_type TEXT,
+                order_id_1 INTEGER,
+                order_id_2 INTEGER,
+                conflict_data TEXT,
+                resolution_status TEXT DEFAULT 'pending',
+                resolved_by TEXT,
+                resolved_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Дубли из старых версий удаляются до создания уникального индекса
+        self.db.execute_query("""
+            DELETE FROM conflicts WHERE id NOT IN (
+                SELECT MIN(id) FROM conflicts GROUP BY conflict_type, order_id_1, COALESCE(order_id_2, 0)
+            )
+        """)
+        self.db.execute_query("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_conflicts_pair
+            ON conflicts(conflict_type, order_id_1, (COALESCE(order_id_2, 0)))
+        """)
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_conflicts_status ON conflicts(resolution_status)"
+        )
+
+    def run(self, since=None) -> Dict[str, int]:
+        """
+        Поиск конфликтов среди заказов, измененных после since (без since - по всей таблице)
+
+        Returns:
+            Dict: Количество новых конфликтов по типам
+        """
+        window = self._scan_window(since)
+        if window is False:
+            return {}
+
+        before = self._counts()
+        window_seconds = self.window_seconds
+        p = self.placeholder
+        epoch = self._epoch_sql(self._time_sql())
+        statuses = ', '.join(f"'{status}'" for status in self.SINGLE_SOURCE_STATUSES)
+
+        query = f"""
+            CREATE TEMP TABLE conflict_scan AS
+            SELECT id, machine_code, order_number, order_price, source,
+                   {epoch} AS ts, {epoch} / {window_seconds} AS bucket
+            FROM orders
+            WHERE match_status IN ({statuses})
+              AND machine_code IS NOT NULL AND machine_code <> ''
+              AND {self._time_sql()} IS NOT NULL
+        """
+        params = None
+        if window:
+            query += f" AND {self._time_sql()} BETWEEN {p} AND {p}"
+            params = window
+
+        self.db.execute_query("DROP TABLE IF EXISTS conflict_scan")
+        self.db.execute_query(query, params)
+        self.db.execute_query("CREATE INDEX idx_conflict_scan_bucket ON conflict_scan(machine_code, bucket)")
+
+        amount_tolerance = self.amount_tolerance
+        self.db.execute_query(f"""
+            INSERT INTO conflicts (conflict_type, order_id_1, order_id_2, conflict_data)
+            SELECT
+                CASE WHEN ABS(a.order_price - b.order_price) <= {amount_tolerance}
+                     THEN 'number_mismatch' ELSE 'amount_mismatch' END,
+                CASE WHEN a.id < b.id THEN a.id ELSE b.id END,
+                CASE WHEN a.id < b.id THEN b.id ELSE a.id END,
+                {self._conflict_data_sql()}
+            FROM conflict_scan a
+            JOIN conflict_scan b
+              ON b.machine_code = a.machine_code
+             AND b.bucket BETWEEN a.bucket AND a.bucket + 1
+            WHERE (b.bucket = a.bucket + 1 OR a.id < b.id)
+              AND ABS(a.ts - b.ts) <= {window_seconds}
+              AND a.order_number <> b.order_number
+              AND COALESCE(a.source, '') <> COALESCE(b.source, '')
+            ON CONFLICT DO NOTHING
+        """)
+        self.db.execute_query("DROP TABLE IF EXISTS conflict_scan")
+
+        after = self._counts()
+        found = {conflict_type: after.get(conflict_type, 0) - before.get(conflict_type, 0)
+                 for conflict_type in after}
+        found = {conflict_type: count for conflict_type, count in found.items() if count}
+        print(f"Conflict detection completed: {found}")
+        return found
+
+    def record(self, conflict_type: str, order_id_1: int, order_id_2: Optional[int] = None,
+               conflict_data: Optional[str] = None) -> None:
+        """Одиночный конфликт (например, расхождение цены HW/VendHub при загрузке)"""
+        p = self.placeholder
+        self.db.execute_query(f"""
+            INSERT INTO conflicts (conflict_type, order_id_1, order_id_2, conflict_data)
+            VALUES ({p}, {p}, {p}, {p})
+            ON CONFLICT DO NOTHING
+        """, (conflict_type, order_id_1, order_id_2, conflict_data))
+
+    def get_conflicts(self, status: str = 'pending', limit: int = 100) -> List[Dict[str, Any]]:
+        """Конфликты для разбора"""
+        p = self.placeholder
+        return self.db.execute_query(f"""
+            SELECT * FROM conflicts
+            WHERE resolution_status = {p}
+            ORDER BY id DESC
+            LIMIT {int(limit)}
+        """, (status,))
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _scan_window(self, since):
+        """
+        Интервал времени заказов, измененных после since, расширенный на окно
+        None - без ограничения, False - проверять нечего
+        """
+        if since is None:
+            return None
+
+        p = self.placeholder
+        rows = self.db.execute_query(f"""
+            SELECT MIN({self._time_sql()}) AS window_start, MAX({self._time_sql()}) AS window_end
+            FROM orders
+            WHERE updated_at >= {p}
+        """, (since,))
+        if not rows or rows[0]['window_start'] is None:
+            return False
+
+        shift = self._shift_sql()
+        bounds = self.db.execute_query(
+            f"SELECT {shift.format(value=p, sign='-')} AS window_start, {shift.format(value=p, sign='+')} AS window_end",
+            (rows[0]['window_start'], rows[0]['window_end'])
+        )
+        return bounds[0]['window_start'], bounds[0]['window_end']
+
+    def _counts(self) -> Dict[str, int]:
+        rows = self.db.execute_query("SELECT conflict_type, COUNT(*) AS count FROM conflicts GROUP BY conflict_type")
+        return {row['conflict_type']: row['count'] for row in rows}
+
+    def _time_sql(self) -> str:
+        """Время заказа: HW - creation_time, строки только из VendHub - event_time"""
+        return "COALESCE(creation_time, event_time, paying_time)"
+
+    def _epoch_sql(self, column: str) -> str:
+        if self.db.is_postgres:
+            return f"CAST(EXTRACT(EPOCH FROM {column}) AS BIGINT)"
+        return f"CAST(strftime('%s', {column}) AS INTEGER)"
+
+    def _shift_sql(self) -> str:
+        seconds = self.window_seconds
+        if self.db.is_postgres:
+            return f"CAST({{value}} AS TIMESTAMP) {{sign}} INTERVAL '{seconds} seconds'"
+        return f"datetime({{value}}, '{{sign}}{seconds} seconds')"
+
+    def _conflict_data_sql(self) -> str:
+        if self.db.is_postgres:
+            return """CAST(json_build_object(
+                    'machine_code', a.machine_code,
+                    'order_numbers', json_build_array(a.order_number, b.order_number),
+                    'prices', json_build_array(a.order_price, b.order_price),
+                    'sources', json_build_array(a.source, b.source),
+                    'seconds_apart', ABS(a.ts - b.ts)) AS TEXT)"""
+        return """json_object(
+                    'machine_code', a.machine_code,
+                    'order_numbers', json_array(a.order_number, b.order_number),
+                    'prices', json_array(a.order_price, b.order_price),
+                    'sources', json_array(a.source, b.source),
+                    'seconds_apart', ABS(a.ts - b.ts))"""
@@ -0,0 +1,17 @@
+"""
+VHM24R - Хуки gunicorn
+Планировщик задач запускается в воркерах, а не в мастер-процессе (--preload):
+воркеры выбирают одного лидера через блокировку, остальные ждут в резерве
+"""
+
+
+def post_worker_init(worker):
+    """Воркер загрузил приложение: участвуем в выборах лидера планировщика"""
+    from scheduler import start_scheduler
+    start_scheduler()
+
+
+def worker_exit(server, worker):
+    """Освобождение блокировки лидера при остановке воркера"""
+    from scheduler import stop_scheduler
+    stop_scheduler()
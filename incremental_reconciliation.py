@@ -0,0 +1,200 @@
+"""
+VHM24R - Инкрементальная ночная сверка
+Обрабатываются только заказы, измененные после последнего успешного запуска (водяной знак),
+прогресс сохраняется после каждой пачки, метрики запуска пишутся в reconciliation_runs
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+
+class IncrementalReconciler:
+    """
+    Запуски сверки по окну [watermark, now)
+
+    - Водяной знак = window_end последнего успешного запуска
+    - Незавершенный запуск (status='running') продолжается с сохраненной контрольной точки
+      в том же окне
+    - Для первого запуска окно начинается за INITIAL_LOOKBACK_DAYS до текущего момента
+    """
+
+    INITIAL_LOOKBACK_DAYS = 2
+    BATCH_SIZE = 1000
+
+    def __init__(self, db, order_processor, batch_size: Optional[int] = None):
+        self.db = db
+        self.order_processor = order_processor
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.placeholder = '%s' if db.is_postgres else '?'
+        self._init_tables()
+
+    def _init_tables(self):
+        """Таблица запусков сверки"""
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        self.db.execute_query(f"""
+            CREATE TABLE IF NOT EXISTS reconciliation_runs (
+                id {id_column},
+                status TEXT NOT NULL,
+                window_start TIMESTAMP,
+                window_end TIMESTAMP NOT NULL,
+                checkpoint_time TIMESTAMP,
+                checkpoint_id INTEGER DEFAULT 0,
+                orders_scanned INTEGER DEFAULT 0,
+                orders_updated INTEGER DEFAULT 0,
+                batches INTEGER DEFAULT 0,
+                resumes INTEGER DEFAULT 0,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP,
+                duration_seconds REAL DEFAULT 0,
+                orders_per_second REAL,
+                error TEXT
+            )
+        """)
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_reconciliation_runs_status ON reconciliation_runs(status, window_end)"
+        )
+
+    def get_watermark(self):
+        """Верхняя граница окна последнего успешного запуска"""
+        rows = self.db.execute_query(
+            "SELECT MAX(window_end) AS watermark FROM reconciliation_runs WHERE status = 'success'"
+        )
+        return rows[0]['watermark'] if rows else None
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Запуск (или продолжение) сверки
+
+        Returns:
+            Dict: id запуска, окно, количество просмотренных/обновленных заказов и пропускная способность
+        """
+        run = self._pending_run() or self._start_run()
+        p = self.placeholder
+        resume_after = None
+        if run.get('checkpoint_time') is not None:
+            resume_after = (run['checkpoint_time'], run['checkpoint_id'] or 0)
+
+        scanned = int(run.get('orders_scanned') or 0)
+        updated = int(run.get('orders_updated') or 0)
+        batches = int(run.get('batches') or 0)
+        elapsed = float(run.get('duration_seconds') or 0)
+        started = time.perf_counter()
+
+        def checkpoint(position, batch_scanned, batch_updated):
+            nonlocal scanned, updated, batches
+            scanned += batch_scanned
+            updated += batch_updated
+            batches += 1
+            self.db.execute_query(f"""
+                UPDATE reconciliation_runs
+                SET checkpoint_time = {p}, checkpoint_id = {p}, orders_scanned = {p},
+                    orders_updated = {p}, batches = {p}, duration_seconds = {p}
+                WHERE id = {p}
+            """, (position[0], position[1], scanned, updated, batches,
+                  round(elapsed + time.perf_counter() - started, 3), run['id']))
+
+        try:
+            self.order_processor.run_incremental_matching(
+                run['window_start'], run['window_end'],
+                resume_after=resume_after, batch_size=self.batch_size, on_batch=checkpoint
+            )
+        except Exception as e:
+            self._finish_run(run['id'], 'failed', scanned, elapsed + time.perf_counter() - started, str(e))
+            raise
+
+        duration = elapsed + time.perf_counter() - started
+        throughput = self._finish_run(run['id'], 'success', scanned, duration)
+
+        return {
+            'run_id': run['id'],
+            'window_start': run['window_start'],
+            'window_end': run['window_end'],
+            'resumed': bool(run.get('resumes')),
+            'scanned': scanned,
+            'updated': updated,
+            'batches': batches,
+            'duration_seconds': round(duration, 3),
+            'orders_per_second': throughput
+        }
+
+    def get_recent_runs(self, limit: int = 20):
+        """Последние запуски с метриками"""
+        return self.db.execute_query(f"""
+            SELECT id, status, window_start, window_end, orders_scanned, orders_updated, batches,
+                   resumes, started_at, finished_at, duration_seconds, orders_per_second, error
+            FROM reconciliation_runs
+            ORDER BY id DESC
+            LIMIT {int(limit)}
+        """)
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _pending_run(self) -> Optional[Dict[str, Any]]:
+        """Незавершенный запуск (процесс упал до финиша) продолжается в том же окне"""
+        rows = self.db.execute_query("""
+            SELECT * FROM reconciliation_runs
+            WHERE status IN ('running', 'failed')
+              AND id > COALESCE((SELECT MAX(id) FROM reconciliation_runs WHERE status = 'success'), 0)
+            ORDER BY id DESC
+            LIMIT 1
+        """)
+        if not rows:
+            return None
+
+        run = rows[0]
+        p = self.placeholder
+        self.db.execute_query(
+            f"UPDATE reconciliation_runs SET status = 'running', resumes = resumes + 1, error = NULL WHERE id = {p}",
+            (run['id'],)
+        )
+        run['resumes'] = int(run.get('resumes') or 0) + 1
+        print(f"Resuming reconciliation run {run['id']} from checkpoint {run.get('checkpoint_time')}")
+        return run
+
+    def _start_run(self) -> Dict[str, Any]:
+        """Новый запуск: окно от водяного знака до текущего времени БД"""
+        window_end = self.db.execute_query("SELECT CURRENT_TIMESTAMP AS now")[0]['now']
+        window_start = self.get_watermark()
+        if window_start is None:
+            window_start = self._shift(window_end, -self.INITIAL_LOOKBACK_DAYS)
+
+        p = self.placeholder
+        insert = f"""
+            INSERT INTO reconciliation_runs (status, window_start, window_end)
+            VALUES ('running', {p}, {p})
+        """
+        cursor = self.db.connection.cursor()
+        if self.db.is_postgres:
+            cursor.execute(insert + " RETURNING id", (window_start, window_end))
+            run_id = cursor.fetchone()['id']
+        else:
+            cursor.execute(insert, (window_start, window_end))
+            run_id = cursor.lastrowid
+        self.db.connection.commit()
+        cursor.close()
+
+        return {'id': run_id, 'window_start': window_start, 'window_end': window_end,
+                'checkpoint_time': None, 'checkpoint_id': 0, 'resumes': 0}
+
+    def _finish_run(self, run_id: int, status: str, scanned: int, duration: float,
+                    error: Optional[str] = None) -> Optional[float]:
+        throughput = round(scanned / duration, 1) if duration > 0 else None
+        p = self.placeholder
+        self.db.execute_query(f"""
+            UPDATE reconciliation_runs
+            SET status = {p}, finished_at = CURRENT_TIMESTAMP, duration_seconds = {p},
+                orders_per_second = {p}, error = {p}
+            WHERE id = {p}
+        """, (status, round(duration, 3), throughput, error, run_id))
+        return throughput
+
+    @staticmethod
+    def _shift(moment, days: int):
+        """Сдвиг метки времени БД (datetime в PostgreSQL, строка в SQLite)"""
+        if isinstance(moment, datetime):
+            return moment + timedelta(days=days)
+        shifted = datetime.strptime(str(moment)[:19], '%Y-%m-%d %H:%M:%S') + timedelta(days=days)
+        return shifted.strftime('%Y-%m-%d %H:%M:%S')
@@ -0,0 +1,274 @@
+"""
+VHM24R - Трассировка памяти конвейера загрузки
+Пиковый RSS по этапам (фоновый опрос psutil) и пик Python-кучи по этапам с топом
+мест выделения памяти (tracemalloc). Включается на сессию загрузки (PIPELINE_MEMORY=1),
+т.к. tracemalloc заметно замедляет обработку
+"""
+
+import os
+import threading
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    psutil = None
+    PSUTIL_AVAILABLE = False
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+
+def _mb(value: float) -> float:
+    return round(value / MB, 1)
+
+
+class PeakRssSampler:
+    """
+    Пиковый RSS процесса за время блока with (фоновый опрос psutil)
+    on_sample(rss) вызывается из потока опроса после каждого замера
+    """
+
+    def __init__(self, interval: float = 0.05, on_sample: Optional[Callable[[int], None]] = None):
+        self.interval = interval
+        self.on_sample = on_sample
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._process = psutil.Process() if PSUTIL_AVAILABLE else None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def start(self):
+        if self._process is not None:
+            self.sample()
+            self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self.sample()
+        elif resource is not None and self._process is None:
+            # Без psutil - пик за все время процесса (ru_maxrss в КБ на Linux)
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def sample(self) -> int:
+        """Текущий RSS (0 без psutil)"""
+        if self._process is None:
+            return 0
+        try:
+            rss = self._process.memory_info().rss
+        except Exception:
+            return 0
+        if rss > self.peak:
+            self.peak = rss
+        if self.on_sample:
+            self.on_sample(rss)
+        return rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    @property
+    def peak_mb(self) -> float:
+        return _mb(self.peak)
+
+
+class MemoryTracer:
+    """
+    Память одной сессии загрузки по этапам конвейера
+
+    - enter(name) / exit(name) вызываются таймерами этапов pipeline_metrics
+    - peak_rss_mb: пиковый RSS, пока этап активен (вложенные этапы входят во внешний)
+    - rss_growth_mb: рост RSS относительно начала внешнего этапа - с ним сравнивается бюджет
+    - py_peak_mb: пиковый прирост Python-кучи за вызов этапа (tracemalloc)
+    - top_allocators: места выделения на момент наибольшего объема Python-кучи
+    tracemalloc и RSS общие для процесса: параллельные запросы того же воркера тоже учитываются
+    """
+
+    TOP_ALLOCATORS = 10
+    FRAMES = 1
+    # Снимок кучи снимается, когда она выросла в SNAPSHOT_GROWTH раз с прошлого снимка
+    SNAPSHOT_GROWTH = 1.5
+    SNAPSHOT_MIN_BYTES = 1 * MB
+
+    def __init__(self, budget_mb: Optional[float] = None, interval: float = 0.05,
+                 top_n: Optional[int] = None, frames: Optional[int] = None):
+        self.budget_mb = budget_mb or None
+        self.top_n = top_n or self.TOP_ALLOCATORS
+        self.frames = frames or int(os.environ.get('PIPELINE_MEMORY_FRAMES', self.FRAMES))
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.rss_start = 0
+        self.rss_end = 0
+        self.top_allocators: List[Dict[str, Any]] = []
+        self.top_allocators_stage: Optional[str] = None
+
+        self._lock = threading.Lock()
+        self._stack: List[List[Any]] = []  # [имя этапа, пик Python-кучи вызова, куча на входе]
+        self._base_rss = 0
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self._snapshot_stage: Optional[str] = None
+        self._started_tracemalloc = False
+        self._sampler = PeakRssSampler(interval, on_sample=self._on_sample)
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        if not PSUTIL_AVAILABLE:
+            print("psutil not available, memory tracing without RSS sampling")
+        self._sampler.start()
+        self.rss_start = self._base_rss = self._sampler.peak
+
+    def stop(self):
+        """Остановка опроса, топ мест выделения памяти"""
+        self._sampler.stop()
+        self.rss_end = self._sampler.sample()
+        if tracemalloc.is_tracing():
+            if self._snapshot is None:
+                self._take_snapshot(None)
+            self.top_allocators = self._top(self._snapshot) if self._snapshot is not None else []
+            self.top_allocators_stage = self._snapshot_stage
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+        self._snapshot = None
+
+    # ========================================================================
+    # ЭТАПЫ
+    # ========================================================================
+
+    def enter(self, name: str):
+        with self._lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {'calls': 0, 'peak_rss': 0, 'rss_growth': 0, 'py_peak': 0}
+            stage['calls'] += 1
+            top_level = not self._stack
+
+        if top_level:
+            self._base_rss = self._sampler.sample() or self._base_rss
+
+        current = 0
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+
+        with self._lock:
+            self._stack.append([name, 0, current])
+
+    def exit(self, name: str):
+        if len(self._stack) == 1:
+            # Короткие этапы могли не попасть ни в один фоновый замер
+            self._sampler.sample()
+
+        current = peak = 0
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+
+        with self._lock:
+            frame = self._stack.pop() if self._stack else [name, 0, 0]
+            frame_peak = max(frame[1], peak)
+            stage = self.stages[frame[0]]
+            stage['py_peak'] = max(stage['py_peak'], frame_peak - frame[2])
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], frame_peak)
+
+        if current >= self.SNAPSHOT_MIN_BYTES and current >= self._snapshot_bytes * self.SNAPSHOT_GROWTH:
+            self._take_snapshot(frame[0])
+
+    # ========================================================================
+    # РЕЗУЛЬТАТ
+    # ========================================================================
+
+    def exceeded(self) -> List[Dict[str, Any]]:
+        """Этапы, рост RSS которых превысил бюджет"""
+        if not self.budget_mb:
+            return []
+        with self._lock:
+            return [
+                {'stage': name, 'rss_growth_mb': _mb(stage['rss_growth']),
+                 'peak_rss_mb': _mb(stage['peak_rss']), 'budget_mb': self.budget_mb}
+                for name, stage in self.stages.items()
+                if stage['rss_growth'] / MB > self.budget_mb
+            ]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                name: {
+                    'calls': stage['calls'],
+                    'peak_rss_mb': _mb(stage['peak_rss']),
+                    'rss_growth_mb': _mb(stage['rss_growth']),
+                    'py_peak_mb': _mb(stage['py_peak'])
+                }
+                for name, stage in self.stages.items()
+            }
+        return {
+            'rss_start_mb': _mb(self.rss_start),
+            'rss_end_mb': _mb(self.rss_end),
+            'peak_rss_mb': self._sampler.peak_mb,
+            'budget_mb': self.budget_mb,
+            'stages': stages,
+            'exceeded': self.exceeded(),
+            'top_allocators_stage': self.top_allocators_stage,
+            'top_allocators': self.top_allocators
+        }
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _on_sample(self, rss: int):
+        """Замер RSS относится ко всем активным этапам"""
+        with self._lock:
+            growth = rss - self._base_rss
+            for name, _, _ in self._stack:
+                stage = self.stages[name]
+                if rss > stage['peak_rss']:
+                    stage['peak_rss'] = rss
+                if growth > stage['rss_growth']:
+                    stage['rss_growth'] = growth
+
+    def _take_snapshot(self, stage: Optional[str]):
+        try:
+            self._snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+                tracemalloc.Filter(False, '<unknown>'),
+            ])
+            self._snapshot_bytes = tracemalloc.get_traced_memory()[0]
+            self._snapshot_stage = stage
+        except Exception as e:
+            print(f"Error taking memory snapshot: {e}")
+
+    def _top(self, snapshot) -> List[Dict[str, Any]]:
+        result = []
+        for stat in snapshot.statistics('lineno')[:self.top_n]:
+            frame = stat.traceback[0]
+            result.append({
+                'file': frame.filename,
+                'line': frame.lineno,
+                'size_mb': round(stat.size / MB, 3),
+                'blocks': stat.count
+            })
+        return result
@@ -6,8 +6,13 @@ VHM24R - Модели данных и работа с базой данных
 import os
 import sqlite3
 import json
+import time
 from typing import Dict, List, Optional, Any
 
+from pipeline_metrics import pipeline_metrics
+from query_builder import QueryBuilder
+from query_stats import QueryObserver
+
 # Импорт psycopg2 с обработкой ошибок для статического анализа
 try:
     import psycopg2  # type: ignore
@@ -28,6 +33,8 @@ class Database:
         self.database_url = os.environ.get('DATABASE_URL')
         self.is_postgres = bool(self.database_url and 'postgresql' in self.database_url)
         self.connection = None
+        self.query_observer = QueryObserver(self)
+        self.query_builder = QueryBuilder(self)
         
         if self.is_postgres:
             self._init_postgres()
@@ -360,8 +367,12 @@ class Database:
         self.connection.commit()
         cursor.close()
     
-    def execute_query(self, query: str, params: Optional[tuple] = None) -> List[Dict]:
-        """Выполнение SQL запроса с возвратом результата"""
+    def execute_query(self, query: str, params: Optional[tuple] = None, fetch: Optional[bool] = None) -> List[Dict]:
+        """
+        Выполнение SQL запроса с возвратом результата
+        fetch - вернуть строки; по умолчанию только для запросов, начинающихся с SELECT
+        """
+        started = time.perf_counter()
         try:
             cursor = self.connection.cursor()
             
@@ -370,25 +381,95 @@ class Database:
             else:
                 cursor.execute(query)
             
-            if query.strip().upper().startswith('SELECT'):
+            if fetch if fetch is not None else query.strip().upper().startswith('SELECT'):
                 if self.is_postgres:
                     result = [dict(row) for row in cursor.fetchall()]
                 else:
                     result = [dict(row) for row in cursor.fetchall()]
+                rows = len(result)
             else:
                 result = []
+                rows = max(cursor.rowcount, 0)
                 if not self.is_postgres:
                     self.connection.commit()
             
             cursor.close()
+            self._record_query(query, params, started, rows)
             return result
             
         except Exception as e:
+            self._record_query(query, params, started, failed=True)
             print(f"Database query error: {e}")
             print(f"Query: {query}")
             print(f"Params: {params}")
             return []
     
+    def execute_insert(self, query: str, params: Optional[tuple] = None) -> Optional[int]:
+        """
+        Выполнение INSERT с возвратом id вставленной строки
+        PostgreSQL - через RETURNING id, SQLite - через lastrowid; при ошибке возвращается None
+        """
+        if self.is_postgres and 'RETURNING' not in query.upper():
+            query = f"{query.rstrip().rstrip(';')} RETURNING id"
+        
+        started = time.perf_counter()
+        try:
+            cursor = self.connection.cursor()
+            cursor.execute(query, params or ())
+            
+            if self.is_postgres:
+                result = cursor.fetchone()
+                row_id = dict(result)['id'] if result else None
+            else:
+                row_id = cursor.lastrowid
+                self.connection.commit()
+            
+            rows = max(cursor.rowcount, 0)
+            cursor.close()
+            self._record_query(query, params, started, rows)
+            return row_id
+            
+        except Exception as e:
+            self._record_query(query, params, started, failed=True)
+            print(f"Database insert error: {e}")
+            print(f"Query: {query}")
+            print(f"Params: {params}")
+            return None
+    
+    def execute_many(self, query: str, rows: List[tuple]) -> Optional[int]:
+        """
+        Пакетное выполнение одного запроса через executemany
+        В статистику запрос попадает один раз с параметрами первой строки;
+        при ошибке транзакция откатывается и возвращается None
+        """
+        if not rows:
+            return 0
+        
+        started = time.perf_counter()
+        try:
+            cursor = self.connection.cursor()
+            cursor.executemany(query, rows)
+            self.connection.commit()
+            cursor.close()
+            self._record_query(query, rows[0], started, len(rows))
+            return len(rows)
+            
+        except Exception as e:
+            self._record_query(query, rows[0], started, failed=True)
+            print(f"Database batch error: {e}")
+            print(f"Query: {query}")
+            try:
+                self.connection.rollback()
+            except Exception:
+                pass
+            return None
+    
+    def _record_query(self, query: str, params, started: float, rows: int = 0, failed: bool = False):
+        """Учет запроса в метриках этапов и статистике запросов"""
+        elapsed = time.perf_counter() - started
+        pipeline_metrics.record_query(elapsed, failed=failed)
+        self.query_observer.record(query, params, elapsed, rows, failed=failed)
+    
     def upsert_order(self, order_data: Dict[str, Any]) -> int:
         """Вставка или обновление заказа"""
         try:
@@ -625,58 +706,59 @@ class Database:
             return {'total': 0, 'OK': 0, 'NO_MATCH_IN_REPORT': 0, 'NO_PAYMENT_FOUND': 0, 'FISCAL_MISSING': 0, 'UNPROCESSED': 0}
     
     def get_orders_with_filters(self, filters: Optional[Dict[str, Any]] = None, limit: int = 1000) -> List[Dict]:
-        """Получение заказов с фильтрами согласно новой схеме БД"""
+        """
+        Получение заказов с фильтрами согласно новой схеме БД
+        Запрос компилируется один раз на набор фильтров (см. QueryBuilder)
+        """
         try:
-            base_query = """
-            SELECT 
-                id, order_number, machine_code, creation_time, order_price,
-                payment_type, match_status, mismatch_details, fiscal_matched, gateway_matched,
-                payment_gateway, transaction_id, fiscal_check_number, goods_name, address
-            FROM orders
-            """
-            
-            where_conditions = []
+            filters = filters or {}
+            used_filters = []
             params = []
             
-            if filters:
-                if 'error_type' in filters:
-                    # Маппим старые error_type на новые match_status
-                    error_mapping = {
-                        'OK': 'fully_matched',
-                        'NO_MATCH_IN_REPORT': 'vendhub_only', 
-                        'NO_PAYMENT_FOUND': 'gateway_mismatch',
-                        'FISCAL_MISSING': 'fiscal_mismatch',
-                        'UNPROCESSED': 'hw_only'
-                    }
-                    mapped_status = error_mapping.get(filters['error_type'], filters['error_type'])
-                    where_conditions.append("match_status = ?")
-                    params.append(mapped_status)
-                
-                if 'machine_code' in filters:
-                    where_conditions.append("machine_code = ?")
-                    params.append(filters['machine_code'])
-                
-                if 'date_from' in filters:
-                    where_conditions.append("DATE(creation_time) >= ?")
-                    params.append(filters['date_from'])
-                
-                if 'date_to' in filters:
-                    where_conditions.append("DATE(creation_time) <= ?")
-                    params.append(filters['date_to'])
-            
-            if where_conditions:
-                base_query += " WHERE " + " AND ".join(where_conditions)
-            
-            base_query += " ORDER BY creation_time DESC"
-            
-            if limit and limit > 0:
-                base_query += f" LIMIT {limit}"
-            
-            if self.is_postgres:
-                # Заменяем ? на %s для PostgreSQL
-                base_query = base_query.replace('?', '%s')
-            
-            return self.execute_query(base_query, tuple(params))
+            if 'error_type' in filters:
+                # Маппим старые error_type на новые match_status
+                error_mapping = {
+                    'OK': 'fully_matched',
+                    'NO_MATCH_IN_REPORT': 'vendhub_only', 
+                    'NO_PAYMENT_FOUND': 'gateway_mismatch',
+                    'FISCAL_MISSING': 'fiscal_mismatch',
+                    'UNPROCESSED': 'hw_only'
+                }
+                used_filters.append('error_type')
+                params.append(error_mapping.get(filters['error_type'], filters['error_type']))
+            
+            for name in ('machine_code', 'date_from', 'date_to'):
+                if name in filters:
+                    used_filters.append(name)
+                    params.append(filters[name])
+            
+            with_limit = bool(limit and limit > 0)
+            if with_limit:
+                params.append(int(limit))
+            
+            def build(builder):
+                conditions = {
+                    'error_type': "match_status = ?",
+                    'machine_code': "machine_code = ?",
+                    'date_from': f"{builder.date('creation_time')} >= ?",
+                    'date_to': f"{builder.date('creation_time')} <= ?"
+                }
+                query = """
+                SELECT 
+                    id, order_number, machine_code, creation_time, order_price,
+                    payment_type, match_status, mismatch_details, fiscal_matched, gateway_matched,
+                    payment_gateway, transaction_id, fiscal_check_number, goods_name, address
+                FROM orders
+                """
+                if used_filters:
+                    query += " WHERE " + " AND ".join(conditions[name] for name in used_filters)
+                query += " ORDER BY creation_time DESC"
+                if with_limit:
+                    query += " LIMIT ?"
+                return query
+            
+            statement = self.query_builder.compile(('orders_with_filters', tuple(used_filters), with_limit), build)
+            return self.query_builder.execute(statement, params)
             
         except Exception as e:
             print(f"Error getting orders with filters: {e}")
@@ -0,0 +1,362 @@
+"""
+VHM24R - Кэш результатов OCR
+Повторно загруженные фото чеков возвращаются из локального SQLite без вызова Tesseract
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Optional
+
+# Опциональные импорты для перцептивного хеша
+try:
+    import cv2
+    import numpy as np
+    PHASH_AVAILABLE = True
+except ImportError:
+    PHASH_AVAILABLE = False
+    cv2 = None
+    np = None
+
+
+class OCRResultCache:
+    """
+    Персистентный кэш результатов OCR
+
+    - Точное совпадение по SHA-256 содержимого файла
+    - Опционально (use_phash) почти-дубликаты: пересжатые/уменьшенные копии фото. dHash видит
+      только макет чека, поэтому совпадение по нему - лишь кандидат, который подтверждается
+      сравнением пикселей с сохраненной уменьшенной копией; без подтверждения - промах
+    - Результаты разных режимов распознавания (variant: режим OCR, языки) хранятся раздельно
+    - LRU вытеснение по времени последнего обращения с лимитами по количеству и объему
+    """
+
+    # dHash делится на 4 полосы по 16 бит: при расстоянии Хэмминга <= 3 хотя бы одна
+    # полоса совпадает точно, поэтому кандидаты ищутся по индексам полос
+    PHASH_BANDS = 4
+    MAX_PHASH_DISTANCE = PHASH_BANDS - 1
+
+    # Проверка пикселей: копия по длинной стороне PIXEL_CHECK_SIZE, разница усредняется
+    # блоками PIXEL_BLOCK x PIXEL_BLOCK; пересжатие дает ~16, другая цифра в сумме - ~100
+    PIXEL_CHECK_SIZE = 512
+    PIXEL_BLOCK = 8
+    PIXEL_TOLERANCE = 32
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 10000,
+                 max_bytes: int = 200 * 1024 * 1024, use_phash: bool = False, phash_distance: int = 3):
+        self.db_path = db_path or os.environ.get('OCR_CACHE_PATH', 'ocr_cache.db')
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.use_phash = use_phash and PHASH_AVAILABLE
+        self.phash_distance = min(phash_distance, self.MAX_PHASH_DISTANCE)
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._init_schema()
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """Параметры для создания такого же кэша в другом процессе"""
+        return {
+            'db_path': self.db_path,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'use_phash': self.use_phash,
+            'phash_distance': self.phash_distance
+        }
+
+    def _init_schema(self):
+        """Создание таблицы кэша"""
+        with self._lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            columns = {row['name'] for row in self.connection.execute("PRAGMA table_info(ocr_cache)")}
+            if columns and 'variant' not in columns:
+                # Записи без режима распознавания нельзя отличить друг от друга - кэш строится заново
+                self.connection.execute("DROP TABLE ocr_cache")
+            elif columns and 'pixels' not in columns:
+                # У старых записей нет копии для проверки - они находятся только по точному хешу
+                self.connection.execute("ALTER TABLE ocr_cache ADD COLUMN pixels BLOB")
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    content_hash TEXT NOT NULL,
+                    variant TEXT NOT NULL DEFAULT '',
+                    phash INTEGER,
+                    phash_b0 INTEGER,
+                    phash_b1 INTEGER,
+                    phash_b2 INTEGER,
+                    phash_b3 INTEGER,
+                    pixels BLOB,
+                    result TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    hits INTEGER DEFAULT 0,
+                    created_at REAL,
+                    last_access REAL,
+                    PRIMARY KEY (content_hash, variant)
+                );
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache(last_access);
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_phash_b0 ON ocr_cache(phash_b0);
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_phash_b1 ON ocr_cache(phash_b1);
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_phash_b2 ON ocr_cache(phash_b2);
+                CREATE INDEX IF NOT EXISTS idx_ocr_cache_phash_b3 ON ocr_cache(phash_b3);
+            """)
+            self.connection.commit()
+
+    def compute_keys(self, image_path: str, variant: str = '') -> Dict[str, Any]:
+        """
+        Вычисление ключей кэша для изображения
+        variant - параметры распознавания, от которых зависит результат (режим OCR, языки)
+        Перцептивный хеш считается лениво в get(), только при промахе по точному хешу
+        """
+        with open(image_path, 'rb') as f:
+            content = f.read()
+
+        return {
+            'content_hash': hashlib.sha256(content).hexdigest(),
+            'variant': variant,
+            'content': content,
+            'phash': None
+        }
+
+    def get(self, keys: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Поиск результата в кэше
+
+        Returns:
+            Dict: Сохраненный результат OCR с полем cache_hit ('exact'/'perceptual') или None
+        """
+        try:
+            variant = keys.get('variant', '')
+            row = self._fetch_exact(keys['content_hash'], variant)
+            hit_type = 'exact'
+
+            if row is None and self.use_phash:
+                if keys.get('phash') is None:
+                    keys['phash'] = self._compute_phash(keys.get('content'))
+                row = self._fetch_near_duplicate(keys['phash'], variant, keys.get('content'))
+                hit_type = 'perceptual'
+
+            if row is None:
+                return None
+
+            self._touch(row['content_hash'], variant)
+            result = json.loads(row['result'])
+            result['cache_hit'] = hit_type
+            return result
+
+        except Exception as e:
+            print(f"OCR cache lookup failed: {e}")
+            return None
+
+    def put(self, keys: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        """Сохранение успешного результата OCR и вытеснение старых записей"""
+        if result.get('status') != 'success':
+            return False
+
+        try:
+            pixels = None
+            if self.use_phash:
+                if keys.get('phash') is None:
+                    keys['phash'] = self._compute_phash(keys.get('content'))
+                pixels = self._encode_pixels(keys.get('content'))
+
+            payload = {k: v for k, v in result.items()
+                       if k not in ('image_path', 'processing_time', 'cache_hit')}
+            serialized = json.dumps(payload, ensure_ascii=False, default=str)
+            phash = keys.get('phash') if pixels is not None else None
+            bands = self._split_bands(phash) if phash is not None else [None] * self.PHASH_BANDS
+            size_bytes = len(serialized.encode('utf-8')) + len(pixels or b'')
+            now = time.time()
+
+            with self._lock:
+                self.connection.execute("""
+                    INSERT OR REPLACE INTO ocr_cache (
+                        content_hash, variant, phash, phash_b0, phash_b1, phash_b2, phash_b3,
+                        pixels, result, size_bytes, hits, created_at, last_access
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?)
+                """, (
+                    keys['content_hash'], keys.get('variant', ''), self._to_signed(phash), *bands,
+                    pixels, serialized, size_bytes, now, now
+                ))
+                self._evict()
+                self.connection.commit()
+
+            return True
+
+        except Exception as e:
+            print(f"OCR cache store failed: {e}")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша"""
+        with self._lock:
+            row = self.connection.execute("""
+                SELECT COUNT(*) AS entries,
+                       COALESCE(SUM(size_bytes), 0) AS size_bytes,
+                       COALESCE(SUM(hits), 0) AS hits
+                FROM ocr_cache
+            """).fetchone()
+        return dict(row)
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            self.connection.execute("DELETE FROM ocr_cache")
+            self.connection.commit()
+
+    def close(self):
+        """Закрытие подключения к файлу кэша"""
+        self.connection.close()
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _fetch_exact(self, content_hash: str, variant: str) -> Optional[sqlite3.Row]:
+        """Поиск по точному хешу содержимого"""
+        with self._lock:
+            return self.connection.execute(
+                "SELECT content_hash, result FROM ocr_cache WHERE content_hash = ? AND variant = ?",
+                (content_hash, variant)
+            ).fetchone()
+
+    def _fetch_near_duplicate(self, phash: Optional[int], variant: str,
+                              content: Optional[bytes]) -> Optional[sqlite3.Row]:
+        """
+        Поиск почти-дубликата: кандидаты по перцептивному хешу от ближайшего,
+        возвращается первый, чьи пиксели совпали с изображением
+        """
+        if phash is None:
+            return None
+
+        bands = self._split_bands(phash)
+        conditions = ' OR '.join(f"phash_b{i} = ?" for i in range(self.PHASH_BANDS))
+
+        with self._lock:
+            candidates = self.connection.execute(
+                f"""SELECT content_hash, phash, pixels, result FROM ocr_cache
+                    WHERE variant = ? AND pixels IS NOT NULL AND ({conditions})""",
+                (variant, *bands)
+            ).fetchall()
+
+        scored = []
+        for row in candidates:
+            distance = bin(phash ^ self._to_unsigned(row['phash'])).count('1')
+            if distance <= self.phash_distance:
+                scored.append((distance, row))
+        if not scored:
+            return None
+
+        image = self._decode_gray(content)
+        for _, row in sorted(scored, key=lambda item: item[0]):
+            if self._same_pixels(image, row['pixels']):
+                return row
+        return None
+
+    def _touch(self, content_hash: str, variant: str):
+        """Обновление времени последнего обращения (LRU)"""
+        with self._lock:
+            self.connection.execute(
+                "UPDATE ocr_cache SET last_access = ?, hits = hits + 1 WHERE content_hash = ? AND variant = ?",
+                (time.time(), content_hash, variant)
+            )
+            self.connection.commit()
+
+    def _evict(self):
+        """Вытеснение наиболее давно использованных записей сверх лимитов"""
+        entries, total_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM ocr_cache"
+        ).fetchone()
+
+        if entries > self.max_entries:
+            self.connection.execute("""
+                DELETE FROM ocr_cache WHERE rowid IN (
+                    SELECT rowid FROM ocr_cache ORDER BY last_access ASC LIMIT ?
+                )
+            """, (entries - self.max_entries,))
+            entries, total_bytes = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM ocr_cache"
+            ).fetchone()
+
+        if total_bytes > self.max_bytes:
+            oldest = self.connection.execute(
+                "SELECT rowid, size_bytes FROM ocr_cache ORDER BY last_access ASC"
+            )
+            to_delete = []
+            for rowid, size_bytes in oldest:
+                if total_bytes <= self.max_bytes:
+                    break
+                to_delete.append((rowid,))
+                total_bytes -= size_bytes
+            self.connection.executemany("DELETE FROM ocr_cache WHERE rowid = ?", to_delete)
+
+    def _compute_phash(self, content: Optional[bytes]) -> Optional[int]:
+        """64-битный разностный хеш (dHash) изображения"""
+        if not PHASH_AVAILABLE or not content:
+            return None
+
+        image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            return None
+
+        small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+
+        value = 0
+        for bit in bits:
+            value = (value << 1) | int(bit)
+        return value
+
+    def _decode_gray(self, content: Optional[bytes]):
+        if not PHASH_AVAILABLE or not content:
+            return None
+        return cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+    def _encode_pixels(self, content: Optional[bytes]) -> Optional[bytes]:
+        """Уменьшенная серая копия изображения (PNG) для подтверждения почти-дубликатов"""
+        image = self._decode_gray(content)
+        if image is None:
+            return None
+
+        height, width = image.shape[:2]
+        scale = min(1.0, self.PIXEL_CHECK_SIZE / max(height, width))
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        ok, encoded = cv2.imencode('.png', cv2.resize(image, size, interpolation=cv2.INTER_AREA))
+        return encoded.tobytes() if ok else None
+
+    def _same_pixels(self, image, stored: Optional[bytes]) -> bool:
+        """Изображение совпадает с сохраненной копией с точностью до пересжатия и масштаба"""
+        if image is None or not stored:
+            return False
+        reference = cv2.imdecode(np.frombuffer(stored, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if reference is None:
+            return False
+
+        height, width = reference.shape[:2]
+        if abs(image.shape[1] / image.shape[0] - width / height) > 0.02 * width / height:
+            return False
+
+        resized = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+        difference = cv2.absdiff(resized, reference)
+        blocks = (max(1, width // self.PIXEL_BLOCK), max(1, height // self.PIXEL_BLOCK))
+        return int(cv2.resize(difference, blocks, interpolation=cv2.INTER_AREA).max()) <= self.PIXEL_TOLERANCE
+
+    def _split_bands(self, phash: int) -> list:
+        """Разбиение хеша на полосы для индексированного поиска"""
+        return [(phash >> (16 * i)) & 0xFFFF for i in range(self.PHASH_BANDS)]
+
+    @staticmethod
+    def _to_signed(value: Optional[int]) -> Optional[int]:
+        """SQLite хранит INTEGER как знаковое 64-битное число"""
+        if value is None:
+            return None
+        return value - (1 << 64) if value >= (1 << 63) else value
+
+    @staticmethod
+    def _to_unsigned(value: Optional[int]) -> int:
+        if value is None:
+            return 0
+        return value + (1 << 64) if value < 0 else value
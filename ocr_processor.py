@@ -3,9 +3,17 @@ VHM24R - OCR модуль для обработки изображений че
 Извлечение структурированных данных из изображений
 """
 
+import itertools
+import multiprocessing
+import os
+import queue
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Optional
+
+from ocr_cache import OCRResultCache
 
 # Опциональные импорты для OCR
 try:
@@ -19,15 +27,64 @@ except ImportError:
     np = None
     pytesseract = None
 
+# Товарные позиции: одна альтернация с именованными группами, применяется ко всему тексту
+# с re.MULTILINE. [^\S\n] - пробельные символы без перевода строки, чтобы совпадение
+# не выходило за пределы строки чека. Порядок альтернатив = приоритет паттернов.
+ITEM_LINE_REGEX = re.compile(
+    r'^[^\S\n]*(?:'
+    # Название Кол-во x Цена
+    r'(?P<qty_name>.+?)[^\S\n]+(?P<qty>\d+[\.,]\d+)[^\S\n]*[xх][^\S\n]*(?P<qty_price>\d+[\.,]\d+)'
+    # Название Кол-во шт Цена
+    r'|(?P<pcs_name>.+?)[^\S\n]+(?P<pcs>\d+[\.,]\d+)[^\S\n]*шт[^\S\n]*(?P<pcs_price>\d+[\.,]\d+)'
+    # Название Цена
+    r'|(?P<name>.+?)[^\S\n]+(?P<price>\d+[\.,]\d+)[^\S\n]*$'
+    r')',
+    re.MULTILINE
+)
+
+# Ключевые слова, которые должны распознаваться в ROI режиме (итоги, дата, номера, способ оплаты)
+ROI_KEYWORDS = [
+    'ИТОГО', 'СУММА', 'СУМ', 'TOTAL', 'UZS', 'ЧЕК', 'RECEIPT', 'ФИСКАЛЬНЫЙ', 'FISCAL', 'ФП',
+    'ID', 'TRANSACTION', 'ТРАНЗАКЦИИ', 'TXN', 'НАЛИЧНЫЕ', 'CASH', 'КАРТА', 'CARD',
+    'PAYME', 'CLICK', 'UZUM', 'БАНК', 'BANK'
+]
+
+# Ограниченный набор символов для ROI: цифры, разделители и буквы ключевых слов
+# (без пробела - он разбил бы строку config; пробелы между словами Tesseract выводит сам)
+ROI_CHAR_WHITELIST = '0123456789.,:-/№' + ''.join(sorted(
+    {ch for word in ROI_KEYWORDS for ch in word + word.lower()}
+))
+
 class OCRProcessor:
     """
     Процессор OCR для извлечения данных из изображений чеков и документов
     """
     
-    def __init__(self):
+    # Доли высоты текстового блока чека: шапка (дата, номер чека) и подвал (итоги, ФП, оплата)
+    ROI_HEADER_SHARE = 0.35
+    ROI_FOOTER_SHARE = 0.45
+    # Высота строки текста в мозаике ROI, px
+    ROI_LINE_HEIGHT = 48
+    
+    def __init__(self, ocr_timeout: int = 0, cache: Optional[OCRResultCache] = None,
+                 ocr_mode: str = 'full', roi_min_confidence: float = 0.6):
         # Настройка языков OCR
         self.languages = ['rus', 'eng']
         
+        # Таймаут одного вызова Tesseract в секундах (0 - без ограничения)
+        self.ocr_timeout = ocr_timeout
+        
+        # Кэш результатов OCR (None - кэширование отключено)
+        self.cache = cache
+        
+        # Режим OCR: 'full' - вся страница, 'roi' - только области шапки и итогов
+        # с откатом на всю страницу при уверенности ниже roi_min_confidence
+        self.ocr_mode = ocr_mode
+        self.roi_min_confidence = roi_min_confidence
+        
+        # Ядро морфологии создается один раз и переиспользуется для всех изображений
+        self._morph_kernel = np.ones((2, 2), np.uint8) if OCR_AVAILABLE else None
+        
         # Паттерны для извлечения данных
         self.patterns = {
             'amount': [
@@ -64,11 +121,28 @@ class OCRProcessor:
                 r'TXN[:\s]*(\w+)'
             ]
         }
+        
+        # Скомпилированный банк паттернов (порядок в группе = приоритет)
+        self._field_regexes = {
+            field: tuple(re.compile(pattern, re.IGNORECASE) for pattern in patterns)
+            for field, patterns in self.patterns.items()
+        }
     
     def process_image(self, image_path: str) -> Dict[str, Any]:
         """
         Основной метод обработки изображения
         """
+        cache_keys = None
+        if self.cache is not None:
+            try:
+                cache_keys = self.cache.compute_keys(image_path, self._cache_variant())
+                cached = self.cache.get(cache_keys)
+                if cached is not None:
+                    return cached
+            except Exception as e:
+                print(f"OCR cache unavailable for {image_path}: {e}")
+                cache_keys = None
+        
         if not OCR_AVAILABLE:
             return {
                 'status': 'error',
@@ -76,35 +150,69 @@ class OCRProcessor:
             }
         
         try:
-            # Предобработка изображения
-            processed_image = self._preprocess_image(image_path)
+            ocr_latency = {}
+            mode_used = 'full'
+            text = ''
+            parsed_data = None
             
-            # OCR извлечение текста
-            text = self._extract_text(processed_image)
+            if self.ocr_mode == 'roi':
+                started = time.perf_counter()
+                text = self._extract_roi_text(image_path)
+                parsed_data = self._parse_receipt_data(text) if text.strip() else None
+                ocr_latency['roi'] = round(time.perf_counter() - started, 4)
+                mode_used = 'roi'
+                
+                if not self._roi_result_acceptable(parsed_data):
+                    mode_used = 'roi_fallback'
+                    parsed_data = None
             
-            if not text.strip():
-                return {'status': 'error', 'message': 'No text extracted'}
-            
-            # Парсинг структурированных данных
-            parsed_data = self._parse_receipt_data(text)
+            if parsed_data is None:
+                started = time.perf_counter()
+                
+                # Предобработка изображения
+                processed_image = self._preprocess_image(image_path)
+                
+                # OCR извлечение текста
+                text = self._extract_text(processed_image)
+                
+                if not text.strip():
+                    return {'status': 'error', 'message': 'No text extracted'}
+                
+                # Парсинг структурированных данных
+                parsed_data = self._parse_receipt_data(text)
+                ocr_latency['full'] = round(time.perf_counter() - started, 4)
             
             # Определение типа документа
             document_type = self._classify_document_type(text, parsed_data)
             
-            return {
+            result = {
                 'status': 'success',
                 'document_type': document_type,
                 'raw_text': text,
                 'parsed_data': parsed_data,
-                'confidence': self._calculate_confidence(parsed_data)
+                'confidence': self._calculate_confidence(parsed_data),
+                'ocr_mode': mode_used,
+                'ocr_latency': ocr_latency
             }
             
+            if cache_keys is not None:
+                self.cache.put(cache_keys, result)
+            
+            return result
+            
         except Exception as e:
             return {
                 'status': 'error',
                 'message': f'OCR processing failed: {str(e)}'
             }
     
+    def _cache_variant(self) -> str:
+        """Параметры, от которых зависит результат OCR: режим и языки (для ROI - порог уверенности)"""
+        variant = f"{self.ocr_mode}:{'+'.join(self.languages)}"
+        if self.ocr_mode == 'roi':
+            variant += f":{self.roi_min_confidence}"
+        return variant
+    
     def _preprocess_image(self, image_path: str):
         """
         Предобработка изображения для улучшения качества OCR
@@ -135,12 +243,113 @@ class OCRProcessor:
         _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
         
         # Морфологические операции для очистки
-        kernel = np.ones((2, 2), np.uint8)
+        kernel = self._morph_kernel
         binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
         binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
         
         return binary
     
+    def _find_text_regions(self, gray) -> List[tuple]:
+        """
+        Поиск строк текста контурами: символы склеиваются горизонтальной дилатацией
+        Возвращает прямоугольники (x, y, w, h), отсортированные сверху вниз
+        """
+        height, width = gray.shape
+        
+        _, binary_inv = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(15, width // 15), 3))
+        dilated = cv2.dilate(binary_inv, kernel, iterations=1)
+        
+        contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            # Отсекаем шум, вертикальные линии и крупные блоки (логотипы, QR-коды)
+            if h < 6 or w < 10 or h > height * 0.2 or w < h:
+                continue
+            boxes.append((x, y, w, h))
+        
+        boxes.sort(key=lambda box: (box[1], box[0]))
+        return boxes
+    
+    def _select_roi_boxes(self, boxes: List[tuple]) -> List[tuple]:
+        """
+        Выбор строк шапки и подвала чека: товарные позиции в середине не нужны
+        для итогов, даты и фискального номера
+        """
+        if len(boxes) <= 6:
+            return list(boxes)
+        
+        top = min(box[1] for box in boxes)
+        bottom = max(box[1] + box[3] for box in boxes)
+        extent = bottom - top
+        
+        header_limit = top + extent * self.ROI_HEADER_SHARE
+        footer_limit = bottom - extent * self.ROI_FOOTER_SHARE
+        
+        return [box for box in boxes
+                if box[1] + box[3] <= header_limit or box[1] >= footer_limit]
+    
+    def _build_roi_mosaic(self, gray, boxes: List[tuple]):
+        """Склейка выбранных строк в одно изображение для одного вызова Tesseract"""
+        padding = 4
+        gap = self.ROI_LINE_HEIGHT // 3
+        height, width = gray.shape
+        
+        lines = []
+        for x, y, w, h in boxes:
+            crop = gray[max(0, y - padding):min(height, y + h + padding),
+                        max(0, x - padding):min(width, x + w + padding)]
+            scale = self.ROI_LINE_HEIGHT / crop.shape[0]
+            interpolation = cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA
+            lines.append(cv2.resize(crop, (max(1, int(crop.shape[1] * scale)), self.ROI_LINE_HEIGHT),
+                                    interpolation=interpolation))
+        
+        mosaic_width = max(line.shape[1] for line in lines) + 2 * gap
+        mosaic_height = len(lines) * (self.ROI_LINE_HEIGHT + gap) + gap
+        mosaic = np.full((mosaic_height, mosaic_width), 255, dtype=np.uint8)
+        
+        y = gap
+        for line in lines:
+            mosaic[y:y + line.shape[0], gap:gap + line.shape[1]] = line
+            y += self.ROI_LINE_HEIGHT + gap
+        
+        mosaic = cv2.GaussianBlur(mosaic, (3, 3), 0)
+        _, binary = cv2.threshold(mosaic, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return binary
+    
+    def _extract_roi_text(self, image_path: str) -> str:
+        """
+        Быстрый OCR только по строкам шапки и итогов с ограниченным набором символов
+        Возвращает пустую строку, если строки текста не найдены
+        """
+        if not OCR_AVAILABLE:
+            raise ValueError("OCR libraries not available")
+        
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError(f"Cannot load image: {image_path}")
+        
+        boxes = self._select_roi_boxes(self._find_text_regions(gray))
+        if not boxes:
+            return ''
+        
+        mosaic = self._build_roi_mosaic(gray, boxes)
+        
+        return pytesseract.image_to_string(
+            mosaic,
+            lang='+'.join(self.languages),
+            config=f'--oem 3 --psm 6 -c tessedit_char_whitelist={ROI_CHAR_WHITELIST}',
+            timeout=self.ocr_timeout
+        )
+    
+    def _roi_result_acceptable(self, parsed_data: Optional[Dict[str, Any]]) -> bool:
+        """Достаточно ли данных из ROI, или нужен откат на распознавание всей страницы"""
+        if not parsed_data or not parsed_data.get('total_amount'):
+            return False
+        return self._calculate_confidence(parsed_data) >= self.roi_min_confidence
+    
     def _extract_text(self, image) -> str:
         """
         Извлечение текста из предобработанного изображения
@@ -155,11 +364,29 @@ class OCRProcessor:
         text = pytesseract.image_to_string(
             image, 
             lang='+'.join(self.languages),
-            config=custom_config
+            config=custom_config,
+            timeout=self.ocr_timeout
         )
         
         return text
     
+    def warm_up(self) -> bool:
+        """
+        Прогрев Tesseract: проверка бинарника и загрузка языковых моделей
+        Вызывается один раз на процесс, чтобы не платить за это на первом чеке
+        """
+        if not OCR_AVAILABLE:
+            return False
+        
+        try:
+            pytesseract.get_tesseract_version()
+            blank = np.full((32, 32), 255, dtype=np.uint8)
+            pytesseract.image_to_string(blank, lang='+'.join(self.languages), config='--psm 6')
+            return True
+        except Exception as e:
+            print(f"Tesseract warm-up failed: {e}")
+            return False
+    
     def _parse_receipt_data(self, text: str) -> Dict[str, Any]:
         """
         Парсинг структурированных данных из текста чека
@@ -175,12 +402,10 @@ class OCRProcessor:
             'payment_method': None
         }
         
-        lines = text.split('\n')
-        
-        # Извлечение основных полей
-        for field, patterns in self.patterns.items():
-            for pattern in patterns:
-                match = re.search(pattern, text, re.IGNORECASE)
+        # Извлечение основных полей: паттерны группы проверяются в порядке приоритета
+        for field, regexes in self._field_regexes.items():
+            for regex in regexes:
+                match = regex.search(text)
                 if match:
                     value = match.group(1)
                     if field == 'amount':
@@ -198,51 +423,40 @@ class OCRProcessor:
                     break
         
         # Извлечение товарных позиций
-        data['items'] = self._extract_items(lines)
+        data['items'] = self._extract_items(text)
         
         # Определение способа оплаты
         data['payment_method'] = self._detect_payment_method(text)
         
         return data
     
-    def _extract_items(self, lines: List[str]) -> List[Dict[str, Any]]:
+    def _extract_items(self, text: str) -> List[Dict[str, Any]]:
         """
-        Извлечение товарных позиций из строк текста
+        Извлечение товарных позиций за один проход по тексту чека
         """
         items = []
         
-        # Паттерны для товарных позиций
-        item_patterns = [
-            r'(.+?)\s+(\d+[\.,]\d+)\s*[xх]\s*(\d+[\.,]\d+)',  # Название Кол-во x Цена
-            r'(.+?)\s+(\d+[\.,]\d+)\s*шт\s*(\d+[\.,]\d+)',    # Название Кол-во шт Цена
-            r'(.+?)\s+(\d+[\.,]\d+)$'                         # Название Цена
-        ]
-        
-        for line in lines:
-            line = line.strip()
-            if not line or len(line) < 5:
+        for match in ITEM_LINE_REGEX.finditer(text):
+            if match.group('qty') is not None:
+                name, quantity, price = match.group('qty_name', 'qty', 'qty_price')
+            elif match.group('pcs') is not None:
+                name, quantity, price = match.group('pcs_name', 'pcs', 'pcs_price')
+            else:
+                name, price = match.group('name', 'price')
+                items.append({
+                    'name': name.strip(),
+                    'quantity': 1.0,
+                    'price': self._parse_float(price),
+                    'total': self._parse_float(price)
+                })
                 continue
             
-            for pattern in item_patterns:
-                match = re.search(pattern, line)
-                if match:
-                    if len(match.groups()) == 3:
-                        name, quantity, price = match.groups()
-                        items.append({
-                            'name': name.strip(),
-                            'quantity': self._parse_float(quantity),
-                            'price': self._parse_float(price),
-                            'total': self._parse_float(quantity) * self._parse_float(price)
-                        })
-                    elif len(match.groups()) == 2:
-                        name, price = match.groups()
-                        items.append({
-                            'name': name.strip(),
-                            'quantity': 1.0,
-                            'price': self._parse_float(price),
-                            'total': self._parse_float(price)
-                        })
-                    break
+            items.append({
+                'name': name.strip(),
+                'quantity': self._parse_float(quantity),
+                'price': self._parse_float(price),
+                'total': self._parse_float(quantity) * self._parse_float(price)
+            })
         
         return items
     
@@ -362,10 +576,15 @@ class OCRProcessor:
         except (ValueError, TypeError):
             return 0.0
     
-    def process_batch_images(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+    def process_batch_images(self, image_paths: List[str], parallel: bool = False,
+                             **parallel_options) -> List[Dict[str, Any]]:
         """
         Пакетная обработка изображений
+        При parallel=True обработка идет в пуле процессов (см. iter_batch_images_parallel)
         """
+        if parallel:
+            return list(self.iter_batch_images_parallel(image_paths, **parallel_options))
+        
         results = []
         
         for image_path in image_paths:
@@ -382,6 +601,128 @@ class OCRProcessor:
         
         return results
     
+    def iter_batch_images_parallel(self, image_paths: List[str], max_workers: Optional[int] = None,
+                                   max_in_flight: Optional[int] = None,
+                                   image_timeout: int = 60) -> Iterator[Dict[str, Any]]:
+        """
+        Параллельная пакетная обработка изображений в пуле процессов
+        
+        Args:
+            image_paths: Пути к изображениям
+            max_workers: Количество процессов (по умолчанию - все ядра)
+            max_in_flight: Максимум изображений в обработке одновременно
+            image_timeout: Таймаут обработки одного изображения в секундах
+        
+        Yields:
+            Dict: Результат по каждому изображению по мере готовности (порядок не сохраняется)
+        
+        Воркер сообщает о начале обработки через очередь пула, поэтому таймаут отсчитывается
+        от фактического старта, а не от постановки в очередь. Если изображение обрабатывается
+        дольше image_timeout, процессы пула завершаются, по зависшим изображениям возвращается
+        ошибка таймаута, а остальные незавершенные изображения отправляются в новый пул
+        """
+        max_workers = max_workers or os.cpu_count() or 1
+        max_in_flight = max(max_in_flight or max_workers * 2, 1)
+        poll_interval = min(1.0, image_timeout / 2) if image_timeout else None
+        
+        paths = iter(image_paths)
+        task_ids = itertools.count(1)
+        started_queue = multiprocessing.Queue()
+        executor = self._create_ocr_pool(max_workers, image_timeout, started_queue)
+        pending = {}   # future -> (id задачи, путь)
+        started = {}   # id задачи -> время начала обработки в воркере
+        
+        try:
+            while True:
+                # Дозаполняем очередь до лимита одновременно обрабатываемых изображений
+                for image_path in paths:
+                    task_id = next(task_ids)
+                    pending[executor.submit(_ocr_worker_task, image_path, task_id)] = (task_id, image_path)
+                    if len(pending) >= max_in_flight:
+                        break
+                
+                if not pending:
+                    break
+                
+                done, _ = wait(pending, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                
+                for future in done:
+                    task_id, image_path = pending.pop(future)
+                    started.pop(task_id, None)
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        yield {
+                            'image_path': image_path,
+                            'status': 'error',
+                            'message': str(e)
+                        }
+                
+                if not image_timeout:
+                    continue
+                
+                now = time.monotonic()
+                self._drain_started_tasks(started_queue, started, now,
+                                          {task_id for task_id, _ in pending.values()})
+                hung = [future for future, (task_id, _) in pending.items()
+                        if not future.done() and now - started.get(task_id, now) >= image_timeout]
+                if not hung:
+                    continue
+                
+                for future in hung:
+                    task_id, image_path = pending.pop(future)
+                    yield {
+                        'image_path': image_path,
+                        'status': 'error',
+                        'message': f'OCR timeout after {image_timeout}s'
+                    }
+                
+                # Зависший воркер не освободится сам: пул завершается, остальное - в новый пул
+                requeue = [image_path for _, image_path in pending.values()]
+                pending.clear()
+                started.clear()
+                self._terminate_ocr_pool(executor)
+                started_queue = multiprocessing.Queue()
+                executor = self._create_ocr_pool(max_workers, image_timeout, started_queue)
+                for image_path in requeue:
+                    task_id = next(task_ids)
+                    pending[executor.submit(_ocr_worker_task, image_path, task_id)] = (task_id, image_path)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _create_ocr_pool(self, max_workers: int, image_timeout: int, started_queue=None) -> ProcessPoolExecutor:
+        """Создание пула процессов с прогревом Tesseract в каждом воркере"""
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_ocr_worker,
+            initargs=(self.languages, image_timeout, self.cache.config if self.cache else None,
+                      self.ocr_mode, self.roi_min_confidence, started_queue)
+        )
+    
+    @staticmethod
+    def _drain_started_tasks(started_queue, started: Dict[int, float], now: float, active_ids: set):
+        """Отметки начала обработки, присланные воркерами (по уже завершенным задачам - пропускаются)"""
+        while True:
+            try:
+                task_id = started_queue.get_nowait()
+            except queue.Empty:
+                return
+            if task_id in active_ids:
+                started.setdefault(task_id, now)
+    
+    @staticmethod
+    def _terminate_ocr_pool(executor: ProcessPoolExecutor):
+        """Принудительное завершение процессов пула (shutdown не прерывает выполняемые задачи)"""
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            try:
+                process.terminate()
+            except Exception as e:
+                print(f"Error terminating OCR worker {process.pid}: {e}")
+        for process in processes:
+            process.join(timeout=5)
+    
     def extract_table_from_image(self, image_path: str) -> List[List[str]]:
         """
         Извлечение табличных данных из изображения
@@ -419,3 +760,54 @@ class OCRProcessor:
         except Exception as e:
             print(f"Error extracting table from image: {e}")
             return []
+
+
+
+# ============================================================================
+# ВОРКЕРЫ ПУЛА ПРОЦЕССОВ
+# ============================================================================
+
+# Экземпляр процессора внутри процесса-воркера (создается один раз в initializer)
+_worker_processor = None
+# Очередь пула для отметок начала обработки (таймаут считается от фактического старта)
+_worker_started_queue = None
+
+
+def _init_ocr_worker(languages: List[str], ocr_timeout: int, cache_config: Optional[Dict[str, Any]] = None,
+                     ocr_mode: str = 'full', roi_min_confidence: float = 0.6, started_queue=None):
+    """Инициализация воркера: один процессор и прогрев Tesseract на процесс"""
+    global _worker_processor, _worker_started_queue
+    _worker_started_queue = started_queue
+    
+    if OCR_AVAILABLE:
+        # Параллелизм обеспечивает пул процессов, внутренние потоки OpenCV только мешают
+        cv2.setNumThreads(1)
+    
+    # Подключение к SQLite нельзя передать между процессами - каждый воркер открывает свое
+    cache = OCRResultCache(**cache_config) if cache_config else None
+    
+    _worker_processor = OCRProcessor(ocr_timeout=ocr_timeout, cache=cache,
+                                     ocr_mode=ocr_mode, roi_min_confidence=roi_min_confidence)
+    _worker_processor.languages = list(languages)
+    _worker_processor.warm_up()
+
+
+def _mark_task_started(task_id: Optional[int]):
+    """Отметка начала обработки для контроля зависаний в родительском процессе"""
+    if _worker_started_queue is not None and task_id is not None:
+        _worker_started_queue.put(task_id)
+
+
+def _ocr_worker_task(image_path: str, task_id: Optional[int] = None) -> Dict[str, Any]:
+    """Обработка одного изображения внутри воркера"""
+    _mark_task_started(task_id)
+    started = time.perf_counter()
+    
+    try:
+        result = _worker_processor.process_image(image_path)
+    except Exception as e:
+        result = {'status': 'error', 'message': str(e)}
+    
+    result['image_path'] = image_path
+    result['processing_time'] = round(time.perf_counter() - started, 4)
+    return result
@@ -0,0 +1,177 @@
+"""
+VHM24R - Журнал изменений заказов (order_changes)
+Старые и новые значения сравниваются в памяти, строки журнала копятся в буфере
+и записываются одним executemany при сбросе (write-behind), чтобы аудит почти
+не замедлял загрузку файлов
+"""
+
+import json
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pipeline_metrics import pipeline_metrics
+
+
+class OrderChangeLog:
+    """
+    Буферизованная запись order_changes
+
+    - capture() сравнивает известную строку заказа с новыми значениями и кладет
+      в буфер по строке на каждое измененное поле (создание - одна строка с JSON значений)
+    - flush() пишет весь буфер одним executemany; вызывается по заполнении буфера
+      и в конце обработки каждого файла
+    - Сырые данные источников (*_data) и служебные метки времени не журналируются
+    """
+
+    FLUSH_SIZE = 1000
+    IGNORED_FIELDS = {'id', 'updated_at', 'created_at', 'hw_data', 'vendhub_data', 'gateway_data', 'fiscal_data'}
+    PREFETCH_CHUNK = 500
+
+    def __init__(self, db, flush_size: Optional[int] = None):
+        self.db = db
+        self.flush_size = flush_size or self.FLUSH_SIZE
+        self.placeholder = '%s' if db.is_postgres else '?'
+        self.stats = {'captured': 0, 'written': 0, 'flushes': 0}
+
+        self._buffer: List[tuple] = []
+        self._lock = threading.Lock()
+        self._init_tables()
+
+    def _init_tables(self):
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        self.db.execute_query(f"""
+            CREATE TABLE IF NOT EXISTS order_changes (
+                id {id_column},
+                order_id INTEGER,
+                field_name TEXT,
+                old_value TEXT,
+                new_value TEXT,
+                change_source TEXT,
+                change_type TEXT,
+                change_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                change_details TEXT
+            )
+        """)
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_order_changes_order_id ON order_changes(order_id)"
+        )
+
+    def capture(self, order_id: Optional[int], old: Optional[Dict[str, Any]], new: Dict[str, Any],
+                source: Optional[str] = None, details: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Фиксация изменений одного заказа
+
+        Args:
+            order_id: id заказа после записи
+            old: Строка заказа до записи (None - заказ создается)
+            new: Записываемые значения (None не перезаписывает поле и не журналируется)
+            source: Файл/процесс, внесший изменение
+            details: Дополнительные данные в change_details
+
+        Returns:
+            int: Количество строк журнала
+        """
+        change_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        details_json = json.dumps(details, ensure_ascii=False, default=str) if details else None
+        rows = []
+
+        if old is None:
+            values = {field: self._normalize(value) for field, value in new.items()
+                      if value is not None and field not in self.IGNORED_FIELDS}
+            rows.append((order_id, None, None, json.dumps(values, ensure_ascii=False),
+                         source, 'create', change_time, details_json))
+        else:
+            for field, value in new.items():
+                if value is None or field in self.IGNORED_FIELDS:
+                    continue
+                old_value = old.get(field)
+                if old_value == value:
+                    continue
+                old_value, new_value = self._normalize(old_value), self._normalize(value)
+                if old_value != new_value:
+                    rows.append((order_id, field, old_value, new_value,
+                                 source, 'update', change_time, details_json))
+
+        if not rows:
+            return 0
+
+        with self._lock:
+            self._buffer.extend(rows)
+            self.stats['captured'] += len(rows)
+            should_flush = len(self._buffer) >= self.flush_size
+
+        if should_flush:
+            self.flush()
+        return len(rows)
+
+    @pipeline_metrics.timed('write')
+    def flush(self) -> int:
+        """Запись буфера одним executemany"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+
+        p = self.placeholder
+        written = self.db.execute_many(f"""
+            INSERT INTO order_changes
+            (order_id, field_name, old_value, new_value, change_source, change_type, change_time, change_details)
+            VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})
+        """, rows)
+        if written is None:
+            print("Error writing order changes")
+            return 0
+
+        self.stats['written'] += len(rows)
+        self.stats['flushes'] += 1
+        return len(rows)
+
+    def fetch_orders_by_key(self, keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+        """
+        Текущие строки заказов по (order_number, machine_code) для сравнения в памяти
+        Читаются пачками по PREFETCH_CHUNK номеров, а не запросом на каждый заказ
+        """
+        keys = list({(str(number), str(machine)) for number, machine in keys})
+        existing = {}
+        p = self.placeholder
+
+        for start in range(0, len(keys), self.PREFETCH_CHUNK):
+            chunk = set(keys[start:start + self.PREFETCH_CHUNK])
+            numbers = sorted({number for number, _ in chunk})
+            rows = self.db.execute_query(
+                f"SELECT * FROM orders WHERE order_number IN ({', '.join([p] * len(numbers))})",
+                tuple(numbers)
+            )
+            for row in rows:
+                key = (str(row.get('order_number')), str(row.get('machine_code')))
+                if key in chunk:
+                    existing[key] = row
+        return existing
+
+    def get_history(self, order_id: int) -> List[Dict[str, Any]]:
+        """История изменений заказа (с учетом еще не записанного буфера)"""
+        self.flush()
+        p = self.placeholder
+        return self.db.execute_query(f"""
+            SELECT field_name, old_value, new_value, change_source, change_type, change_time, change_details
+            FROM order_changes
+            WHERE order_id = {p}
+            ORDER BY id
+        """, (order_id,))
+
+    @staticmethod
+    def _normalize(value) -> Optional[str]:
+        """Единое текстовое представление: 1 == True == 1.0, datetime == строка SQLite"""
+        if value is None or type(value) is str:
+            return value
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float, Decimal)):
+            return str(round(float(value), 6))
+        if isinstance(value, datetime):
+            return value.isoformat(sep=' ')
+        if isinstance(value, date):
+            return value.isoformat()
+        return str(value)
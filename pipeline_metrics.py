@@ -0,0 +1,338 @@
+"""
+VHM24R - Метрики конвейера загрузки
+Таймеры и счетчики по этапам (read, detect, parse, match, write), число и время
+запросов к БД, сводка сессии загрузки в processing_logs и вывод в формате Prometheus.
+Значения накапливаются в памяти процесса (у каждого воркера gunicorn - свои)
+"""
+
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from memory_tracing import MemoryTracer
+
+STAGES = ('read', 'detect', 'parse', 'match', 'write')
+
+
+def _empty_stage() -> Dict[str, float]:
+    return {'calls': 0, 'seconds': 0.0, 'rows': 0, 'db_queries': 0, 'db_seconds': 0.0}
+
+
+def _empty_db() -> Dict[str, float]:
+    return {'queries': 0, 'seconds': 0.0, 'errors': 0}
+
+
+class _StageTimer:
+    """
+    Таймер этапа. Время вложенного этапа вычитается из внешнего, поэтому сумма
+    секунд по этапам равна общему времени, а не больше его
+    """
+
+    __slots__ = ('metrics', 'name', 'child_seconds', 'start', 'memory')
+
+    def __init__(self, metrics: 'PipelineMetrics', name: str):
+        self.metrics = metrics
+        self.name = name
+        self.child_seconds = 0.0
+        self.start = 0.0
+        self.memory = None
+
+    def __enter__(self):
+        session = getattr(self.metrics._local, 'session', None)
+        self.memory = session.memory if session is not None else None
+        if self.memory is not None:
+            self.memory.enter(self.name)
+        self.metrics._stack().append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        stack = self.metrics._stack()
+        stack.pop()
+        if stack:
+            stack[-1].child_seconds += elapsed
+        self.metrics._add(self.name, calls=1, seconds=elapsed - self.child_seconds)
+        if self.memory is not None:
+            self.memory.exit(self.name)
+        return False
+
+
+class PipelineSession:
+    """Метрики одной сессии загрузки (все файлы одного запроса)"""
+
+    def __init__(self, session_id: str, profile: bool = False, memory: Optional[MemoryTracer] = None):
+        self.session_id = session_id
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.db = _empty_db()
+        self.profiler = cProfile.Profile() if profile else None
+        self.profile_path: Optional[str] = None
+        self.memory = memory
+        self.memory_profile_path: Optional[str] = None
+        self.started = time.perf_counter()
+        self.elapsed: Optional[float] = None
+
+    def summary(self) -> Dict[str, Any]:
+        """Сводка для processing_logs: секунды, строки и строк/с по этапам, запросы к БД"""
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        stages = {}
+        for name, values in self.stages.items():
+            stage = {key: (round(value, 6) if isinstance(value, float) else value) for key, value in values.items()}
+            if values['rows'] and values['seconds'] > 0:
+                stage['rows_per_second'] = round(values['rows'] / values['seconds'], 1)
+            stages[name] = stage
+
+        summary = {
+            'session_id': self.session_id,
+            'elapsed_seconds': round(elapsed, 6),
+            'stages': stages,
+            'db': {key: (round(value, 6) if isinstance(value, float) else value) for key, value in self.db.items()}
+        }
+        if self.profile_path:
+            summary['profile_path'] = self.profile_path
+        if self.memory is not None:
+            summary['memory'] = self.memory.summary()
+            if self.memory_profile_path:
+                summary['memory']['profile_path'] = self.memory_profile_path
+        return summary
+
+
+class PipelineMetrics:
+    """
+    Реестр метрик процесса
+
+    - stage(name) / timed(name): время этапа и число вызовов
+    - add_rows(name, rows): обработанные строки этапа
+    - record_query(seconds): запрос к БД, относится к текущему этапу потока
+    - start_session() / finish_session(): сводка сессии в processing_logs и,
+      по желанию, дамп cProfile (PIPELINE_PROFILE=1, каталог PIPELINE_PROFILE_DIR)
+      и профиль памяти по этапам (PIPELINE_MEMORY=1, см. memory_tracing)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stages: Dict[str, Dict[str, float]] = {name: _empty_stage() for name in STAGES}
+            self.db = _empty_db()
+            self.sessions = 0
+            self.last_session: Dict[str, Any] = {}
+
+    # ========================================================================
+    # ЭТАПЫ И ЗАПРОСЫ
+    # ========================================================================
+
+    def stage(self, name: str) -> _StageTimer:
+        """Контекстный менеджер этапа: with pipeline_metrics.stage('read'): ..."""
+        return _StageTimer(self, name)
+
+    def timed(self, name: str):
+        """Декоратор: весь вызов метода относится к этапу name"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with _StageTimer(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_rows(self, name: str, rows: int):
+        if rows:
+            self._add(name, rows=rows)
+
+    def record_query(self, seconds: float, failed: bool = False):
+        """Запрос через Database (execute_query/execute_insert/execute_many; время - полный круг до БД и обратно)"""
+        stack = self._stack()
+        stage = stack[-1].name if stack else None
+        session = getattr(self._local, 'session', None)
+
+        with self._lock:
+            self.db['queries'] += 1
+            self.db['seconds'] += seconds
+            if failed:
+                self.db['errors'] += 1
+            if stage:
+                values = self.stages.setdefault(stage, _empty_stage())
+                values['db_queries'] += 1
+                values['db_seconds'] += seconds
+
+        if session is not None:
+            session.db['queries'] += 1
+            session.db['seconds'] += seconds
+            if failed:
+                session.db['errors'] += 1
+            if stage:
+                values = session.stages.setdefault(stage, _empty_stage())
+                values['db_queries'] += 1
+                values['db_seconds'] += seconds
+
+    # ========================================================================
+    # СЕССИИ
+    # ========================================================================
+
+    def start_session(self, session_id: str, profile: Optional[bool] = None, memory: Optional[bool] = None,
+                      memory_budget_mb: Optional[float] = None) -> PipelineSession:
+        """Начало сессии в текущем потоке"""
+        if profile is None:
+            profile = os.environ.get('PIPELINE_PROFILE', '').lower() in ('1', 'true', 'yes')
+        if memory is None:
+            memory = os.environ.get('PIPELINE_MEMORY', '').lower() in ('1', 'true', 'yes')
+        tracer = MemoryTracer(budget_mb=memory_budget_mb) if memory else None
+        session = PipelineSession(session_id, profile=profile, memory=tracer)
+        self._local.session = session
+        if tracer is not None:
+            tracer.start()
+        if session.profiler:
+            session.profiler.enable()
+        return session
+
+    def finish_session(self, session: PipelineSession, db=None) -> Dict[str, Any]:
+        """
+        Завершение сессии: дамп профиля и запись сводки в processing_logs
+
+        Returns:
+            Dict: Сводка сессии
+        """
+        if session.elapsed is not None:
+            return session.summary()
+        if getattr(self._local, 'session', None) is session:
+            self._local.session = None
+        session.elapsed = time.perf_counter() - session.started
+
+        profile_dir = os.environ.get('PIPELINE_PROFILE_DIR', 'profiles')
+        if session.profiler:
+            session.profiler.disable()
+            try:
+                os.makedirs(profile_dir, exist_ok=True)
+                session.profile_path = os.path.join(profile_dir, f"{session.session_id}.prof")
+                session.profiler.dump_stats(session.profile_path)
+            except Exception as e:
+                print(f"Error saving pipeline profile: {e}")
+
+        if session.memory is not None:
+            session.memory.stop()
+            try:
+                os.makedirs(profile_dir, exist_ok=True)
+                session.memory_profile_path = os.path.join(profile_dir, f"{session.session_id}.memory.json")
+                with open(session.memory_profile_path, 'w', encoding='utf-8') as f:
+                    json.dump(session.memory.summary(), f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                print(f"Error saving memory profile: {e}")
+
+        summary = session.summary()
+        with self._lock:
+            self.sessions += 1
+            self.last_session = summary
+
+        exceeded = summary.get('memory', {}).get('exceeded')
+        if exceeded:
+            print(f"Memory budget exceeded in session {session.session_id}: "
+                  + ', '.join(f"{item['stage']} +{item['rss_growth_mb']} MB" for item in exceeded))
+
+        if db is not None:
+            db.log_processing_event(session.session_id, 'INFO', 'Pipeline metrics', summary)
+            if exceeded:
+                db.log_processing_event(session.session_id, 'WARNING', 'Memory budget exceeded',
+                                        {'exceeded': exceeded})
+        return summary
+
+    @contextmanager
+    def session(self, session_id: str, db=None, profile: Optional[bool] = None, memory: Optional[bool] = None,
+                memory_budget_mb: Optional[float] = None):
+        """Сессия как контекстный менеджер (скрипты, тесты)"""
+        session = self.start_session(session_id, profile=profile, memory=memory, memory_budget_mb=memory_budget_mb)
+        try:
+            yield session
+        finally:
+            self.finish_session(session, db)
+
+    # ========================================================================
+    # ЭКСПОРТ
+    # ========================================================================
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'stages': {name: dict(values) for name, values in self.stages.items()},
+                'db': dict(self.db),
+                'sessions': self.sessions,
+                'last_session': self.last_session
+            }
+
+    def render_prometheus(self, prefix: str = 'vhm24r') -> str:
+        """Метрики в текстовом формате Prometheus (version 0.0.4)"""
+        data = self.snapshot()
+        stages = data['stages']
+        lines: List[str] = []
+
+        def metric(name: str, metric_type: str, help_text: str, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{self._escape(str(val))}"' for key, val in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}" if label_text
+                             else f"{prefix}_{name} {value}")
+
+        stage_names = sorted(stages)
+        metric('stage_calls_total', 'counter', 'Pipeline stage invocations',
+               [({'stage': name}, stages[name]['calls']) for name in stage_names])
+        metric('stage_seconds_total', 'counter', 'Time spent in pipeline stage excluding nested stages',
+               [({'stage': name}, round(stages[name]['seconds'], 6)) for name in stage_names])
+        metric('stage_rows_total', 'counter', 'Rows processed by pipeline stage',
+               [({'stage': name}, stages[name]['rows']) for name in stage_names])
+        metric('stage_db_queries_total', 'counter', 'Database queries issued within pipeline stage',
+               [({'stage': name}, stages[name]['db_queries']) for name in stage_names])
+        metric('stage_db_seconds_total', 'counter', 'Database round-trip time within pipeline stage',
+               [({'stage': name}, round(stages[name]['db_seconds'], 6)) for name in stage_names])
+        metric('db_queries_total', 'counter', 'Database queries via execute_query', [({}, data['db']['queries'])])
+        metric('db_query_seconds_total', 'counter', 'Database round-trip time via execute_query',
+               [({}, round(data['db']['seconds'], 6))])
+        metric('db_query_errors_total', 'counter', 'Failed database queries', [({}, data['db']['errors'])])
+        metric('upload_sessions_total', 'counter', 'Completed upload sessions', [({}, data['sessions'])])
+
+        last_stages = data['last_session'].get('stages', {})
+        metric('last_session_rows_per_second', 'gauge', 'Rows per second by stage in the last upload session',
+               [({'stage': name}, last_stages[name]['rows_per_second'])
+                for name in sorted(last_stages) if 'rows_per_second' in last_stages[name]])
+        if data['last_session']:
+            metric('last_session_seconds', 'gauge', 'Duration of the last upload session',
+                   [({}, data['last_session']['elapsed_seconds'])])
+
+        return '\n'.join(lines) + '\n'
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _stack(self) -> List[_StageTimer]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _add(self, name: str, **values):
+        session = getattr(self._local, 'session', None)
+        with self._lock:
+            stage = self.stages.setdefault(name, _empty_stage())
+            for key, value in values.items():
+                stage[key] += value
+        if session is not None:
+            stage = session.stages.setdefault(name, _empty_stage())
+            for key, value in values.items():
+                stage[key] += value
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Общий реестр процесса
+pipeline_metrics = PipelineMetrics()
@@ -3,12 +3,18 @@ VHM24R - Интеллектуальный модуль сверки заказо
 Оптимизированные процессоры с логикой согласно промту
 """
 
+import hashlib
 import pandas as pd
 import json
 from datetime import datetime, timedelta
 import re
 from typing import Dict, List, Optional, Any, Tuple
 
+from bank_parser import BankStatementParser
+from cash_ledger import CashBalanceTracker
+from config_service import get_config_service
+from order_audit import OrderChangeLog
+
 class OrderProcessor:
     """
     Основной процессор сверки заказов с логикой из промта:
@@ -21,6 +27,8 @@ class OrderProcessor:
     def __init__(self, db):
         self.db = db
         self.config = self._load_config()
+        self.cash_balances = CashBalanceTracker(db)
+        self.change_log = OrderChangeLog(db)
         
         # Настройки временных окон из промта
         self.time_window = 3  # ±3 минуты для основного сопоставления
@@ -28,12 +36,11 @@ class OrderProcessor:
         self.gateway_time_window = 10  # ±10 минут для платежных шлюзов
         self.price_tolerance = 1  # ±1 сум допустимое расхождение
     
-    def _load_config(self) -> Dict[str, str]:
-        """Загрузка конфигурации"""
+    def _load_config(self) -> Dict[str, Any]:
+        """Загрузка конфигурации (общий кэш system_config)"""
         try:
-            config_data = self.db.execute_query("SELECT config_key, config_value FROM system_config")
-            return {item['config_key']: item['config_value'] for item in config_data}
-        except:
+            return get_config_service(self.db).snapshot()
+        except Exception:
             return {}
     
     def process_file(self, file_path: str, file_type: str) -> int:
@@ -70,6 +77,7 @@ class OrderProcessor:
                 print("No recognizable HW columns found")
                 return 0
             
+            orders = []
             for _, row in df.iterrows():
                 order_number = str(row.get(column_mapping.get('order_number', ''), ''))
                 if not order_number or order_number == 'nan':
@@ -96,10 +104,9 @@ class OrderProcessor:
                     'hw_data': row.to_dict(),
                     'error_type': 'UNPROCESSED'
                 }
-                
-                self.db.upsert_order(order_data)
-                processed += 1
+                orders.append(order_data)
             
+            processed = self._upsert_orders(orders, 'happy_workers')
             print(f"Processed {processed} HW records")
             return processed
             
@@ -124,6 +131,7 @@ class OrderProcessor:
                 print("No recognizable VendHub columns found")
                 return 0
             
+            orders = []
             for _, row in df.iterrows():
                 order_number = str(row.get(column_mapping.get('order_number', ''), ''))
                 if not order_number or order_number == 'nan':
@@ -139,10 +147,9 @@ class OrderProcessor:
                     'vendhub_data': row.to_dict(),
                     'error_type': 'UNPROCESSED'
                 }
-                
-                self.db.upsert_order(order_data)
-                processed += 1
+                orders.append(order_data)
             
+            processed = self._upsert_orders(orders, 'vendhub')
             print(f"Processed {processed} VendHub records")
             return processed
             
@@ -150,6 +157,23 @@ class OrderProcessor:
             print(f"Error processing VendHub file: {e}")
             return 0
     
+    def _upsert_orders(self, orders: List[Dict[str, Any]], source: str) -> int:
+        """
+        Запись заказов файла с журналом изменений: текущие строки читаются пачками,
+        различия считаются в памяти, журнал пишется одним executemany в конце файла
+        """
+        existing = self.change_log.fetch_orders_by_key(
+            (order['order_number'], order['machine_code']) for order in orders
+        )
+        
+        for order_data in orders:
+            old = existing.get((order_data['order_number'], order_data['machine_code']))
+            order_id = self.db.upsert_order(order_data)
+            self.change_log.capture(order_id, old, order_data, source)
+        
+        self.change_log.flush()
+        return len(orders)
+    
     def process_fiscal_file(self, file_path: str) -> int:
         """
         Обработка fiscal_bills.xlsx - фискальные чеки
@@ -311,6 +335,11 @@ class OrderProcessor:
         hw_order = self.db.execute_query("SELECT * FROM orders WHERE id = ?", (hw_order_id,))[0]
         vendhub_order = self.db.execute_query("SELECT * FROM orders WHERE id = ?", (vendhub_order_id,))[0]
         
+        # Уже учтенные в кассе заказы будут классифицированы заново
+        for order in (hw_order, vendhub_order):
+            if CashBalanceTracker.is_cash_order(order):
+                self.cash_balances.revert_cash_order(order['id'])
+        
         # Объединяем данные в основной заказ (HW)
         merged_data = {
             'vendhub_data': vendhub_order['vendhub_data'],
@@ -341,6 +370,11 @@ class OrderProcessor:
             details = self._generate_error_details(order, error_type)
             
             self.db.update_order_error_type(order['id'], error_type, details)
+            
+            if CashBalanceTracker.is_cash_order({**order, 'error_type': error_type}):
+                self.cash_balances.apply_cash_order(
+                    order['id'], order['machine_code'], self._safe_float(order['order_price']), order.get('creation_time')
+                )
     
     def _determine_error_type(self, order: Dict[str, Any]) -> str:
         """
@@ -405,30 +439,33 @@ class OrderProcessor:
         time_start = fiscal_time - timedelta(minutes=self.fiscal_time_window)
         time_end = fiscal_time + timedelta(minutes=self.fiscal_time_window)
         
-        return self.db.execute_query("""
+        statement = self.db.query_builder.compile(('legacy_cash_orders_for_fiscal',), lambda builder: f"""
             SELECT * FROM orders 
             WHERE payment_type = 'Cash'
             AND creation_time BETWEEN ? AND ?
             AND ABS(order_price - ?) <= ?
             AND (matched_fiscal = FALSE OR matched_fiscal IS NULL)
-            ORDER BY ABS(julianday(creation_time) - julianday(?)) ASC
+            ORDER BY {builder.seconds_between('creation_time', '?')} ASC
             LIMIT 1
-        """, (time_start, time_end, amount, self.price_tolerance, fiscal_time))
+        """)
+        return self.db.query_builder.execute(statement, (time_start, time_end, amount, self.price_tolerance, fiscal_time))
     
     def _find_custom_payment_orders_for_gateway(self, transaction_time: datetime, amount: float) -> List[Dict]:
         """Поиск Custom payment заказов для платежного шлюза"""
         time_start = transaction_time - timedelta(minutes=self.gateway_time_window)
         time_end = transaction_time + timedelta(minutes=self.gateway_time_window)
         
-        return self.db.execute_query("""
+        statement = self.db.query_builder.compile(('legacy_custom_payment_orders_for_gateway',), lambda builder: f"""
             SELECT * FROM orders 
             WHERE payment_type = 'Custom payment'
             AND creation_time BETWEEN ? AND ?
             AND ABS(order_price - ?) <= ?
             AND (matched_payment = FALSE OR matched_payment IS NULL)
-            ORDER BY ABS(julianday(creation_time) - julianday(?)) ASC
+            ORDER BY {builder.seconds_between('creation_time', '?')} ASC
             LIMIT 1
-        """, (time_start, time_end, amount, self.price_tolerance, transaction_time))
+        """)
+        return self.db.query_builder.execute(
+            statement, (time_start, time_end, amount, self.price_tolerance, transaction_time))
     
     # ========================================================================
     # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
@@ -778,35 +815,33 @@ class RecipeProcessor:
 class FinanceProcessor:
     """Процессор финансовой сверки и инкассации"""
     
+    # Трекер кассовых остатков под схему заказов (таблицу cash_collections создает он же)
+    CASH_TRACKER = CashBalanceTracker
+    
     def __init__(self, db):
         self.db = db
         self._init_finance_tables()
+        self.cash_balances = self.CASH_TRACKER(db)
     
     def _init_finance_tables(self):
         """Инициализация финансовых таблиц"""
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
         tables = [
-            """CREATE TABLE IF NOT EXISTS bank_transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            f"""CREATE TABLE IF NOT EXISTS bank_transactions (
+                id {id_column},
                 transaction_date DATE,
                 transaction_time TIME,
                 amount DECIMAL(12,2),
                 description TEXT,
                 account_number TEXT,
                 transaction_type TEXT,
+                reference_number TEXT DEFAULT '',
+                row_key TEXT,
+                possible_duplicate BOOLEAN DEFAULT FALSE,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )""",
-            """CREATE TABLE IF NOT EXISTS cash_collections (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                machine_code TEXT,
-                collection_date DATE,
-                collection_time TIME,
-                collector_name TEXT,
-                amount_collected DECIMAL(10,2),
-                notes TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )""",
-            """CREATE TABLE IF NOT EXISTS reconciliation_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
+            f"""CREATE TABLE IF NOT EXISTS reconciliation_results (
+                id {id_column},
                 reconciliation_date DATE,
                 total_orders DECIMAL(12,2),
                 total_payments DECIMAL(12,2),
@@ -818,37 +853,223 @@ class FinanceProcessor:
         
         for table_sql in tables:
             self.db.execute_query(table_sql)
+        
+        self._ensure_bank_transactions_key()
+    
+    def _ensure_bank_transactions_key(self):
+        """
+        Уникальный индекс по ключу строки выписки row_key (см. _bank_row_key)
+        Для таблиц, созданных до появления ключа: добавляются колонки, ключи считаются
+        для существующих строк. Строки не удаляются: повторы одной и той же строки
+        получают разные ключи и помечаются possible_duplicate для ручной проверки
+        """
+        if self.db.is_postgres:
+            columns = self.db.execute_query(
+                "SELECT column_name AS name FROM information_schema.columns WHERE table_name = 'bank_transactions'"
+            )
+            index_exists = self.db.execute_query(
+                "SELECT 1 AS found FROM pg_indexes WHERE indexname = 'idx_bank_transactions_row_key'"
+            )
+        else:
+            columns = self.db.execute_query("SELECT name FROM pragma_table_info('bank_transactions')")
+            index_exists = self.db.execute_query(
+                "SELECT 1 AS found FROM sqlite_master WHERE type = 'index' AND name = 'idx_bank_transactions_row_key'"
+            )
+        
+        if index_exists:
+            return
+        
+        existing_columns = {column['name'] for column in columns}
+        for name, definition in [('reference_number', "TEXT DEFAULT ''"), ('row_key', 'TEXT'),
+                                 ('possible_duplicate', 'BOOLEAN DEFAULT FALSE')]:
+            if columns and name not in existing_columns:
+                self.db.execute_query(f"ALTER TABLE bank_transactions ADD COLUMN {name} {definition}")
+        
+        # Прежний ключ (счет, дата, сумма, референс) склеивал разные поступления без референса
+        self.db.execute_query("DROP INDEX IF EXISTS idx_bank_transactions_natural_key")
+        self.db.execute_query("UPDATE bank_transactions SET reference_number = '' WHERE reference_number IS NULL")
+        
+        rows = self.db.execute_query("""
+            SELECT id, account_number, transaction_date, transaction_time, amount, description, reference_number
+            FROM bank_transactions
+            WHERE row_key IS NULL
+            ORDER BY id
+        """)
+        if rows:
+            occurrences = {}
+            updates = []
+            for row in rows:
+                parts = (row['account_number'], row['transaction_date'], row['transaction_time'],
+                         row['amount'], row['description'], row['reference_number'])
+                occurrence = occurrences[parts] = occurrences.get(parts, -1) + 1
+                updates.append((self._bank_row_key(*parts, occurrence), occurrence > 0, row['id']))
+            
+            p = '%s' if self.db.is_postgres else '?'
+            cursor = self.db.connection.cursor()
+            try:
+                cursor.executemany(
+                    f"UPDATE bank_transactions SET row_key = {p}, possible_duplicate = {p} WHERE id = {p}", updates
+                )
+                self.db.connection.commit()
+            except Exception as e:
+                self.db.connection.rollback()
+                print(f"Error migrating bank transactions keys: {e}")
+                return
+            finally:
+                cursor.close()
+            
+            flagged = sum(1 for _, duplicate, _ in updates if duplicate)
+            if flagged:
+                print(f"Bank transactions: {flagged} possible duplicates flagged for review")
+        
+        self.db.execute_query("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_bank_transactions_row_key
+            ON bank_transactions (row_key)
+        """)
+        
+        if self.db.is_postgres:
+            self.db.connection.commit()
+    
+    @staticmethod
+    def _bank_row_key(account, transaction_date, transaction_time, amount, description, reference,
+                      occurrence: int = 0) -> str:
+        """
+        Ключ строки выписки: счет, дата и время, сумма, назначение и референс
+        occurrence - номер повтора такой же строки в выписке: одинаковые поступления
+        без референса (например, две выплаты Click одного размера за день) различаются
+        """
+        parts = [
+            '' if account is None else str(account),
+            '' if transaction_date is None else str(transaction_date)[:10],
+            '' if transaction_time is None else str(transaction_time),
+            f"{float(amount or 0):.2f}",
+            '' if description is None else str(description),
+            '' if reference is None else str(reference),
+            str(occurrence)
+        ]
+        return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
     
     def import_bank_statement(self, file_path):
-        """Импорт банковской выписки"""
+        """
+        Импорт банковской выписки
+        Строки вставляются одним пакетом в одной транзакции; уже загруженные ранее
+        (тот же ключ строки row_key) пропускаются уникальным индексом
+        
+        Returns:
+            Dict: inserted - добавлено строк, skipped - пропущено дублей, total - строк к загрузке
+        """
         try:
             df = pd.read_excel(file_path) if file_path.endswith('.xlsx') else pd.read_csv(file_path)
-            processed = 0
+            records = self._bank_statement_records(df)
             
-            for _, row in df.iterrows():
-                # Базовая обработка банковской выписки
-                transaction_data = {
-                    'transaction_date': row.get('Date', ''),
-                    'amount': self._safe_float(row.get('Amount', 0)),
-                    'description': str(row.get('Description', '')),
-                    'account_number': str(row.get('Account', '')),
-                    'transaction_type': str(row.get('Type', ''))
-                }
-                
-                if transaction_data['amount'] > 0:
-                    self.db.execute_query("""
-                        INSERT INTO bank_transactions 
-                        (transaction_date, amount, description, account_number, transaction_type)
-                        VALUES (?, ?, ?, ?, ?)
-                    """, (transaction_data['transaction_date'], transaction_data['amount'],
-                         transaction_data['description'], transaction_data['account_number'],
-                         transaction_data['transaction_type']))
-                    processed += 1
+            inserted = self._insert_bank_transactions(records)
             
-            return processed
+            return {
+                'inserted': inserted,
+                'skipped': len(records) - inserted,
+                'total': len(records)
+            }
         except Exception as e:
             print(f"Error importing bank statement: {e}")
+            if self.db.is_postgres:
+                self.db.connection.rollback()
+            return {'inserted': 0, 'skipped': 0, 'total': 0, 'error': str(e)}
+    
+    def _bank_statement_records(self, df: pd.DataFrame) -> List[Tuple]:
+        """Строки выписки с положительной суммой в порядке колонок bank_transactions"""
+        if df.empty:
+            return []
+        
+        def column(name, default=''):
+            return df[name] if name in df.columns else pd.Series(default, index=df.index)
+        
+        def as_text(values: pd.Series) -> pd.Series:
+            # str(NaN) == 'nan' - как и при построчном str(row.get(...))
+            return values.map(str)
+        
+        def split_timestamp(value):
+            """Дата и время операции (время - только если указано в выписке)"""
+            if hasattr(value, 'strftime'):
+                has_time = (value.hour, value.minute, value.second) != (0, 0, 0)
+                return value.strftime('%Y-%m-%d'), value.strftime('%H:%M:%S') if has_time else None
+            if pd.isna(value):
+                return '', None
+            match = re.match(r'^(\d{4}-\d{2}-\d{2})[ T](\d{2}:\d{2}(?::\d{2})?)', str(value).strip())
+            if match:
+                return match.group(1), match.group(2)
+            return value, None
+        
+        amounts = column('Amount', 0).map(self._safe_float)
+        positive = amounts > 0
+        timestamps = column('Date').map(split_timestamp)
+        
+        frame = pd.DataFrame({
+            'transaction_date': timestamps.map(lambda parts: parts[0]),
+            'transaction_time': timestamps.map(lambda parts: parts[1]),
+            'amount': amounts.round(2),
+            'description': as_text(column('Description')),
+            'account_number': as_text(column('Account')),
+            'transaction_type': as_text(column('Type')),
+            'reference_number': column('Reference').map(lambda v: '' if pd.isna(v) else str(v).strip())
+        })[positive]
+        
+        if frame.empty:
+            return []
+        
+        # Повторы строки без референса внутри выписки нумеруются, с референсом - склеиваются
+        key_columns = ['account_number', 'transaction_date', 'transaction_time', 'amount',
+                       'description', 'reference_number']
+        occurrence = frame.fillna({'transaction_time': ''}).groupby(key_columns, sort=False).cumcount()
+        occurrence[frame['reference_number'] != ''] = 0
+        frame['row_key'] = [
+            self._bank_row_key(*values, occurrence_index)
+            for values, occurrence_index in zip(frame[key_columns].itertuples(index=False, name=None), occurrence)
+        ]
+        frame = frame.astype(object).where(frame.notna(), None)
+        
+        return list(frame.itertuples(index=False, name=None))
+    
+    def _insert_bank_transactions(self, records: List[Tuple]) -> int:
+        """Пакетная вставка с пропуском дублей; возвращает число добавленных строк"""
+        if not records:
             return 0
+        
+        columns = ("(transaction_date, transaction_time, amount, description, account_number, "
+                   "transaction_type, reference_number, row_key)")
+        
+        if self.db.is_postgres:
+            from psycopg2.extras import execute_values
+            
+            cursor = self.db.connection.cursor()
+            try:
+                inserted = execute_values(cursor, f"""
+                    INSERT INTO bank_transactions {columns} VALUES %s
+                    ON CONFLICT (row_key) DO NOTHING
+                    RETURNING id
+                """, records, page_size=1000, fetch=True)
+                self.db.connection.commit()
+                return len(inserted)
+            except Exception:
+                self.db.connection.rollback()
+                raise
+            finally:
+                cursor.close()
+        
+        cursor = self.db.connection.cursor()
+        try:
+            before = self.db.connection.total_changes
+            cursor.executemany(
+                f"INSERT OR IGNORE INTO bank_transactions {columns} VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                records
+            )
+            inserted = self.db.connection.total_changes - before
+            self.db.connection.commit()
+            return inserted
+        except Exception:
+            self.db.connection.rollback()
+            raise
+        finally:
+            cursor.close()
     
     def perform_reconciliation(self, start_date, end_date):
         """Выполнение сверки платежных систем"""
@@ -891,6 +1112,54 @@ class FinanceProcessor:
             print(f"Error in reconciliation: {e}")
             return {'error': str(e)}
     
+    def get_daily_settlement_totals(self, start_date, end_date) -> List[Dict[str, Any]]:
+        """
+        Дневные итоги заказов по платежным шлюзам (агрегат в БД, без выгрузки заказов)
+        Нетто-сумма рассчитывается по BankStatementParser.commission_rates
+        """
+        parser = BankStatementParser()
+        gateways = list(parser.commission_rates)
+        
+        def build(builder):
+            settlement_date = builder.date('COALESCE(paying_time, creation_time)')
+            return f"""
+                SELECT payment_gateway AS payment_system,
+                       {settlement_date} AS settlement_date,
+                       COUNT(*) AS orders_count,
+                       SUM(order_price) AS gross_amount
+                FROM orders
+                WHERE payment_gateway IN ({', '.join('?' for _ in gateways)})
+                AND order_price > 0
+                AND {settlement_date} BETWEEN ? AND ?
+                GROUP BY payment_gateway, {settlement_date}
+            """
+        
+        statement = self.db.query_builder.compile(('daily_settlement_totals', len(gateways)), build)
+        rows = self.db.query_builder.execute(statement, tuple(gateways) + (start_date, end_date))
+        for row in rows:
+            row['settlement_date'] = str(row['settlement_date'])
+        
+        return parser.with_net_amounts(rows)
+    
+    def reconcile_bank_settlements(self, transactions: List[Dict[str, Any]], start_date, end_date,
+                                   **options) -> Dict[str, Any]:
+        """
+        Сверка зачислений платежных систем из выписки с дневными итогами заказов
+        Окно итогов расширяется назад на задержку зачисления (max_lag_days)
+        """
+        try:
+            parser = BankStatementParser()
+            max_lag_days = options.get('max_lag_days', 3)
+            window_start = (datetime.strptime(str(start_date)[:10], '%Y-%m-%d')
+                            - timedelta(days=max_lag_days)).strftime('%Y-%m-%d')
+            
+            daily_totals = self.get_daily_settlement_totals(window_start, end_date)
+            return parser.reconcile_settlements(transactions, daily_totals, **options)
+            
+        except Exception as e:
+            print(f"Error in settlement reconciliation: {e}")
+            return {'error': str(e)}
+    
     def register_cash_collection(self, data):
         """Регистрация инкассации наличных"""
         try:
@@ -905,30 +1174,63 @@ class FinanceProcessor:
             if self.db.is_postgres:
                 query += " RETURNING id"
                 result = self.db.execute_query(query, params)
-                return result[0]['id'] if result else None
+                collection_id = result[0]['id'] if result else None
             else:
                 cursor = self.db.connection.cursor()
                 cursor.execute(query, params)
                 collection_id = cursor.lastrowid
                 self.db.connection.commit()
                 cursor.close()
-                return collection_id
+            
+            if collection_id is not None:
+                self.cash_balances.apply_collection(
+                    collection_id, data['machine_code'], self._safe_float(data['amount_collected']),
+                    data['collection_date'], data.get('collection_time')
+                )
+            return collection_id
                 
         except Exception as e:
             print(f"Error registering cash collection: {e}")
             return None
     
     def get_machines_cash_status(self):
-        """Получение состояния касс автоматов"""
-        return self.db.execute_query("""
-            SELECT machine_code, 
-                   SUM(CASE WHEN payment_type = 'Cash' AND error_type = 'OK' THEN order_price ELSE 0 END) as cash_amount,
-                   MAX(creation_time) as last_order_time
-            FROM orders 
-            WHERE creation_time >= date('now', '-7 days')
-            GROUP BY machine_code
-            ORDER BY cash_amount DESC
-        """)
+        """
+        Получение состояния касс автоматов
+        Остатки берутся из machine_cash_balances, которая обновляется по событиям
+        """
+        today = datetime.now().date()
+        status = []
+        
+        for row in self.get_cash_balances():
+            last_collection = self._parse_collection_date(row.get('last_collection_date'))
+            days_since_collection = (today - last_collection).days if last_collection else None
+            balance = self._safe_float(row['balance'])
+            
+            status.append({
+                **row,
+                'cash_amount': balance,
+                'estimated_balance': balance,
+                'days_since_collection': days_since_collection,
+                'needs_collection': balance > 0 and (days_since_collection is None or days_since_collection >= 7)
+            })
+        
+        return status
+    
+    def get_cash_balance_at(self, machine_code: str, moment) -> float:
+        """Кассовый остаток автомата на момент времени (по снимкам machine_cash_ledger)"""
+        return self.cash_balances.balance_at(machine_code, moment)
+    
+    def _parse_collection_date(self, value):
+        if not value:
+            return None
+        if isinstance(value, datetime):
+            return value.date()
+        if hasattr(value, 'year'):
+            return value
+        try:
+            return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+        except ValueError:
+            return None
     
     def get_recent_collections(self):
         """Получение последних инкассаций"""
@@ -939,27 +1241,28 @@ class FinanceProcessor:
         """)
     
     def get_cash_balances(self):
-        """Получение кассовых остатков по автоматам"""
-        return self.db.execute_query("""
-            SELECT o.machine_code,
-                   SUM(CASE WHEN o.payment_type = 'Cash' AND o.error_type = 'OK' THEN o.order_price ELSE 0 END) as total_cash,
-                   COALESCE(SUM(c.amount_collected), 0) as collected_cash,
-                   (SUM(CASE WHEN o.payment_type = 'Cash' AND o.error_type = 'OK' THEN o.order_price ELSE 0 END) - COALESCE(SUM(c.amount_collected), 0)) as balance
-            FROM orders o
-            LEFT JOIN cash_collections c ON o.machine_code = c.machine_code
-            WHERE o.creation_time >= date('now', '-30 days')
-            GROUP BY o.machine_code
-            ORDER BY balance DESC
-        """)
+        """
+        Получение кассовых остатков по автоматам
+        Читается готовая таблица остатков (история заполняется при создании трекера)
+        """
+        return self.cash_balances.get_balances()
+    
+    def rebuild_cash_balances(self) -> int:
+        """Полный пересчет журнала и остатков (бэкфилл, ручные правки заказов или инкассаций)"""
+        return self.cash_balances.rebuild()
     
     def get_finance_stats(self):
         """Статистика финансового модуля"""
         bank_count = self.db.execute_query("SELECT COUNT(*) as count FROM bank_transactions")[0]['count']
         collections_count = self.db.execute_query("SELECT COUNT(*) as count FROM cash_collections")[0]['count']
+        possible_duplicates = self.db.execute_query(
+            "SELECT COUNT(*) as count FROM bank_transactions WHERE possible_duplicate = TRUE"
+        )[0]['count']
         
         return {
             'bank_transactions': bank_count,
-            'cash_collections': collections_count
+            'cash_collections': collections_count,
+            'bank_possible_duplicates': possible_duplicates
         }
     
     def get_financial_report(self, start_date, end_date):
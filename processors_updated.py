@@ -3,10 +3,19 @@ VHM24R - Обновленные процессоры согласно ТЗ
 Реализация правильной логики сопоставления заказов
 """
 
+import os
 import pandas as pd
 import json
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
+
+from assignment import assign_by_time
+from cash_ledger import MatchedCashBalanceTracker
+from config_service import get_config_service
+from conflict_detector import ConflictDetector
+from order_audit import OrderChangeLog
+from pipeline_metrics import pipeline_metrics
+from processors import FinanceProcessor as BaseFinanceProcessor
 
 class OrderProcessor:
     """
@@ -22,9 +31,24 @@ class OrderProcessor:
     def __init__(self, db):
         self.db = db
         
-        # Настройки временных окон согласно ТЗ (±1 минута для всех)
-        self.time_tolerance = 60  # секунд
-        self.amount_tolerance = 0.01  # сумм
+        # Временные окна и допуски из system_config (по ТЗ ±1 минута для всех),
+        # общий кэш с планировщиком, без запросов на каждую строку
+        self.config = get_config_service(db)
+        
+        # Режим сопоставления чеков/транзакций с заказами:
+        # optimal - назначение с минимальной суммой |Δt| по кластерам файла (см. assignment.py)
+        # greedy - каждая строка файла берет ближайший свободный заказ
+        self.assignment_mode = os.environ.get('MATCH_ASSIGNMENT_MODE', 'optimal')
+        
+        # Журнал изменений заказов (order_changes), источник - текущий файл/процесс
+        self.change_log = OrderChangeLog(db)
+        self.change_source = None
+        
+        # Конфликты между источниками (таблица conflicts)
+        self.conflict_detector = ConflictDetector(db)
+        
+        # Кассовые остатки автоматов: наличный заказ учитывается, когда становится fully_matched
+        self.cash_balances = MatchedCashBalanceTracker(db)
         
         # Статусы заказов согласно ТЗ
         self.ORDER_STATUSES = {
@@ -46,6 +70,27 @@ class OrderProcessor:
         # Маппинг колонок согласно ТЗ
         self.COLUMN_MAPPINGS = self._init_column_mappings()
     
+    @property
+    def time_tolerance(self) -> int:
+        """Общий допуск по времени, секунд"""
+        return self.config.get('time_tolerance_seconds')
+    
+    @property
+    def amount_tolerance(self) -> float:
+        return self.config.get('amount_tolerance')
+    
+    @property
+    def vendhub_time_window(self) -> int:
+        return self.config.get('hw_vendhub_time_window')
+    
+    @property
+    def fiscal_time_window(self) -> int:
+        return self.config.get('fiscal_time_window')
+    
+    @property
+    def gateway_time_window(self) -> int:
+        return self.config.get('gateway_time_window')
+    
     def _init_column_mappings(self) -> Dict[str, Dict[str, List[str]]]:
         """Инициализация маппинга колонок согласно ТЗ"""
         return {
@@ -137,19 +182,28 @@ class OrderProcessor:
     def process_file(self, file_path: str, file_type: str) -> int:
         """Обработка файла в зависимости от типа"""
         print(f"Processing {file_type} file: {file_path}")
+        self.change_source = file_type
+        self.config.refresh()
         
-        if file_type == 'happy_workers':
-            return self.process_hw_file(file_path)
-        elif file_type == 'vendhub':
-            return self.process_vendhub_file(file_path)
-        elif file_type == 'fiscal_bills':
-            return self.process_fiscal_file(file_path)
-        elif file_type in ['payme', 'click', 'uzum']:
-            return self.process_gateway_file(file_path, file_type)
-        else:
-            print(f"Unknown file type: {file_type}")
-            return 0
+        try:
+            if file_type == 'happy_workers':
+                processed = self.process_hw_file(file_path)
+            elif file_type == 'vendhub':
+                processed = self.process_vendhub_file(file_path)
+            elif file_type == 'fiscal_bills':
+                processed = self.process_fiscal_file(file_path)
+            elif file_type in ['payme', 'click', 'uzum']:
+                processed = self.process_gateway_file(file_path, file_type)
+            else:
+                print(f"Unknown file type: {file_type}")
+                return 0
+            pipeline_metrics.add_rows('parse', processed)
+            return processed
+        finally:
+            self.change_log.flush()
+            self.change_source = None
     
+    @pipeline_metrics.timed('parse')
     def process_hw_file(self, file_path: str) -> int:
         """
         ЭТАП 1: Создание основы из Happy Workers
@@ -168,6 +222,7 @@ class OrderProcessor:
                 print("No recognizable HW columns found")
                 return 0
             
+            orders = []
             for _, row in df.iterrows():
                 order_number = str(row.get(column_mapping.get('order_number', ''), ''))
                 if not order_number or order_number == 'nan':
@@ -208,8 +263,17 @@ class OrderProcessor:
                 
                 # Нормализуем тип платежа
                 order_data['payment_type'] = self._normalize_payment_type(order_data['order_resource'])
-                
-                self._insert_or_update_order(order_data)
+                orders.append(order_data)
+            
+            # Текущие версии заказов файла читаются пачками для журнала изменений
+            existing = self.change_log.fetch_orders_by_key(
+                (order['order_number'], order['machine_code']) for order in orders
+            )
+            
+            for order_data in orders:
+                self._insert_or_update_order(
+                    order_data, existing.get((order_data['order_number'], order_data['machine_code']))
+                )
                 processed += 1
             
             print(f"Processed {processed} HW records")
@@ -219,6 +283,7 @@ class OrderProcessor:
             print(f"Error processing HW file: {e}")
             return 0
     
+    @pipeline_metrics.timed('parse')
     def process_vendhub_file(self, file_path: str) -> int:
         """
         ЭТАП 2: Обогащение данными из VendHub
@@ -272,16 +337,17 @@ class OrderProcessor:
                                 'matched_sources': json.dumps(['happy_workers', 'vendhub'])
                             }
                             
-                            self._update_order(existing_order['id'], vendhub_data)
+                            self._update_order(existing_order['id'], vendhub_data, existing_order)
                             processed += 1
                         else:
                             # Расхождение в цене
                             self._log_mismatch(existing_order['id'], 'price_mismatch', 
-                                             f"HW price: {existing_order['order_price']}, VH price: {order_price}")
+                                             f"HW price: {existing_order['order_price']}, VH price: {order_price}",
+                                             existing_order)
                     else:
                         # Время вне окна
                         self._log_mismatch(existing_order['id'], 'time_out_of_range', 
-                                         f"VendHub time {event_time} outside HW window")
+                                         f"VendHub time {event_time} outside HW window", existing_order)
                 else:
                     # Создаем новый заказ только из VendHub
                     vendhub_order = {
@@ -306,6 +372,7 @@ class OrderProcessor:
             print(f"Error processing VendHub file: {e}")
             return 0
     
+    @pipeline_metrics.timed('parse')
     def process_fiscal_file(self, file_path: str) -> int:
         """
         ЭТАП 3: Добавление фискальных данных
@@ -323,35 +390,27 @@ class OrderProcessor:
                 print("No recognizable fiscal columns found")
                 return 0
             
+            events = []
             for _, row in df.iterrows():
                 fiscal_time = self._parse_datetime(row.get(column_mapping.get('fiscal_time', '')))
                 amount = self._safe_float(row.get(column_mapping.get('amount', ''), 0))
                 
                 if not fiscal_time or amount <= 0:
                     continue
+                events.append((fiscal_time, amount, row))
+            
+            assignments = self._assign_optimal(events, 'fiscal') if self.assignment_mode == 'optimal' else None
+            
+            for i, (fiscal_time, amount, row) in enumerate(events):
+                if assignments is not None:
+                    order, candidates = assignments[i]
+                else:
+                    # Ищем подходящие Cash заказы
+                    matching_orders = self._find_cash_orders_for_fiscal(fiscal_time, amount)
+                    order, candidates = (matching_orders[0] if matching_orders else None), []
                 
-                # Ищем подходящие Cash заказы
-                matching_orders = self._find_cash_orders_for_fiscal(fiscal_time, amount)
-                
-                if matching_orders:
-                    # Обновляем первый подходящий заказ
-                    order = matching_orders[0]
-                    fiscal_data = {
-                        'fiscal_time': fiscal_time,
-                        'fiscal_amount': amount,
-                        'fiscal_check_number': str(row.get(column_mapping.get('fiscal_check_number', ''), '')),
-                        'taxpayer_id': str(row.get(column_mapping.get('taxpayer_id', ''), '')),
-                        'cash_register_id': str(row.get(column_mapping.get('cash_register_id', ''), '')),
-                        'shift_number': self._safe_int(row.get(column_mapping.get('shift_number', ''), 0)),
-                        'receipt_type': str(row.get(column_mapping.get('receipt_type', ''), '')),
-                        'fiscal_matched': True
-                    }
-                    
-                    # Обновляем статус
-                    if order['match_status'] == 'matched':
-                        fiscal_data['match_status'] = 'fully_matched'
-                    
-                    self._update_order(order['id'], fiscal_data)
+                if order:
+                    self.apply_fiscal_match(order, fiscal_time, amount, row, column_mapping, candidates)
                     processed += 1
                 else:
                     # Сохраняем несопоставленную запись
@@ -364,6 +423,36 @@ class OrderProcessor:
             print(f"Error processing fiscal file: {e}")
             return 0
     
+    def apply_fiscal_match(self, order: Dict[str, Any], fiscal_time: datetime, amount: float,
+                           record, column_mapping: Optional[Dict[str, str]] = None,
+                           candidates: Optional[List[int]] = None):
+        """
+        Привязка фискального чека к Cash заказу
+        record - строка фискального файла (или сохраненная в unmatched_records)
+        candidates - id всех допустимых заказов для чека (сохраняются при неоднозначности)
+        """
+        if column_mapping is None:
+            column_mapping = self._map_columns(list(record.keys()), 'fiscal_bills') or {}
+        
+        fiscal_data = {
+            'fiscal_time': fiscal_time,
+            'fiscal_amount': amount,
+            'fiscal_check_number': str(record.get(column_mapping.get('fiscal_check_number', ''), '')),
+            'taxpayer_id': str(record.get(column_mapping.get('taxpayer_id', ''), '')),
+            'cash_register_id': str(record.get(column_mapping.get('cash_register_id', ''), '')),
+            'shift_number': self._safe_int(record.get(column_mapping.get('shift_number', ''), 0)),
+            'receipt_type': str(record.get(column_mapping.get('receipt_type', ''), '')),
+            'fiscal_matched': True,
+            'match_candidates': self._candidates_json(candidates)
+        }
+        
+        # Обновляем статус
+        if order['match_status'] == 'matched':
+            fiscal_data['match_status'] = 'fully_matched'
+        
+        self._update_order(order['id'], fiscal_data, order)
+    
+    @pipeline_metrics.timed('parse')
     def process_gateway_file(self, file_path: str, gateway_type: str) -> int:
         """
         ЭТАП 4: Добавление данных платежных шлюзов
@@ -381,26 +470,34 @@ class OrderProcessor:
                 print(f"No recognizable {gateway_type} columns found")
                 return 0
             
+            events = []
             for _, row in df.iterrows():
                 transaction_time = self._parse_datetime(row.get(column_mapping.get('transaction_time', '')))
                 amount = self._safe_float(row.get(column_mapping.get('amount', ''), 0))
                 
                 if not transaction_time or amount <= 0:
                     continue
+                events.append((transaction_time, amount, row))
+            
+            assignments = self._assign_optimal(events, 'gateway') if self.assignment_mode == 'optimal' else None
+            
+            for i, (transaction_time, amount, row) in enumerate(events):
+                if assignments is not None:
+                    order, candidates = assignments[i]
+                else:
+                    # Ищем подходящие Custom payment заказы
+                    matching_orders = self._find_custom_payment_orders_for_gateway(transaction_time, amount)
+                    order, candidates = (matching_orders[0] if matching_orders else None), []
                 
-                # Ищем подходящие Custom payment заказы
-                matching_orders = self._find_custom_payment_orders_for_gateway(transaction_time, amount)
-                
-                if matching_orders:
-                    # Обновляем первый подходящий заказ
-                    order = matching_orders[0]
+                if order:
                     gateway_data = {
                         'gateway_time': transaction_time,
                         'gateway_amount': amount,  # ПРЯМОЕ сравнение согласно ТЗ!
                         'payment_gateway': gateway_type,
                         'transaction_id': str(row.get(column_mapping.get('transaction_id', ''), '')),
                         'gateway_status': str(row.get(column_mapping.get('status', ''), '')),
-                        'gateway_matched': True
+                        'gateway_matched': True,
+                        'match_candidates': self._candidates_json(candidates)
                     }
                     
                     # Специфичные поля для каждого шлюза
@@ -435,7 +532,7 @@ class OrderProcessor:
                     if order['match_status'] == 'matched':
                         gateway_data['match_status'] = 'fully_matched'
                     
-                    self._update_order(order['id'], gateway_data)
+                    self._update_order(order['id'], gateway_data, order)
                     processed += 1
                 else:
                     # Создаем новый заказ только из шлюза
@@ -461,6 +558,7 @@ class OrderProcessor:
             print(f"Error processing {gateway_type} file: {e}")
             return 0
     
+    @pipeline_metrics.timed('match')
     def run_matching(self) -> Dict[str, int]:
         """
         ЭТАП 5: Финальная классификация и установка статусов
@@ -471,15 +569,13 @@ class OrderProcessor:
         try:
             # Получаем все заказы для финальной классификации
             orders = self.db.execute_query("SELECT * FROM orders")
+            pipeline_metrics.add_rows('match', len(orders))
             
+            self.change_source = 'matching'
             for order in orders:
-                final_status = self._determine_final_status(order)
-                details = self._generate_status_details(order, final_status)
-                
-                self._update_order(order['id'], {
-                    'match_status': final_status,
-                    'mismatch_details': details
-                })
+                self._classify_order(order)
+            self.change_log.flush()
+            self.change_source = None
             
             # Получаем финальную статистику
             stats = self._get_final_statistics()
@@ -491,6 +587,68 @@ class OrderProcessor:
             print(f"Error in final matching: {e}")
             return {'total': 0}
     
+    @pipeline_metrics.timed('match')
+    def run_incremental_matching(self, window_start, window_end, resume_after: Optional[Tuple] = None,
+                                 batch_size: int = 1000, on_batch=None) -> Dict[str, int]:
+        """
+        Классификация только заказов, измененных в окне [window_start, window_end) по updated_at
+        Правая граница исключается: собственные записи сверки получают updated_at >= window_end
+        и попадают только в следующее окно
+        
+        Заказы читаются пачками по ключу (updated_at, id). После каждой пачки вызывается
+        on_batch(checkpoint, scanned, updated), где checkpoint = (updated_at, id) последнего
+        заказа пачки: с него можно продолжить через resume_after после сбоя
+        """
+        checkpoint_time, checkpoint_id = resume_after or (window_start, 0)
+        totals = {'scanned': 0, 'updated': 0, 'batches': 0}
+        
+        while True:
+            orders = self.db.execute_query("""
+                SELECT * FROM orders
+                WHERE updated_at < ?
+                  AND (updated_at > ? OR (updated_at = ? AND id > ?))
+                ORDER BY updated_at, id
+                LIMIT ?
+            """, (window_end, checkpoint_time, checkpoint_time, checkpoint_id, batch_size))
+            
+            if not orders:
+                break
+            
+            self.change_source = 'incremental_matching'
+            batch_updated = sum(1 for order in orders if self._classify_order(order))
+            self.change_log.flush()
+            self.change_source = None
+            checkpoint_time, checkpoint_id = orders[-1]['updated_at'], orders[-1]['id']
+            
+            totals['scanned'] += len(orders)
+            totals['updated'] += batch_updated
+            totals['batches'] += 1
+            
+            if on_batch:
+                on_batch((checkpoint_time, checkpoint_id), len(orders), batch_updated)
+            
+            if len(orders) < batch_size:
+                break
+        
+        return totals
+    
+    def _classify_order(self, order: Dict[str, Any]) -> bool:
+        """
+        Установка финального статуса заказа
+        Запись выполняется только при изменении статуса, чтобы не сдвигать updated_at зря
+        """
+        final_status = self._determine_final_status(order)
+        details = self._generate_status_details(order, final_status)
+        
+        if order.get('match_status') == final_status and (order.get('mismatch_details') or '') == details:
+            return False
+        
+        self._update_order(order['id'], {
+            'match_status': final_status,
+            'mismatch_details': details
+        }, order)
+        return True
+    
     def _determine_final_status(self, order: Dict[str, Any]) -> str:
         """
         Определение финального статуса заказа согласно ТЗ
@@ -567,19 +725,24 @@ class OrderProcessor:
     # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
     # ========================================================================
     
+    @pipeline_metrics.timed('read')
     def _read_file(self, file_path: str) -> Optional[pd.DataFrame]:
         """Чтение файла с обработкой ошибок"""
         try:
             if file_path.endswith('.xlsx') or file_path.endswith('.xls'):
-                return pd.read_excel(file_path)
+                df = pd.read_excel(file_path)
             else:
                 # Пробуем разные кодировки для CSV
+                df = None
                 for encoding in ['utf-8', 'cp1251', 'windows-1251', 'iso-8859-1']:
                     try:
-                        return pd.read_csv(file_path, encoding=encoding)
+                        df = pd.read_csv(file_path, encoding=encoding)
+                        break
                     except UnicodeDecodeError:
                         continue
-                return None
+            if df is not None:
+                pipeline_metrics.add_rows('read', len(df))
+            return df
         except Exception as e:
             print(f"Error reading file {file_path}: {e}")
             return None
@@ -621,6 +784,12 @@ class OrderProcessor:
         
         return None
     
+    def _to_datetime(self, value) -> Optional[datetime]:
+        """Метка времени из БД (datetime в PostgreSQL, строка в SQLite)"""
+        if isinstance(value, datetime):
+            return value
+        return self._parse_datetime(str(value)[:19]) if value else None
+    
     def _safe_float(self, value) -> float:
         """Безопасное преобразование в float"""
         if pd.isna(value) or value is None or value == '':
@@ -659,8 +828,13 @@ class OrderProcessor:
         else:
             return 'Custom payment'  # По умолчанию
     
-    def _insert_or_update_order(self, order_data: Dict[str, Any]):
-        """Вставка или обновление заказа в БД"""
+    @pipeline_metrics.timed('write')
+    def _insert_or_update_order(self, order_data: Dict[str, Any],
+                                existing: Optional[Dict[str, Any]] = None) -> Optional[int]:
+        """
+        Вставка или обновление заказа в БД
+        existing - текущая строка заказа (если известна) для журнала изменений
+        """
         try:
             # Подготавливаем данные для вставки
             fields = []
@@ -679,35 +853,63 @@ class OrderProcessor:
             VALUES ({', '.join(placeholders)})
             """
             
-            self.db.execute_query(query, tuple(values))
+            order_id = self.db.execute_insert(query, tuple(values))
+            if order_id is None:
+                return None
+            
+            details = {'replaced_id': existing['id']} if existing and existing.get('id') != order_id else None
+            self.change_log.capture(order_id, existing, order_data, self.change_source, details)
+            # INSERT OR REPLACE заменяет строку целиком
+            self._sync_cash_ledger(order_id, existing, order_data)
+            return order_id
             
         except Exception as e:
             print(f"Error inserting/updating order: {e}")
+            return None
     
-    def _update_order(self, order_id: int, update_data: Dict[str, Any]):
-        """Обновление существующего заказа"""
+    @pipeline_metrics.timed('write')
+    def _update_order(self, order_id: int, update_data: Dict[str, Any],
+                      old_order: Optional[Dict[str, Any]] = None):
+        """
+        Обновление существующего заказа
+        old_order - строка заказа до обновления: изменения сравниваются с ней в памяти
+        """
         try:
-            set_clauses = []
-            values = []
-            
-            for key, value in update_data.items():
-                if value is not None:
-                    set_clauses.append(f"{key} = ?")
-                    values.append(value)
+            values = {key: value for key, value in update_data.items() if value is not None}
             
-            if set_clauses:
-                query = f"""
-                UPDATE orders 
-                SET {', '.join(set_clauses)}, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-                """
-                values.append(order_id)
+            if values:
+                if old_order is None:
+                    rows = self.db.execute_query("SELECT * FROM orders WHERE id = ?", (order_id,))
+                    old_order = rows[0] if rows else {}
                 
-                self.db.execute_query(query, tuple(values))
+                # UPDATE компилируется один раз на набор колонок
+                self.db.query_builder.update_row('orders', values, order_id)
+                self.change_log.capture(order_id, old_order, update_data, self.change_source)
+                self._sync_cash_ledger(order_id, old_order, {**old_order, **values})
             
         except Exception as e:
             print(f"Error updating order {order_id}: {e}")
     
+    def _sync_cash_ledger(self, order_id: Optional[int], old: Optional[Dict[str, Any]], new: Dict[str, Any]):
+        """
+        Учет заказа в кассе автомата по его состоянию до и после записи
+        Журнал меняется только при смене кассового состояния или суммы/автомата/времени
+        """
+        was_cash = bool(old) and self.cash_balances.is_cash_order(old)
+        is_cash = order_id is not None and self.cash_balances.is_cash_order(new)
+        if not was_cash and not is_cash:
+            return
+        if was_cash and is_cash and old.get('id') == order_id and all(
+                old.get(field) == new.get(field) for field in ('machine_code', 'order_price', 'creation_time')):
+            return
+        
+        if was_cash:
+            self.cash_balances.revert_cash_order(old.get('id', order_id))
+        if is_cash:
+            self.cash_balances.apply_cash_order(order_id, new.get('machine_code'),
+                                                self._safe_float(new.get('order_price')), new.get('creation_time'))
+    
+    @pipeline_metrics.timed('match')
     def _find_hw_order(self, order_number: str, machine_code: str) -> Optional[Dict[str, Any]]:
         """Поиск заказа Happy Workers по ключам"""
         try:
@@ -731,9 +933,9 @@ class OrderProcessor:
         Creation time ≤ Event time ≤ Delivery time (±1 мин)
         """
         try:
-            creation_time = hw_order.get('creation_time')
-            delivery_time = hw_order.get('delivery_time')
-            refund_time = hw_order.get('refund_time')
+            creation_time = self._to_datetime(hw_order.get('creation_time'))
+            delivery_time = self._to_datetime(hw_order.get('delivery_time'))
+            refund_time = self._to_datetime(hw_order.get('refund_time'))
             
             if not creation_time:
                 return False
@@ -745,8 +947,8 @@ class OrderProcessor:
                 end_time = creation_time + timedelta(minutes=10)
             
             # Проверяем с допуском ±1 минута
-            window_start = creation_time - timedelta(seconds=self.time_tolerance)
-            window_end = end_time + timedelta(seconds=self.time_tolerance)
+            window_start = creation_time - timedelta(seconds=self.vendhub_time_window)
+            window_end = end_time + timedelta(seconds=self.vendhub_time_window)
             
             return window_start <= event_time <= window_end
             
@@ -754,51 +956,107 @@ class OrderProcessor:
             print(f"Error validating VendHub time window: {e}")
             return False
     
+    @pipeline_metrics.timed('match')
+    def _assign_optimal(self, events: List[tuple], kind: str) -> List[Tuple[Optional[Dict[str, Any]], List[int]]]:
+        """
+        Оптимальное назначение строк файла (время, сумма, строка) свободным заказам
+        Returns:
+            List: Для каждой строки (заказ или None, id допустимых заказов)
+        """
+        if not events:
+            return []
+        
+        window = self.fiscal_time_window if kind == 'fiscal' else self.gateway_time_window
+        tolerance = timedelta(seconds=window)
+        event_times = [event[0] for event in events]
+        orders = self._find_orders_in_range(kind, min(event_times) - tolerance, max(event_times) + tolerance)
+        order_points = [(self._to_datetime(order['paying_time']), float(order['order_price'] or 0))
+                        for order in orders]
+        
+        assignments = assign_by_time([(event[0], event[1]) for event in events], order_points,
+                                     window, self.amount_tolerance)
+        return [(orders[a['order']] if a['order'] is not None else None,
+                 [orders[o]['id'] for o in a['candidates']]) for a in assignments]
+    
+    def _find_orders_in_range(self, kind: str, time_start: datetime, time_end: datetime) -> List[Dict[str, Any]]:
+        """Все свободные Cash (kind='fiscal') или Custom payment (kind='gateway') заказы в интервале"""
+        if kind == 'fiscal':
+            condition = """(order_resource = 'Cash payment' OR payment_type = 'Cash')
+            AND (fiscal_matched = 0 OR fiscal_matched IS NULL)"""
+        else:
+            condition = """(order_resource = 'Custom payment' OR payment_type IN ('Payme', 'Click', 'Uzum'))
+            AND (gateway_matched = 0 OR gateway_matched IS NULL)"""
+        
+        try:
+            query = f"""
+            SELECT * FROM orders 
+            WHERE {condition}
+            AND paying_time BETWEEN ? AND ?
+            ORDER BY paying_time, id
+            """
+            
+            return self.db.execute_query(query, (time_start, time_end))
+            
+        except Exception as e:
+            print(f"Error finding orders in range: {e}")
+            return []
+    
+    def _candidates_json(self, candidates: Optional[List[int]]) -> Optional[str]:
+        """match_candidates заполняется только при нескольких допустимых заказах"""
+        if candidates and len(candidates) > 1:
+            return json.dumps(candidates)
+        return None
+    
+    @pipeline_metrics.timed('match')
     def _find_cash_orders_for_fiscal(self, fiscal_time: datetime, amount: float) -> List[Dict[str, Any]]:
         """Поиск Cash заказов для фискального чека"""
         try:
-            time_start = fiscal_time - timedelta(seconds=self.time_tolerance)
-            time_end = fiscal_time + timedelta(seconds=self.time_tolerance)
+            time_start = fiscal_time - timedelta(seconds=self.fiscal_time_window)
+            time_end = fiscal_time + timedelta(seconds=self.fiscal_time_window)
             
-            query = """
+            statement = self.db.query_builder.compile(('cash_orders_for_fiscal',), lambda builder: f"""
             SELECT * FROM orders 
             WHERE (order_resource = 'Cash payment' OR payment_type = 'Cash')
             AND paying_time BETWEEN ? AND ?
             AND ABS(order_price - ?) <= ?
             AND (fiscal_matched = 0 OR fiscal_matched IS NULL)
-            ORDER BY ABS(julianday(paying_time) - julianday(?)) ASC
+            ORDER BY {builder.seconds_between('paying_time', '?')} ASC
             LIMIT 1
-            """
+            """)
             
-            return self.db.execute_query(query, (time_start, time_end, amount, self.amount_tolerance, fiscal_time))
+            return self.db.query_builder.execute(
+                statement, (time_start, time_end, amount, self.amount_tolerance, fiscal_time))
             
         except Exception as e:
             print(f"Error finding cash orders for fiscal: {e}")
             return []
     
+    @pipeline_metrics.timed('match')
     def _find_custom_payment_orders_for_gateway(self, transaction_time: datetime, amount: float) -> List[Dict[str, Any]]:
         """Поиск Custom payment заказов для платежного шлюза"""
         try:
-            time_start = transaction_time - timedelta(seconds=self.time_tolerance)
-            time_end = transaction_time + timedelta(seconds=self.time_tolerance)
+            time_start = transaction_time - timedelta(seconds=self.gateway_time_window)
+            time_end = transaction_time + timedelta(seconds=self.gateway_time_window)
             
-            query = """
+            statement = self.db.query_builder.compile(('custom_payment_orders_for_gateway',), lambda builder: f"""
             SELECT * FROM orders 
             WHERE (order_resource = 'Custom payment' OR payment_type IN ('Payme', 'Click', 'Uzum'))
             AND paying_time BETWEEN ? AND ?
             AND ABS(order_price - ?) <= ?
             AND (gateway_matched = 0 OR gateway_matched IS NULL)
-            ORDER BY ABS(julianday(paying_time) - julianday(?)) ASC
+            ORDER BY {builder.seconds_between('paying_time', '?')} ASC
             LIMIT 1
-            """
+            """)
             
-            return self.db.execute_query(query, (time_start, time_end, amount, self.amount_tolerance, transaction_time))
+            return self.db.query_builder.execute(
+                statement, (time_start, time_end, amount, self.amount_tolerance, transaction_time))
             
         except Exception as e:
             print(f"Error finding custom payment orders for gateway: {e}")
             return []
     
-    def _log_mismatch(self, order_id: int, mismatch_type: str, details: str):
+    def _log_mismatch(self, order_id: int, mismatch_type: str, details: str,
+                      order: Optional[Dict[str, Any]] = None):
         """Логирование несоответствия"""
         try:
             mismatch_data = {
@@ -806,11 +1064,20 @@ class OrderProcessor:
                 'mismatch_details': details
             }
             
-            self._update_order(order_id, mismatch_data)
+            self._update_order(order_id, mismatch_data, order)
+            
+            conflict_type = {'price_mismatch': 'amount_mismatch',
+                             'time_out_of_range': 'time_mismatch'}.get(mismatch_type)
+            if conflict_type:
+                self.conflict_detector.record(conflict_type, order_id, None, json.dumps({
+                    'details': details,
+                    'source': self.change_source
+                }, ensure_ascii=False))
             
         except Exception as e:
             print(f"Error logging mismatch: {e}")
     
+    @pipeline_metrics.timed('write')
     def _save_unmatched_record(self, record_type: str, record_data: Dict[str, Any], 
                               record_time: datetime, amount: float):
         """Сохранение несопоставленной записи"""
@@ -879,27 +1146,10 @@ class RecipeProcessor:
         }
 
 
-class FinanceProcessor:
-    """Процессор финансовой сверки и инкассации"""
-    
-    def __init__(self, db):
-        self.db = db
-    
-    def get_finance_stats(self):
-        """Статистика финансового модуля"""
-        return {
-            'bank_transactions': 0,
-            'cash_collections': 0
-        }
-    
-    def get_cash_balances(self):
-        """Получение кассовых остатков по автоматам"""
-        return []
-    
-    def get_machines_cash_status(self):
-        """Получение состояния касс автоматов"""
-        return []
+class FinanceProcessor(BaseFinanceProcessor):
+    """
+    Процессор финансовой сверки и инкассации
+    Кассовые остатки ведутся по схеме schema_final (см. MatchedCashBalanceTracker)
+    """
     
-    def get_recent_collections(self):
-        """Получение последних инкассаций"""
-        return []
+    CASH_TRACKER = MatchedCashBalanceTracker
@@ -0,0 +1,249 @@
+"""
+VHM24R - Построитель SQL запросов с кэшем скомпилированных выражений
+Запрос пишется один раз: плейсхолдеры ? и переносимые функции времени (seconds_between,
+days_ago, date_days_ago, date). Текст компилируется под диалект (SQLite/PostgreSQL) и
+кэшируется по ключу (диалект, вид запроса, таблица, набор колонок), поэтому горячие пути
+не собирают и не переписывают SQL на каждый вызов. В PostgreSQL скомпилированные запросы
+выполняются как серверные prepared statements (PREPARE/EXECUTE) - без повторного разбора
+"""
+
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class CompiledStatement:
+    """Запрос, скомпилированный под диалект"""
+
+    __slots__ = ('key', 'name', 'sql', 'prepared_sql', 'params_count', 'returns_rows', 'preparable')
+
+    def __init__(self, key: Tuple, name: str, sql: str, prepared_sql: str, params_count: int, returns_rows: bool):
+        self.key = key
+        self.name = name
+        self.sql = sql                      # для cursor.execute: ? (SQLite) или %s (psycopg2)
+        self.prepared_sql = prepared_sql    # для PREPARE: $1, $2, ...
+        self.params_count = params_count
+        self.returns_rows = returns_rows
+        self.preparable = True
+
+
+class QueryBuilder:
+    """
+    Кэш скомпилированных запросов одного подключения Database
+
+    - compile(key, build): build(builder) вызывается только при промахе кэша
+    - update()/update_row(): UPDATE по набору колонок (порядок колонок не важен)
+    - execute(): выполнение через Database.execute_query; в PostgreSQL - EXECUTE
+      подготовленного на сервере запроса (PG_PREPARED_STATEMENTS=0 отключает)
+    - Кэш ограничен MAX_STATEMENTS, вытесненные prepared statements освобождаются (DEALLOCATE)
+    """
+
+    MAX_STATEMENTS = 256
+
+    def __init__(self, db, prepare: Optional[bool] = None):
+        self.db = db
+        if prepare is None:
+            prepare = os.environ.get('PG_PREPARED_STATEMENTS', 'true').lower() not in ('0', 'false', 'no')
+        self.prepare = prepare
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[Tuple, CompiledStatement]' = OrderedDict()
+        self._counter = itertools.count(1)
+        self._prepared: set = set()
+        self._prepared_connection = None
+
+    @property
+    def dialect(self) -> str:
+        return 'postgresql' if self.db.is_postgres else 'sqlite'
+
+    # ========================================================================
+    # КОМПИЛЯЦИЯ
+    # ========================================================================
+
+    def compile(self, key: Sequence, build: Callable[['QueryBuilder'], str]) -> CompiledStatement:
+        """Скомпилированный запрос из кэша или build(self) при первом обращении"""
+        full_key = (self.dialect,) + tuple(key)
+        with self._lock:
+            statement = self._cache.get(full_key)
+            if statement is not None:
+                self._cache.move_to_end(full_key)
+                self.hits += 1
+                return statement
+            self.misses += 1
+
+        statement = self._compile_sql(full_key, build(self))
+
+        evicted = []
+        with self._lock:
+            self._cache[full_key] = statement
+            while len(self._cache) > self.MAX_STATEMENTS:
+                evicted.append(self._cache.popitem(last=False)[1])
+        for old in evicted:
+            self._deallocate(old)
+        return statement
+
+    def statement(self, sql: str) -> CompiledStatement:
+        """Готовый текст с плейсхолдерами ? (кэш по тексту)"""
+        return self.compile(('sql', sql), lambda builder: sql)
+
+    def update(self, table: str, columns: Iterable[str], where: Sequence[str] = ('id',),
+               touch: Optional[str] = 'updated_at') -> CompiledStatement:
+        """UPDATE table SET <columns> [, touch = CURRENT_TIMESTAMP] WHERE <where>; параметры - колонки, затем where"""
+        columns = tuple(columns)
+        where = tuple(where)
+
+        def build(builder):
+            self._check_identifiers(table, *columns, *where, *([touch] if touch else []))
+            assignments = [f"{column} = ?" for column in columns]
+            if touch:
+                assignments.append(f"{touch} = CURRENT_TIMESTAMP")
+            conditions = ' AND '.join(f"{column} = ?" for column in where)
+            return f"UPDATE {table} SET {', '.join(assignments)} WHERE {conditions}"
+
+        return self.compile(('update', table, columns, where, touch), build)
+
+    def update_row(self, table: str, values: Dict[str, Any], key_value: Any, key: str = 'id',
+                   touch: Optional[str] = 'updated_at') -> List[Dict]:
+        """Обновление одной строки: запрос кэшируется по набору колонок values"""
+        columns = tuple(sorted(values))
+        statement = self.update(table, columns, (key,), touch)
+        return self.execute(statement, [values[column] for column in columns] + [key_value])
+
+    # ========================================================================
+    # ВЫПОЛНЕНИЕ
+    # ========================================================================
+
+    def execute(self, statement: CompiledStatement, params: Sequence = ()) -> List[Dict]:
+        """Выполнение скомпилированного запроса (ошибки обрабатывает Database.execute_query)"""
+        params = tuple(params)
+        if self.db.is_postgres and self.prepare and statement.preparable and self._ensure_prepared(statement):
+            if params:
+                query = f"EXECUTE {statement.name} ({', '.join(['%s'] * len(params))})"
+            else:
+                query = f"EXECUTE {statement.name}"
+            return self.db.execute_query(query, params or None, fetch=statement.returns_rows)
+        return self.db.execute_query(statement.sql, params or None, fetch=statement.returns_rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'dialect': self.dialect,
+                'statements': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+                'prepared': len(self._prepared)
+            }
+
+    # ========================================================================
+    # ФУНКЦИИ ВРЕМЕНИ ПО ДИАЛЕКТАМ
+    # ========================================================================
+
+    def seconds_between(self, left: str, right: str) -> str:
+        """Модуль разницы двух меток времени в секундах"""
+        if self.db.is_postgres:
+            return f"ABS(EXTRACT(EPOCH FROM ({left} - CAST({right} AS TIMESTAMP))))"
+        return f"ABS(julianday({left}) - julianday({right})) * 86400"
+
+    def days_ago(self, days: int) -> str:
+        """Метка времени N дней назад"""
+        if self.db.is_postgres:
+            return f"CURRENT_TIMESTAMP - INTERVAL '{int(days)} days'"
+        return f"datetime('now', '-{int(days)} days')"
+
+    def date_days_ago(self, days: int) -> str:
+        """Дата (начало суток) N дней назад"""
+        if self.db.is_postgres:
+            return f"CURRENT_DATE - INTERVAL '{int(days)} days'"
+        return f"date('now', '-{int(days)} days')"
+
+    def date(self, expression: str) -> str:
+        """Дата без времени"""
+        if self.db.is_postgres:
+            return f"CAST({expression} AS DATE)"
+        return f"DATE({expression})"
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _compile_sql(self, key: Tuple, sql: str) -> CompiledStatement:
+        """Плейсхолдеры ? вне строковых литералов -> %s (psycopg2) и $N (PREPARE)"""
+        sql = sql.strip()
+        kind = key[1] if len(key) > 1 and isinstance(key[1], str) and _IDENTIFIER.match(key[1]) else 'sql'
+        name = f"qb_{kind}_{next(self._counter)}"
+        returns_rows = sql.upper().startswith(('SELECT', 'WITH')) or ' RETURNING ' in sql.upper()
+
+        if not self.db.is_postgres:
+            return CompiledStatement(key, name, sql, sql, sql.count('?'), returns_rows)
+
+        percent_parts, dollar_parts = [], []
+        count = 0
+        in_string = False
+        for char in sql:
+            if char == "'":
+                in_string = not in_string
+            if char == '?' and not in_string:
+                count += 1
+                percent_parts.append('%s')
+                dollar_parts.append(f"${count}")
+                continue
+            percent_parts.append('%%' if char == '%' else char)
+            dollar_parts.append(char)
+
+        percent_sql = ''.join(percent_parts) if count else sql
+        return CompiledStatement(key, name, percent_sql, ''.join(dollar_parts), count, returns_rows)
+
+    def _ensure_prepared(self, statement: CompiledStatement) -> bool:
+        """PREPARE при первом выполнении на текущем подключении"""
+        connection = self.db.connection
+        if connection is not self._prepared_connection:
+            self._prepared = set()
+            self._prepared_connection = connection
+        if statement.name in self._prepared:
+            return True
+
+        cursor = None
+        try:
+            cursor = connection.cursor()
+            # Ошибка PREPARE не должна обрывать текущую транзакцию
+            cursor.execute("SAVEPOINT query_builder_prepare")
+            cursor.execute(f"PREPARE {statement.name} AS {statement.prepared_sql}")
+            cursor.execute("RELEASE SAVEPOINT query_builder_prepare")
+            self._prepared.add(statement.name)
+            return True
+        except Exception as e:
+            if cursor is not None:
+                try:
+                    cursor.execute("ROLLBACK TO SAVEPOINT query_builder_prepare")
+                except Exception:
+                    pass
+            statement.preparable = False
+            print(f"Error preparing statement {statement.name}: {e}")
+            return False
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+    def _deallocate(self, statement: CompiledStatement):
+        if statement.name not in self._prepared or self.db.connection is not self._prepared_connection:
+            return
+        self._prepared.discard(statement.name)
+        try:
+            cursor = self.db.connection.cursor()
+            cursor.execute(f"DEALLOCATE {statement.name}")
+            cursor.close()
+        except Exception as e:
+            print(f"Error deallocating statement {statement.name}: {e}")
+
+    @staticmethod
+    def _check_identifiers(*names: str):
+        for name in names:
+            if not _IDENTIFIER.match(name):
+                raise ValueError(f"Invalid SQL identifier: {name!r}")
@@ -0,0 +1,221 @@
+"""
+VHM24R - Статистика SQL запросов
+Каждый запрос через Database.execute_query сводится к отпечатку (литералы и списки IN
+заменены на ?), по отпечатку копятся вызовы, время, p95 и строки. Медленные запросы
+попадают в журнал вместе с планом (EXPLAIN QUERY PLAN в SQLite, EXPLAIN в PostgreSQL)
+"""
+
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\$\d+|(?<!:):\w+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def fingerprint(query: str) -> str:
+    """Нормализованный текст запроса: одинаковые по форме запросы дают один отпечаток"""
+    text = _STRING_LITERAL.sub('?', query)
+    text = _NUMBER_LITERAL.sub('?', text)
+    text = _PLACEHOLDER.sub('?', text)
+    text = _WHITESPACE.sub(' ', text).strip()
+    text = _IN_LIST.sub('(...)', text)
+    return text
+
+
+class QueryObserver:
+    """
+    Наблюдатель запросов одного подключения
+
+    - record() вызывается из execute_query после каждого запроса
+    - По отпечатку: вызовы, ошибки, суммарное/максимальное время, строки,
+      p95 по последним LATENCY_SAMPLES замерам
+    - Запросы дольше SLOW_QUERY_MS (по умолчанию 200 мс) пишутся в журнал медленных
+      запросов; план одного отпечатка запрашивается не чаще раза в EXPLAIN_INTERVAL секунд
+    """
+
+    SLOW_QUERY_MS = 200
+    LATENCY_SAMPLES = 256
+    MAX_FINGERPRINTS = 500
+    SLOW_LOG_SIZE = 100
+    EXPLAIN_INTERVAL = 300
+    OVERFLOW_KEY = '<other>'
+
+    def __init__(self, db, slow_query_ms: Optional[float] = None):
+        self.db = db
+        if slow_query_ms is None:
+            slow_query_ms = float(os.environ.get('SLOW_QUERY_MS', self.SLOW_QUERY_MS))
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self.enabled = os.environ.get('QUERY_STATS', 'true').lower() not in ('0', 'false', 'no')
+
+        self._lock = threading.Lock()
+        self._fingerprints: Dict[str, str] = {}
+        self._explained: Dict[str, float] = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats: Dict[str, Dict[str, Any]] = {}
+            self.slow_log = deque(maxlen=self.SLOW_LOG_SIZE)
+            self.started_at = datetime.now()
+
+    def record(self, query: str, params, seconds: float, rows: int = 0, failed: bool = False):
+        """Учет одного выполненного запроса"""
+        if not self.enabled:
+            return
+
+        key = self._fingerprint(query)
+        with self._lock:
+            entry = self.stats.get(key)
+            if entry is None:
+                if len(self.stats) >= self.MAX_FINGERPRINTS:
+                    key = self.OVERFLOW_KEY
+                    entry = self.stats.get(key)
+                if entry is None:
+                    entry = self.stats[key] = {
+                        'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                        'rows': 0, 'slow': 0, 'samples': deque(maxlen=self.LATENCY_SAMPLES)
+                    }
+            entry['calls'] += 1
+            entry['total_seconds'] += seconds
+            entry['rows'] += rows
+            entry['samples'].append(seconds)
+            if seconds > entry['max_seconds']:
+                entry['max_seconds'] = seconds
+            if failed:
+                entry['errors'] += 1
+            slow = seconds >= self.slow_query_seconds and not failed
+            if slow:
+                entry['slow'] += 1
+
+        if slow:
+            self._log_slow(key, query, params, seconds, rows)
+
+    def top(self, sort: str = 'total_seconds', limit: int = 20) -> List[Dict[str, Any]]:
+        """Отпечатки, отсортированные по total_seconds, calls, p95_ms, rows или errors"""
+        with self._lock:
+            items = [(key, dict(entry, samples=list(entry['samples']))) for key, entry in self.stats.items()]
+
+        result = []
+        for key, entry in items:
+            samples = sorted(entry.pop('samples'))
+            calls = entry['calls']
+            result.append({
+                'fingerprint': key,
+                'calls': calls,
+                'errors': entry['errors'],
+                'slow': entry['slow'],
+                'rows': entry['rows'],
+                'total_seconds': round(entry['total_seconds'], 6),
+                'mean_ms': round(entry['total_seconds'] / calls * 1000, 3) if calls else 0,
+                'p95_ms': round(self._percentile(samples, 0.95) * 1000, 3),
+                'max_ms': round(entry['max_seconds'] * 1000, 3),
+            })
+
+        if sort not in ('total_seconds', 'calls', 'p95_ms', 'rows', 'errors', 'mean_ms', 'max_ms'):
+            sort = 'total_seconds'
+        result.sort(key=lambda item: item[sort], reverse=True)
+        return result[:limit]
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = sum(entry['calls'] for entry in self.stats.values())
+            total = sum(entry['total_seconds'] for entry in self.stats.values())
+            return {
+                'since': self.started_at.isoformat(),
+                'fingerprints': len(self.stats),
+                'calls': calls,
+                'total_seconds': round(total, 6),
+                'slow_query_ms': self.slow_query_seconds * 1000,
+                'slow_queries': len(self.slow_log)
+            }
+
+    def slow_queries(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Последние медленные запросы (новые первыми)"""
+        with self._lock:
+            return list(reversed(self.slow_log))[:limit]
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _fingerprint(self, query: str) -> str:
+        """Отпечатки кэшируются по исходному тексту: регулярные выражения не на каждый вызов"""
+        key = self._fingerprints.get(query)
+        if key is None:
+            key = fingerprint(query)
+            if len(self._fingerprints) >= self.MAX_FINGERPRINTS * 4:
+                self._fingerprints.clear()
+            self._fingerprints[query] = key
+        return key
+
+    def _log_slow(self, key: str, query: str, params, seconds: float, rows: int):
+        now = time.monotonic()
+        plan = None
+        if now - self._explained.get(key, -self.EXPLAIN_INTERVAL) >= self.EXPLAIN_INTERVAL:
+            self._explained[key] = now
+            plan = self._explain(query, params)
+
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'fingerprint': key,
+            'ms': round(seconds * 1000, 3),
+            'rows': rows,
+            'plan': plan
+        }
+        with self._lock:
+            self.slow_log.append(entry)
+
+        print(f"Slow query ({entry['ms']} ms, {rows} rows): {key}")
+        if plan:
+            print("Plan:\n  " + "\n  ".join(plan))
+
+    def _explain(self, query: str, params) -> Optional[List[str]]:
+        """План запроса; EXPLAIN без ANALYZE запрос не выполняет"""
+        statement = query.strip()
+        if not statement or statement.split(None, 1)[0].upper() not in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+            return None
+
+        prefix = 'EXPLAIN' if self.db.is_postgres else 'EXPLAIN QUERY PLAN'
+        cursor = None
+        try:
+            cursor = self.db.connection.cursor()
+            if self.db.is_postgres:
+                # Ошибка EXPLAIN не должна обрывать текущую транзакцию
+                cursor.execute("SAVEPOINT query_stats_explain")
+            if params:
+                cursor.execute(f"{prefix} {statement}", params)
+            else:
+                cursor.execute(f"{prefix} {statement}")
+            rows = [dict(row) for row in cursor.fetchall()]
+            if self.db.is_postgres:
+                cursor.execute("RELEASE SAVEPOINT query_stats_explain")
+        except Exception as e:
+            if self.db.is_postgres and cursor is not None:
+                try:
+                    cursor.execute("ROLLBACK TO SAVEPOINT query_stats_explain")
+                except Exception:
+                    pass
+            return [f"EXPLAIN failed: {e}"]
+        finally:
+            if cursor is not None:
+                cursor.close()
+
+        if self.db.is_postgres:
+            return [row.get('QUERY PLAN', str(row)) for row in rows]
+        return [row.get('detail', str(row)) for row in rows]
+
+    @staticmethod
+    def _percentile(samples: List[float], fraction: float) -> float:
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, max(0, math.ceil(fraction * len(samples)) - 1))
+        return samples[index]
@@ -9,6 +9,8 @@ from datetime import datetime
 import os
 import json
 
+from pipeline_metrics import pipeline_metrics
+
 class ReportsProcessor:
     """Процессор для работы с отчетами по типам"""
     
@@ -115,13 +117,16 @@ class ReportsProcessor:
             file_id = self._register_file(original_filename, file_type, file_path)
             
             # Читаем файл
-            if file_path.endswith('.xlsx'):
-                df = pd.read_excel(file_path)
-            else:
-                df = pd.read_csv(file_path, encoding='utf-8-sig')
+            with pipeline_metrics.stage('read'):
+                if file_path.endswith('.xlsx'):
+                    df = pd.read_excel(file_path)
+                else:
+                    df = pd.read_csv(file_path, encoding='utf-8-sig')
+            pipeline_metrics.add_rows('read', len(df))
             
             # Обрабатываем данные
             processed_count = self._save_to_report_table(df, file_type, original_filename)
+            pipeline_metrics.add_rows('parse', processed_count)
             
             # Обновляем информацию о файле
             self._update_file_status(file_id, True, processed_count)
@@ -137,6 +142,7 @@ class ReportsProcessor:
                 self._update_file_status(file_id, False, 0, str(e))
             raise
     
+    @pipeline_metrics.timed('write')
     def _register_file(self, original_filename, file_type, file_path):
         """Регистрация загруженного файла"""
         
@@ -154,6 +160,7 @@ class ReportsProcessor:
         
         return file_id
     
+    @pipeline_metrics.timed('write')
     def _update_file_status(self, file_id, processed, records_count, error_message=None):
         """Обновление статуса обработки файла"""
         
@@ -166,6 +173,7 @@ class ReportsProcessor:
         
         self.db.commit()
     
+    @pipeline_metrics.timed('parse')
     def _save_to_report_table(self, df, file_type, filename):
         """Сохранение данных в таблицу отчета"""
         
@@ -206,6 +214,7 @@ class ReportsProcessor:
         
         return len(processed_data)
     
+    @pipeline_metrics.timed('write')
     def _bulk_insert(self, table_name, data):
         """Массовая вставка данных"""
         
@@ -228,6 +237,7 @@ class ReportsProcessor:
         cursor.executemany(sql, values)
         self.db.commit()
     
+    @pipeline_metrics.timed('match')
     def _update_main_orders_table(self, file_type):
         """Обновление основной таблицы orders на основе данных из отчетных таблиц"""
         
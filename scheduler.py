@@ -4,150 +4,419 @@ VHM24R - Планировщик задач для работы 24/7
 """
 
 import os
-import asyncio
-import schedule
+import socket
+import tempfile
 import time
 import threading
 from datetime import datetime, date, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
+from backup_writer import iter_rows
+from config_service import get_config_service
+from incremental_reconciliation import IncrementalReconciler
+from unmatched_retry import UnmatchedRecordRetrier
+
+# Файловая блокировка доступна только на POSIX
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+    fcntl = None
+
+try:
+    import psycopg2  # type: ignore
+except ImportError:
+    psycopg2 = None  # type: ignore
+
+
+class SchedulerLeaderLock:
+    """
+    Блокировка лидера планировщика
+    
+    - PostgreSQL: сессионный pg_try_advisory_lock на отдельном подключении
+    - SQLite/локально: flock на файле блокировки
+    
+    Блокировка снимается автоматически при завершении процесса-владельца,
+    поэтому после перезапуска воркера лидерство переходит к другому процессу
+    """
+    
+    ADVISORY_LOCK_KEY = 2424001
+    
+    def __init__(self, database_url: Optional[str] = None, lock_path: Optional[str] = None):
+        self.database_url = database_url if database_url is not None else os.environ.get('DATABASE_URL')
+        self.lock_path = lock_path or os.environ.get(
+            'SCHEDULER_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'vhm24r_scheduler.lock')
+        )
+        self._connection = None
+        self._file = None
+    
+    @property
+    def backend(self) -> str:
+        return 'postgres' if self.database_url and psycopg2 is not None else 'file'
+    
+    @property
+    def held(self) -> bool:
+        return self._connection is not None or self._file is not None
+    
+    def acquire(self) -> bool:
+        """Неблокирующая попытка стать лидером"""
+        if self.held:
+            return True
+        
+        try:
+            if self.backend == 'postgres':
+                return self._acquire_advisory_lock()
+            return self._acquire_file_lock()
+        except Exception as e:
+            print(f"Scheduler leader lock failed: {e}")
+            return False
+    
+    def is_alive(self) -> bool:
+        """Проверка, что блокировка все еще удерживается (подключение к БД не потеряно)"""
+        if self._file is not None:
+            return True
+        if self._connection is None:
+            return False
+        
+        try:
+            cursor = self._connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            return True
+        except Exception:
+            self.release()
+            return False
+    
+    def release(self):
+        """Освобождение блокировки"""
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+        
+        if self._file is not None:
+            try:
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                self._file.close()
+            except Exception:
+                pass
+            self._file = None
+    
+    def _acquire_advisory_lock(self) -> bool:
+        connection = psycopg2.connect(self.database_url)
+        connection.autocommit = True
+        
+        cursor = connection.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (self.ADVISORY_LOCK_KEY,))
+        locked = bool(cursor.fetchone()[0])
+        cursor.close()
+        
+        if locked:
+            self._connection = connection
+        else:
+            connection.close()
+        return locked
+    
+    def _acquire_file_lock(self) -> bool:
+        lock_file = open(self.lock_path, 'a+')
+        
+        if FCNTL_AVAILABLE:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(f"{socket.gethostname()}:{os.getpid()}\n")
+        lock_file.flush()
+        
+        self._file = lock_file
+        return True
+
+
 class VHMScheduler:
     """
     Планировщик задач для VHM24R
     Согласно промту: работает 24/7, автоматические задачи
+    
+    Задачи выполняются только в процессе-лидере (см. SchedulerLeaderLock): остальные
+    воркеры gunicorn периодически пытаются перехватить лидерство. Запуск задачи,
+    пока предыдущий еще идет, пропускается; каждая попытка пишется в scheduler_job_runs
     """
     
-    def __init__(self, db, order_processor, telegram_notifier=None, file_manager=None):
+    LEADER_RETRY_SECONDS = 60
+    
+    def __init__(self, db, order_processor, telegram_notifier=None, file_manager=None,
+                 leader_lock: Optional[SchedulerLeaderLock] = None, autostart: bool = True):
         self.db = db
         self.order_processor = order_processor
         self.telegram_notifier = telegram_notifier
         self.file_manager = file_manager
         
-        # Инициализируем планировщик
-        self.scheduler = BackgroundScheduler()
-        self.scheduler.start()
+        self.leader_lock = leader_lock or SchedulerLeaderLock()
+        self.leader_retry_seconds = int(os.environ.get('SCHEDULER_LEADER_RETRY', self.LEADER_RETRY_SECONDS))
+        self.is_leader = False
+        
+        self._job_functions = {}
+        self._job_locks = {}
+        self._stop_event = threading.Event()
+        self._election_thread = None
+        
+        self._init_job_tables()
         
-        # Настраиваем задачи
-        self._setup_scheduled_tasks()
+        # Инициализируем планировщик (запускается только у лидера)
+        self.scheduler = self._create_scheduler()
         
-        print("VHM Scheduler initialized and started")
+        if autostart:
+            self.start()
+        
+        print("VHM Scheduler initialized")
+    
+    def _create_scheduler(self) -> BackgroundScheduler:
+        """APScheduler без наложения запусков: max_instances=1, пропущенные запуски схлопываются"""
+        scheduler = BackgroundScheduler(job_defaults={
+            'max_instances': 1,
+            'coalesce': True,
+            'misfire_grace_time': 300
+        })
+        scheduler.add_listener(self._on_job_skipped, EVENT_JOB_MAX_INSTANCES)
+        self._setup_scheduled_tasks(scheduler)
+        return scheduler
+    
+    def _init_job_tables(self):
+        """Таблица истории запусков задач"""
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        self.db.execute_query(f"""
+            CREATE TABLE IF NOT EXISTS scheduler_job_runs (
+                id {id_column},
+                job_id TEXT NOT NULL,
+                status TEXT NOT NULL,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                duration_seconds REAL,
+                error TEXT,
+                host TEXT,
+                pid INTEGER
+            )
+        """)
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_scheduler_job_runs_job ON scheduler_job_runs(job_id, started_at)"
+        )
     
-    def _setup_scheduled_tasks(self):
+    def _setup_scheduled_tasks(self, scheduler: BackgroundScheduler):
         """Настройка всех запланированных задач"""
+        jobs = [
+            # 1. Ежедневная сверка в 02:00
+            ('daily_reconciliation', 'Ежедневная сверка заказов',
+             self.daily_reconciliation, CronTrigger(hour=2, minute=0)),
+            # 2. Ежедневный отчет в 09:00
+            ('daily_report', 'Ежедневный отчет',
+             self.send_daily_report, CronTrigger(hour=9, minute=0)),
+            # 3. Проверка критических ошибок каждый час
+            ('critical_errors_check', 'Проверка критических ошибок',
+             self.check_critical_errors, IntervalTrigger(hours=1)),
+            # 4. Очистка старых файлов еженедельно (воскресенье в 03:00)
+            ('weekly_cleanup', 'Еженедельная очистка файлов',
+             self.cleanup_old_files, CronTrigger(day_of_week=6, hour=3, minute=0)),
+            # 5. Проверка состояния автоматов каждые 4 часа
+            ('machine_health_check', 'Проверка состояния автоматов',
+             self.check_machine_health, IntervalTrigger(hours=4)),
+            # 6. Резервное копирование данных ежедневно в 04:00
+            ('daily_backup', 'Ежедневное резервное копирование',
+             self.backup_data, CronTrigger(hour=4, minute=0)),
+            # 7. Мониторинг системы каждые 30 минут
+            ('system_health', 'Мониторинг системы',
+             self.system_health_check, IntervalTrigger(minutes=30)),
+            # 8. Повторное сопоставление несопоставленных чеков каждый час
+            ('unmatched_retry', 'Повторное сопоставление несопоставленных записей',
+             self.retry_unmatched_records, IntervalTrigger(hours=1)),
+        ]
         
-        # 1. Ежедневная сверка в 02:00
-        self.scheduler.add_job(
-            func=self.daily_reconciliation,
-            trigger=CronTrigger(hour=2, minute=0),
-            id='daily_reconciliation',
-            name='Ежедневная сверка заказов',
-            replace_existing=True
-        )
+        for job_id, name, func, trigger in jobs:
+            self._job_functions[job_id] = func
+            self._job_locks.setdefault(job_id, threading.Lock())
+            scheduler.add_job(
+                func=self._run_job,
+                args=[job_id],
+                trigger=trigger,
+                id=job_id,
+                name=name,
+                replace_existing=True
+            )
+    
+    # ========================================================================
+    # ЛИДЕРСТВО
+    # ========================================================================
+    
+    def start(self):
+        """Запуск выборов лидера в текущем процессе"""
+        if self._election_thread and self._election_thread.is_alive():
+            return
         
-        # 2. Ежедневный отчет в 09:00
-        self.scheduler.add_job(
-            func=self.send_daily_report,
-            trigger=CronTrigger(hour=9, minute=0),
-            id='daily_report',
-            name='Ежедневный отчет',
-            replace_existing=True
-        )
+        self._stop_event.clear()
+        self._try_become_leader()
         
-        # 3. Проверка критических ошибок каждый час
-        self.scheduler.add_job(
-            func=self.check_critical_errors,
-            trigger=IntervalTrigger(hours=1),
-            id='critical_errors_check',
-            name='Проверка критических ошибок',
-            replace_existing=True
+        self._election_thread = threading.Thread(
+            target=self._election_loop, name='vhm-scheduler-election', daemon=True
         )
+        self._election_thread.start()
+    
+    def _election_loop(self):
+        """Резервные процессы периодически пытаются стать лидером, лидер проверяет блокировку"""
+        while not self._stop_event.wait(self.leader_retry_seconds):
+            if self.is_leader and not self.leader_lock.is_alive():
+                print(f"Scheduler leadership lost in pid {os.getpid()}")
+                self._step_down()
+            elif not self.is_leader:
+                self._try_become_leader()
+    
+    def _try_become_leader(self) -> bool:
+        if not self.leader_lock.acquire():
+            return False
         
-        # 4. Очистка старых файлов еженедельно (воскресенье в 03:00)
-        self.scheduler.add_job(
-            func=self.cleanup_old_files,
-            trigger=CronTrigger(day_of_week=6, hour=3, minute=0),
-            id='weekly_cleanup',
-            name='Еженедельная очистка файлов',
-            replace_existing=True
-        )
+        if self.scheduler is None:
+            self.scheduler = self._create_scheduler()
+        self.scheduler.start()
+        self.is_leader = True
+        print(f"VHM Scheduler leader: pid {os.getpid()} ({self.leader_lock.backend} lock)")
+        return True
+    
+    def _step_down(self):
+        if self.scheduler is not None and self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        self.scheduler = None
+        self.leader_lock.release()
+        self.is_leader = False
+    
+    # ========================================================================
+    # ЗАПУСК ЗАДАЧ И ИСТОРИЯ
+    # ========================================================================
+    
+    def _run_job(self, job_id: str) -> bool:
+        """
+        Выполнение задачи с записью длительности
+        Если эта же задача еще выполняется в процессе (например, ручной запуск), запуск пропускается
+        """
+        job_lock = self._job_locks.setdefault(job_id, threading.Lock())
+        if not job_lock.acquire(blocking=False):
+            self._record_job_run(job_id, 'skipped', datetime.now(), 0.0)
+            print(f"Job {job_id} is still running, skipped")
+            return False
         
-        # 5. Проверка состояния автоматов каждые 4 часа
-        self.scheduler.add_job(
-            func=self.check_machine_health,
-            trigger=IntervalTrigger(hours=4),
-            id='machine_health_check',
-            name='Проверка состояния автоматов',
-            replace_existing=True
-        )
+        started_at = datetime.now()
+        started = time.perf_counter()
+        status, error = 'success', None
         
-        # 6. Резервное копирование данных ежедневно в 04:00
-        self.scheduler.add_job(
-            func=self.backup_data,
-            trigger=CronTrigger(hour=4, minute=0),
-            id='daily_backup',
-            name='Ежедневное резервное копирование',
-            replace_existing=True
-        )
+        try:
+            self._job_functions[job_id]()
+        except Exception as e:
+            status, error = 'error', str(e)
+            print(f"Error in job {job_id}: {e}")
+        finally:
+            job_lock.release()
+            self._record_job_run(job_id, status, started_at, time.perf_counter() - started, error)
         
-        # 7. Мониторинг системы каждые 30 минут
-        self.scheduler.add_job(
-            func=self.system_health_check,
-            trigger=IntervalTrigger(minutes=30),
-            id='system_health',
-            name='Мониторинг системы',
-            replace_existing=True
-        )
+        return status == 'success'
+    
+    def _on_job_skipped(self, event):
+        """APScheduler не запустил задачу, потому что предыдущий запуск не завершился"""
+        self._record_job_run(event.job_id, 'skipped', datetime.now(), 0.0)
+        print(f"Job {event.job_id} overran its interval, run skipped")
+    
+    def _record_job_run(self, job_id: str, status: str, started_at: datetime,
+                        duration: float, error: Optional[str] = None):
+        placeholder = '%s' if self.db.is_postgres else '?'
+        values = ', '.join([placeholder] * 8)
+        
+        try:
+            self.db.execute_query(f"""
+                INSERT INTO scheduler_job_runs
+                (job_id, status, started_at, finished_at, duration_seconds, error, host, pid)
+                VALUES ({values})
+            """, (job_id, status, started_at.isoformat(sep=' '),
+                  (started_at + timedelta(seconds=duration)).isoformat(sep=' '),
+                  round(duration, 3), error, socket.gethostname(), os.getpid()))
+        except Exception as e:
+            print(f"Error recording job run: {e}")
+    
+    def get_job_history(self, job_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """История запусков задач (последние сначала)"""
+        placeholder = '%s' if self.db.is_postgres else '?'
+        where = f"WHERE job_id = {placeholder}" if job_id else ""
+        params = (job_id,) if job_id else None
+        
+        return self.db.execute_query(f"""
+            SELECT job_id, status, started_at, finished_at, duration_seconds, error, host, pid
+            FROM scheduler_job_runs
+            {where}
+            ORDER BY started_at DESC, id DESC
+            LIMIT {int(limit)}
+        """, params)
     
     def daily_reconciliation(self):
         """
         Ежедневная автоматическая сверка
         Согласно промту: ежедневный парсинг
+        
+        Сверяются только заказы, измененные после предыдущего успешного запуска
+        (см. IncrementalReconciler); прерванный запуск продолжается с контрольной точки
         """
         try:
             print(f"Starting daily reconciliation at {datetime.now()}")
             
-            # Получаем все необработанные заказы за последние 2 дня
-            cutoff_date = datetime.now() - timedelta(days=2)
-            
-            unprocessed_orders = self.db.execute_query("""
-                SELECT COUNT(*) as count FROM orders 
-                WHERE error_type = 'UNPROCESSED' 
-                AND created_at >= ?
-            """, (cutoff_date,))
-            
-            if unprocessed_orders and unprocessed_orders[0]['count'] > 0:
-                print(f"Found {unprocessed_orders[0]['count']} unprocessed orders")
-                
-                # Запускаем сверку
+            if not hasattr(self.order_processor, 'run_incremental_matching'):
                 stats = self.order_processor.run_matching()
-                
-                # Отправляем уведомление о результатах
-                if self.telegram_notifier:
-                    asyncio.run(self.telegram_notifier.send_processing_complete(
-                        session_id=f"daily_{datetime.now().strftime('%Y%m%d')}",
-                        stats=stats,
-                        files_count=0
-                    ))
-                
                 print(f"Daily reconciliation completed. Stats: {stats}")
-            else:
-                print("No unprocessed orders found for daily reconciliation")
+                return
+            
+            result = IncrementalReconciler(self.db, self.order_processor).run()
+            print(f"Daily reconciliation completed: {result['scanned']} orders scanned, "
+                  f"{result['updated']} updated, {result['orders_per_second']} orders/s")
+            
+            # Отправляем уведомление о результатах
+            if result['updated'] and self.telegram_notifier:
+                stats = self.order_processor._get_final_statistics() \
+                    if hasattr(self.order_processor, '_get_final_statistics') else result
+                self.telegram_notifier.send_processing_complete(
+                    session_id=f"daily_{datetime.now().strftime('%Y%m%d')}",
+                    stats=stats,
+                    files_count=0
+                )
                 
         except Exception as e:
             print(f"Error in daily reconciliation: {e}")
             if self.telegram_notifier:
-                asyncio.run(self.telegram_notifier.send_message(
+                self.telegram_notifier.send_message(
                     f"🚨 Ошибка ежедневной сверки: {str(e)}"
-                ))
+                )
+            raise
+    
+    def retry_unmatched_records(self):
+        """
+        Повторная сверка фискальных чеков из unmatched_records с заказами,
+        пришедшими позже (с экспоненциальной задержкой между попытками)
+        """
+        if not hasattr(self.order_processor, 'apply_fiscal_match'):
+            return
+        
+        stats = UnmatchedRecordRetrier(self.db, self.order_processor).run()
+        print(f"Unmatched records retry completed. Stats: {stats}")
     
     def send_daily_report(self):
         """Отправка ежедневного отчета"""
         try:
             if self.telegram_notifier:
-                asyncio.run(self.telegram_notifier.send_daily_report())
+                self.telegram_notifier.send_daily_report()
                 print(f"Daily report sent at {datetime.now()}")
         except Exception as e:
             print(f"Error sending daily report: {e}")
@@ -175,25 +444,17 @@ class VHMScheduler:
             if recent_errors:
                 total_errors = sum(error['count'] for error in recent_errors)
                 
-                # Получаем порог из конфигурации
-                critical_threshold = 5  # По умолчанию 5 ошибок в час
-                try:
-                    config = self.db.execute_query(
-                        "SELECT config_value FROM system_config WHERE config_key = 'critical_error_threshold'"
-                    )
-                    if config:
-                        critical_threshold = int(config[0]['config_value'])
-                except:
-                    pass
+                # Порог из конфигурации (по умолчанию 5 ошибок в час)
+                critical_threshold = get_config_service(self.db).get('critical_error_threshold')
                 
                 if total_errors >= critical_threshold:
                     error_stats = {error['error_type']: error['count'] for error in recent_errors}
                     
                     if self.telegram_notifier:
-                        asyncio.run(self.telegram_notifier.send_critical_errors_alert(
+                        self.telegram_notifier.send_critical_errors_alert(
                             session_id=f"hourly_{datetime.now().strftime('%Y%m%d_%H')}",
                             stats=error_stats
-                        ))
+                        )
                     
                     print(f"Critical errors detected: {total_errors} errors in last hour")
                 
@@ -215,7 +476,7 @@ class VHMScheduler:
                 """.strip()
                 
                 if self.telegram_notifier:
-                    asyncio.run(self.telegram_notifier.send_message(message))
+                    self.telegram_notifier.send_message(message)
                 
                 print(f"File cleanup completed: {cleanup_stats}")
             
@@ -249,11 +510,11 @@ class VHMScheduler:
             
             for issue in machine_issues:
                 if self.telegram_notifier:
-                    asyncio.run(self.telegram_notifier.send_machine_issues_alert(
+                    self.telegram_notifier.send_machine_issues_alert(
                         machine_code=issue['machine_code'],
                         error_count=issue['error_orders'],
                         error_rate=issue['error_rate']
-                    ))
+                    )
                 
                 print(f"Machine health issue: {issue['machine_code']} - {issue['error_rate']}% error rate")
             
@@ -261,30 +522,31 @@ class VHMScheduler:
             print(f"Error checking machine health: {e}")
     
     def backup_data(self):
-        """Ежедневное резервное копирование данных"""
+        """
+        Ежедневное резервное копирование данных
+        Все заказы за вчера пишутся потоково (gzip NDJSON или Parquet, BACKUP_FORMAT),
+        без ограничения количества строк; manifest.json содержит сводку и контрольные суммы
+        """
         try:
             if self.file_manager:
-                # Создаем резервную копию статистики за вчера
                 yesterday = date.today() - timedelta(days=1)
+                backup = self.file_manager.create_streaming_backup(
+                    prefix=f"backups/{yesterday.strftime('%Y/%m/%d')}",
+                    fmt=os.environ.get('BACKUP_FORMAT', 'ndjson')
+                )
                 
-                backup_data = {
+                backup.write_rows('orders', self._iter_orders_for_backup(yesterday))
+                manifest = backup.write_manifest({
                     'date': yesterday.isoformat(),
-                    'summary': self._get_daily_summary(yesterday),
-                    'orders': self._get_orders_for_backup(yesterday),
                     'backup_type': 'daily_backup',
-                    'created_at': datetime.now().isoformat()
-                }
-                
-                session_id = f"backup_{yesterday.strftime('%Y%m%d')}"
-                success = self.file_manager.backup_processing_results(session_id, backup_data)
+                    'summary': self._get_daily_summary(yesterday)
+                })
                 
-                if success:
-                    print(f"Daily backup completed for {yesterday}")
-                else:
-                    print(f"Daily backup failed for {yesterday}")
+                print(f"Daily backup completed for {yesterday}: {manifest['total_rows']} rows")
             
         except Exception as e:
             print(f"Error in daily backup: {e}")
+            raise
     
     def system_health_check(self):
         """Мониторинг состояния системы"""
@@ -312,7 +574,7 @@ class VHMScheduler:
             
             if issues and self.telegram_notifier:
                 message = "🚨 <b>ПРОБЛЕМЫ СИСТЕМЫ</b>\n\n" + "\n".join(issues)
-                asyncio.run(self.telegram_notifier.send_message(message))
+                self.telegram_notifier.send_message(message)
             
         except Exception as e:
             print(f"Error in system health check: {e}")
@@ -336,21 +598,15 @@ class VHMScheduler:
         except:
             return {}
     
-    def _get_orders_for_backup(self, target_date: date) -> List[Dict]:
-        """Получение заказов за день для резервного копирования"""
-        try:
-            orders = self.db.execute_query("""
-                SELECT 
-                    order_number, machine_code, creation_time, order_price,
-                    error_type, payment_type, matched_payment, matched_fiscal
-                FROM orders 
-                WHERE DATE(creation_time) = ?
-                ORDER BY creation_time
-            """, (target_date,))
-            
-            return orders[:1000]  # Ограничиваем количество для экономии места
-        except:
-            return []
+    def _iter_orders_for_backup(self, target_date: date):
+        """Построчное чтение всех заказов за день для резервного копирования"""
+        day_start = datetime.combine(target_date, datetime.min.time())
+        return iter_rows(self.db, """
+            SELECT * FROM orders
+            WHERE creation_time >= ? AND creation_time < ?
+            ORDER BY id
+        """, (day_start.strftime('%Y-%m-%d %H:%M:%S'),
+              (day_start + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')))
     
     def _check_database_health(self) -> bool:
         """Проверка состояния БД"""
@@ -386,44 +642,67 @@ class VHMScheduler:
     
     def stop(self):
         """Остановка планировщика"""
-        if self.scheduler.running:
-            self.scheduler.shutdown()
+        self._stop_event.set()
+        was_running = self.scheduler is not None and self.scheduler.running
+        self._step_down()
+        if was_running:
             print("VHM Scheduler stopped")
     
     def get_job_status(self) -> List[Dict]:
         """Получение статуса всех задач"""
+        stats = {}
+        for row in self.db.execute_query("""
+            SELECT job_id, COUNT(*) AS runs, AVG(duration_seconds) AS avg_duration,
+                   MAX(duration_seconds) AS max_duration, MAX(started_at) AS last_run
+            FROM scheduler_job_runs
+            WHERE status != 'skipped'
+            GROUP BY job_id
+        """):
+            stats[row['job_id']] = row
+        
+        scheduler = self.scheduler or self._create_scheduler()
         jobs = []
-        for job in self.scheduler.get_jobs():
+        for job in scheduler.get_jobs():
+            history = stats.get(job.id, {})
+            next_run = getattr(job, 'next_run_time', None)
             jobs.append({
                 'id': job.id,
                 'name': job.name,
-                'next_run': job.next_run_time.isoformat() if job.next_run_time else None,
-                'trigger': str(job.trigger)
+                'next_run': next_run.isoformat() if next_run else None,
+                'trigger': str(job.trigger),
+                'leader': self.is_leader,
+                'runs': history.get('runs', 0),
+                'last_run': history.get('last_run'),
+                'avg_duration': history.get('avg_duration'),
+                'max_duration': history.get('max_duration')
             })
         return jobs
     
     def run_job_manually(self, job_id: str) -> bool:
         """Ручной запуск задачи"""
-        try:
-            job = self.scheduler.get_job(job_id)
-            if job:
-                job.func()
-                return True
-            return False
-        except Exception as e:
-            print(f"Error running job {job_id}: {e}")
+        if job_id not in self._job_functions:
             return False
+        return self._run_job(job_id)
 
 
 # Глобальный экземпляр планировщика
 vhm_scheduler = None
 
-def init_scheduler(db, order_processor, telegram_notifier=None, file_manager=None):
-    """Инициализация планировщика задач"""
+def init_scheduler(db, order_processor, telegram_notifier=None, file_manager=None, autostart=True):
+    """
+    Инициализация планировщика задач
+    Под gunicorn (--preload) передается autostart=False: выборы лидера запускаются
+    в каждом воркере из хука post_worker_init (gunicorn.conf.py), а не в мастер-процессе
+    """
     global vhm_scheduler
-    vhm_scheduler = VHMScheduler(db, order_processor, telegram_notifier, file_manager)
+    vhm_scheduler = VHMScheduler(db, order_processor, telegram_notifier, file_manager, autostart=autostart)
     return vhm_scheduler
 
+def start_scheduler():
+    """Запуск выборов лидера в текущем процессе (воркере)"""
+    if vhm_scheduler:
+        vhm_scheduler.start()
+
 def stop_scheduler():
     """Остановка планировщика"""
     global vhm_scheduler
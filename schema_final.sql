@@ -136,6 +136,7 @@ CREATE TABLE unmatched_records (
     last_attempt TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE INDEX idx_unmatched_records_type_time ON unmatched_records(record_type, record_time);
 
 -- Таблица конфликтов
 CREATE TABLE conflicts (
@@ -149,6 +150,7 @@ CREATE TABLE conflicts (
     resolved_at TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+CREATE UNIQUE INDEX idx_conflicts_pair ON conflicts(conflict_type, order_id_1, (COALESCE(order_id_2, 0)));
 
 -- Таблица метаданных файлов
 CREATE TABLE file_metadata (
@@ -179,6 +181,12 @@ CREATE TABLE system_config (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Версия system_config (увеличивается триггерами ConfigService при изменении настроек)
+CREATE TABLE system_config_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+
 -- Таблица логов обработки
 CREATE TABLE processing_logs (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -197,6 +205,7 @@ INSERT INTO system_config (config_key, config_value, description) VALUES
 ('fiscal_time_window', '60', 'Временное окно для сопоставления фискальных чеков в секундах'),
 ('gateway_time_window', '60', 'Временное окно для сопоставления платежных шлюзов в секундах'),
 ('max_file_size_mb', '100', 'Максимальный размер загружаемого файла в МБ'),
+('memory_stage_budget_mb', '512', 'Бюджет роста RSS на этап загрузки в МБ (при PIPELINE_MEMORY=1)'),
 ('auto_matching_enabled', 'true', 'Включено ли автоматическое сопоставление'),
 ('telegram_notifications', 'true', 'Включены ли уведомления в Telegram'),
 ('backup_to_cloud', 'true', 'Включено ли резервное копирование в облако'),
@@ -185,6 +185,12 @@ CREATE TABLE IF NOT EXISTS system_config (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Версия system_config (увеличивается триггерами ConfigService при изменении настроек)
+CREATE TABLE IF NOT EXISTS system_config_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+
 -- ========================================================================
 -- ЛОГИ ОБРАБОТКИ
 -- ========================================================================
@@ -231,8 +237,10 @@ CREATE INDEX IF NOT EXISTS idx_orders_fiscal_time_amount ON orders(fiscal_time,
 CREATE INDEX IF NOT EXISTS idx_order_changes_order_id ON order_changes(order_id);
 CREATE INDEX IF NOT EXISTS idx_order_changes_change_time ON order_changes(change_time);
 CREATE INDEX IF NOT EXISTS idx_unmatched_records_type ON unmatched_records(record_type);
+CREATE INDEX IF NOT EXISTS idx_unmatched_records_type_time ON unmatched_records(record_type, record_time);
 CREATE INDEX IF NOT EXISTS idx_unmatched_records_time_amount ON unmatched_records(record_time, record_amount);
 CREATE INDEX IF NOT EXISTS idx_conflicts_status ON conflicts(resolution_status);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_conflicts_pair ON conflicts(conflict_type, order_id_1, (COALESCE(order_id_2, 0)));
 CREATE INDEX IF NOT EXISTS idx_file_metadata_session_id ON file_metadata(session_id);
 CREATE INDEX IF NOT EXISTS idx_file_metadata_file_hash ON file_metadata(file_hash);
 
@@ -423,6 +423,38 @@ class FileManager:
         
         return self.storage.upload_json_data(backup_data, remote_key)
     
+    def backup_memory_profile(self, session_id: str, profile: Dict) -> bool:
+        """Профиль памяти сессии загрузки рядом с результатами обработки"""
+        remote_key = f"results/{session_id}/memory_profile.json"
+        
+        backup_data = {
+            'session_id': session_id,
+            'backup_time': datetime.now().isoformat(),
+            'memory_profile': profile,
+            'system_info': {
+                'version': 'VHM24R-1.0',
+                'backup_type': 'memory_profile'
+            }
+        }
+        
+        return self.storage.upload_json_data(backup_data, remote_key)
+    
+    def create_streaming_backup(self, prefix: str, fmt: str = 'ndjson'):
+        """
+        Потоковая резервная копия (см. backup_writer.StreamingBackupWriter)
+        Без настроенного хранилища копия пишется в локальный каталог BACKUP_LOCAL_DIR
+        """
+        from backup_writer import StreamingBackupWriter, LocalS3Client
+        
+        if self.storage.enabled:
+            client, bucket = self.storage.client, self.storage.bucket_name
+        else:
+            client = LocalS3Client(os.environ.get('BACKUP_LOCAL_DIR', 'backups'))
+            bucket = self.storage.bucket_name
+        
+        part_size = int(os.environ.get('BACKUP_PART_SIZE_MB', 8)) * 1024 * 1024
+        return StreamingBackupWriter(client, bucket, prefix, fmt=fmt, part_size=part_size)
+    
     def cleanup_old_files(self, days_to_keep: int = 30) -> Dict:
         """
         Очистка старых файлов (локальных и в хранилище)
@@ -0,0 +1,201 @@
+"""
+VHM24R - Генератор синтетических отчетов для бенчмарков и тестов
+Детерминированно (по seed) создает согласованные файлы HW, VendHub, фискальных чеков
+и платежных шлюзов Payme/Click/Uzum с заданной долей шума: пропущенные строки,
+запоздавшие события (вне окна сопоставления) и дубли
+"""
+
+import csv
+import os
+import random
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+GOODS = [
+    ('Капучино', 15000), ('Латте', 17000), ('Американо', 12000), ('Эспрессо', 10000),
+    ('Горячий шоколад', 16000), ('Чай черный', 8000), ('Раф', 19000), ('Какао', 14000)
+]
+TASTES = ['Классический', 'Ваниль', 'Карамель', 'Кокос', '']
+GATEWAYS = ('payme', 'click', 'uzum')
+MACHINE_CATEGORIES = ['Кофейный автомат', 'Снековый автомат']
+
+HEADERS = {
+    'happy_workers': ['Order number', 'Machine code', 'Address', 'Goods name', 'Taste name', 'Order type',
+                      'Order resource', 'Order price', 'Creation time', 'Paying time', 'Brewing time',
+                      'Delivery time', 'Refund time', 'Payment status', 'Brew status', 'Reason'],
+    'vendhub': ['Order number', 'Time', 'Goods name', 'Order price', 'Machine Code', 'Machine category',
+                'Payment type', 'Order resource', 'Goods ID', 'Username', 'Amount of accrued bonus',
+                'ИКПУ', 'Штрихкод'],
+    'fiscal_bills': ['fiscal_check_number', 'fiscal_time', 'amount', 'taxpayer_id', 'cash_register_id',
+                     'shift_number', 'receipt_type'],
+    'payme': ['transaction_id', 'transaction_time', 'amount', 'masked_pan', 'merchant_id', 'terminal_id',
+              'commission', 'status', 'username'],
+    'click': ['transaction_id', 'transaction_time', 'amount', 'card_number', 'merchant_id', 'service_id',
+              'commission', 'status', 'error_code'],
+    'uzum': ['transaction_id', 'transaction_time', 'amount', 'masked_pan', 'shop_id', 'order_id',
+             'commission', 'cashback_amount', 'status'],
+}
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class SyntheticDataGenerator:
+    """
+    Набор отчетов за days дней по machines автоматам, orders_per_day заказов в день
+
+    Шум применяется к каждому источнику независимо:
+    - missing_rate: строка заказа отсутствует в источнике (в HW - заказ есть только в VendHub)
+    - late_rate: событие источника сдвинуто на 3-30 минут (за пределы окна сопоставления)
+    - duplicate_rate: строка источника повторяется
+    Одинаковые параметры и seed всегда дают одинаковые файлы
+    """
+
+    def __init__(self, machines: int = 20, days: int = 7, orders_per_day: int = 1000, seed: int = 42,
+                 start_date: Optional[date] = None, cash_share: float = 0.4,
+                 missing_rate: float = 0.02, late_rate: float = 0.01, duplicate_rate: float = 0.005):
+        self.machines = machines
+        self.days = days
+        self.orders_per_day = orders_per_day
+        self.seed = seed
+        self.start_date = start_date or date(2024, 5, 1)
+        self.cash_share = cash_share
+        self.missing_rate = missing_rate
+        self.late_rate = late_rate
+        self.duplicate_rate = duplicate_rate
+
+    @property
+    def params(self) -> Dict[str, Any]:
+        return {
+            'machines': self.machines, 'days': self.days, 'orders_per_day': self.orders_per_day,
+            'seed': self.seed, 'start_date': self.start_date.isoformat(), 'cash_share': self.cash_share,
+            'missing_rate': self.missing_rate, 'late_rate': self.late_rate, 'duplicate_rate': self.duplicate_rate
+        }
+
+    def iter_orders(self) -> Iterator[Dict[str, Any]]:
+        """Заказы в порядке времени создания (без шума)"""
+        rnd = random.Random(self.seed)
+        machines = [f"VM{index:04d}" for index in range(1, self.machines + 1)]
+        number = 0
+
+        for day_index in range(self.days):
+            day_start = datetime.combine(self.start_date + timedelta(days=day_index), datetime.min.time())
+            offsets = sorted(rnd.randint(7 * 3600, 23 * 3600) for _ in range(self.orders_per_day))
+            for offset in offsets:
+                number += 1
+                machine = rnd.choice(machines)
+                goods, price = rnd.choice(GOODS)
+                creation_time = day_start + timedelta(seconds=offset)
+                paying_time = creation_time + timedelta(seconds=rnd.randint(2, 20))
+                brewing_time = paying_time + timedelta(seconds=rnd.randint(5, 15))
+                cash = rnd.random() < self.cash_share
+
+                yield {
+                    'order_number': f"{day_index + 1:03d}{number:09d}",
+                    'machine_code': machine,
+                    'address': f"г. Ташкент, точка {machine[2:]}",
+                    'goods_name': goods,
+                    'taste_name': rnd.choice(TASTES),
+                    'order_price': price,
+                    'creation_time': creation_time,
+                    'paying_time': paying_time,
+                    'brewing_time': brewing_time,
+                    'delivery_time': brewing_time + timedelta(seconds=rnd.randint(30, 90)),
+                    'cash': cash,
+                    'gateway': None if cash else rnd.choice(GATEWAYS),
+                    'goods_id': f"G{GOODS.index((goods, price)) + 1:03d}",
+                    'username': f"user{rnd.randint(1, 5000)}",
+                }
+
+    def generate(self, output_dir: str) -> Dict[str, Any]:
+        """
+        Запись файлов <file_type>.csv в output_dir потоково (память не зависит от объема)
+
+        Returns:
+            Dict: Пути файлов, число строк по файлам, число заказов
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        noise = random.Random(self.seed + 1)
+        paths = {file_type: os.path.join(output_dir, f"{file_type}.csv") for file_type in HEADERS}
+        handles = {file_type: open(path, 'w', encoding='utf-8', newline='') for file_type, path in paths.items()}
+        writers = {file_type: csv.writer(handle) for file_type, handle in handles.items()}
+        counts = {file_type: 0 for file_type in HEADERS}
+        orders = 0
+
+        try:
+            for file_type, writer in writers.items():
+                writer.writerow(HEADERS[file_type])
+
+            for order in self.iter_orders():
+                orders += 1
+                self._write(writers, counts, noise, 'happy_workers', self._hw_row(order))
+                self._write(writers, counts, noise, 'vendhub', self._vendhub_row(order, noise))
+                if order['cash']:
+                    self._write(writers, counts, noise, 'fiscal_bills', self._fiscal_row(order, noise))
+                else:
+                    self._write(writers, counts, noise, order['gateway'], self._gateway_row(order, noise))
+        finally:
+            for handle in handles.values():
+                handle.close()
+
+        return {'files': paths, 'rows': counts, 'orders': orders}
+
+    # ========================================================================
+    # СТРОКИ ИСТОЧНИКОВ
+    # ========================================================================
+
+    def _write(self, writers, counts, noise: random.Random, file_type: str, row: List[Any]):
+        """Строка с учетом пропусков и дублей"""
+        if noise.random() < self.missing_rate:
+            return
+        copies = 2 if noise.random() < self.duplicate_rate else 1
+        for _ in range(copies):
+            writers[file_type].writerow(row)
+        counts[file_type] += copies
+
+    def _event_time(self, base: datetime, noise: random.Random, max_delay: int) -> datetime:
+        """Время события источника: в пределах окна или, с долей late_rate, за его пределами"""
+        if noise.random() < self.late_rate:
+            return base + timedelta(minutes=noise.randint(3, 30))
+        return base + timedelta(seconds=noise.randint(0, max_delay))
+
+    def _hw_row(self, order: Dict[str, Any]) -> List[Any]:
+        return [
+            order['order_number'], order['machine_code'], order['address'], order['goods_name'],
+            order['taste_name'], 'Normal order', 'Cash payment' if order['cash'] else 'Custom payment',
+            order['order_price'], order['creation_time'].strftime(TIME_FORMAT),
+            order['paying_time'].strftime(TIME_FORMAT), order['brewing_time'].strftime(TIME_FORMAT),
+            order['delivery_time'].strftime(TIME_FORMAT), '', 'Paid', 'Delivered', ''
+        ]
+
+    def _vendhub_row(self, order: Dict[str, Any], noise: random.Random) -> List[Any]:
+        payment_type = 'Cash' if order['cash'] else order['gateway'].capitalize()
+        return [
+            order['order_number'], self._event_time(order['creation_time'], noise, 20).strftime(TIME_FORMAT),
+            order['goods_name'], order['order_price'], order['machine_code'], noise.choice(MACHINE_CATEGORIES),
+            payment_type, 'Cash payment' if order['cash'] else 'Custom payment',
+            order['goods_id'], order['username'], noise.choice([0, 0, 0, 150, 300]),
+            f"0{order['goods_id'][1:]}1001001000000", f"4780000{order['goods_id'][1:]}00"
+        ]
+
+    def _fiscal_row(self, order: Dict[str, Any], noise: random.Random) -> List[Any]:
+        return [
+            f"F{order['order_number']}", self._event_time(order['paying_time'], noise, 30).strftime(TIME_FORMAT),
+            order['order_price'], '305123456', f"KKM{order['machine_code'][2:]}",
+            int(order['order_number'][:3]), 'Продажа'
+        ]
+
+    def _gateway_row(self, order: Dict[str, Any], noise: random.Random) -> List[Any]:
+        gateway = order['gateway']
+        transaction_time = self._event_time(order['paying_time'], noise, 30).strftime(TIME_FORMAT)
+        card = f"8600****{noise.randint(1000, 9999)}"
+        commission = round(order['order_price'] * 0.01, 2)
+        transaction_id = f"{gateway[0].upper()}{order['order_number']}"
+
+        if gateway == 'payme':
+            return [transaction_id, transaction_time, order['order_price'], card, 'M-PAYME-1',
+                    f"T{order['machine_code'][2:]}", commission, 'success', order['username']]
+        if gateway == 'click':
+            return [transaction_id, transaction_time, order['order_price'], card, 'M-CLICK-1',
+                    '20145', commission, 'success', 0]
+        return [transaction_id, transaction_time, order['order_price'], card, f"S{order['machine_code'][2:]}",
+                order['order_number'], commission, 0, 'success']
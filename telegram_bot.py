@@ -5,12 +5,290 @@ VHM24R - Telegram Bot для уведомлений и управления
 
 import os
 import asyncio
+import html
 import json
-from datetime import datetime, date
-from typing import Dict, List, Optional
+import re
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime, date, timedelta
+from typing import Any, Dict, List, Optional
 import requests
 from telegram import Bot
-from telegram.error import TelegramError
+
+from config_service import get_config_service
+
+# Токены HTML-разметки Telegram: теги, сущности, переводы строк и текст между ними
+HTML_TOKEN = re.compile(r'<[^>]*>|&#?\w+;|\n|[^<&\n]+|[<&]')
+HTML_OPEN_TAG = re.compile(r'^<([a-zA-Z][\w-]*)')
+
+
+class TelegramSendQueue:
+    """
+    Очередь отправки сообщений с собственным event loop в фоновом потоке
+    
+    - submit() не блокирует вызывающий поток: сообщение только кладется в очередь
+    - Очередь ограничена max_size, при переполнении вытесняются самые старые сообщения
+    - Сообщения с одинаковым coalesce_key (или одинаковым текстом) схлопываются в последнее
+    - Всплеск сообщений за batch_window секунд отправляется одним сообщением на чат (до 4096 символов)
+    - Лимиты Telegram: не чаще раза в секунду в личный чат, 20 в минуту в группу, 30 в секунду всего;
+      ответ RetryAfter выдерживается перед повтором
+    - Длинный HTML режется по строкам вне тегов и сущностей; открытые теги закрываются в конце
+      части и открываются заново в следующей. Если Telegram все же не разобрал разметку,
+      сообщение отправляется повторно обычным текстом
+    """
+    
+    MAX_MESSAGE_LENGTH = 4096
+    SEPARATOR = "\n\n"
+    # Длина кусков, на которые режется строка без переводов строк
+    TEXT_PIECE_LENGTH = 256
+    
+    def __init__(self, send_func, max_size: int = 500, batch_window: float = 1.0,
+                 chat_interval: float = 1.0, group_interval: float = 3.0,
+                 global_rate: int = 30, max_retries: int = 3):
+        self.send_func = send_func
+        self.max_size = max_size
+        self.batch_window = batch_window
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.global_rate = global_rate
+        self.max_retries = max_retries
+        
+        self.stats = {'queued': 0, 'sent': 0, 'coalesced': 0, 'dropped': 0, 'failed': 0}
+        
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._loop = None
+        self._thread = None
+        self._wakeup = None
+        self._worker_task = None
+        self._pid = None
+        self._chat_next_send = {}
+        self._recent_sends = deque(maxlen=global_rate)
+    
+    def submit(self, chat_id, text: str, parse_mode: str = 'HTML', coalesce_key: Optional[str] = None) -> bool:
+        """Постановка сообщения в очередь; возвращается сразу"""
+        key = (chat_id, parse_mode, coalesce_key or text)
+        
+        with self._lock:
+            if key in self._pending:
+                self._pending.pop(key)
+                self.stats['coalesced'] += 1
+            elif len(self._pending) >= self.max_size:
+                self._pending.popitem(last=False)
+                self.stats['dropped'] += 1
+            
+            self._pending[key] = (chat_id, parse_mode, text)
+            self.stats['queued'] += 1
+            self._idle.clear()
+        
+        self._ensure_started()
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+    
+    def flush(self, timeout: float = 30) -> bool:
+        """Ожидание отправки всех сообщений из очереди"""
+        return self._idle.wait(timeout)
+    
+    def stop(self, timeout: float = 5):
+        """Остановка фонового потока после отправки очереди"""
+        if not self._thread or self._pid != os.getpid():
+            return
+        self.flush(timeout)
+        self._loop.call_soon_threadsafe(self._worker_task.cancel)
+        self._thread.join(timeout)
+        self._thread = None
+    
+    def _ensure_started(self):
+        """Фоновый поток создается при первой отправке и заново после fork"""
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            
+            self._pid = os.getpid()
+            self._loop = asyncio.new_event_loop()
+            self._wakeup = asyncio.Event()
+            started = threading.Event()
+            
+            def run_loop():
+                asyncio.set_event_loop(self._loop)
+                self._worker_task = self._loop.create_task(self._worker())
+                self._loop.call_soon(started.set)
+                try:
+                    self._loop.run_until_complete(self._worker_task)
+                except asyncio.CancelledError:
+                    pass
+                finally:
+                    self._loop.close()
+            
+            self._thread = threading.Thread(target=run_loop, name='telegram-send-queue', daemon=True)
+            self._thread.start()
+        
+        started.wait(5)
+    
+    async def _worker(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            
+            # Даем всплеску накопиться, чтобы отправить его одним сообщением
+            await asyncio.sleep(self.batch_window)
+            
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    break
+                for chat_id, parse_mode, text in batch:
+                    await self._send_with_limits(chat_id, text, parse_mode)
+            
+            with self._lock:
+                if not self._pending:
+                    self._idle.set()
+    
+    def _take_batch(self) -> List[tuple]:
+        """Все накопленные сообщения, склеенные по чатам в тексты не длиннее лимита Telegram"""
+        with self._lock:
+            items = list(self._pending.values())
+            self._pending.clear()
+        
+        grouped = OrderedDict()
+        for chat_id, parse_mode, text in items:
+            grouped.setdefault((chat_id, parse_mode), []).append(text)
+        
+        batch = []
+        for (chat_id, parse_mode), texts in grouped.items():
+            current = ''
+            for text in texts:
+                for chunk in self._split(text, parse_mode):
+                    if current and len(current) + len(self.SEPARATOR) + len(chunk) <= self.MAX_MESSAGE_LENGTH:
+                        current += self.SEPARATOR + chunk
+                    else:
+                        if current:
+                            batch.append((chat_id, parse_mode, current))
+                        current = chunk
+            if current:
+                batch.append((chat_id, parse_mode, current))
+        return batch
+    
+    def _split(self, text: str, parse_mode: Optional[str] = None) -> List[str]:
+        limit = self.MAX_MESSAGE_LENGTH
+        if len(text) <= limit:
+            return [text]
+        if (parse_mode or '').upper() == 'HTML':
+            return self._split_html(text, limit)
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    
+    def _split_html(self, text: str, limit: int) -> List[str]:
+        """
+        Разбиение HTML на части не длиннее limit с корректной разметкой в каждой части
+        Части заканчиваются на границе строки; строка длиннее лимита режется между токенами
+        """
+        chunks = []
+        stack = []  # открытые теги: (имя, открывающий тег)
+        current = ''
+        prefix = ''
+        
+        def closing(tags) -> str:
+            return ''.join(f"</{name}>" for name, _ in reversed(tags))
+        
+        def fits(extra: str, tags) -> bool:
+            return len(current) + len(extra) + len(closing(tags)) <= limit
+        
+        def flush():
+            nonlocal current, prefix
+            chunks.append(current + closing(stack))
+            prefix = current = ''.join(tag for _, tag in stack)
+        
+        for line in re.findall(r'[^\n]*\n|[^\n]+', text):
+            tokens = HTML_TOKEN.findall(line)
+            line_stack = self._apply_tags(stack, tokens)
+            if not fits(line, line_stack) and current != prefix:
+                flush()
+            if fits(line, line_stack):
+                current += line
+                stack = line_stack
+                continue
+            
+            # Строка не помещается даже в пустую часть - режем между токенами
+            for token in tokens:
+                pieces = [token] if token.startswith(('<', '&')) else [
+                    token[i:i + self.TEXT_PIECE_LENGTH] for i in range(0, len(token), self.TEXT_PIECE_LENGTH)
+                ]
+                for piece in pieces:
+                    piece_stack = self._apply_tags(stack, [piece])
+                    if not fits(piece, piece_stack) and current != prefix:
+                        flush()
+                    current += piece
+                    stack = piece_stack
+        
+        if current != prefix or not chunks:
+            chunks.append(current + closing(stack))
+        return chunks
+    
+    @staticmethod
+    def _apply_tags(stack: List[tuple], tokens: List[str]) -> List[tuple]:
+        """Стек открытых тегов после токенов"""
+        stack = list(stack)
+        for token in tokens:
+            if token.startswith('</'):
+                name = token[2:-1].strip().lower()
+                for index in range(len(stack) - 1, -1, -1):
+                    if stack[index][0] == name:
+                        del stack[index]
+                        break
+            elif token.startswith('<') and not token.endswith('/>'):
+                match = HTML_OPEN_TAG.match(token)
+                if match:
+                    stack.append((match.group(1).lower(), token))
+        return stack
+    
+    async def _send_with_limits(self, chat_id, text: str, parse_mode: str) -> bool:
+        for _ in range(self.max_retries):
+            await self._throttle(chat_id)
+            try:
+                await self.send_func(chat_id, text, parse_mode)
+                self.stats['sent'] += 1
+                return True
+            except Exception as e:
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is None and parse_mode and "can't parse entities" in str(e).lower():
+                    # Разметка не разобрана - сообщение не теряется, а уходит обычным текстом
+                    print(f"Telegram markup error, resending as plain text: {e}")
+                    text, parse_mode = self._plain_text(text), None
+                    continue
+                if retry_after is None:
+                    print(f"Telegram error: {e}")
+                    break
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                print(f"Telegram rate limit hit, retrying in {retry_after}s")
+                await asyncio.sleep(float(retry_after))
+        
+        self.stats['failed'] += 1
+        return False
+    
+    @staticmethod
+    def _plain_text(text: str) -> str:
+        return html.unescape(re.sub(r'<[^>]*>', '', text))
+    
+    async def _throttle(self, chat_id):
+        """Ожидание до момента, когда отправка не нарушит лимиты чата и бота"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            wait = self._chat_next_send.get(chat_id, 0) - now
+            if len(self._recent_sends) >= self.global_rate:
+                wait = max(wait, self._recent_sends[0] + 1.0 - now)
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        
+        now = loop.time()
+        interval = self.group_interval if str(chat_id).startswith('-') else self.chat_interval
+        self._chat_next_send[chat_id] = now + interval
+        self._recent_sends.append(now)
+
 
 class TelegramNotifier:
     """
@@ -18,6 +296,8 @@ class TelegramNotifier:
     - Ошибки выше критического уровня
     - Ежедневные отчеты
     - Статистика сверки
+    
+    Методы отправки не блокируют: сообщения уходят через TelegramSendQueue
     """
     
     def __init__(self, db=None):
@@ -28,27 +308,28 @@ class TelegramNotifier:
         
         if self.enabled:
             self.bot = Bot(token=self.bot_token)
+            self.queue = TelegramSendQueue(
+                self._deliver,
+                max_size=int(os.environ.get('TELEGRAM_QUEUE_SIZE', 500)),
+                batch_window=float(os.environ.get('TELEGRAM_BATCH_WINDOW', 1.0))
+            )
         else:
+            self.queue = None
             print("Telegram notifications disabled: missing bot token or chat ID")
     
-    async def send_message(self, message: str, parse_mode: str = 'HTML') -> bool:
-        """Отправка сообщения в Telegram"""
+    async def _deliver(self, chat_id, text: str, parse_mode: str):
+        """Фактическая отправка (выполняется в event loop очереди)"""
+        await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+    
+    def send_message(self, message: str, parse_mode: str = 'HTML', coalesce_key: Optional[str] = None) -> bool:
+        """Постановка сообщения в очередь отправки в Telegram"""
         if not self.enabled:
             print(f"Telegram disabled. Would send: {message}")
             return False
         
-        try:
-            await self.bot.send_message(
-                chat_id=self.chat_id,
-                text=message,
-                parse_mode=parse_mode
-            )
-            return True
-        except TelegramError as e:
-            print(f"Telegram error: {e}")
-            return False
+        return self.queue.submit(self.chat_id, message, parse_mode, coalesce_key)
     
-    async def send_critical_errors_alert(self, session_id: str, stats: Dict[str, int]):
+    def send_critical_errors_alert(self, session_id: str, stats: Dict[str, int]):
         """
         Отправка уведомления о критических ошибках
         Согласно промту: ошибки выше критического уровня
@@ -60,13 +341,9 @@ class TelegramNotifier:
         critical_threshold = 10
         if self.db:
             try:
-                config = self.db.execute_query(
-                    "SELECT config_value FROM system_config WHERE config_key = 'critical_error_threshold'"
-                )
-                if config:
-                    critical_threshold = int(config[0]['config_value'])
-            except:
-                pass
+                critical_threshold = get_config_service(self.db).get('critical_error_threshold', critical_threshold)
+            except Exception as e:
+                print(f"Error reading critical error threshold: {e}")
         
         # Подсчитываем общее количество ошибок
         total_errors = (
@@ -97,9 +374,9 @@ class TelegramNotifier:
 Требуется проверка данных!
             """.strip()
             
-            await self.send_message(message)
+            self.send_message(message, coalesce_key='critical_errors')
     
-    async def send_daily_report(self, report_date: Optional[date] = None):
+    def send_daily_report(self, report_date: Optional[date] = None):
         """Отправка ежедневного отчета"""
         if not self.enabled or not self.db:
             return
@@ -147,12 +424,12 @@ class TelegramNotifier:
 🕐 <b>Отчет сформирован:</b> {datetime.now().strftime('%H:%M')}
             """.strip()
             
-            await self.send_message(message)
+            self.send_message(message, coalesce_key=f"daily_report:{report_date.isoformat()}")
             
         except Exception as e:
             print(f"Error sending daily report: {e}")
     
-    async def send_processing_complete(self, session_id: str, stats: Dict[str, int], files_count: int):
+    def send_processing_complete(self, session_id: str, stats: Dict[str, int], files_count: int):
         """Уведомление о завершении обработки"""
         if not self.enabled:
             return
@@ -175,9 +452,32 @@ class TelegramNotifier:
 🕐 <b>Время:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}
         """.strip()
         
-        await self.send_message(message)
+        self.send_message(message, coalesce_key=f"processing:{session_id}")
     
-    async def send_machine_issues_alert(self, machine_code: str, error_count: int, error_rate: float):
+    def send_memory_budget_alert(self, session_id: str, exceeded: List[Dict[str, Any]]):
+        """Уведомление о превышении бюджета памяти этапами загрузки"""
+        if not self.enabled or not exceeded:
+            return
+        
+        stages = '\n'.join(
+            f"• {item['stage']}: +{item['rss_growth_mb']} МБ (пик RSS {item['peak_rss_mb']} МБ)"
+            for item in exceeded
+        )
+        message = f"""
+⚠️ <b>ПРЕВЫШЕН БЮДЖЕТ ПАМЯТИ</b>
+
+🆔 <b>Сессия:</b> {session_id[:8]}...
+📏 <b>Бюджет на этап:</b> {exceeded[0]['budget_mb']} МБ
+
+<b>Этапы:</b>
+{stages}
+
+🕐 <b>Время:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}
+        """.strip()
+        
+        self.send_message(message, coalesce_key='memory_budget')
+    
+    def send_machine_issues_alert(self, machine_code: str, error_count: int, error_rate: float):
         """Уведомление о проблемах с конкретным автоматом"""
         if not self.enabled:
             return
@@ -194,19 +494,18 @@ class TelegramNotifier:
 🕐 <b>Время:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}
             """.strip()
             
-            await self.send_message(message)
+            self.send_message(message, coalesce_key=f"machine:{machine_code}")
     
     def send_sync(self, message: str):
-        """Синхронная отправка сообщения"""
+        """Отправка сообщения (совместимость: теперь тоже через очередь)"""
         if not self.enabled:
             return False
         
-        try:
-            asyncio.run(self.send_message(message))
-            return True
-        except Exception as e:
-            print(f"Error sending sync message: {e}")
-            return False
+        return self.send_message(message)
+    
+    def flush(self, timeout: float = 30) -> bool:
+        """Ожидание отправки накопленных сообщений (например, перед остановкой процесса)"""
+        return self.queue.flush(timeout) if self.queue else True
 
 
 class TelegramBot:
@@ -261,13 +560,13 @@ class TelegramBot:
     async def _get_current_stats(self) -> str:
         """Получение текущей статистики"""
         try:
-            stats = self.db.execute_query("""
+            stats = self.db.execute_query(f"""
                 SELECT 
                     COUNT(*) as total_orders,
                     COUNT(CASE WHEN error_type = 'OK' THEN 1 END) as successful_orders,
                     COUNT(CASE WHEN error_type != 'OK' AND error_type != 'UNPROCESSED' THEN 1 END) as error_orders
                 FROM orders 
-                WHERE creation_time >= CURRENT_DATE - INTERVAL '7 days'
+                WHERE creation_time >= {self.db.query_builder.date_days_ago(7)}
             """)
             
             if stats:
@@ -331,7 +630,7 @@ class TelegramBot:
     async def _get_machine_issues(self) -> str:
         """Получение списка проблемных автоматов"""
         try:
-            machine_issues = self.db.execute_query("""
+            machine_issues = self.db.execute_query(f"""
                 SELECT 
                     machine_code,
                     COUNT(*) as total_orders,
@@ -342,7 +641,7 @@ class TelegramBot:
                     ) as error_rate
                 FROM orders 
                 WHERE machine_code IS NOT NULL 
-                    AND creation_time >= CURRENT_DATE - INTERVAL '3 days'
+                    AND creation_time >= {self.db.query_builder.date_days_ago(3)}
                 GROUP BY machine_code
                 HAVING COUNT(CASE WHEN error_type != 'OK' THEN 1 END) > 0
                 ORDER BY error_rate DESC
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование оптимального сопоставления
+Венгерский алгоритм и режим optimal для фискальных чеков
+"""
+
+import itertools
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from assignment import assign_by_time, hungarian
+from processors_updated import OrderProcessor
+from test_finance_processor import temporary_database
+
+
+def test_hungarian_matches_brute_force():
+    """Стоимость назначения совпадает с полным перебором"""
+    print("🔍 Тестирование венгерского алгоритма...")
+
+    rng = random.Random(42)
+    for _ in range(50):
+        rows, columns = rng.randint(1, 5), rng.randint(1, 5)
+        cost = [[rng.randint(0, 60) for _ in range(columns)] for _ in range(rows)]
+
+        pairs = hungarian(cost)
+        assert len(pairs) == min(rows, columns)
+        assert len({r for r, _ in pairs}) == len(pairs) == len({c for _, c in pairs})
+
+        if rows <= columns:
+            best = min(sum(cost[r][c] for r, c in enumerate(perm))
+                       for perm in itertools.permutations(range(columns), rows))
+        else:
+            best = min(sum(cost[r][c] for c, r in enumerate(perm))
+                       for perm in itertools.permutations(range(rows), columns))
+        assert sum(cost[r][c] for r, c in pairs) == best
+
+    print("✅ Оптимум найден на 50 случайных матрицах")
+    return True
+
+
+def test_crowded_window_assigns_every_receipt():
+    """Два кофе одной цены в пределах минуты: жадный выбор теряет чек, оптимальный - нет"""
+    print("\n🔍 Тестирование кластеров с одинаковыми суммами...")
+
+    base = datetime(2024, 5, 1, 10, 0, 0)
+    orders = [(base, 15000.0), (base + timedelta(seconds=70), 15000.0),
+              (base + timedelta(hours=1), 9000.0)]
+    receipts = [(base + timedelta(seconds=40), 15000.0), (base + timedelta(seconds=130), 15000.0),
+                (base + timedelta(hours=1, seconds=5), 9000.0), (base + timedelta(hours=2), 9000.0)]
+
+    result = assign_by_time(receipts, orders, 60, 0.01)
+    assert [entry['order'] for entry in result] == [0, 1, 2, None]
+    assert result[0]['candidates'] == [1, 0]
+    assert result[3]['candidates'] == []
+
+    with temporary_database() as (db, tmp_dir):
+        db.execute_query("""CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, payment_type TEXT, order_resource TEXT,
+            paying_time TIMESTAMP, order_price DECIMAL(10,2), match_status TEXT DEFAULT 'unmatched',
+            match_candidates TEXT, fiscal_time TIMESTAMP, fiscal_amount DECIMAL(10,2), fiscal_check_number TEXT,
+            taxpayer_id TEXT, cash_register_id TEXT, shift_number INTEGER, receipt_type TEXT,
+            fiscal_matched BOOLEAN DEFAULT 0, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        db.execute_query("""CREATE TABLE unmatched_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, record_type TEXT, record_data TEXT, record_time TIMESTAMP,
+            record_amount DECIMAL(10,2), attempts INTEGER DEFAULT 0, last_attempt TIMESTAMP
+        )""")
+        for number, (paying_time, price) in zip(['N1', 'N2'], orders[:2]):
+            db.execute_query(
+                "INSERT INTO orders (order_number, payment_type, paying_time, order_price, match_status) "
+                "VALUES (?, 'Cash', ?, ?, 'matched')",
+                (number, paying_time, price)
+            )
+
+        fiscal_path = os.path.join(tmp_dir, 'fiscal.csv')
+        with open(fiscal_path, 'w', encoding='utf-8') as f:
+            f.write("fiscal_check_number,fiscal_time,amount\n")
+            f.write("F-1,2024-05-01 10:00:40,15000\n")
+            f.write("F-2,2024-05-01 10:02:10,15000\n")
+
+        processor = OrderProcessor(db)
+        processor.assignment_mode = 'optimal'
+        assert processor.process_fiscal_file(fiscal_path) == 2
+
+        rows = {row['order_number']: row for row in db.execute_query("SELECT * FROM orders")}
+        assert rows['N1']['fiscal_check_number'] == 'F-1'
+        assert rows['N2']['fiscal_check_number'] == 'F-2'
+        assert rows['N1']['match_candidates'] == f"[{rows['N2']['id']}, {rows['N1']['id']}]"
+        assert rows['N2']['match_candidates'] is None
+        assert db.execute_query("SELECT COUNT(*) AS count FROM unmatched_records")[0]['count'] == 0
+
+    print("✅ Все чеки сопоставлены, кандидаты сохранены для аудита")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_hungarian_matches_brute_force,
+        test_crowded_window_assigns_every_receipt,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование потокового резервного копирования
+Multipart загрузка проверяется на локальной замене S3-клиента
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+from backup_writer import StreamingBackupWriter, LocalS3Client, iter_rows
+from test_finance_processor import temporary_database
+
+
+def test_streaming_backup_is_complete_and_checksummed():
+    """Все строки выгружаются частями, манифест совпадает с содержимым"""
+    print("🔍 Тестирование потоковой резервной копии...")
+
+    with temporary_database() as (db, tmp_dir):
+        db.execute_query("""CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, machine_code TEXT,
+            creation_time TIMESTAMP, order_price DECIMAL(10,2), goods_name TEXT
+        )""")
+        cursor = db.connection.cursor()
+        cursor.executemany(
+            "INSERT INTO orders (order_number, machine_code, creation_time, order_price, goods_name) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(f"N{i}", f"M{i % 7}", f"2024-05-01 {i % 24:02d}:00:00", 1000 + i, f"Капучино {i}")
+             for i in range(2500)]
+        )
+        db.connection.commit()
+        cursor.close()
+
+        client = LocalS3Client(os.path.join(tmp_dir, 'storage'))
+        writer = StreamingBackupWriter(client, 'bucket', 'backups/2024/05/01', part_size=4096, batch_size=100)
+
+        entry = writer.write_rows('orders', iter_rows(db, "SELECT * FROM orders ORDER BY id", batch_size=100))
+        manifest = writer.write_manifest({'date': '2024-05-01'})
+
+        assert entry['rows'] == 2500
+        assert entry['parts'] > 1
+
+        object_path = os.path.join(tmp_dir, 'storage', 'bucket', 'backups', '2024', '05', '01', 'orders.ndjson.gz')
+        with open(object_path, 'rb') as f:
+            compressed = f.read()
+        assert hashlib.sha256(compressed).hexdigest() == entry['sha256']
+        assert len(compressed) == entry['bytes']
+
+        content = gzip.decompress(compressed)
+        assert hashlib.sha256(content).hexdigest() == entry['content_sha256']
+        lines = content.decode('utf-8').splitlines()
+        assert len(lines) == 2500
+        assert json.loads(lines[-1])['goods_name'] == 'Капучино 2499'
+
+        manifest_path = os.path.join(os.path.dirname(object_path), 'manifest.json')
+        with open(manifest_path, encoding='utf-8') as f:
+            stored = json.load(f)
+        assert stored['total_rows'] == 2500 == manifest['total_rows']
+        assert stored['files'][0]['sha256'] == entry['sha256']
+        assert stored['date'] == '2024-05-01'
+
+        # Незавершенные загрузки не оставляют частей
+        assert not os.listdir(os.path.join(tmp_dir, 'storage', '.multipart'))
+
+    print("✅ Копия полная, контрольные суммы совпадают")
+    return True
+
+
+def test_failed_backup_aborts_upload():
+    """Ошибка при чтении строк отменяет multipart загрузку"""
+    print("\n🔍 Тестирование отмены загрузки...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        client = LocalS3Client(tmp_dir)
+        writer = StreamingBackupWriter(client, 'bucket', 'backups/x', part_size=64)
+
+        def broken_rows():
+            for i in range(100):
+                yield {'id': i, 'payload': 'x' * 50}
+            raise RuntimeError("connection lost")
+
+        try:
+            writer.write_rows('orders', broken_rows())
+            assert False, "ожидалась ошибка"
+        except RuntimeError:
+            pass
+
+        assert not os.path.exists(os.path.join(tmp_dir, 'bucket', 'backups', 'x', 'orders.ndjson.gz'))
+        assert not os.listdir(os.path.join(tmp_dir, '.multipart'))
+        assert writer.files == []
+
+    print("✅ Частичная копия не сохраняется")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_streaming_backup_is_complete_and_checksummed,
+        test_failed_backup_aborts_upload,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
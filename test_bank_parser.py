@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование парсера банковских выписок
+Проверка сверки транзакций с заказами
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from bank_parser import BankStatementParser
+
+GATEWAYS = ['payme', 'click', 'uzum', 'cash', '']
+PRICES = [5000.0, 8000.0, 12000.0, 15000.0, 15100.0, 15800.0, 20000.0]
+
+
+def legacy_reconcile(parser, transactions, orders_data, time_tolerance_minutes=10):
+    """Прежний попарный алгоритм сверки, эталон для сравнения"""
+    matched = []
+    remaining_orders = orders_data.copy()
+
+    for transaction in transactions:
+        best_match = None
+        best_score = 0
+        for order in remaining_orders:
+            score = parser._calculate_match_score(transaction, order, time_tolerance_minutes)
+            if score > best_score and score >= 0.7:
+                best_match = order
+                best_score = score
+        if best_match:
+            matched.append((transaction['id'], best_match['id'], best_score))
+            remaining_orders.remove(best_match)
+
+    return matched, [order['id'] for order in remaining_orders]
+
+
+def generate_data(seed, transactions_count=150, orders_count=300):
+    """Синтетические заказы с частыми ценами и временем около полуночи"""
+    rnd = random.Random(seed)
+    start = datetime(2024, 5, 1)
+
+    orders = []
+    for i in range(orders_count):
+        day = start + timedelta(days=rnd.randint(0, 3))
+        if rnd.random() < 0.5:
+            moment = day + timedelta(minutes=rnd.randint(-30, 30))
+        else:
+            moment = day + timedelta(minutes=rnd.randint(0, 1439))
+        time_value = moment.isoformat()
+        if rnd.random() < 0.05:
+            time_value += 'Z'
+        orders.append({
+            'id': i,
+            'order_price': rnd.choice(PRICES + [0, rnd.uniform(4000, 21000)]),
+            'payment_gateway': rnd.choice(GATEWAYS),
+            'paying_time': time_value if rnd.random() < 0.9 else None,
+            'creation_time': moment.isoformat(),
+        })
+
+    transactions = []
+    for i in range(transactions_count):
+        gross = rnd.choice(PRICES) * rnd.choice([1.0, 1.0, 1.02, 1.04, 0.97])
+        transactions.append({
+            'id': i,
+            'payment_system': rnd.choice(GATEWAYS[:4] + ['unknown']),
+            'net_amount': gross * 0.98,
+            'amount': gross,
+            'transaction_date': (start + timedelta(days=rnd.randint(0, 3))).strftime('%Y-%m-%d'),
+        })
+
+    return transactions, orders
+
+
+def test_indexed_reconciliation_matches_pairwise():
+    """Индексированная сверка дает те же пары и оценки, что и попарный перебор"""
+    print("🔍 Тестирование индексированной сверки...")
+
+    parser = BankStatementParser()
+
+    for seed in range(4):
+        transactions, orders = generate_data(seed)
+        for tolerance in (10, 45):
+            result = parser.reconcile_with_orders(transactions, orders, tolerance)
+            expected_matched, expected_unmatched = legacy_reconcile(parser, transactions, orders, tolerance)
+
+            actual = [(m['transaction']['id'], m['order']['id'], m['match_score']) for m in result['matched']]
+            assert actual == expected_matched, f"seed={seed}, tolerance={tolerance}"
+            assert [o['id'] for o in result['unmatched_orders']] == expected_unmatched
+            assert result['summary']['matched_count'] == len(expected_matched)
+            assert len(result['unmatched_transactions']) == len(transactions) - len(expected_matched)
+
+    print("✅ Результаты совпадают с попарным перебором")
+    return True
+
+
+def generate_statement_frame(seed, rows=300):
+    """Выписка со смешанными форматами дат, сумм и описаний"""
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    descriptions = ['Оплата PAYME TASHKENT', 'CLICK UZBEKISTAN перевод', 'UZUM BANK', 'ИНКАССАЦИЯ выручки',
+                    'прочее', 'CLICK UZ и PAYME UZ', None, 'Uzum pay', 'infinity click']
+    records = []
+    for _ in range(rows):
+        records.append({
+            'Дата операции': rnd.choice([
+                f"{rnd.randint(1, 28):02d}.05.2024",
+                f"2024-05-{rnd.randint(1, 28):02d} 1{rnd.randint(0, 9)}:3{rnd.randint(0, 9)}:00",
+                f"{rnd.randint(1, 28):02d}/05/2024 10:15",
+                datetime(2024, 5, rnd.randint(1, 28), rnd.randint(0, 23), 5),
+                'нет даты', None, 20240501
+            ]),
+            'Сумма': rnd.choice([
+                rnd.randint(-50000, 90000), f"{rnd.randint(1, 90000)},50", f"1 234.{rnd.randint(0, 99)} сум",
+                'н/д', None, 0, float(rnd.randint(1, 9999))
+            ]),
+            'Назначение платежа': rnd.choice(descriptions),
+            'Контрагент': rnd.choice(['OOO PAYME', 'ООО КЛИК', None, 'ИП Ромашка']),
+            'Кредит': rnd.choice([None, 0, 100, '5'])
+        })
+    return pd.DataFrame(records)
+
+
+def test_vectorized_statement_parsing_matches_rows():
+    """Разбор выписки по колонкам совпадает с построчным _parse_transaction"""
+    print("\n🔍 Тестирование векторного разбора выписки...")
+
+    import contextlib
+    import io
+
+    parser = BankStatementParser()
+    for seed in range(5):
+        df = parser._normalize_columns(generate_statement_frame(seed))
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [t for t in (parser._parse_transaction(row, 'ACC1') for _, row in df.iterrows()) if t]
+        actual = parser._parse_transactions_frame(df, 'ACC1')
+
+        assert len(actual) == len(expected) > 0
+        for got, want in zip(actual, expected):
+            got_raw, want_raw = got.pop('raw_data'), want.pop('raw_data')
+            assert got == want, (got, want)
+            assert got_raw.keys() == want_raw.keys()
+
+        grouped = parser._group_by_payment_system(actual)
+        assert list(grouped) == list(dict.fromkeys(t['payment_system'] for t in actual))
+        for system, stats in grouped.items():
+            members = [t for t in actual if t['payment_system'] == system]
+            assert stats['count'] == len(members)
+            assert stats['transactions'] == members
+            assert abs(stats['net_amount'] - sum(t['net_amount'] for t in members)) < 1e-6
+
+    # Приоритет систем сохраняется, даже если другая упомянута в тексте раньше
+    import pandas as pd
+    text = pd.Series(['CLICK UZ, затем PAYME UZ', 'прочее'])
+    assert parser._identify_payment_systems(text, pd.Series(['', ''])).tolist() == ['payme', 'other']
+
+    print("✅ Результаты совпадают с построчным разбором")
+    return True
+
+
+def test_csv_dialect_sniffing_and_cache():
+    """Диалект CSV определяется за один разбор и запоминается для счета"""
+    print("\n🔍 Тестирование определения диалекта CSV...")
+
+    import bank_parser
+    from unittest import mock
+
+    parser = BankStatementParser()
+    header = 'Дата;Сумма;Назначение платежа;Контрагент;Номер документа'
+    body = '\n'.join(
+        f"0{day}.05.2024;{day * 1000},50;Оплата PAYME TASHKENT;OOO PAYME;{day}" for day in range(1, 8)
+    )
+    preamble = 'АКБ Капиталбанк\nВыписка по счету 20208000123\n\n'
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cp1251_path = os.path.join(tmp_dir, 'statement_cp1251.csv')
+        with open(cp1251_path, 'w', encoding='cp1251') as f:
+            f.write(preamble + header + '\n' + body + '\n')
+
+        utf8_path = os.path.join(tmp_dir, 'statement_utf8.csv')
+        with open(utf8_path, 'w', encoding='utf-8') as f:
+            f.write(header.replace(';', ',') + '\n' + '\n'.join(
+                f"0{day}.05.2024,{day * 1000},Оплата PAYME TASHKENT,OOO PAYME,{day}" for day in range(1, 8)
+            ) + '\n')
+
+        dialect = parser._sniff_csv_dialect(cp1251_path)
+        assert dialect == {'encoding': 'cp1251', 'sep': ';', 'skiprows': 3}
+        assert parser._sniff_csv_dialect(utf8_path) == {'encoding': 'utf-8', 'sep': ',', 'skiprows': 0}
+
+        bank_parser._statement_dialects.clear()
+        with mock.patch.object(bank_parser.pd, 'read_csv', wraps=bank_parser.pd.read_csv) as read_csv:
+            result = parser.parse_statement(cp1251_path, bank_account='20208000123')
+            assert read_csv.call_count == 1
+        assert result['status'] == 'success'
+        assert result['total_transactions'] == 7
+        assert result['transactions'][0]['payment_system'] == 'payme'
+        assert result['transactions'][0]['amount'] == 1000.5
+
+        # Повторная выписка того же счета - без определения диалекта
+        with mock.patch.object(parser, '_sniff_csv_dialect') as sniff:
+            assert parser.parse_statement(cp1251_path, bank_account='20208000123')['total_transactions'] == 7
+            sniff.assert_not_called()
+
+        # Запомненный диалект не подходит к новому файлу счета - определяется заново
+        assert parser.parse_statement(utf8_path, bank_account='20208000123')['total_transactions'] == 7
+        assert bank_parser._statement_dialects['20208000123']['sep'] == ','
+        bank_parser._statement_dialects.clear()
+
+    print("✅ Диалект определен, выписка прочитана одним разбором")
+    return True
+
+
+def test_settlement_reconciliation_single_and_multi_day():
+    """Зачисления шлюзов сверяются с дневными итогами, включая зачисление за несколько дней"""
+    print("\n🔍 Тестирование сверки дневных зачислений...")
+
+    parser = BankStatementParser()
+    orders = []
+    for day, prices in {1: [15000, 12000], 2: [20000] * 3, 3: [8000, 8000], 4: [5000]}.items():
+        for i, price in enumerate(prices):
+            orders.append({
+                'order_price': price, 'payment_gateway': 'payme',
+                'paying_time': f"2024-05-0{day} 1{i}:00:00"
+            })
+    orders.append({'order_price': 9000, 'payment_gateway': 'click', 'paying_time': '2024-05-02 09:00:00'})
+    orders.append({'order_price': 7000, 'payment_gateway': 'cash', 'paying_time': '2024-05-02 09:00:00'})
+
+    daily_totals = parser.compute_daily_settlement_totals(orders)
+    assert len(daily_totals) == 5
+    assert {d['settlement_date']: d['net_amount'] for d in daily_totals if d['payment_system'] == 'payme'} == {
+        '2024-05-01': 27000 * 0.98, '2024-05-02': 60000 * 0.98,
+        '2024-05-03': 16000 * 0.98, '2024-05-04': 5000 * 0.98
+    }
+
+    transactions = [
+        # 01.05 зачислено 02.05, 02.05 - 03.05, 03.05 и 04.05 одной суммой 05.05
+        {'payment_system': 'payme', 'transaction_date': '2024-05-02', 'amount': 26460.0},
+        {'payment_system': 'payme', 'transaction_date': '2024-05-03', 'amount': 58800.0},
+        {'payment_system': 'payme', 'transaction_date': '2024-05-05', 'amount': 20580.0},
+        {'payment_system': 'click', 'transaction_date': '2024-05-03', 'amount': 1234.0},
+        {'payment_system': 'other', 'transaction_date': '2024-05-03', 'amount': 500.0},
+    ]
+    result = parser.reconcile_settlements(transactions, daily_totals)
+
+    assert [m['settlement_dates'] for m in result['matched']] == [
+        ['2024-05-01'], ['2024-05-02'], ['2024-05-03', '2024-05-04']
+    ]
+    assert result['summary']['multi_day_count'] == 1
+    assert result['matched'][2]['orders_count'] == 3
+    assert len(result['unmatched_transactions']) == 1
+    assert len(result['other_transactions']) == 1
+    assert [(d['payment_system'], d['settlement_date']) for d in result['unsettled_days']] == [('click', '2024-05-02')]
+
+    print("✅ Дневные и многодневные зачисления сопоставлены")
+    return True
+
+
+def test_daily_settlement_totals_from_database():
+    """Дневные итоги считаются агрегатным запросом в БД"""
+    print("\n🔍 Тестирование агрегата дневных итогов в БД...")
+
+    from models import Database
+    from processors import FinanceProcessor
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        previous_path = os.environ.get('SQLITE_DB_PATH')
+        os.environ['SQLITE_DB_PATH'] = os.path.join(tmp_dir, 'orders.db')
+        try:
+            db = Database()
+            db.execute_query("""CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, order_price DECIMAL(10,2),
+                payment_gateway TEXT, paying_time TIMESTAMP, creation_time TIMESTAMP
+            )""")
+            for number, (price, gateway, paying_time) in enumerate([
+                (15000, 'payme', '2024-05-01 10:00:00'),
+                (12000, 'payme', '2024-05-01 23:59:00'),
+                (9000, 'click', '2024-05-02 09:00:00'),
+                (7000, 'cash', '2024-05-02 09:00:00'),
+                (5000, 'payme', None),
+            ]):
+                db.execute_query(
+                    "INSERT INTO orders (order_number, order_price, payment_gateway, paying_time, creation_time) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (str(number), price, gateway, paying_time, '2024-05-03 08:00:00')
+                )
+
+            finance = FinanceProcessor(db)
+            totals = finance.get_daily_settlement_totals('2024-05-01', '2024-05-31')
+            # Повторный вызов берет скомпилированный запрос из кэша построителя
+            hits = db.query_builder.stats()['hits']
+            assert finance.get_daily_settlement_totals('2024-05-01', '2024-05-31') == totals
+            assert db.query_builder.stats()['hits'] == hits + 1
+            db.close()
+        finally:
+            if previous_path is None:
+                os.environ.pop('SQLITE_DB_PATH', None)
+            else:
+                os.environ['SQLITE_DB_PATH'] = previous_path
+
+    assert [(d['payment_system'], d['settlement_date'], d['orders_count'], d['gross_amount']) for d in totals] == [
+        ('click', '2024-05-02', 1, 9000.0),
+        ('payme', '2024-05-01', 2, 27000.0),
+        ('payme', '2024-05-03', 1, 5000.0),
+    ]
+    assert totals[1]['net_amount'] == 27000 * 0.98
+
+    print("✅ Агрегат совпадает со сверткой в памяти")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_indexed_reconciliation_matches_pairwise,
+        test_vectorized_statement_parsing_matches_rows,
+        test_csv_dialect_sniffing_and_cache,
+        test_settlement_reconciliation_single_and_multi_day,
+        test_daily_settlement_totals_from_database,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
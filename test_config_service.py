@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование кэша system_config
+Настройки читаются один раз, изменение строк увеличивает версию и сбрасывает кэш
+"""
+
+import sys
+
+from config_service import ConfigService
+from processors_updated import OrderProcessor
+from test_finance_processor import temporary_database
+
+
+def count_queries(db):
+    """Подсчет запросов через execute_query"""
+    calls = []
+    execute_query = db.execute_query
+
+    def wrapper(query, params=None):
+        calls.append(query)
+        return execute_query(query, params)
+
+    db.execute_query = wrapper
+    return calls
+
+
+def test_typed_values_and_defaults():
+    """Значения приводятся к типам, пропущенные и битые - по умолчанию"""
+    print("🔍 Тестирование типов настроек...")
+
+    with temporary_database() as (db, _):
+        config = ConfigService(db)
+        for key, value in (('time_tolerance_seconds', '90'), ('amount_tolerance', '0.5'),
+                           ('auto_matching_enabled', 'false'), ('fiscal_time_window', 'abc'),
+                           ('app_version', '2.0.0')):
+            db.execute_query("INSERT INTO system_config (config_key, config_value) VALUES (?, ?)", (key, value))
+        config.refresh()
+
+        assert config.get('time_tolerance_seconds') == 90
+        assert config.get('amount_tolerance') == 0.5
+        assert config.get('auto_matching_enabled') is False
+        assert config.get('fiscal_time_window') == 60
+        assert config.get('gateway_time_window') == 60
+        assert config.get('app_version') == '2.0.0'
+        assert config.get('critical_error_threshold', 10) == 10
+        assert config.snapshot()['debug_mode'] is False
+
+    print("✅ Типы и значения по умолчанию корректны")
+    return True
+
+
+def test_cache_invalidated_by_version():
+    """Чтение из кэша без запросов; изменение строки подхватывается по версии"""
+    print("🔍 Тестирование версии настроек...")
+
+    with temporary_database() as (db, _):
+        config = ConfigService(db, check_interval=3600)
+        version = config.version
+
+        calls = count_queries(db)
+        for _ in range(1000):
+            config.get('amount_tolerance')
+        assert calls == []
+
+        # Изменение в обход сервиса (например, вручную в БД)
+        db.execute_query("INSERT INTO system_config (config_key, config_value) VALUES ('fiscal_time_window', '120')")
+        assert config.get('fiscal_time_window') == 60
+        assert config.refresh() is True
+        assert config.version > version
+        assert config.get('fiscal_time_window') == 120
+
+        # Без изменений refresh() ограничивается проверкой версии
+        loads = config.stats['loads']
+        assert config.refresh() is False
+        assert config.stats['loads'] == loads
+
+        assert config.set('fiscal_time_window', 30)
+        assert config.get('fiscal_time_window') == 30
+
+    print("✅ Кэш сбрасывается при изменении system_config")
+    return True
+
+
+def test_processor_uses_config_windows():
+    """Процессор берет окна из общего кэша без пересоздания"""
+    print("🔍 Тестирование окон сопоставления процессора...")
+
+    with temporary_database() as (db, _):
+        db.execute_query("CREATE TABLE orders (id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT)")
+        processor = OrderProcessor(db)
+        assert processor.fiscal_time_window == 60
+        assert processor.amount_tolerance == 0.01
+
+        processor.config.set('fiscal_time_window', 180)
+        processor.config.set('amount_tolerance', '1')
+        assert processor.fiscal_time_window == 180
+        assert processor.gateway_time_window == 60
+        assert processor.amount_tolerance == 1.0
+
+        assert OrderProcessor(db).config is processor.config
+
+    print("✅ Окна процессора настраиваются через system_config")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_typed_values_and_defaults,
+        test_cache_invalidated_by_version,
+        test_processor_uses_config_windows,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
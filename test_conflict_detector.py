@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование поиска конфликтов
+Пары заказов ищутся по корзинам времени на одном автомате, дубли не пишутся
+"""
+
+import json
+import sys
+
+from processors_updated import OrderProcessor
+from test_finance_processor import temporary_database
+
+
+def create_orders_table(db):
+    db.execute_query("""CREATE TABLE orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, machine_code TEXT,
+        creation_time TIMESTAMP, event_time TIMESTAMP, paying_time TIMESTAMP, order_price DECIMAL(10,2),
+        source TEXT, match_status TEXT, mismatch_details TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+
+def insert_order(db, number, machine, moment, price, source):
+    time_column = 'creation_time' if source == 'happy_workers' else 'event_time'
+    status = 'hw_only' if source == 'happy_workers' else 'vendhub_only'
+    db.execute_query(
+        f"INSERT INTO orders (order_number, machine_code, {time_column}, order_price, source, match_status) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (number, machine, moment, price, source, status)
+    )
+
+
+def test_bucketed_pass_finds_number_and_amount_conflicts():
+    """Номер и сумма расходятся только у близких заказов одного автомата из разных источников"""
+    print("🔍 Тестирование поиска конфликтов...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        for number, machine, moment, price, source in [
+            ('N1', 'M1', '2024-05-01 10:00:00', 15000, 'happy_workers'),
+            ('V1', 'M1', '2024-05-01 10:00:30', 15000, 'vendhub'),       # другой номер
+            ('N2', 'M1', '2024-05-01 10:30:50', 9000, 'happy_workers'),
+            ('V2', 'M1', '2024-05-01 10:31:20', 9500, 'vendhub'),        # другая сумма, соседняя корзина
+            ('N3', 'M1', '2024-05-01 11:00:00', 15000, 'happy_workers'),
+            ('V3', 'M1', '2024-05-01 11:01:30', 15000, 'vendhub'),       # вне окна
+            ('N4', 'M2', '2024-05-01 10:00:10', 15000, 'happy_workers'), # другой автомат
+            ('N5', 'M1', '2024-05-01 12:00:00', 7000, 'happy_workers'),
+            ('N6', 'M1', '2024-05-01 12:00:05', 7000, 'happy_workers'),  # один источник
+        ]:
+            insert_order(db, number, machine, moment, price, source)
+
+        detector = OrderProcessor(db).conflict_detector
+        assert detector.run() == {'number_mismatch': 1, 'amount_mismatch': 1}
+
+        conflicts = {row['conflict_type']: row for row in detector.get_conflicts()}
+        data = json.loads(conflicts['number_mismatch']['conflict_data'])
+        assert sorted(data['order_numbers']) == ['N1', 'V1'] and data['seconds_apart'] == 30
+        assert conflicts['number_mismatch']['order_id_1'] < conflicts['number_mismatch']['order_id_2']
+        assert sorted(json.loads(conflicts['amount_mismatch']['conflict_data'])['prices']) == [9000, 9500]
+
+        # Повторный проход не создает дублей
+        assert detector.run() == {}
+        assert db.execute_query("SELECT COUNT(*) AS count FROM conflicts")[0]['count'] == 2
+
+        # Проход после загрузки смотрит только на интервал новых заказов
+        since = db.execute_query("SELECT CURRENT_TIMESTAMP AS now")[0]['now']
+        db.execute_query("UPDATE orders SET updated_at = '2000-01-01 00:00:00'")
+        insert_order(db, 'V5', 'M1', '2024-05-01 12:00:20', 7000, 'vendhub')
+        assert detector.run(since=since) == {'number_mismatch': 2}
+
+    print("✅ Конфликты найдены без попарного сравнения всей таблицы")
+    return True
+
+
+def test_vendhub_mismatch_is_recorded_once():
+    """Расхождение цены при загрузке VendHub пишется в conflicts один раз"""
+    print("\n🔍 Тестирование записи расхождений...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        insert_order(db, 'N1', 'M1', '2024-05-01 10:00:00', 15000, 'happy_workers')
+        processor = OrderProcessor(db)
+
+        for _ in range(2):
+            processor._log_mismatch(1, 'price_mismatch', 'HW price: 15000, VH price: 14000')
+
+        conflicts = processor.conflict_detector.get_conflicts()
+        assert len(conflicts) == 1
+        assert conflicts[0]['conflict_type'] == 'amount_mismatch' and conflicts[0]['order_id_2'] is None
+
+    print("✅ Расхождение записано без дублей")
+    return True
+
+
+def test_window_and_tolerance_come_from_config():
+    """Окно и допуск по сумме читаются из system_config"""
+    print("\n🔍 Тестирование настроек поиска конфликтов...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        for number, machine, moment, price, source in [
+            ('N2', 'M1', '2024-05-01 10:30:50', 9000, 'happy_workers'),
+            ('V2', 'M1', '2024-05-01 10:31:20', 9500, 'vendhub'),        # сумма в пределах допуска
+            ('N3', 'M1', '2024-05-01 11:00:00', 15000, 'happy_workers'),
+            ('V3', 'M1', '2024-05-01 11:01:30', 15000, 'vendhub'),       # 90 секунд - внутри окна
+        ]:
+            insert_order(db, number, machine, moment, price, source)
+
+        detector = OrderProcessor(db).conflict_detector
+        assert detector.config.set('hw_vendhub_time_window', 120)
+        assert detector.config.set('amount_tolerance', 600)
+        assert (detector.window_seconds, detector.amount_tolerance) == (120, 600.0)
+
+        assert detector.run() == {'number_mismatch': 2}
+
+    print("✅ Настройки из system_config применяются")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_bucketed_pass_finds_number_and_amount_conflicts,
+        test_vendhub_mismatch_is_recorded_once,
+        test_window_and_tolerance_come_from_config,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование финансового процессора
+Импорт банковских выписок и кассовые остатки на временной SQLite базе
+"""
+
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+from models import Database
+from processors import FinanceProcessor, OrderProcessor
+
+
+@contextmanager
+def temporary_database():
+    """Отдельная SQLite база во временной папке"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        previous_path = os.environ.get('SQLITE_DB_PATH')
+        os.environ['SQLITE_DB_PATH'] = os.path.join(tmp_dir, 'orders.db')
+        db = Database()
+        try:
+            yield db, tmp_dir
+        finally:
+            db.close()
+            if previous_path is None:
+                os.environ.pop('SQLITE_DB_PATH', None)
+            else:
+                os.environ['SQLITE_DB_PATH'] = previous_path
+
+
+def test_bank_statement_bulk_import_skips_duplicates():
+    """Повторный импорт выписки не удваивает суммы"""
+    print("🔍 Тестирование пакетного импорта выписки...")
+
+    with temporary_database() as (db, tmp_dir):
+        finance = FinanceProcessor(db)
+
+        statement_path = os.path.join(tmp_dir, 'statement.csv')
+        with open(statement_path, 'w', encoding='utf-8') as f:
+            f.write("Date,Amount,Description,Account,Type,Reference\n")
+            f.write("2024-05-01,150000.00,PAYME TASHKENT,20208000123,credit,A-1\n")
+            f.write("2024-05-01,150000.00,PAYME TASHKENT,20208000123,credit,A-2\n")
+            f.write("2024-05-02,-5000.00,Комиссия банка,20208000123,debit,A-3\n")
+            f.write("2024-05-02,98000.50,CLICK UZ,20208000123,credit,\n")
+            # Две одинаковые выплаты без референса за день - разные поступления
+            f.write("2024-05-02,40000.00,CLICK UZ,20208000123,credit,\n")
+            f.write("2024-05-02,40000.00,CLICK UZ,20208000123,credit,\n")
+            f.write("2024-05-02 15:30:00,40000.00,CLICK UZ,20208000123,credit,\n")
+
+        first = finance.import_bank_statement(statement_path)
+        assert first == {'inserted': 6, 'skipped': 0, 'total': 6}
+
+        second = finance.import_bank_statement(statement_path)
+        assert second == {'inserted': 0, 'skipped': 6, 'total': 6}
+
+        with open(statement_path, 'a', encoding='utf-8') as f:
+            f.write("2024-05-03,12000.00,UZUM BANK,20208000123,credit,A-4\n")
+        assert finance.import_bank_statement(statement_path)['inserted'] == 1
+
+        total = db.execute_query("SELECT COUNT(*) AS count, SUM(amount) AS total FROM bank_transactions")[0]
+        assert total['count'] == 7
+        assert total['total'] == 150000.0 * 2 + 98000.5 + 40000.0 * 3 + 12000.0
+        timed = db.execute_query("SELECT transaction_date, transaction_time FROM bank_transactions "
+                                 "WHERE transaction_time IS NOT NULL")
+        assert timed == [{'transaction_date': '2024-05-02', 'transaction_time': '15:30:00'}]
+
+    print("✅ Дубли пропущены, счетчики вставки корректны")
+    return True
+
+
+def test_bank_transactions_key_migrates_existing_duplicates():
+    """Старая таблица без ключа: строки сохраняются, повторы помечаются, индекс создается"""
+    print("\n🔍 Тестирование миграции bank_transactions...")
+
+    with temporary_database() as (db, tmp_dir):
+        db.execute_query("""CREATE TABLE bank_transactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, transaction_date DATE, transaction_time TIME,
+            amount DECIMAL(12,2), description TEXT, account_number TEXT, transaction_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        for _ in range(3):
+            db.execute_query(
+                "INSERT INTO bank_transactions (transaction_date, amount, description, account_number) "
+                "VALUES ('2024-05-01', 1000, 'x', 'ACC')"
+            )
+
+        finance = FinanceProcessor(db)
+
+        rows = db.execute_query("SELECT possible_duplicate FROM bank_transactions ORDER BY id")
+        assert [bool(row['possible_duplicate']) for row in rows] == [False, True, True]
+        assert db.execute_query(
+            "SELECT 1 AS found FROM sqlite_master WHERE name = 'idx_bank_transactions_row_key'"
+        )
+
+        # Повторный импорт той же строки не добавляет ее еще раз
+        statement_path = os.path.join(tmp_dir, 'statement.csv')
+        with open(statement_path, 'w', encoding='utf-8') as f:
+            f.write("Date,Amount,Description,Account,Type,Reference\n")
+            f.write("2024-05-01,1000,x,ACC,credit,\n")
+        assert finance.import_bank_statement(statement_path)['skipped'] == 1
+        assert db.execute_query("SELECT COUNT(*) AS count FROM bank_transactions")[0]['count'] == 3
+
+    print("✅ Миграция выполнена")
+    return True
+
+
+def create_orders_table(db):
+    """Минимальная таблица заказов для финансовых расчетов"""
+    db.execute_query("""CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, machine_code TEXT,
+        creation_time TIMESTAMP, order_price DECIMAL(10,2), payment_type TEXT,
+        hw_data TEXT, vendhub_data TEXT, matched_fiscal BOOLEAN DEFAULT 0, matched_payment BOOLEAN DEFAULT 0,
+        error_type TEXT DEFAULT 'UNPROCESSED', error_details TEXT, updated_at TIMESTAMP
+    )""")
+
+
+def test_cash_balances_without_join_fan_out():
+    """Остатки не умножаются на число инкассаций и обновляются инкрементально"""
+    print("\n🔍 Тестирование кассовых остатков...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        for i, (machine, price, payment, error_type) in enumerate([
+            ('M1', 10000, 'Cash', 'OK'), ('M1', 5000, 'Cash', 'OK'),
+            ('M1', 7000, 'Custom payment', 'OK'), ('M1', 3000, 'Cash', 'FISCAL_MISSING'),
+            ('M2', 2000, 'Cash', 'OK'),
+        ]):
+            db.execute_query(
+                "INSERT INTO orders (order_number, machine_code, creation_time, order_price, payment_type, error_type) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (f"N{i}", machine, f"2024-05-01 10:0{i}:00", price, payment, error_type)
+            )
+
+        finance = FinanceProcessor(db)
+        for amount in (4000, 3000, 1000):
+            finance.register_cash_collection({
+                'machine_code': 'M1', 'collection_date': '2024-05-02', 'collection_time': None,
+                'collector_name': 'Иван', 'amount_collected': amount
+            })
+
+        balances = {row['machine_code']: row for row in finance.get_cash_balances()}
+        assert balances['M1']['total_cash'] == 15000
+        assert balances['M1']['collected_cash'] == 8000
+        assert balances['M1']['balance'] == 7000
+        assert balances['M2']['balance'] == 2000
+
+        finance.register_cash_collection({
+            'machine_code': 'M2', 'collection_date': '2024-05-03', 'collection_time': '09:00',
+            'collector_name': 'Иван', 'amount_collected': 1500
+        })
+
+        db.execute_query(
+            "INSERT INTO orders (order_number, machine_code, creation_time, order_price, payment_type, "
+            "hw_data, vendhub_data, matched_fiscal) VALUES ('N9', 'M2', '2024-05-03 12:00:00', 800, 'Cash', '{\"a\": 1}', '{\"b\": 1}', 1)"
+        )
+        OrderProcessor(db)._classify_all_orders()
+
+        m2 = finance.cash_balances.get_balance('M2')
+        assert m2['balance'] == 2000 - 1500 + 800
+        assert m2['last_collection_date'] == '2024-05-03'
+        assert m2['last_order_time'] == '2024-05-03 12:00:00'
+
+        # Инкрементальные обновления совпадают с полным пересчетом
+        incremental = finance.cash_balances.get_balances()
+        finance.rebuild_cash_balances()
+        assert [(r['machine_code'], r['balance']) for r in finance.cash_balances.get_balances()] == \
+            [(r['machine_code'], r['balance']) for r in incremental]
+
+    print("✅ Остатки корректны, инкассации не умножают выручку")
+    return True
+
+
+def test_cash_history_backfilled_before_first_event():
+    """История учитывается, даже если новое событие пришло раньше первого открытия страницы"""
+    print("\n🔍 Тестирование бэкфилла кассовой истории...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        db.execute_query(
+            "INSERT INTO orders (order_number, machine_code, creation_time, order_price, payment_type, error_type) "
+            "VALUES ('N1', 'M1', '2024-05-01 10:00:00', 5000, 'Cash', 'OK')"
+        )
+
+        finance = FinanceProcessor(db)
+        finance.register_cash_collection({
+            'machine_code': 'M2', 'collection_date': '2024-05-02', 'collection_time': '09:00',
+            'collector_name': 'Иван', 'amount_collected': 100
+        })
+
+        balances = {row['machine_code']: row['balance'] for row in finance.get_cash_balances()}
+        assert balances == {'M1': 5000, 'M2': -100}, balances
+
+        # Маркер бэкфилла: повторное создание процессора не пересчитывает журнал
+        db.execute_query("DELETE FROM machine_cash_balances WHERE machine_code = 'M1'")
+        FinanceProcessor(db)
+        assert finance.cash_balances.get_balance('M1') is None
+
+    print("✅ Прошлые заказы учтены вместе с новыми событиями")
+    return True
+
+
+def test_matched_cash_orders_reach_app_finance_processor():
+    """Наличные заказы, сопоставленные processors_updated, попадают в остатки финансового модуля"""
+    print("\n🔍 Тестирование кассовых остатков для схемы schema_final...")
+
+    from processors_updated import FinanceProcessor as AppFinanceProcessor, OrderProcessor as AppOrderProcessor
+    from synthetic_data import SyntheticDataGenerator
+
+    with temporary_database() as (db, tmp_dir):
+        with open('schema_final.sql', encoding='utf-8') as f:
+            db.connection.executescript(f.read())
+        generated = SyntheticDataGenerator(machines=2, days=1, orders_per_day=30, seed=5, missing_rate=0,
+                                           late_rate=0, duplicate_rate=0).generate(os.path.join(tmp_dir, 'data'))
+        processor = AppOrderProcessor(db)
+        finance = AppFinanceProcessor(db)
+        for file_type in ('happy_workers', 'vendhub', 'fiscal_bills', 'payme', 'click', 'uzum'):
+            processor.process_file(generated['files'][file_type], file_type)
+        processor.run_matching()
+
+        expected = {row['machine_code']: row['total'] for row in db.execute_query("""
+            SELECT machine_code, SUM(order_price) AS total FROM orders
+            WHERE order_resource = 'Cash payment' AND match_status = 'fully_matched'
+            GROUP BY machine_code
+        """)}
+        assert expected
+        balances = {row['machine_code']: row['balance'] for row in finance.get_cash_balances()}
+        assert balances == expected, (balances, expected)
+
+        # Полный пересчет дает те же остатки
+        finance.rebuild_cash_balances()
+        assert {row['machine_code']: row['balance'] for row in finance.get_cash_balances()} == expected
+
+        machine = next(iter(expected))
+        finance.register_cash_collection({
+            'machine_code': machine, 'collection_date': '2099-01-01', 'collection_time': '10:00',
+            'collector_name': 'Иван', 'amount_collected': 1000
+        })
+        status = {row['machine_code']: row for row in finance.get_machines_cash_status()}
+        assert status[machine]['estimated_balance'] == expected[machine] - 1000
+        assert finance.get_cash_balance_at(machine, '2098-12-31') == expected[machine]
+
+    print("✅ Остатки финансового модуля приложения ведутся по сопоставленным заказам")
+    return True
+
+
+def test_cash_ledger_point_in_time_balances():
+    """Снимки журнала дают остаток на любой момент, в том числе после событий задним числом"""
+    print("\n🔍 Тестирование журнала кассы автомата...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        finance = FinanceProcessor(db)
+        ledger = finance.cash_balances
+
+        assert ledger.apply_cash_order(1, 'M1', 10000, '2024-05-01 10:00:00')
+        assert ledger.apply_cash_order(2, 'M1', 4000, '2024-05-02 11:00:00')
+        assert ledger.apply_collection(1, 'M1', 12000, '2024-05-03', '09:00')
+        assert not ledger.apply_cash_order(2, 'M1', 4000, '2024-05-02 11:00:00')
+
+        # Заказ задним числом сдвигает все более поздние снимки
+        assert ledger.apply_cash_order(3, 'M1', 500, '2024-05-01 12:00:00')
+
+        assert ledger.balance_at('M1', '2024-04-30') == 0
+        assert ledger.balance_at('M1', '2024-05-01 11:00:00') == 10000
+        assert ledger.balance_at('M1', '2024-05-02 23:59:59') == 14500
+        assert ledger.balance_at('M1', '2024-05-03 09:00:00') == 2500
+        assert finance.get_cash_balance_at('M1', '2024-06-01') == 2500
+
+        assert ledger.revert_cash_order(1)
+        assert ledger.balance_at('M1', '2024-05-03 12:00:00') == -7500
+        assert ledger.get_balance('M1')['balance'] == -7500
+
+        status = finance.get_machines_cash_status()
+        assert status[0]['machine_code'] == 'M1' and status[0]['estimated_balance'] == -7500
+
+        # Пересчет из исходных таблиц воспроизводит инкрементальные снимки
+        for order_id, price, created in [(2, 4000, '2024-05-02 11:00:00'), (3, 500, '2024-05-01 12:00:00')]:
+            db.execute_query(
+                "INSERT INTO orders (id, order_number, machine_code, creation_time, order_price, payment_type, error_type) "
+                "VALUES (?, ?, 'M1', ?, ?, 'Cash', 'OK')",
+                (order_id, f"N{order_id}", created, price)
+            )
+        db.execute_query(
+            "INSERT INTO cash_collections (id, machine_code, collection_date, collection_time, amount_collected) "
+            "VALUES (1, 'M1', '2024-05-03', '09:00', 12000)"
+        )
+
+        snapshot = "SELECT event_time, source_type, source_id, balance_after FROM machine_cash_ledger ORDER BY event_time, id"
+        incremental = db.execute_query(snapshot)
+        assert finance.rebuild_cash_balances() == 1
+        assert db.execute_query(snapshot) == incremental
+        assert ledger.get_balance('M1')['balance'] == -7500
+
+    print("✅ Остатки на момент времени читаются из снимков журнала")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_bank_statement_bulk_import_skips_duplicates,
+        test_bank_transactions_key_migrates_existing_duplicates,
+        test_cash_balances_without_join_fan_out,
+        test_cash_history_backfilled_before_first_event,
+        test_matched_cash_orders_reach_app_finance_processor,
+        test_cash_ledger_point_in_time_balances,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование OCR процессора
+Проверка пакетной обработки и разбора текста чеков без обращения к Tesseract
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import ocr_processor
+from ocr_cache import OCRResultCache, PHASH_AVAILABLE
+from ocr_processor import OCRProcessor, _mark_task_started
+
+
+def test_parallel_batch_streams_every_image():
+    """Параллельная обработка возвращает ровно один результат на каждое изображение"""
+    print("🔍 Тестирование параллельной пакетной обработки...")
+
+    processor = OCRProcessor()
+    image_paths = [f"missing_receipt_{i}.jpg" for i in range(7)]
+
+    results = list(processor.iter_batch_images_parallel(
+        image_paths, max_workers=2, max_in_flight=3, image_timeout=30
+    ))
+
+    assert sorted(r['image_path'] for r in results) == sorted(image_paths)
+    assert all(r['status'] == 'error' for r in results)
+
+    print("✅ Все изображения обработаны, несуществующие файлы помечены ошибкой")
+    return True
+
+
+def _hanging_worker_task(image_path, task_id=None):
+    """Подмена задачи воркера: изображения с 'hang' в имени зависают"""
+    _mark_task_started(task_id)
+    if 'hang' in os.path.basename(image_path):
+        with open(image_path, 'w') as f:
+            f.write(str(os.getpid()))
+        time.sleep(60)
+    return {'image_path': image_path, 'status': 'success'}
+
+
+def test_parallel_batch_times_out_only_hung_image():
+    """Таймаут получает только зависшее изображение, очередь переотправляется, воркер завершается"""
+    print("\n🔍 Тестирование таймаута зависшего изображения...")
+
+    processor = OCRProcessor()
+    original_task = ocr_processor._ocr_worker_task
+    ocr_processor._ocr_worker_task = _hanging_worker_task
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image_paths = [os.path.join(tmp_dir, name) for name in ('a.jpg', 'hang.jpg', 'b.jpg', 'c.jpg', 'd.jpg')]
+            started = time.monotonic()
+            results = list(processor.iter_batch_images_parallel(
+                image_paths, max_workers=1, max_in_flight=5, image_timeout=1
+            ))
+            elapsed = time.monotonic() - started
+
+            statuses = {os.path.basename(r['image_path']): r['status'] for r in results}
+            assert len(results) == len(image_paths)
+            assert statuses == {'a.jpg': 'success', 'hang.jpg': 'error', 'b.jpg': 'success',
+                                'c.jpg': 'success', 'd.jpg': 'success'}, statuses
+            assert elapsed < 20, elapsed
+
+            with open(image_paths[1]) as f:
+                hung_pid = int(f.read())
+            try:
+                os.kill(hung_pid, 0)
+                assert False, "зависший воркер не завершен"
+            except ProcessLookupError:
+                pass
+    finally:
+        ocr_processor._ocr_worker_task = original_task
+
+    print("✅ Зависшее изображение отмечено таймаутом, остальные обработаны в новом пуле")
+    return True
+
+
+def test_batch_parallel_flag_matches_sequential():
+    """Флаг parallel в process_batch_images дает тот же набор результатов"""
+    print("\n🔍 Тестирование флага parallel...")
+
+    processor = OCRProcessor()
+    image_paths = ["missing_a.png", "missing_b.png"]
+
+    sequential = processor.process_batch_images(image_paths)
+    parallel = processor.process_batch_images(image_paths, parallel=True, max_workers=2)
+
+    assert {r['image_path']: r['status'] for r in sequential} == \
+        {r['image_path']: r['status'] for r in parallel}
+
+    print("✅ Результаты последовательного и параллельного режимов совпадают")
+    return True
+
+
+def test_receipt_parsing_single_pass():
+    """Однопроходный разбор совпадает с прежним построчным алгоритмом"""
+    print("\n🔍 Тестирование разбора текста чека...")
+
+    from benchmark_ocr_parsing import generate_receipt_text, legacy_parse_receipt_data
+
+    processor = OCRProcessor()
+    text = "ЧЕК № 1542\n12.05.2024 14:33:10\nЛатте 2.00 x 15000.00\n  Вода   4000.00 \nИТОГО: 34000.00\nНаличные"
+    data = processor._parse_receipt_data(text)
+
+    assert data['receipt_number'] == '1542'
+    assert data['date'] == '2024-05-12'
+    assert data['time'] == '14:33:10'
+    assert data['total_amount'] == 34000.0
+    assert data['payment_method'] == 'cash'
+    assert [item['name'] for item in data['items']] == ['Латте', 'Вода', 'ИТОГО:']
+    assert data['items'][0]['total'] == 30000.0
+
+    for seed in range(200):
+        text = generate_receipt_text(seed)
+        assert processor._parse_receipt_data(text) == legacy_parse_receipt_data(processor, text)
+
+    print("✅ Поля и товарные позиции извлекаются корректно")
+    return True
+
+
+def test_ocr_cache_hits_and_lru_eviction():
+    """Повторное изображение берется из кэша, старые записи вытесняются по LRU"""
+    print("\n🔍 Тестирование кэша результатов OCR...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = OCRResultCache(db_path=os.path.join(tmp_dir, 'cache.db'), max_entries=2)
+        processor = OCRProcessor(cache=cache)
+
+        paths = []
+        for i in range(3):
+            path = os.path.join(tmp_dir, f"receipt_{i}.bin")
+            with open(path, 'wb') as f:
+                f.write(f"receipt-{i}".encode())
+            paths.append(path)
+
+        result = {
+            'status': 'success', 'document_type': 'receipt', 'raw_text': 'ИТОГО: 1000.00',
+            'parsed_data': {'total_amount': 1000.0}, 'confidence': 0.4
+        }
+        variant = processor._cache_variant()
+        cache.put(cache.compute_keys(paths[0], variant), dict(result, ocr_mode='full'))
+
+        cached = processor.process_image(paths[0])
+        assert cached['cache_hit'] == 'exact'
+        assert cached['parsed_data'] == result['parsed_data']
+        assert cached['confidence'] == 0.4
+
+        # Результат полного режима не отдается вызовам в режиме ROI и с другими языками
+        roi_processor = OCRProcessor(cache=cache, ocr_mode='roi')
+        assert roi_processor._cache_variant() != variant
+        assert cache.get(cache.compute_keys(paths[0], roi_processor._cache_variant())) is None
+        eng_processor = OCRProcessor(cache=cache)
+        eng_processor.languages = ['eng']
+        assert cache.get(cache.compute_keys(paths[0], eng_processor._cache_variant())) is None
+
+        # Ошибки не кэшируются
+        assert not cache.put(cache.compute_keys(paths[1]), {'status': 'error', 'message': 'x'})
+
+        cache.put(cache.compute_keys(paths[1]), result)
+        processor.process_image(paths[0])
+        cache.put(cache.compute_keys(paths[2]), result)
+
+        assert cache.stats()['entries'] == 2
+        assert cache.get(cache.compute_keys(paths[1])) is None
+        assert cache.get(cache.compute_keys(paths[0], variant)) is not None
+
+        if PHASH_AVAILABLE:
+            import cv2
+            import numpy as np
+
+            image = np.tile(np.linspace(0, 255, 300, dtype=np.uint8), (200, 1))
+            original = os.path.join(tmp_dir, 'photo.png')
+            recompressed = os.path.join(tmp_dir, 'photo_copy.jpg')
+            cv2.imwrite(original, image)
+            cv2.imwrite(recompressed, cv2.resize(image, (150, 100)), [cv2.IMWRITE_JPEG_QUALITY, 70])
+
+            # По умолчанию используется только точный хеш
+            cache.put(cache.compute_keys(original), result)
+            assert cache.get(cache.compute_keys(recompressed)) is None
+
+            phash_cache = OCRResultCache(db_path=os.path.join(tmp_dir, 'phash.db'), use_phash=True)
+            phash_cache.put(phash_cache.compute_keys(original), result)
+            assert phash_cache.get(phash_cache.compute_keys(recompressed))['cache_hit'] == 'perceptual'
+            phash_cache.close()
+
+        cache.close()
+
+    print("✅ Кэш возвращает сохраненные результаты и соблюдает лимиты")
+    return True
+
+
+def test_same_layout_receipts_do_not_share_cache_hit():
+    """Чеки одного макета с разными суммами совпадают по dHash, но не по пикселям"""
+    print("\n🔍 Тестирование почти-дубликатов в кэше OCR...")
+
+    if not PHASH_AVAILABLE:
+        print("⚠️ OpenCV недоступен, тест пропущен")
+        return True
+
+    import cv2
+    import numpy as np
+
+    def render_receipt(path, total, fiscal_number):
+        image = np.full((1400, 700), 245, dtype=np.uint8)
+        lines = ["OOO VENDHUB", "CHEK N 1542", "12.05.2024 14:33", f"LATTE 1 x {total}",
+                 f"ITOGO: {total}.00", f"FN {fiscal_number}", "FD 000123", "NALICHNYE"]
+        for i, line in enumerate(lines):
+            cv2.putText(image, line, (40, 120 + i * 150), cv2.FONT_HERSHEY_SIMPLEX, 1.4, 20, 3)
+        cv2.imwrite(path, image)
+        return image
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = OCRResultCache(db_path=os.path.join(tmp_dir, 'cache.db'), use_phash=True)
+        first = os.path.join(tmp_dir, 'first.png')
+        second = os.path.join(tmp_dir, 'second.png')
+        image = render_receipt(first, 15000, 123456789)
+        render_receipt(second, 17000, 987654321)
+
+        first_keys, second_keys = cache.compute_keys(first), cache.compute_keys(second)
+        first_keys['phash'] = cache._compute_phash(first_keys['content'])
+        second_keys['phash'] = cache._compute_phash(second_keys['content'])
+        assert bin(first_keys['phash'] ^ second_keys['phash']).count('1') <= cache.phash_distance
+
+        cache.put(first_keys, {
+            'status': 'success', 'document_type': 'receipt', 'raw_text': 'ITOGO: 15000.00',
+            'parsed_data': {'total_amount': 15000.0, 'fiscal_number': '123456789'}, 'confidence': 0.9
+        })
+        assert cache.get(cache.compute_keys(second)) is None
+
+        # Пересжатая уменьшенная копия того же чека подтверждается
+        copy = os.path.join(tmp_dir, 'first_copy.jpg')
+        cv2.imwrite(copy, cv2.resize(image, (350, 700)), [cv2.IMWRITE_JPEG_QUALITY, 60])
+        hit = cache.get(cache.compute_keys(copy))
+        assert hit['cache_hit'] == 'perceptual' and hit['parsed_data']['total_amount'] == 15000.0
+        cache.close()
+
+    print("✅ Разные чеки одного макета не получают чужой результат")
+    return True
+
+
+def test_roi_selects_header_and_footer_lines():
+    """ROI режим находит строки текста и оставляет только шапку и подвал чека"""
+    print("\n🔍 Тестирование поиска областей текста...")
+
+    from ocr_processor import OCR_AVAILABLE
+    if not OCR_AVAILABLE:
+        print("⚠️ OpenCV недоступен, тест пропущен")
+        return True
+
+    import cv2
+    import numpy as np
+
+    processor = OCRProcessor(ocr_mode='roi')
+    image = np.full((1200, 600), 255, dtype=np.uint8)
+    for i in range(20):
+        cv2.putText(image, f"LINE {i} 1000.00", (40, 50 + i * 55),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1.0, 0, 2)
+
+    boxes = processor._find_text_regions(image)
+    assert len(boxes) == 20
+    assert [box[1] for box in boxes] == sorted(box[1] for box in boxes)
+
+    selected = processor._select_roi_boxes(boxes)
+    assert 0 < len(selected) < len(boxes)
+    assert boxes[0] in selected and boxes[-1] in selected
+    assert boxes[10] not in selected
+
+    mosaic = processor._build_roi_mosaic(image, selected)
+    assert mosaic.shape[0] < image.shape[0]
+
+    assert not processor._roi_result_acceptable({'date': '2024-05-12'})
+    assert processor._roi_result_acceptable({
+        'total_amount': 1000.0, 'date': '2024-05-12', 'fiscal_number': '123', 'payment_method': 'cash'
+    })
+
+    print("✅ Выбраны строки шапки и итогов, середина чека пропущена")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_parallel_batch_streams_every_image,
+        test_parallel_batch_times_out_only_hung_image,
+        test_batch_parallel_flag_matches_sequential,
+        test_receipt_parsing_single_pass,
+        test_ocr_cache_hits_and_lru_eviction,
+        test_same_layout_receipts_do_not_share_cache_hit,
+        test_roi_selects_header_and_footer_lines,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
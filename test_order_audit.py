@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование журнала изменений заказов
+Загрузка файлов пишет order_changes пачками, без запроса на каждый заказ
+"""
+
+import os
+import sys
+
+from processors_updated import OrderProcessor
+from test_finance_processor import temporary_database
+
+
+def create_orders_table(db):
+    """Таблица заказов со всеми полями HW и фискальных данных"""
+    db.execute_query("""CREATE TABLE orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, machine_code TEXT, address TEXT,
+        goods_name TEXT, taste_name TEXT, order_type TEXT, order_resource TEXT, order_price DECIMAL(10,2),
+        creation_time TIMESTAMP, paying_time TIMESTAMP, brewing_time TIMESTAMP, delivery_time TIMESTAMP,
+        refund_time TIMESTAMP, payment_status TEXT, brew_status TEXT, reason TEXT, payment_type TEXT,
+        match_status TEXT DEFAULT 'unmatched', mismatch_details TEXT, match_candidates TEXT,
+        source TEXT, matched_sources TEXT, fiscal_matched BOOLEAN DEFAULT 0, gateway_matched BOOLEAN DEFAULT 0,
+        fiscal_time TIMESTAMP, fiscal_amount DECIMAL(10,2), fiscal_check_number TEXT, taxpayer_id TEXT,
+        cash_register_id TEXT, shift_number INTEGER, receipt_type TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(order_number, machine_code)
+    )""")
+
+
+def write_hw_file(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("order_number,machine_code,order_resource,order_price,creation_time,paying_time\n")
+        for number, machine, resource, price, paying_time in rows:
+            f.write(f"{number},{machine},{resource},{price},{paying_time},{paying_time}\n")
+
+
+def test_ingestion_records_field_level_changes():
+    """Создание, изменение цены и привязка чека попадают в журнал по полям"""
+    print("🔍 Тестирование журнала изменений...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        processor = OrderProcessor(db)
+
+        hw_path = os.path.join(tmp_dir, 'hw.csv')
+        rows = [('N1', 'M1', 'Cash payment', 15000, '2024-05-01 10:00:00'),
+                ('N2', 'M1', 'Cash payment', 9000, '2024-05-01 10:10:00'),
+                ('N3', 'M2', 'Custom payment', 7000, '2024-05-01 11:00:00')]
+        write_hw_file(hw_path, rows)
+        assert processor.process_file(hw_path, 'happy_workers') == 3
+
+        changes = db.execute_query("SELECT * FROM order_changes ORDER BY id")
+        assert [row['change_type'] for row in changes] == ['create'] * 3
+        assert all(row['change_source'] == 'happy_workers' for row in changes)
+        assert processor.change_log.stats['flushes'] == 1
+
+        # Повторная загрузка: меняется только цена N2
+        rows[1] = ('N2', 'M1', 'Cash payment', 9500, '2024-05-01 10:10:00')
+        write_hw_file(hw_path, rows)
+        processor.process_file(hw_path, 'happy_workers')
+
+        updates = db.execute_query("SELECT * FROM order_changes WHERE change_type = 'update'")
+        assert [(row['field_name'], row['old_value'], row['new_value']) for row in updates] == \
+            [('order_price', '9000.0', '9500.0')]
+
+        fiscal_path = os.path.join(tmp_dir, 'fiscal.csv')
+        with open(fiscal_path, 'w', encoding='utf-8') as f:
+            f.write("fiscal_check_number,fiscal_time,amount\n")
+            f.write("F-1,2024-05-01 10:00:20,15000\n")
+        processor.process_file(fiscal_path, 'fiscal_bills')
+
+        n1 = db.execute_query("SELECT id FROM orders WHERE order_number = 'N1'")[0]['id']
+        history = processor.change_log.get_history(n1)
+        fiscal_fields = {row['field_name']: row['new_value'] for row in history
+                         if row['change_source'] == 'fiscal_bills'}
+        assert fiscal_fields['fiscal_check_number'] == 'F-1'
+        assert fiscal_fields['fiscal_matched'] == '1.0'
+        assert processor.change_log.stats['flushes'] == 3
+
+        # Классификация журналируется только по действительно измененным полям
+        processor.run_matching()
+        classified = db.execute_query(
+            "SELECT field_name, old_value, new_value FROM order_changes WHERE order_id = ? "
+            "AND change_source = 'matching'", (n1,)
+        )
+        assert classified == [{'field_name': 'mismatch_details', 'old_value': None,
+                               'new_value': 'Заказ найден только в Happy Workers'}]
+
+    print("✅ Изменения записаны по полям, одна запись журнала на файл")
+    return True
+
+
+def test_buffer_flushes_in_batches():
+    """Буфер сбрасывается одним executemany при заполнении"""
+    print("\n🔍 Тестирование буфера журнала...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        processor = OrderProcessor(db)
+        change_log = processor.change_log
+        change_log.flush_size = 10
+
+        for i in range(25):
+            change_log.capture(i, {'order_price': 100}, {'order_price': 100 + i, 'updated_at': 'x'}, 'test')
+
+        # Нулевое изменение цены не журналируется
+        assert change_log.stats['captured'] == 24
+        assert change_log.stats['flushes'] == 2
+        assert db.execute_query("SELECT COUNT(*) AS count FROM order_changes")[0]['count'] == 20
+
+        change_log.flush()
+        assert db.execute_query("SELECT COUNT(*) AS count FROM order_changes")[0]['count'] == 24
+
+    print("✅ Буфер сбрасывается пачками")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_ingestion_records_field_level_changes,
+        test_buffer_flushes_in_batches,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
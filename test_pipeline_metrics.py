@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование метрик конвейера загрузки
+Время и строки по этапам, запросы к БД, сводка сессии и вывод Prometheus
+"""
+
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from pipeline_metrics import PipelineMetrics, pipeline_metrics
+from processors_updated import OrderProcessor
+from test_finance_processor import temporary_database
+from test_order_audit import create_orders_table, write_hw_file
+
+
+def test_nested_stages_are_exclusive():
+    """Время вложенного этапа не учитывается во внешнем"""
+    print("🔍 Тестирование вложенных этапов...")
+
+    metrics = PipelineMetrics()
+
+    @metrics.timed('write')
+    def write():
+        time.sleep(0.02)
+
+    with metrics.stage('parse'):
+        time.sleep(0.01)
+        write()
+        write()
+    metrics.add_rows('parse', 10)
+
+    stages = metrics.snapshot()['stages']
+    assert stages['write']['calls'] == 2
+    assert stages['write']['seconds'] >= 0.04
+    assert 0.01 <= stages['parse']['seconds'] < stages['write']['seconds']
+    assert stages['parse']['rows'] == 10
+
+    text = metrics.render_prometheus()
+    assert '# TYPE vhm24r_stage_seconds_total counter' in text
+    assert 'vhm24r_stage_calls_total{stage="write"} 2' in text
+    assert 'vhm24r_stage_rows_total{stage="parse"} 10' in text
+
+    print("✅ Этапы учитываются без двойного счета")
+    return True
+
+
+def test_upload_session_summary():
+    """Сессия загрузки: этапы, строки/с, запросы к БД, запись в processing_logs"""
+    print("🔍 Тестирование сводки сессии...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        db.execute_query("""CREATE TABLE processing_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, log_level TEXT,
+            message TEXT, details TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        processor = OrderProcessor(db)
+
+        hw_path = os.path.join(tmp_dir, 'hw.csv')
+        write_hw_file(hw_path, [(f'N{i}', 'M1', 'Cash payment', 1000 + i, '2024-05-01 10:00:00')
+                                for i in range(50)])
+
+        queries_before = pipeline_metrics.snapshot()['db']['queries']
+        os.environ['PIPELINE_PROFILE_DIR'] = os.path.join(tmp_dir, 'profiles')
+        try:
+            with pipeline_metrics.session('session-1', db, profile=True) as session:
+                processor.process_file(hw_path, 'happy_workers')
+                processor.run_matching()
+        finally:
+            os.environ.pop('PIPELINE_PROFILE_DIR', None)
+
+        summary = session.summary()
+        stages = summary['stages']
+        assert stages['read']['rows'] == 50
+        assert stages['parse']['rows'] == 50
+        assert stages['match']['rows'] == 50
+        assert stages['parse']['rows_per_second'] > 0
+        assert stages['write']['calls'] > 0 and stages['write']['db_queries'] > 0
+        # Запросы вне этапов (проверка версии настроек) входят только в общий счетчик
+        assert summary['db']['queries'] >= sum(stage['db_queries'] for stage in stages.values()) > 0
+        assert pipeline_metrics.snapshot()['db']['queries'] - queries_before >= summary['db']['queries']
+        assert os.path.exists(summary['profile_path'])
+
+        logs = db.execute_query("SELECT * FROM processing_logs WHERE session_id = 'session-1'")
+        assert len(logs) == 1
+        assert json.loads(logs[0]['details'])['stages']['read']['rows'] == 50
+
+        assert 'vhm24r_last_session_rows_per_second{stage="parse"}' in pipeline_metrics.render_prometheus()
+
+    print("✅ Сводка сессии записана в processing_logs")
+    return True
+
+
+def test_order_writes_are_instrumented():
+    """Запись заказов и журнала изменений видна в метриках этапа write и в статистике запросов"""
+    print("🔍 Тестирование учета записи заказов...")
+
+    with temporary_database() as (db, tmp_dir):
+        create_orders_table(db)
+        processor = OrderProcessor(db)
+
+        hw_path = os.path.join(tmp_dir, 'hw.csv')
+        write_hw_file(hw_path, [(f'N{i}', 'M1', 'Cash payment', 1000 + i, '2024-05-01 10:00:00')
+                                for i in range(50)])
+
+        db.query_observer.reset()
+        with pipeline_metrics.session('session-write', db) as session:
+            processor.process_file(hw_path, 'happy_workers')
+
+        write = session.summary()['stages']['write']
+        assert write['db_queries'] >= write['calls'] > 50
+
+        top = {item['fingerprint']: item for item in db.query_observer.top(sort='calls')}
+        orders = [item for fingerprint, item in top.items() if fingerprint.startswith('INSERT OR REPLACE INTO orders')]
+        assert len(orders) == 1 and orders[0]['calls'] == 50
+        changes = [item for fingerprint, item in top.items() if fingerprint.startswith('INSERT INTO order_changes')]
+        assert len(changes) == 1 and changes[0]['rows'] == 50
+        assert processor.change_log.stats['written'] == 50
+
+    print("✅ Запись заказов учтена в метриках")
+    return True
+
+
+def test_memory_tracing_by_stage():
+    """Профиль памяти: прирост кучи по этапам, топ мест выделения, превышение бюджета"""
+    print("🔍 Тестирование трассировки памяти...")
+
+    with temporary_database() as (db, tmp_dir):
+        db.execute_query("""CREATE TABLE processing_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, log_level TEXT,
+            message TEXT, details TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        metrics = PipelineMetrics()
+
+        os.environ['PIPELINE_PROFILE_DIR'] = os.path.join(tmp_dir, 'profiles')
+        try:
+            with metrics.session('session-mem', db, memory=True, memory_budget_mb=10) as session:
+                with metrics.stage('parse'):
+                    blob = b'x' * (40 * 1024 * 1024)
+                    with metrics.stage('write'):
+                        small = [str(i) for i in range(1000)]
+                # Блок жив до выхода из этапа - последний замер RSS его видит
+                del blob, small
+                with metrics.stage('match'):
+                    pass
+        finally:
+            os.environ.pop('PIPELINE_PROFILE_DIR', None)
+
+        memory = session.summary()['memory']
+        stages = memory['stages']
+        assert stages['parse']['py_peak_mb'] >= 40
+        assert stages['write']['py_peak_mb'] < 1
+        assert stages['parse']['rss_growth_mb'] >= 30
+        assert [item['stage'] for item in memory['exceeded']] == ['parse']
+        assert memory['top_allocators_stage'] == 'write'
+        assert memory['top_allocators'][0]['file'].endswith('test_pipeline_metrics.py')
+        assert memory['top_allocators'][0]['size_mb'] >= 40
+        assert not tracemalloc.is_tracing()
+
+        with open(memory['profile_path'], encoding='utf-8') as f:
+            assert json.load(f)['exceeded'][0]['stage'] == 'parse'
+
+        warnings = db.execute_query(
+            "SELECT * FROM processing_logs WHERE session_id = 'session-mem' AND log_level = 'WARNING'")
+        assert len(warnings) == 1
+        assert json.loads(warnings[0]['details'])['exceeded'][0]['budget_mb'] == 10
+
+    print("✅ Профиль памяти собран, превышение бюджета отмечено")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_nested_stages_are_exclusive,
+        test_upload_session_summary,
+        test_order_writes_are_instrumented,
+        test_memory_tracing_by_stage,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование построителя запросов
+Кэш скомпилированных запросов, перевод плейсхолдеров под PostgreSQL и горячие пути на SQLite
+"""
+
+import sys
+from datetime import datetime
+
+from processors_updated import OrderProcessor
+from query_builder import QueryBuilder
+from test_finance_processor import temporary_database
+
+
+class _PostgresStub:
+    """Минимальный Database для компиляции под PostgreSQL (без выполнения)"""
+    is_postgres = True
+    connection = None
+
+
+def _load_schema(db):
+    with open('schema_final.sql', encoding='utf-8') as f:
+        db.connection.executescript(f.read())
+
+
+def test_statement_cache_hits():
+    """Повторная компиляция берет запрос из кэша, порядок колонок UPDATE не важен"""
+    print("🔍 Тестирование кэша скомпилированных запросов...")
+
+    with temporary_database() as (db, _):
+        builder = QueryBuilder(db)
+        calls = []
+
+        def build(qb):
+            calls.append(1)
+            return "SELECT * FROM orders WHERE id = ?"
+
+        first = builder.compile(('order_by_id',), build)
+        second = builder.compile(('order_by_id',), build)
+        assert first is second
+        assert len(calls) == 1
+        assert builder.stats()['hits'] == 1 and builder.stats()['misses'] == 1
+
+        update = builder.update('orders', ('machine_code', 'order_price'))
+        assert update.sql == "UPDATE orders SET machine_code = ?, order_price = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?"
+        assert update.params_count == 3 and not update.returns_rows
+
+        # update_row сортирует колонки - разный порядок ключей дает один запрос
+        statements = builder.stats()['statements']
+        _load_schema(db)
+        builder.update_row('orders', {'order_price': 1, 'machine_code': 'A'}, 1)
+        builder.update_row('orders', {'machine_code': 'B', 'order_price': 2}, 1)
+        assert builder.stats()['statements'] == statements
+
+    print("✅ Кэш запросов работает")
+    return True
+
+
+def test_postgres_placeholder_translation():
+    """? вне литералов -> %s и $N, символ % экранируется"""
+    print("🔍 Тестирование перевода плейсхолдеров под PostgreSQL...")
+
+    builder = QueryBuilder(_PostgresStub(), prepare=False)
+    statement = builder.compile(('like',), lambda qb: f"""
+        SELECT * FROM orders
+        WHERE goods_name LIKE '%?%' AND machine_code = ? AND {qb.seconds_between('paying_time', '?')} < ?
+    """)
+
+    assert statement.params_count == 3
+    assert "LIKE '%%?%%'" in statement.sql
+    assert "machine_code = %s" in statement.sql
+    assert "CAST(%s AS TIMESTAMP)" in statement.sql
+    assert "LIKE '%?%'" in statement.prepared_sql
+    assert "machine_code = $1" in statement.prepared_sql and "< $3" in statement.prepared_sql
+    assert statement.name.startswith('qb_like_')
+    assert builder.date_days_ago(7) == "CURRENT_DATE - INTERVAL '7 days'"
+
+    sqlite_builder = QueryBuilder(type('SqliteStub', (), {'is_postgres': False})())
+    assert sqlite_builder.date_days_ago(7) == "date('now', '-7 days')"
+
+    try:
+        builder.update('orders; DROP TABLE orders', ('machine_code',))
+        assert False, "ожидался ValueError"
+    except ValueError:
+        pass
+
+    print("✅ Плейсхолдеры переводятся корректно")
+    return True
+
+
+def test_hot_paths_on_sqlite():
+    """Фильтры заказов по дате и обновление заказа через скомпилированные запросы"""
+    print("🔍 Тестирование горячих путей на SQLite...")
+
+    with temporary_database() as (db, _):
+        _load_schema(db)
+        db.execute_query("""
+            INSERT INTO orders (order_number, machine_code, creation_time, paying_time, order_price, match_status, updated_at)
+            VALUES ('A1', 'VM1', '2024-05-01 10:00:00', '2024-05-01 10:00:05', 15000, 'fully_matched', '2000-01-01 00:00:00'),
+                   ('A2', 'VM1', '2024-05-02 11:00:00', '2024-05-02 11:00:07', 12000, 'hw_only', '2000-01-01 00:00:00'),
+                   ('A3', 'VM2', '2024-05-03 12:00:00', '2024-05-03 12:00:03', 17000, 'fully_matched', '2000-01-01 00:00:00')
+        """)
+
+        orders = db.get_orders_with_filters({'date_from': '2024-05-02', 'date_to': '2024-05-03'})
+        assert [order['order_number'] for order in orders] == ['A3', 'A2']
+        orders = db.get_orders_with_filters({'machine_code': 'VM1', 'error_type': 'OK'}, limit=5)
+        assert [order['order_number'] for order in orders] == ['A1']
+        assert len(db.get_orders_with_filters(limit=2)) == 2
+        misses = db.query_builder.stats()['misses']
+        db.get_orders_with_filters({'date_from': '2024-05-01', 'date_to': '2024-05-01'})
+        assert db.query_builder.stats()['misses'] == misses
+
+        order_id = db.execute_query("SELECT id FROM orders WHERE order_number = 'A2'")[0]['id']
+        processor = OrderProcessor(db)
+        processor._update_order(order_id, {'payment_type': 'Cash', 'goods_name': None})
+        row = db.execute_query("SELECT payment_type, goods_name, updated_at FROM orders WHERE id = ?", (order_id,))[0]
+        assert row['payment_type'] == 'Cash'
+        assert row['updated_at'] > '2000-01-01 00:00:00'
+
+        found = processor._find_cash_orders_for_fiscal(datetime(2024, 5, 2, 11, 0, 9), 12000)
+        assert [order['order_number'] for order in found] == ['A2']
+
+    print("✅ Горячие пути работают на SQLite")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_statement_cache_hits,
+        test_postgres_placeholder_translation,
+        test_hot_paths_on_sqlite,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
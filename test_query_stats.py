@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование статистики SQL запросов
+Отпечатки запросов, p95 и строки по отпечатку, журнал медленных запросов с планом
+"""
+
+import sys
+
+from query_stats import QueryObserver, fingerprint
+from test_finance_processor import temporary_database
+
+
+def test_fingerprint_normalizes_literals():
+    """Литералы, плейсхолдеры и списки IN не создают новых отпечатков"""
+    print("🔍 Тестирование отпечатков запросов...")
+
+    first = fingerprint("SELECT * FROM orders WHERE order_number IN ('A', 'B') AND order_price > 100")
+    second = fingerprint("""
+        SELECT *   FROM orders
+        WHERE order_number IN (?, ?, ?, ?) AND order_price > 250.5
+    """)
+    assert first == second == "SELECT * FROM orders WHERE order_number IN (...) AND order_price > ?"
+    assert fingerprint("SELECT id FROM t2 WHERE a = %s") == fingerprint("SELECT id FROM t2 WHERE a = ?")
+    assert fingerprint("SELECT CAST(x AS TEXT)::text FROM t") == "SELECT CAST(x AS TEXT)::text FROM t"
+
+    print("✅ Отпечатки нормализуются")
+    return True
+
+
+def test_database_records_query_stats():
+    """execute_query копит вызовы, строки и время по отпечатку"""
+    print("🔍 Тестирование статистики запросов...")
+
+    with temporary_database() as (db, _):
+        db.execute_query("CREATE TABLE items (id INTEGER PRIMARY KEY, machine_code TEXT, price REAL)")
+        for i in range(20):
+            db.execute_query("INSERT INTO items (machine_code, price) VALUES (?, ?)", (f"M{i % 4}", i))
+        db.query_observer.reset()
+
+        for i in range(4):
+            db.execute_query(f"SELECT * FROM items WHERE machine_code = 'M{i}'")
+        db.execute_query("UPDATE items SET price = price + 1 WHERE machine_code = ?", ('M1',))
+        db.execute_query("SELECT * FROM missing_table")
+
+        top = {item['fingerprint']: item for item in db.query_observer.top(sort='calls')}
+        select = top["SELECT * FROM items WHERE machine_code = ?"]
+        assert select['calls'] == 4
+        assert select['rows'] == 20
+        assert 0 < select['p95_ms'] <= select['max_ms']
+        assert top["UPDATE items SET price = price + ? WHERE machine_code = ?"]['rows'] == 5
+        assert top["SELECT * FROM missing_table"]['errors'] == 1
+        assert db.query_observer.summary()['calls'] == 6
+
+    print("✅ Статистика по отпечаткам собирается")
+    return True
+
+
+def test_execute_insert_returns_id_and_records_stats():
+    """execute_insert возвращает id новой строки и учитывается как обычный запрос"""
+    print("🔍 Тестирование вставки с возвратом id...")
+
+    with temporary_database() as (db, _):
+        db.execute_query("CREATE TABLE items (id INTEGER PRIMARY KEY, machine_code TEXT, price REAL)")
+        db.query_observer.reset()
+
+        ids = [db.execute_insert("INSERT INTO items (machine_code, price) VALUES (?, ?)", (f"M{i}", i))
+               for i in range(3)]
+        assert ids == [1, 2, 3]
+        assert db.execute_insert("INSERT INTO missing_table (x) VALUES (?)", (1,)) is None
+
+        top = {item['fingerprint']: item for item in db.query_observer.top(sort='calls')}
+        assert top["INSERT INTO items (machine_code, price) VALUES (...)"]['calls'] == 3
+        assert top["INSERT INTO missing_table (x) VALUES (?)"]['errors'] == 1
+        assert db.execute_query("SELECT COUNT(*) AS n FROM items")[0]['n'] == 3
+
+    print("✅ id возвращается, запросы учтены")
+    return True
+
+
+def test_slow_queries_logged_with_plan():
+    """Медленный запрос попадает в журнал с EXPLAIN QUERY PLAN, план - один раз на отпечаток"""
+    print("🔍 Тестирование журнала медленных запросов...")
+
+    with temporary_database() as (db, _):
+        db.execute_query("CREATE TABLE items (id INTEGER PRIMARY KEY, machine_code TEXT)")
+        db.execute_query("CREATE INDEX idx_items_machine ON items(machine_code)")
+        db.query_observer = QueryObserver(db, slow_query_ms=0)
+
+        db.execute_query("SELECT * FROM items WHERE machine_code = ?", ('M1',))
+        db.execute_query("SELECT * FROM items WHERE machine_code = ?", ('M2',))
+
+        slow = db.query_observer.slow_queries()
+        assert len(slow) == 2
+        assert slow[0]['plan'] is None
+        assert any('idx_items_machine' in line for line in slow[1]['plan'])
+        assert db.query_observer.top()[0]['slow'] == 2
+
+    print("✅ Медленные запросы журналируются с планом")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_fingerprint_normalizes_literals,
+        test_database_records_query_stats,
+        test_execute_insert_returns_id_and_records_stats,
+        test_slow_queries_logged_with_plan,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование планировщика задач
+Выбор лидера и история запусков без реального расписания
+"""
+
+import os
+import sys
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+from incremental_reconciliation import IncrementalReconciler
+from processors_updated import OrderProcessor
+from scheduler import SchedulerLeaderLock, VHMScheduler, FCNTL_AVAILABLE
+from test_finance_processor import temporary_database
+from unmatched_retry import UnmatchedRecordRetrier
+
+
+def test_leader_lock_allows_single_owner():
+    """Файловую блокировку лидера держит только один владелец"""
+    print("🔍 Тестирование блокировки лидера...")
+
+    if not FCNTL_AVAILABLE:
+        print("⚠️ fcntl недоступен, тест пропущен")
+        return True
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lock_path = os.path.join(tmp_dir, 'scheduler.lock')
+        first = SchedulerLeaderLock(database_url='', lock_path=lock_path)
+        second = SchedulerLeaderLock(database_url='', lock_path=lock_path)
+
+        assert first.backend == 'file'
+        assert first.acquire()
+        assert not second.acquire()
+
+        first.release()
+        assert second.acquire()
+        second.release()
+
+    print("✅ Лидер один, после освобождения блокировку получает резервный процесс")
+    return True
+
+
+def test_job_runs_are_recorded_and_overlaps_skipped():
+    """Длительность запусков пишется в историю, наложенный запуск пропускается"""
+    print("\n🔍 Тестирование истории запусков задач...")
+
+    with temporary_database() as (db, tmp_dir):
+        lock = SchedulerLeaderLock(database_url='', lock_path=os.path.join(tmp_dir, 'scheduler.lock'))
+        scheduler = VHMScheduler(db, order_processor=None, leader_lock=lock, autostart=False)
+        assert not scheduler.is_leader
+
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_job():
+            started.set()
+            release.wait(5)
+
+        def failing_job():
+            raise RuntimeError("boom")
+
+        scheduler._job_functions['daily_backup'] = slow_job
+        scheduler._job_functions['system_health'] = failing_job
+
+        worker = threading.Thread(target=scheduler.run_job_manually, args=('daily_backup',))
+        worker.start()
+        assert started.wait(5)
+        assert not scheduler.run_job_manually('daily_backup')
+        release.set()
+        worker.join()
+
+        assert not scheduler.run_job_manually('system_health')
+        assert not scheduler.run_job_manually('unknown_job')
+
+        history = scheduler.get_job_history('daily_backup')
+        assert sorted(row['status'] for row in history) == ['skipped', 'success']
+        assert scheduler.get_job_history('system_health')[0]['error'] == 'boom'
+
+        status = {job['id']: job for job in scheduler.get_job_status()}
+        assert len(status) == 8
+        assert status['daily_backup']['runs'] == 1
+        assert status['daily_reconciliation']['runs'] == 0
+
+        scheduler.stop()
+
+    print("✅ Запуски записаны, наложение пропущено")
+    return True
+
+
+def test_incremental_reconciliation_resumes_from_checkpoint():
+    """Ночная сверка берет только измененные заказы и продолжает прерванный запуск"""
+    print("\n🔍 Тестирование инкрементальной сверки...")
+
+    with temporary_database() as (db, tmp_dir):
+        db.execute_query("""CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, payment_type TEXT, order_resource TEXT,
+            match_status TEXT DEFAULT 'unmatched', mismatch_details TEXT,
+            fiscal_matched BOOLEAN DEFAULT 0, gateway_matched BOOLEAN DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        now = db.execute_query("SELECT datetime('now', '-1 hour') AS t")[0]['t']
+        for i in range(7):
+            db.execute_query(
+                "INSERT INTO orders (order_number, payment_type, match_status, fiscal_matched, updated_at) "
+                "VALUES (?, 'Cash', 'matched', ?, ?)",
+                (f"N{i}", i % 2, now)
+            )
+        # Заказ вне окна первого запуска не трогается
+        db.execute_query(
+            "INSERT INTO orders (order_number, payment_type, match_status, updated_at) "
+            "VALUES ('OLD', 'Cash', 'matched', '2020-01-01 00:00:00')"
+        )
+
+        processor = OrderProcessor(db)
+        reconciler = IncrementalReconciler(db, processor, batch_size=3)
+
+        original = processor.run_incremental_matching
+
+        def crash_after_first_batch(*args, on_batch=None, **kwargs):
+            def checkpoint(*batch):
+                on_batch(*batch)
+                raise RuntimeError("worker killed")
+            return original(*args, on_batch=checkpoint, **kwargs)
+
+        processor.run_incremental_matching = crash_after_first_batch
+        try:
+            reconciler.run()
+            assert False, "запуск должен был упасть"
+        except RuntimeError:
+            pass
+        processor.run_incremental_matching = original
+
+        failed = reconciler.get_recent_runs()[0]
+        assert failed['status'] == 'failed' and failed['orders_scanned'] == 3
+
+        result = reconciler.run()
+        assert result['run_id'] == failed['id'] and result['resumed']
+        assert result['scanned'] == 7
+        assert result['updated'] == 7
+
+        statuses = {row['order_number']: row['match_status'] for row in db.execute_query("SELECT * FROM orders")}
+        assert statuses['N1'] == 'fully_matched' and statuses['N0'] == 'fiscal_mismatch'
+        assert statuses['OLD'] == 'matched'
+
+        run = reconciler.get_recent_runs()[0]
+        assert run['status'] == 'success' and run['resumes'] == 1
+        assert run['orders_per_second'] is not None
+        assert reconciler.get_watermark() == result['window_end']
+
+        # Следующий запуск видит только записи самой сверки и ничего не меняет
+        second = reconciler.run()
+        assert second['run_id'] != result['run_id']
+        assert second['window_start'] == result['window_end']
+        assert second['updated'] == 0
+
+    print("✅ Окно ограничено водяным знаком, прогресс восстановлен после сбоя")
+    return True
+
+
+def test_unmatched_fiscal_records_retried_with_backoff():
+    """Чек без заказа сопоставляется, когда заказ приходит позже; повторы идут с задержкой"""
+    print("\n🔍 Тестирование повторного сопоставления чеков...")
+
+    with temporary_database() as (db, tmp_dir):
+        db.execute_query("""CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, order_number TEXT, payment_type TEXT, order_resource TEXT,
+            paying_time TIMESTAMP, order_price DECIMAL(10,2), match_status TEXT DEFAULT 'unmatched',
+            fiscal_time TIMESTAMP, fiscal_amount DECIMAL(10,2), fiscal_check_number TEXT, taxpayer_id TEXT,
+            cash_register_id TEXT, shift_number INTEGER, receipt_type TEXT,
+            fiscal_matched BOOLEAN DEFAULT 0, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""")
+        processor = OrderProcessor(db)
+        retrier = UnmatchedRecordRetrier(db, processor)
+
+        fiscal_path = os.path.join(tmp_dir, 'fiscal.csv')
+        with open(fiscal_path, 'w', encoding='utf-8') as f:
+            f.write("fiscal_check_number,fiscal_time,amount,taxpayer_id\n")
+            f.write("F-1,2024-05-01 10:00:30,15000,123\n")
+            f.write("F-2,2024-05-01 10:05:00,9000,123\n")
+            f.write("F-3,2024-05-01 18:00:00,9000,123\n")
+
+        assert processor.process_fiscal_file(fiscal_path) == 0
+        assert db.execute_query("SELECT COUNT(*) AS count FROM unmatched_records")[0]['count'] == 3
+
+        since = retrier.current_timestamp()
+        # Файл HW загружен позже: заказы к первым двум чекам (второй - с другой суммой)
+        for number, paying_time, price in [('N1', '2024-05-01 10:00:00', 15000),
+                                           ('N2', '2024-05-01 10:05:10', 7000)]:
+            db.execute_query(
+                "INSERT INTO orders (order_number, payment_type, paying_time, order_price, match_status) "
+                "VALUES (?, 'Cash', ?, ?, 'matched')",
+                (number, paying_time, price)
+            )
+
+        now = datetime(2024, 5, 2, 12, 0, 0)
+        stats = retrier.run(since=since, now=now)
+        assert stats == {'candidates': 2, 'matched': 1, 'retried': 1, 'deferred': 0}
+
+        order = db.execute_query("SELECT * FROM orders WHERE order_number = 'N1'")[0]
+        assert order['fiscal_matched'] == 1 and order['match_status'] == 'fully_matched'
+        assert order['fiscal_check_number'] == 'F-1'
+
+        # Чек F-3 вне окна новых заказов не проверялся
+        attempts = {row['record_time']: row['attempts'] for row in
+                    db.execute_query("SELECT record_time, attempts FROM unmatched_records")}
+        assert attempts == {'2024-05-01 10:05:00': 1, '2024-05-01 18:00:00': 0}
+
+        # До истечения задержки запись пропускается, после - проверяется снова
+        assert retrier.run(now=now + timedelta(minutes=5))['deferred'] == 1
+        assert retrier.run(now=now + timedelta(minutes=16))['retried'] == 1
+        assert retrier.run(now=now + timedelta(minutes=40))['deferred'] == 1
+
+    print("✅ Поздний заказ получил чек, повторы идут с экспоненциальной задержкой")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_leader_lock_allows_single_owner,
+        test_job_runs_are_recorded_and_overlaps_skipped,
+        test_incremental_reconciliation_resumes_from_checkpoint,
+        test_unmatched_fiscal_records_retried_with_backoff,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
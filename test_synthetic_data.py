@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование генератора синтетических отчетов
+Детерминированность по seed, доли шума и сквозное сопоставление на малом объеме
+"""
+
+import csv
+import filecmp
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+from processors_updated import OrderProcessor
+from synthetic_data import HEADERS, TIME_FORMAT, SyntheticDataGenerator
+from test_finance_processor import temporary_database
+
+
+def _read_rows(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_generation_is_deterministic():
+    """Одинаковые параметры и seed дают байт-в-байт одинаковые файлы"""
+    print("🔍 Тестирование детерминированности генератора...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generator = SyntheticDataGenerator(machines=5, days=2, orders_per_day=200, seed=7)
+        first = generator.generate(os.path.join(tmp_dir, 'first'))
+        second = SyntheticDataGenerator(machines=5, days=2, orders_per_day=200, seed=7).generate(
+            os.path.join(tmp_dir, 'second'))
+        other = SyntheticDataGenerator(machines=5, days=2, orders_per_day=200, seed=8).generate(
+            os.path.join(tmp_dir, 'other'))
+
+        assert first['orders'] == 400
+        assert first['rows'] == second['rows']
+        for file_type in HEADERS:
+            assert filecmp.cmp(first['files'][file_type], second['files'][file_type], shallow=False)
+        assert not filecmp.cmp(first['files']['happy_workers'], other['files']['happy_workers'], shallow=False)
+
+    print("✅ Генерация детерминирована")
+    return True
+
+
+def test_noise_rates():
+    """Пропуски, дубли и запоздавшие события - в заданных долях"""
+    print("🔍 Тестирование шума в данных...")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        clean = SyntheticDataGenerator(machines=5, days=1, orders_per_day=2000, seed=3,
+                                       missing_rate=0, late_rate=0, duplicate_rate=0).generate(tmp_dir)
+        assert clean['rows']['happy_workers'] == clean['rows']['vendhub'] == 2000
+        assert sum(clean['rows'][file_type] for file_type in ('fiscal_bills', 'payme', 'click', 'uzum')) == 2000
+
+        noisy = SyntheticDataGenerator(machines=5, days=1, orders_per_day=2000, seed=3,
+                                       missing_rate=0.1, late_rate=0.2, duplicate_rate=0.05).generate(tmp_dir)
+        hw_rows = _read_rows(noisy['files']['happy_workers'])
+        numbers = [row['Order number'] for row in hw_rows]
+        duplicates = len(numbers) - len(set(numbers))
+        missing = 2000 - len(set(numbers))
+        assert 120 <= missing <= 280, missing
+        assert 40 <= duplicates <= 150, duplicates
+
+        # Запоздавшая транзакция - позже оплаты больше чем на минуту (вне окна сопоставления)
+        paying = {row['Order number']: datetime.strptime(row['Paying time'], TIME_FORMAT) for row in hw_rows}
+        late = total = 0
+        for row in _read_rows(noisy['files']['payme']):
+            order_number = row['transaction_id'][1:]
+            if order_number in paying:
+                total += 1
+                delay = datetime.strptime(row['transaction_time'], TIME_FORMAT) - paying[order_number]
+                late += delay.total_seconds() > 60
+        assert 0.1 <= late / total <= 0.3, late / total
+
+    print("✅ Доли шума соответствуют параметрам")
+    return True
+
+
+def test_generated_files_match_end_to_end():
+    """Без шума все заказы после загрузки и сопоставления полностью сходятся"""
+    print("🔍 Тестирование сквозного сопоставления синтетических данных...")
+
+    with temporary_database() as (db, tmp_dir):
+        with open('schema_final.sql', encoding='utf-8') as f:
+            db.connection.executescript(f.read())
+        generated = SyntheticDataGenerator(machines=3, days=1, orders_per_day=60, seed=11, missing_rate=0,
+                                           late_rate=0, duplicate_rate=0).generate(os.path.join(tmp_dir, 'data'))
+        processor = OrderProcessor(db)
+
+        for file_type in ('happy_workers', 'vendhub', 'fiscal_bills', 'payme', 'click', 'uzum'):
+            processor.process_file(generated['files'][file_type], file_type)
+        processor.run_matching()
+
+        rows = db.execute_query("SELECT match_status, COUNT(*) AS cnt FROM orders GROUP BY match_status")
+        statuses = {row['match_status']: row['cnt'] for row in rows}
+        assert sum(statuses.values()) == 60, statuses
+        assert statuses.get('fully_matched') == 60, statuses
+
+    print("✅ Синтетические заказы сопоставляются полностью")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_generation_is_deterministic,
+        test_noise_rates,
+        test_generated_files_match_end_to_end,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+VHM24R - Тестирование очереди отправки Telegram
+Отправка подменяется асинхронной функцией, которая записывает сообщения
+"""
+
+import re
+import sys
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+from telegram_bot import TelegramSendQueue
+
+
+class RecordingSender:
+    """Асинхронная функция отправки, запоминающая сообщения и время отправки"""
+
+    def __init__(self, delay: float = 0.0, fail_first_with_retry_after: int = 0, reject_html: bool = False):
+        self.sent = []
+        self.delay = delay
+        self.retry_after_left = fail_first_with_retry_after
+        self.reject_html = reject_html
+
+    async def __call__(self, chat_id, text, parse_mode):
+        if self.retry_after_left:
+            self.retry_after_left -= 1
+            raise RetryAfter(1)
+        if self.reject_html and parse_mode == 'HTML':
+            raise BadRequest("Can't parse entities: unexpected end tag at byte offset 10")
+        self.sent.append((time.monotonic(), chat_id, text, parse_mode))
+
+
+def test_submit_does_not_block_and_batches_burst():
+    """Всплеск сообщений отправляется одним сообщением, submit возвращается сразу"""
+    print("🔍 Тестирование пакетной отправки...")
+
+    sender = RecordingSender()
+    queue = TelegramSendQueue(sender, batch_window=0.2, chat_interval=0.0)
+
+    started = time.perf_counter()
+    for i in range(20):
+        assert queue.submit('100', f"Ошибка {i}")
+    assert time.perf_counter() - started < 0.1
+
+    assert queue.flush(5)
+    assert len(sender.sent) == 1
+    text = sender.sent[0][2]
+    assert text.split("\n\n") == [f"Ошибка {i}" for i in range(20)]
+    assert queue.stats['sent'] == 1
+    queue.stop()
+
+    print("✅ 20 сообщений ушли одним")
+    return True
+
+
+def test_coalescing_and_bounded_queue():
+    """Одинаковые ключи схлопываются, при переполнении вытесняются старые сообщения"""
+    print("\n🔍 Тестирование схлопывания и ограничения очереди...")
+
+    sender = RecordingSender()
+    queue = TelegramSendQueue(sender, max_size=3, batch_window=0.2, chat_interval=0.0)
+
+    queue.submit('100', "Автомат A: 1 ошибка", coalesce_key='machine:A')
+    queue.submit('100', "Автомат A: 5 ошибок", coalesce_key='machine:A')
+    for i in range(4):
+        queue.submit('100', f"Сообщение {i}")
+
+    assert queue.flush(5)
+    parts = [part for _, _, text, _ in sender.sent for part in text.split("\n\n")]
+    assert parts == ["Сообщение 1", "Сообщение 2", "Сообщение 3"]
+    assert queue.stats['coalesced'] == 1
+    assert queue.stats['dropped'] == 2
+    queue.stop()
+
+    print("✅ Дубли схлопнуты, очередь ограничена")
+    return True
+
+
+def test_long_batches_are_split_and_rate_limited():
+    """Склейка не превышает лимит длины, отправки в один чат разнесены по времени"""
+    print("\n🔍 Тестирование лимитов Telegram...")
+
+    sender = RecordingSender(fail_first_with_retry_after=1)
+    queue = TelegramSendQueue(sender, batch_window=0.05, chat_interval=0.3)
+
+    for i in range(3):
+        queue.submit('100', str(i) * 3000)
+    queue.submit('-200', "Группа")
+
+    assert queue.flush(10)
+    private = [entry for entry in sender.sent if entry[1] == '100']
+    assert len(private) == 3
+    assert all(len(text) <= TelegramSendQueue.MAX_MESSAGE_LENGTH for _, _, text, _ in sender.sent)
+    assert private[1][0] - private[0][0] >= 0.29
+    assert private[2][0] - private[1][0] >= 0.29
+    assert [entry[2] for entry in sender.sent if entry[1] == '-200'] == ["Группа"]
+    assert queue.stats['failed'] == 0
+    queue.stop()
+
+    print("✅ Длинные сообщения разбиты, интервалы и RetryAfter соблюдены")
+    return True
+
+
+def _balanced_html(text: str) -> bool:
+    stack = []
+    for closing, name in re.findall(r'<(/?)(\w+)[^>]*>', text):
+        if not closing:
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
+
+def test_long_html_is_split_without_breaking_markup():
+    """Длинный HTML режется вне тегов и сущностей, теги закрываются и открываются заново"""
+    print("\n🔍 Тестирование разбиения HTML...")
+
+    sender = RecordingSender()
+    queue = TelegramSendQueue(sender, batch_window=0.05, chat_interval=0.0)
+
+    lines = [f"<b>Автомат {i}</b>: <a href=\"https://vhm24r.uz/m/{i}\">ошибок {i}</a> &amp; сверка" for i in range(150)]
+    report = "<i>Отчет\n" + "\n".join(lines) + "</i>"
+    queue.submit('100', report)
+    queue.submit('100', "<b>" + "x" * 9000 + "</b>")
+
+    assert queue.flush(10)
+    texts = [entry[2] for entry in sender.sent]
+    assert len(texts) > 2
+    for text in texts:
+        assert len(text) <= TelegramSendQueue.MAX_MESSAGE_LENGTH
+        assert _balanced_html(text), text[-50:]
+        assert not re.search(r'<[^>]*$|&#?\w*$', text)
+    plain = "".join(TelegramSendQueue._plain_text(text) for text in texts)
+    assert plain.count("& сверка") == 150
+    assert plain.count("x") == 9000
+    queue.stop()
+
+    print(f"✅ Отчет разбит на {len(texts)} частей с корректной разметкой")
+    return True
+
+
+def test_unparsable_html_is_resent_as_plain_text():
+    """Если Telegram не разобрал разметку, сообщение уходит обычным текстом"""
+    print("\n🔍 Тестирование отправки без разметки...")
+
+    sender = RecordingSender(reject_html=True)
+    queue = TelegramSendQueue(sender, batch_window=0.05, chat_interval=0.0)
+
+    queue.submit('100', "<b>Ошибка</b> сверки &lt;A&gt;")
+
+    assert queue.flush(5)
+    assert [(entry[2], entry[3]) for entry in sender.sent] == [("Ошибка сверки <A>", None)]
+    assert queue.stats['failed'] == 0
+    queue.stop()
+
+    print("✅ Сообщение не потеряно")
+    return True
+
+
+if __name__ == "__main__":
+    tests = [
+        test_submit_does_not_block_and_batches_burst,
+        test_coalescing_and_bounded_queue,
+        test_long_batches_are_split_and_rate_limited,
+        test_long_html_is_split_without_breaking_markup,
+        test_unparsable_html_is_resent_as_plain_text,
+    ]
+
+    passed = 0
+    for test_func in tests:
+        try:
+            if test_func():
+                passed += 1
+        except AssertionError as e:
+            print(f"❌ Тест {test_func.__name__} провален: {e}")
+
+    print(f"\n📊 Пройдено: {passed}/{len(tests)}")
+    sys.exit(0 if passed == len(tests) else 1)
@@ -0,0 +1,209 @@
+"""
+VHM24R - Повторное сопоставление несопоставленных записей
+Фискальные чеки из unmatched_records повторно сверяются с заказами, которые появились
+после их загрузки (например, файл HW/VendHub пришел позже фискального). Попытки
+ограничены экспоненциальной задержкой по attempts/last_attempt
+"""
+
+import json
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+from assignment import assign_by_time
+
+
+class UnmatchedRecordRetrier:
+    """
+    Проход по unmatched_records
+
+    - Окно поиска: paying_time Cash заказов без фискального чека, измененных после since
+      (без since - все такие заказы), расширенное на допуск по времени
+    - Записи окна читаются одним запросом по индексу (record_type, record_time)
+    - Правила те же, что в process_fiscal_file: Cash заказ, |paying_time - fiscal_time| <= допуск,
+      |order_price - amount| <= допуск по сумме, оптимальное назначение по |Δt|
+    - Неудачная попытка увеличивает attempts; следующая возможна не раньше
+      RETRY_BASE_MINUTES * 2^(attempts-1), после MAX_ATTEMPTS запись больше не проверяется
+    """
+
+    RECORD_TYPE = 'fiscal'
+    RETRY_BASE_MINUTES = 15
+    MAX_RETRY_DELAY_HOURS = 24
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, db, order_processor):
+        self.db = db
+        self.order_processor = order_processor
+        self.placeholder = '%s' if db.is_postgres else '?'
+        self._init_tables()
+
+    def _init_tables(self):
+        """Таблица и индекс для дешевого поиска по окну времени"""
+        id_column = 'SERIAL PRIMARY KEY' if self.db.is_postgres else 'INTEGER PRIMARY KEY AUTOINCREMENT'
+        self.db.execute_query(f"""
+            CREATE TABLE IF NOT EXISTS unmatched_records (
+                id {id_column},
+                record_type TEXT,
+                record_data TEXT,
+                record_time TIMESTAMP,
+                record_amount DECIMAL(10,2),
+                attempts INTEGER DEFAULT 0,
+                last_attempt TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        self.db.execute_query(
+            "CREATE INDEX IF NOT EXISTS idx_unmatched_records_type_time ON unmatched_records(record_type, record_time)"
+        )
+
+    def current_timestamp(self):
+        """Текущее время БД: отметка since для прохода после загрузки файлов"""
+        rows = self.db.execute_query("SELECT CURRENT_TIMESTAMP AS now")
+        return rows[0]['now'] if rows else None
+
+    def run(self, since=None, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Повторное сопоставление записей, чье время попадает в окно новых заказов
+
+        Args:
+            since: Учитывать только заказы с updated_at >= since (время БД)
+            now: Текущее время для расчета задержки (для тестов)
+
+        Returns:
+            Dict: Количество проверенных, сопоставленных, отложенных записей
+        """
+        stats = {'candidates': 0, 'matched': 0, 'retried': 0, 'deferred': 0}
+        now = now or datetime.now()
+
+        window = self._orders_window(since)
+        if not window:
+            return stats
+
+        tolerance = timedelta(seconds=self.order_processor.fiscal_time_window)
+        window_start, window_end = window[0] - tolerance, window[1] + tolerance
+
+        records = []
+        for record in self._records_in_window(window_start, window_end):
+            if self._is_due(record, now):
+                records.append(record)
+            else:
+                stats['deferred'] += 1
+        stats['candidates'] = len(records)
+        if not records:
+            return stats
+
+        orders = self._candidate_orders(window_start - tolerance, window_end + tolerance)
+        self.order_processor.change_source = 'unmatched_retry'
+        try:
+            matched_ids, failed_ids = self._match_batch(records, orders, tolerance)
+        finally:
+            self.order_processor.change_log.flush()
+            self.order_processor.change_source = None
+
+        p = self.placeholder
+        for record_id in matched_ids:
+            self.db.execute_query(f"DELETE FROM unmatched_records WHERE id = {p}", (record_id,))
+        if failed_ids:
+            self.db.execute_query(f"""
+                UPDATE unmatched_records
+                SET attempts = COALESCE(attempts, 0) + 1, last_attempt = {p}
+                WHERE id IN ({', '.join([p] * len(failed_ids))})
+            """, (now.strftime('%Y-%m-%d %H:%M:%S'), *failed_ids))
+
+        stats['matched'] = len(matched_ids)
+        stats['retried'] = len(failed_ids)
+        print(f"Unmatched records retry: {stats}")
+        return stats
+
+    # ========================================================================
+    # ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ
+    # ========================================================================
+
+    def _orders_window(self, since) -> Optional[tuple]:
+        """Диапазон paying_time Cash заказов, ожидающих фискальный чек"""
+        p = self.placeholder
+        query = """
+            SELECT MIN(paying_time) AS window_start, MAX(paying_time) AS window_end
+            FROM orders
+            WHERE (order_resource = 'Cash payment' OR payment_type = 'Cash')
+              AND (fiscal_matched = FALSE OR fiscal_matched IS NULL)
+              AND paying_time IS NOT NULL
+        """
+        params = None
+        if since is not None:
+            query += f" AND updated_at >= {p}"
+            params = (since,)
+
+        rows = self.db.execute_query(query, params)
+        if not rows or rows[0]['window_start'] is None:
+            return None
+        return self._to_datetime(rows[0]['window_start']), self._to_datetime(rows[0]['window_end'])
+
+    def _records_in_window(self, window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+        p = self.placeholder
+        return self.db.execute_query(f"""
+            SELECT id, record_data, record_time, record_amount, attempts, last_attempt
+            FROM unmatched_records
+            WHERE record_type = {p} AND record_time BETWEEN {p} AND {p}
+            ORDER BY record_time, id
+        """, (self.RECORD_TYPE, window_start, window_end))
+
+    def _candidate_orders(self, window_start: datetime, window_end: datetime) -> List[Dict[str, Any]]:
+        p = self.placeholder
+        return self.db.execute_query(f"""
+            SELECT * FROM orders
+            WHERE (order_resource = 'Cash payment' OR payment_type = 'Cash')
+              AND (fiscal_matched = FALSE OR fiscal_matched IS NULL)
+              AND paying_time BETWEEN {p} AND {p}
+            ORDER BY paying_time, id
+        """, (window_start, window_end))
+
+    def _is_due(self, record: Dict[str, Any], now: datetime) -> bool:
+        """Экспоненциальная задержка между попытками"""
+        attempts = int(record.get('attempts') or 0)
+        if attempts >= self.MAX_ATTEMPTS:
+            return False
+        if attempts == 0 or not record.get('last_attempt'):
+            return True
+
+        delay = min(timedelta(minutes=self.RETRY_BASE_MINUTES * 2 ** (attempts - 1)),
+                    timedelta(hours=self.MAX_RETRY_DELAY_HOURS))
+        return self._to_datetime(record['last_attempt']) + delay <= now
+
+    def _match_batch(self, records: List[Dict[str, Any]], orders: List[Dict[str, Any]],
+                     tolerance: timedelta) -> tuple:
+        """
+        Сопоставление пачки тем же оптимальным назначением, что и при загрузке файла
+        Returns:
+            (id сопоставленных записей, id несопоставленных записей)
+        """
+        record_points = [(self._to_datetime(record['record_time']), float(record['record_amount'] or 0))
+                         for record in records]
+        order_points = [(self._to_datetime(order['paying_time']), float(order['order_price'] or 0))
+                        for order in orders]
+        assignments = assign_by_time(record_points, order_points, tolerance.total_seconds(),
+                                     self.order_processor.amount_tolerance)
+
+        matched_ids, failed_ids = [], []
+        for record, (fiscal_time, amount), assignment in zip(records, record_points, assignments):
+            if assignment['order'] is None:
+                failed_ids.append(record['id'])
+                continue
+
+            try:
+                record_data = json.loads(record['record_data'] or '{}')
+            except (TypeError, ValueError):
+                record_data = {}
+            self.order_processor.apply_fiscal_match(
+                orders[assignment['order']], fiscal_time, amount, record_data,
+                candidates=[orders[o]['id'] for o in assignment['candidates']]
+            )
+            matched_ids.append(record['id'])
+
+        return matched_ids, failed_ids
+
+    @staticmethod
+    def _to_datetime(value) -> datetime:
+        """Метка времени БД (datetime в PostgreSQL, строка в SQLite)"""
+        if isinstance(value, datetime):
+            return value
+        return datetime.fromisoformat(str(value)[:19].replace('T', ' '))